@@ -1,95 +1,104 @@
 # app/bot.py
 import os
+import asyncio
 import logging
 from pathlib import Path
 from decimal import Decimal
+from typing import Any, Awaitable, Dict, Optional
 
 import httpx
-from telegram import Update
+from telegram import ChatMember, Update
 from telegram.constants import ParseMode
 from telegram.error import BadRequest
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     MessageHandler,
     ContextTypes,
     filters,
 )
+from telegram.request import HTTPXRequest
 
-from .config import BOT_TOKEN
+from .config import BOT_TOKEN, BOT_MODE, BOT_CONCURRENT_UPDATES, QWEN_API_KEY
 from . import texts
-from .keyboards import (
-    start_inline_menu,
-    video_models_menu,
-    video_categories_menu,
-    kling_models_menu,
-    runway_models_menu,
-    sora_models_menu,
-    veo_models_menu,
-    wan_models_menu,
-    image_models_menu,
-    seedream_models_menu,
-    nanobanana_models_menu,
-    audio_models_menu,
-    text_models_menu,
-    jobs_menu,
-)
+from .keyboards import start_inline_menu, menu_screens
 
 from .db import (
     run_migrations,
-    ensure_user,
+    close_pools,
     get_user,
     apply_referral_start,
     spend_credits_by_tg_id,
     add_credits_by_tg_id,
     get_last_result_by_tg_id,
+    set_users_blocked,
+    InsufficientCredits,
 )
 from .web_shared import public_base_url
+from .core.user_sessions import user_sessions
+from .core.gemini_stream import (
+    GEMINI_STREAM,
+    TelegramStreamReply,
+    stream_gemini_text,
+    generate_gemini_text,
+)
+from .core.chat_memory import chat_memory
+from .core.qwen import run_qwen_job
+from .core.loop_monitor import loop_monitor
+from .core import metrics, tracing, events, replica_monitor, notifications, broadcast
 
 logger = logging.getLogger(__name__)
 
 HERO_PATH = Path(__file__).parent / "assets" / "hero.png"
+HERO_EXISTS = HERO_PATH.exists()
+# Μετά το πρώτο upload, το Telegram κρατάει τη φωτογραφία: στέλνουμε μόνο το file_id.
+_hero_file_id: Optional[str] = os.getenv("HERO_FILE_ID", "").strip() or None
 REF_BONUS_CREDITS = 1
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
 
 
+async def _reply_start_card(msg, caption: str, reply_markup):
+    """Στέλνει την κάρτα (hero photo μέσω cached file_id, αλλιώς κείμενο)."""
+    global _hero_file_id
+
+    if not HERO_EXISTS and not _hero_file_id:
+        return await msg.reply_text(caption, reply_markup=reply_markup)
+
+    if _hero_file_id:
+        try:
+            return await msg.reply_photo(photo=_hero_file_id, caption=caption, reply_markup=reply_markup)
+        except BadRequest:
+            # π.χ. άλλαξε το bot token -> το file_id δεν ισχύει, ξανανέβασε
+            logger.warning("Cached hero file_id rejected, re-uploading")
+            _hero_file_id = None
+            if not HERO_EXISTS:
+                return await msg.reply_text(caption, reply_markup=reply_markup)
+
+    with HERO_PATH.open("rb") as fh:
+        sent = await msg.reply_photo(photo=fh, caption=caption, reply_markup=reply_markup)
+    if sent.photo:
+        _hero_file_id = sent.photo[-1].file_id
+    return sent
+
+
 async def send_start_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    ensure_user(u.id, u.username, u.first_name)
-
-    hero_exists = HERO_PATH.exists()
+    user_sessions.touch(u.id, u.username, u.first_name)
 
     try:
         if update.message:
-            if hero_exists:
-                await update.message.reply_photo(
-                    photo=HERO_PATH.open("rb"),
-                    caption=texts.START_CAPTION,
-                    reply_markup=start_inline_menu(),
-                )
-            else:
-                await update.message.reply_text(
-                    texts.START_CAPTION,
-                    reply_markup=start_inline_menu(),
-                )
+            await _reply_start_card(update.message, texts.START_CAPTION, start_inline_menu())
             return
 
         if update.callback_query:
             q = update.callback_query
             await q.answer()
-            if hero_exists:
-                await q.message.reply_photo(
-                    photo=HERO_PATH.open("rb"),
-                    caption=texts.START_CAPTION,
-                    reply_markup=start_inline_menu(),
-                )
-            else:
-                await q.message.reply_text(
-                    texts.START_CAPTION,
-                    reply_markup=start_inline_menu(),
-                )
+            await _reply_start_card(q.message, texts.START_CAPTION, start_inline_menu())
             return
 
     except Exception as e:
@@ -102,22 +111,18 @@ async def send_start_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def edit_start_card(q, caption: str, reply_markup):
     msg = q.message
     try:
-        await msg.edit_caption(caption=caption, reply_markup=reply_markup)
-    except BadRequest:
-        if HERO_PATH.exists():
-            await msg.reply_photo(
-                photo=HERO_PATH.open("rb"),
-                caption=caption,
-                reply_markup=reply_markup,
-            )
+        if msg.photo:
+            await msg.edit_caption(caption=caption, reply_markup=reply_markup)
         else:
-            await msg.reply_text(caption, reply_markup=reply_markup)
+            await msg.edit_text(caption, reply_markup=reply_markup)
+    except BadRequest:
+        await _reply_start_card(msg, caption, reply_markup)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     tg_id = int(user.id)
-    ensure_user(tg_id, user.username, user.first_name)
+    user_sessions.touch(tg_id, user.username, user.first_name)
 
     # ---- referral parsing ----
     ref_code = None
@@ -129,6 +134,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ---- apply referral ----
     if ref_code:
         try:
+            await user_sessions.ensure_persisted(tg_id)
             me = get_user(tg_id)
             if me:
                 r = apply_referral_start(invited_user_id=int(me["id"]), code=ref_code, bonus_credits=REF_BONUS_CREDITS)
@@ -156,68 +162,14 @@ async def on_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     u = q.from_user
-    ensure_user(u.id, u.username, u.first_name)
+    user_sessions.touch(u.id, u.username, u.first_name)
 
     data = q.data or ""
 
-    if data == "menu:home":
-        await edit_start_card(q, texts.START_CAPTION, start_inline_menu())
-        return
-
-    # Video — categories
-    if data == "menu:video":
-        await edit_start_card(q, "👇 Επίλεξε κατηγορία ΒΙΝΤΕΟ:", video_categories_menu())
-        return
-
-    # Video — brand submenus
-    if data == "menu:video:kling":
-        await edit_start_card(q, "🟢 Kling — Επίλεξε μοντέλο:", kling_models_menu())
-        return
-
-    if data == "menu:video:runway":
-        await edit_start_card(q, "🎬 Runway — Επίλεξε μοντέλο:", runway_models_menu())
-        return
-
-    if data == "menu:video:sora":
-        await edit_start_card(q, "🛰 Sora — Επίλεξε μοντέλο:", sora_models_menu())
-        return
-
-    if data == "menu:video:veo":
-        await edit_start_card(q, "🎬 Google Veo — Επίλεξε μοντέλο:", veo_models_menu())
-        return
-
-    if data == "menu:video:wan":
-        await edit_start_card(q, "🌀 Wan — Επίλεξε μοντέλο:", wan_models_menu())
-        return
-
-    # Image — categories
-    if data == "menu:images":
-        await edit_start_card(q, "👇 Επίλεξε μοντέλο AI για ΕΙΚΟΝΕΣ:", image_models_menu())
-        return
-
-    # Image — brand submenus
-    if data == "menu:images:seedream":
-        await edit_start_card(q, "🌱 Seedream — Επίλεξε μοντέλο:", seedream_models_menu())
-        return
-
-    if data == "menu:images:nanobanana":
-        await edit_start_card(q, "🍌 Nano Banana — Επίλεξε μοντέλο:", nanobanana_models_menu())
-        return
-
-    if data == "menu:audio":
-        await edit_start_card(q, "👇 Επίλεξε μοντέλο AI για ΗΧΟ:", audio_models_menu())
-        return
-
-    if data == "menu:text":
-        await edit_start_card(q, "👇 Επίλεξε μοντέλο AI για ΚΕΙΜΕΝΟ:", text_models_menu())
-        return
-
-    if data == "menu:jobs":
-        await edit_start_card(
-            q,
-            "💼 Εργασίες\n\nΕπίλεξε τι θέλεις να κάνεις:",
-            jobs_menu(),
-        )
+    screen = menu_screens().get(data)
+    if screen:
+        caption, markup = screen
+        await edit_start_card(q, caption, markup)
         return
 
     if data.startswith("menu:set:"):
@@ -230,7 +182,8 @@ async def on_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if model == "gemini3flash":
                 await q.message.reply_text(
                     "✅ Gemini 3 Flash ενεργοποιήθηκε.\n"
-                    "Στείλε τώρα ένα μήνυμα για να σου απαντήσω."
+                    "Στείλε τώρα ένα μήνυμα για να σου απαντήσω.\n"
+                    "Για νέα συζήτηση: /newchat"
                 )
             elif model == "qwen_ai":
                 await q.message.reply_text(
@@ -257,7 +210,7 @@ async def on_jobs_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     u = q.from_user
-    ensure_user(u.id, u.username, u.first_name)
+    user_sessions.touch(u.id, u.username, u.first_name)
 
     data = q.data or ""
 
@@ -266,7 +219,6 @@ async def on_jobs_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         offer_id = data.split(":", 2)[2]
         try:
             from .db import accept_job_offer
-            from .core.telegram_client import tg_send_message as _tg_msg
 
             result = accept_job_offer(offer_id)
             if not result:
@@ -282,15 +234,9 @@ async def on_jobs_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Notify freelancer
                 freelancer_tg = result.get("freelancer_tg_id")
                 if freelancer_tg:
-                    try:
-                        await _tg_msg(
-                            int(freelancer_tg),
-                            f"✅ Η πρότασή σου έγινε δεκτή!\n\n"
-                            f"📋 Εργασία: {result.get('job_title', '—')}\n\n"
-                            f"Επικοινώνησε με τον πελάτη για τις λεπτομέρειες."
-                        )
-                    except Exception:
-                        pass
+                    await asyncio.to_thread(
+                        notifications.offer_accepted, int(freelancer_tg), result.get("job_title") or "—"
+                    )
             else:
                 await q.message.reply_text("ℹ️ Αυτή η πρόταση έχει ήδη διαχειριστεί.")
         except Exception as e:
@@ -335,6 +281,7 @@ async def on_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     tg_id = int(u.id)
     text = update.message.text.strip()
+    user_sessions.touch(tg_id, u.username, u.first_name)
 
     selected_text = context.user_data.get("selected_text")
     selected_image = context.user_data.get("selected_image")
@@ -346,101 +293,98 @@ async def on_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         COST = Decimal("0.5")
+        await user_sessions.ensure_persisted(tg_id)
         try:
             spend_credits_by_tg_id(tg_id, COST, "Gemini 3 Flash chat", "gemini", "gemini-3-flash")
-        except Exception:
+        except InsufficientCredits:
             await update.message.reply_text("❌ Δεν έχεις αρκετά credits.")
             return
 
-        await update.message.reply_text("💬 Σκέφτομαι...")
+        placeholder = await update.message.reply_text("💬 Σκέφτομαι...")
+        out = TelegramStreamReply(placeholder)
+        reply_parts = []
 
         try:
-            body = {
-                "contents": [{"parts": [{"text": text}]}],
-            }
-            async with httpx.AsyncClient(timeout=60) as c:
-                r = await c.post(
-                    "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent",
-                    params={"key": GEMINI_API_KEY},
-                    json=body,
-                )
-            data = r.json()
-            if r.status_code >= 400:
-                raise RuntimeError(f"Gemini error: {data}")
-
-            reply = ""
-            candidates = data.get("candidates") or []
-            if candidates:
-                parts = (candidates[0].get("content") or {}).get("parts") or []
-                for p in parts:
-                    if p.get("text"):
-                        reply += p["text"]
-
-            if not reply:
-                reply = "(Δεν λήφθηκε απάντηση)"
-
-            await update.message.reply_text(reply[:4096])
+            system, contents = await chat_memory.get_context(tg_id, text)
+            if GEMINI_STREAM:
+                async for delta in stream_gemini_text(contents, GEMINI_API_KEY, system_instruction=system):
+                    reply_parts.append(delta)
+                    await out.feed(delta)
+            else:
+                reply = await generate_gemini_text(contents, GEMINI_API_KEY, system_instruction=system)
+                reply_parts.append(reply)
+                await out.feed(reply)
+            await out.finish()
+            if reply_parts:
+                await chat_memory.append_turn(tg_id, text, "".join(reply_parts))
 
         except Exception as e:
             logger.exception("Gemini Flash error")
+            if out.total_chars:
+                # ο χρήστης πήρε ήδη μέρος της απάντησης: κράτα το κείμενο, χωρίς refund
+                try:
+                    await out.finish("\n\n⚠️ Η απάντηση διακόπηκε.")
+                except Exception:
+                    pass
+                return
             try:
                 add_credits_by_tg_id(tg_id, COST, "Refund Gemini Flash fail", "system", None)
             except Exception:
                 pass
-            await update.message.reply_text(f"⛔ Σφάλμα: Δοκίμασε ξανά.")
+            try:
+                await placeholder.edit_text("⛔ Σφάλμα: Δοκίμασε ξανά.")
+            except Exception:
+                await update.message.reply_text("⛔ Σφάλμα: Δοκίμασε ξανά.")
         return
 
     # --- Qwen AI (image generation via inline) ---
     if selected_image == "qwen_ai":
-        qwen_key = os.getenv("QWEN_API_KEY", "").strip()
-        if not qwen_key:
+        if not QWEN_API_KEY:
             await update.message.reply_text("⚠️ Qwen API key δεν έχει ρυθμιστεί.")
             return
 
         COST = Decimal("1")
+        await user_sessions.ensure_persisted(tg_id)
         try:
             spend_credits_by_tg_id(tg_id, COST, "Qwen AI image", "qwen", "qwen-ai")
-        except Exception:
+        except InsufficientCredits:
             await update.message.reply_text("❌ Δεν έχεις αρκετά credits.")
             return
 
-        await update.message.reply_text("🤖 Δημιουργία εικόνας Qwen AI...")
+        await update.message.reply_text("🤖 Δημιουργία εικόνας Qwen AI... Θα σου τη στείλω μόλις είναι έτοιμη.")
+        # το job (create + polling + αποστολή) τρέχει εκτός handler
+        context.application.create_task(
+            run_qwen_job(update.effective_chat.id, tg_id, text, COST),
+            update=update,
+        )
+        return
 
-        try:
-            async with httpx.AsyncClient(timeout=120) as c:
-                r = await c.post(
-                    "https://dashscope.aliyuncs.com/api/v1/services/aigc/text2image/image-synthesis",
-                    headers={
-                        "Authorization": f"Bearer {qwen_key}",
-                        "Content-Type": "application/json",
-                        "X-DashScope-Async": "enable",
-                    },
-                    json={
-                        "model": "wanx-v1",
-                        "input": {"prompt": text},
-                        "parameters": {"n": 1, "size": "1024*1024"},
-                    },
-                )
-            data = r.json()
-            if r.status_code >= 400:
-                raise RuntimeError(f"Qwen error: {data}")
 
-            # Qwen returns async task - get result URL
-            output = data.get("output") or {}
-            results = output.get("results") or []
-            if results and results[0].get("url"):
-                await update.message.reply_photo(photo=results[0]["url"], caption="✅ Qwen AI: Έτοιμο")
-            else:
-                raise RuntimeError(f"No image URL: {data}")
+async def newchat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Καθαρίζει τη μνήμη συζήτησης του Gemini για τον χρήστη."""
+    if not update.message:
+        return
+    try:
+        await chat_memory.reset(update.effective_user.id)
+    except Exception:
+        logger.exception("chat memory reset failed")
+        await update.message.reply_text("⛔ Σφάλμα: Δοκίμασε ξανά.")
+        return
+    await update.message.reply_text("🧹 Ξεκινάμε νέα συζήτηση.")
 
-        except Exception as e:
-            logger.exception("Qwen AI error")
-            try:
-                add_credits_by_tg_id(tg_id, COST, "Refund Qwen AI fail", "system", None)
-            except Exception:
-                pass
-            await update.message.reply_text("⛔ Σφάλμα: Δοκίμασε ξανά.")
+
+async def on_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ο χρήστης μπλόκαρε / ξεμπλόκαρε το bot: τα broadcasts τον παραλείπουν / τον ξαναβρίσκουν."""
+    cmu = update.my_chat_member
+    if not cmu or cmu.chat.type != "private":
+        return
+    status = cmu.new_chat_member.status
+    if status not in (ChatMember.BANNED, ChatMember.MEMBER):
         return
+    try:
+        await asyncio.to_thread(set_users_blocked, [cmu.from_user.id], status == ChatMember.BANNED)
+    except Exception:
+        logger.exception("set_users_blocked failed")
 
 
 async def on_resend_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -451,7 +395,7 @@ async def on_resend_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     u = q.from_user
-    ensure_user(u.id, u.username, u.first_name)
+    user_sessions.touch(u.id, u.username, u.first_name)
 
     data = q.data or ""
     # Format: "resend:model_name"
@@ -467,7 +411,7 @@ async def on_resend_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Download the file from our server
-        async with httpx.AsyncClient(timeout=120, follow_redirects=True) as c:
+        async with metrics.http_client(timeout=120, follow_redirects=True) as c:
             r = await c.get(result_url)
             if r.status_code >= 400:
                 raise RuntimeError(f"Download error {r.status_code}")
@@ -499,15 +443,128 @@ async def on_resend_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.message.reply_text("❌ Αποτυχία αποστολής. Δοκίμασε ξανά αργότερα.")
 
 
-def main():
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Επεξεργάζεται έως max_concurrent_updates updates παράλληλα,
+    αλλά τα updates του ίδιου χρήστη τρέχουν σειριακά (με τη σειρά άφιξης).
+
+    Το process_update του PTB (final) κρατάει το δικό του semaphore όσο τρέχει
+    το do_process_update. Αν το όριο ήταν εκεί, ένας χρήστης με N updates σε
+    αναμονή πίσω από ένα μεγάλο Gemini stream θα κρατούσε N slots και θα σταματούσε
+    όλους τους άλλους. Γι' αυτό το semaphore του PTB δεν περιορίζει (_UNBOUNDED) και
+    το slot (self._slots) παίρνεται μόνο όταν έρθει η σειρά του update στον χρήστη.
+    """
+
+    _UNBOUNDED = 1 << 30
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(self._UNBOUNDED)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._refs: Dict[int, int] = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return getattr(self, "_limit", self._UNBOUNDED)
+
+    @staticmethod
+    def _user_key(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return int(update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._user_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._refs[key] = self._refs.get(key, 0) + 1
+        try:
+            # πρώτα η σειρά του χρήστη (χωρίς slot), μετά το slot
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._refs[key] -= 1
+            if not self._refs[key]:
+                del self._refs[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def _post_init(application: Application) -> None:
+    loop_monitor.start()
+    metrics.start()
+    tracing.start("bot")
+    events.start()
+    replica_monitor.start()
+    user_sessions.start()
+    chat_memory.start()
+    notifications.start()
+    broadcast.start()
+
+
+async def _post_shutdown(application: Application) -> None:
+    await broadcast.stop()
+    await notifications.stop()
+    await chat_memory.stop()
+    await user_sessions.stop()
+    await replica_monitor.stop()
+    await events.stop()
+    await tracing.stop()
+    await metrics.stop()
+    await loop_monitor.stop()
+    close_pools()
+
+
+def _bot_request(pool_size: int) -> HTTPXRequest:
+    """HTTPXRequest του PTB με metrics στα Bot API calls (ίδιο pool με τα defaults του PTB)."""
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return HTTPXRequest(
+        connection_pool_size=pool_size,
+        httpx_kwargs={"transport": metrics.http_transport(limits=limits)},
+    )
+
+
+def build_application(webhook: bool = False) -> Application:
+    """Στήνει το PTB Application με όλους τους handlers (κοινό για polling & webhook)."""
     if not BOT_TOKEN:
         raise RuntimeError("Missing BOT_TOKEN")
 
-    run_migrations()
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(_bot_request(256))
+        .get_updates_request(_bot_request(1))
+        .concurrent_updates(PerUserUpdateProcessor(BOT_CONCURRENT_UPDATES))
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+    )
+    if webhook:
+        # τα updates έρχονται από το FastAPI endpoint, όχι από getUpdates
+        builder = builder.updater(None)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = builder.build()
+
+    # όλα τα μενού χτίζονται μία φορά εδώ, όχι σε κάθε click
+    menu_screens()
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("newchat", newchat))
+    app.add_handler(ChatMemberHandler(on_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
 
     # Jobs handler
     app.add_handler(CallbackQueryHandler(on_jobs_click, pattern=r"^jobs:"))
@@ -521,6 +578,36 @@ def main():
     # Inline text messages (Gemini Flash, Qwen AI)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text_message))
 
+    return app
+
+
+def main():
+    if not BOT_TOKEN:
+        raise RuntimeError("Missing BOT_TOKEN")
+
+    run_migrations()
+
+    if BOT_MODE == "webhook":
+        # Ξεχωριστό bot service σε webhook mode: μπορεί να τρέχει σε N replicas πίσω από load balancer.
+        import uvicorn
+        from fastapi import FastAPI
+        from .routes.health import router as health_router
+        from .routes.debug import router as debug_router
+        from .routes.metrics import router as metrics_router
+        from .routes.telegram_webhook import router as webhook_router, start_bot_webhook, stop_bot_webhook
+
+        api = FastAPI()
+        api.include_router(health_router)
+        api.include_router(debug_router)
+        api.include_router(metrics_router)
+        api.include_router(webhook_router)
+        api.add_event_handler("startup", start_bot_webhook)
+        api.add_event_handler("shutdown", stop_bot_webhook)
+
+        uvicorn.run(api, host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
+        return
+
+    app = build_application()
     app.run_polling(close_loop=False)
 
 
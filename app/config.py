@@ -21,3 +21,17 @@ SEEDREAM_API_KEY = os.getenv("SEEDREAM_API_KEY", "")
 QWEN_API_KEY = os.getenv("QWEN_API_KEY", "")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
 SUNO_API_KEY = os.getenv("SUNO_API_KEY", "")
+
+# --- Telegram bot runtime ---
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()  # polling | webhook
+BOT_WEBHOOK_PATH = "/telegram/webhook"
+BOT_WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL", "").strip() or (f"{WEBAPP_URL}{BOT_WEBHOOK_PATH}" if WEBAPP_URL else "")
+BOT_WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET", "")
+BOT_WEBHOOK_IN_WEB = os.getenv("BOT_WEBHOOK_IN_WEB", "0") == "1"
+BOT_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+
+# --- Upstream API base URLs (override για staging / load tests με mock providers) ---
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
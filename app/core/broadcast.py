@@ -0,0 +1,420 @@
+# app/core/broadcast.py
+"""Μαζικά μηνύματα (ανακοινώσεις, promos, outages) προς όλους τους χρήστες.
+
+Ένα broadcast γράφεται στον πίνακα broadcasts (POST /admin/broadcasts) και
+το τρέχει ένα background task, σε όποιο process (web ή bot) πάρει πρώτο το lease
+του. Οι παραλήπτες έρχονται με σειρά tg_user_id από server-side cursor
+(db.iter_broadcast_targets), χωρίς να φορτώνεται όλη η λίστα στη μνήμη.
+
+Pacing (AIMD): ξεκινάει στο BROADCAST_RATE μηνύματα/s. Σε κάθε 429 ο ρυθμός
+πέφτει στο μισό και όλες οι αποστολές σταματούν για retry_after. Μετά από
+BROADCAST_RAISE_SECONDS χωρίς 429 ανεβαίνει κατά 1/s. Το όριο του Telegram
+(TELEGRAM_BOT_RATE) είναι ανά bot, κοινό για όλα τα processes (web, bot, workers).
+Το broadcast μένει κάτω από TELEGRAM_BOT_RATE μείον BROADCAST_RESERVED_RATE
+(περιθώριο για απότομες αυξήσεις) μείον ό,τι στέλνουν εκείνη τη στιγμή οι
+ειδοποιήσεις και οι παραδόσεις αποτελεσμάτων σε όλα τα processes (κοινός
+μετρητής, telegram_sender.bot_rate()), ώστε αυτά να μην περιμένουν ούτε να
+παίρνουν 429 εξαιτίας του.
+
+Lease: ένα heartbeat task το ανανεώνει κάθε BROADCAST_LEASE_SECONDS/3, ανεξάρτητα
+από τις αποστολές (μια παύση retry_after μπορεί να κρατήσει περισσότερο από το
+lease). Αν το lease χαθεί ή δεν ανανεωθεί εγκαίρως, οι αποστολές σταματούν αμέσως,
+πριν το πάρει άλλο process, ώστε να μην στέλνουν δύο από το ίδιο checkpoint.
+
+Checkpoint: κάθε BROADCAST_CHECKPOINT_SECONDS γράφεται το μεγαλύτερο
+tg_user_id μέχρι το οποίο όλοι έχουν τελειώσει, μαζί με τους μετρητές και τους
+χρήστες που βρέθηκαν blocked (403 / chat not found). Αυτοί σημειώνονται στο
+users.blocked_at και παραλείπονται στα επόμενα broadcasts. Αν το process πέσει,
+άλλο process συνεχίζει από το checkpoint μόλις λήξει το lease. Όσοι πήραν μήνυμα
+μετά το τελευταίο checkpoint θα το ξαναπάρουν (λίγα δευτερόλεπτα αποστολών).
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from .. import db
+from . import metrics, telegram_sender
+from .telegram_sender import TelegramSendError
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("BROADCAST_ENABLED", "1") == "1"
+MAX_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+MIN_RATE = float(os.getenv("BROADCAST_MIN_RATE", "1"))
+RAISE_SECONDS = float(os.getenv("BROADCAST_RAISE_SECONDS", "5"))
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "32"))
+CHECKPOINT_SECONDS = float(os.getenv("BROADCAST_CHECKPOINT_SECONDS", "2"))
+LEASE_SECONDS = float(os.getenv("BROADCAST_LEASE_SECONDS", "60"))
+POLL_SECONDS = float(os.getenv("BROADCAST_POLL_SECONDS", "5"))
+LOG_SECONDS = float(os.getenv("BROADCAST_LOG_SECONDS", "10"))
+BOT_RATE = float(os.getenv("TELEGRAM_BOT_RATE", "30"))
+RESERVED_RATE = float(os.getenv("BROADCAST_RESERVED_RATE", "10"))
+FETCH_BATCH = 2000
+MAX_ATTEMPTS = 3
+
+# Αν αποτύχουν τόσες πρώτες αποστολές χωρίς καμία επιτυχία (π.χ. κακό parse_mode
+# ή markup), το broadcast σταματάει ως failed αντί να περάσει όλους τους χρήστες.
+_ABORT_AFTER_FAILURES = 20
+
+_BLOCKED_400 = ("chat not found", "user is deactivated", "peer_id_invalid", "bot was blocked")
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_task: Optional[asyncio.Task] = None
+
+
+# ----------------------
+# Pacing
+# ----------------------
+class _Pacer:
+    """Adaptive rate (AIMD) με κοινή παύση σε 429."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._last_change = time.monotonic()
+
+    async def _limit(self) -> float:
+        room = BOT_RATE - RESERVED_RATE - await telegram_sender.bot_rate()
+        return max(MIN_RATE, min(self.rate, room))
+
+    async def wait(self, stop: asyncio.Event) -> None:
+        """Περιμένει το επόμενο slot. Διακόπτεται αν τεθεί το stop (χάθηκε το lease)."""
+        limit = await self._limit()
+        now = time.monotonic()
+        slot = max(now, self._next, self._paused_until)
+        self._next = slot + 1.0 / limit
+        if slot > now:
+            try:
+                await asyncio.wait_for(stop.wait(), slot - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def throttled(self, retry_after: float) -> None:
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + retry_after)
+        # τα in-flight αιτήματα παίρνουν 429 μαζί: μία μείωση ανά παύση
+        if now - self._last_change > 1.0:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._last_change = now
+            metrics.inc("broadcast_throttled_total")
+            logger.warning("Broadcast throttled: retry_after=%.0fs, rate -> %.1f/s", retry_after, self.rate)
+
+    def ok(self) -> None:
+        now = time.monotonic()
+        if self.rate < MAX_RATE and now - self._last_change >= RAISE_SECONDS:
+            self.rate = min(MAX_RATE, self.rate + 1)
+            self._last_change = now
+
+
+# ----------------------
+# Run
+# ----------------------
+class _Run:
+    def __init__(self, row: Dict[str, Any]):
+        self.id = int(row["id"])
+        self.text = row["text"]
+        self.parse_mode = row.get("parse_mode")
+        self.reply_markup = row.get("reply_markup")
+        self.total = int(row.get("total") or 0)
+        self.checkpoint = int(row["last_tg_user_id"])
+        self.done_before = int(row["sent"]) + int(row["failed"]) + int(row["blocked"])
+        self.had_success = int(row["sent"]) > 0
+
+        self.pacer = _Pacer(MAX_RATE)
+        self.sem = asyncio.Semaphore(CONCURRENCY)
+        self.tasks: Set[asyncio.Task] = set()
+        self.retry: Deque[Tuple[int, int]] = deque()  # (tg_user_id, attempts)
+
+        # σειρά αποστολής + όσοι τελείωσαν: το checkpoint προχωράει μόνο πάνω
+        # από το συνεχόμενο πρόθεμα που τελείωσε
+        self.order: Deque[int] = deque()
+        self.finished: Set[int] = set()
+
+        # deltas από το τελευταίο checkpoint
+        self.sent = 0
+        self.failed = 0
+        self.blocked: List[int] = []
+        self.done_total = self.done_before
+        self.failures = 0  # σε αυτό το run (για το abort)
+        self.last_error: Optional[str] = None
+
+        self.rate_window: Deque[Tuple[float, int]] = deque([(time.monotonic(), self.done_total)])
+        self.send_rate = 0.0
+
+        self.lease_lost = asyncio.Event()
+        self.lease_renewed = time.monotonic()
+
+    # ---- outcome ----
+    def _finish(self, tg_id: int) -> None:
+        self.done_total += 1
+        self.finished.add(tg_id)
+        while self.order and self.order[0] in self.finished:
+            self.checkpoint = self.order.popleft()
+            self.finished.discard(self.checkpoint)
+
+    async def _send(self, tg_id: int, attempts: int) -> None:
+        try:
+            await telegram_sender.send_message(
+                tg_id, self.text, reply_markup=self.reply_markup, parse_mode=self.parse_mode, bulk=True
+            )
+        except TelegramSendError as e:
+            desc = str(e).lower()
+            if e.status_code == 403 or (e.status_code == 400 and any(s in desc for s in _BLOCKED_400)):
+                self.blocked.append(tg_id)
+                metrics.inc("broadcast_messages_total", result="blocked")
+                self._finish(tg_id)
+                return
+            if e.retry_after:
+                self.pacer.throttled(e.retry_after)
+                # 429: όριο του bot, όχι του χρήστη, δεν μετράει ως προσπάθεια
+                self.retry.append((tg_id, attempts))
+                return
+            if not e.permanent and attempts < MAX_ATTEMPTS:
+                self.retry.append((tg_id, attempts + 1))
+                return
+            self.failed += 1
+            self.failures += 1
+            self.last_error = str(e)[:500]
+            metrics.inc("broadcast_messages_total", result="failed")
+            self._finish(tg_id)
+            return
+        except Exception as e:
+            logger.exception("Broadcast %s: send to %s failed", self.id, tg_id)
+            self.failed += 1
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"[:500]
+            metrics.inc("broadcast_messages_total", result="failed")
+            self._finish(tg_id)
+            return
+        finally:
+            self.sem.release()
+
+        self.sent += 1
+        self.had_success = True
+        self.pacer.ok()
+        metrics.inc("broadcast_messages_total", result="sent")
+        self._finish(tg_id)
+
+    def _spawn(self, tg_id: int, attempts: int) -> None:
+        t = asyncio.get_running_loop().create_task(self._send(tg_id, attempts))
+        self.tasks.add(t)
+        t.add_done_callback(self.tasks.discard)
+
+    def _should_abort(self) -> bool:
+        return not self.had_success and self.failures >= _ABORT_AFTER_FAILURES
+
+    # ---- checkpoint ----
+    def _measure_rate(self) -> None:
+        now = time.monotonic()
+        self.rate_window.append((now, self.done_total))
+        while len(self.rate_window) > 2 and now - self.rate_window[0][0] > 10:
+            self.rate_window.popleft()
+        t0, n0 = self.rate_window[0]
+        self.send_rate = (self.done_total - n0) / (now - t0) if now > t0 else 0.0
+        metrics.set_gauge("broadcast_send_rate", self.send_rate)
+        metrics.set_gauge("broadcast_pacing_rate", self.pacer.rate)
+
+    async def _heartbeat(self) -> None:
+        """
+        Ανανεώνει το lease ανεξάρτητα από το send loop. Αν η βάση δεν απαντά,
+        σταματάει τις αποστολές πριν λήξει το lease (άρα πριν το πάρει άλλος).
+        """
+        interval = LEASE_SECONDS / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                ok = await asyncio.to_thread(db.renew_broadcast_lease, self.id, OWNER, LEASE_SECONDS)
+            except Exception:
+                logger.exception("Broadcast %s: lease renewal failed", self.id)
+                ok = time.monotonic() - self.lease_renewed < LEASE_SECONDS - interval
+            else:
+                if ok:
+                    self.lease_renewed = time.monotonic()
+            if not ok:
+                self.lease_lost.set()
+                return
+
+    async def _checkpoint(self) -> Optional[str]:
+        self._measure_rate()
+        sent, failed, blocked = self.sent, self.failed, self.blocked
+        self.sent, self.failed, self.blocked = 0, 0, []
+        try:
+            return await asyncio.to_thread(
+                db.checkpoint_broadcast,
+                self.id, OWNER, self.checkpoint, sent, failed, blocked, self.send_rate, LEASE_SECONDS,
+            )
+        except Exception:
+            # κρατάμε τα deltas για το επόμενο checkpoint
+            self.sent += sent
+            self.failed += failed
+            self.blocked = blocked + self.blocked
+            raise
+
+    def _log_progress(self) -> None:
+        left = max(0, self.total - self.done_total)
+        eta = left / self.send_rate if self.send_rate > 0 else 0
+        logger.info(
+            "Broadcast %s: %d/%d done, %.1f msg/s (pacing %.1f), ETA %.0fs",
+            self.id, self.done_total, self.total, self.send_rate, self.pacer.rate, eta,
+        )
+
+    # ---- main loop ----
+    async def run(self) -> None:
+        targets = db.iter_broadcast_targets(self.checkpoint, FETCH_BATCH)
+        queue: Deque[int] = deque()
+        exhausted = False
+        status: Optional[str] = "running"
+        final: Optional[str] = None
+        last_cp = last_log = time.monotonic()
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat())
+        logger.info("Broadcast %s: starting after tg_user_id %s (%d done)", self.id, self.checkpoint, self.done_before)
+        try:
+            while True:
+                if self.lease_lost.is_set():
+                    status = None
+                    break
+                if self.retry:
+                    tg_id, attempts = self.retry.popleft()
+                elif queue:
+                    tg_id, attempts = queue.popleft(), 1
+                    self.order.append(tg_id)
+                elif not exhausted:
+                    batch = await asyncio.to_thread(next, targets, None)
+                    if batch is None:
+                        exhausted = True
+                    else:
+                        queue.extend(batch)
+                    continue
+                elif self.tasks:
+                    await asyncio.wait(set(self.tasks), timeout=CHECKPOINT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                    tg_id = None
+                else:
+                    final = "done"
+                    break
+
+                if tg_id is not None:
+                    await self.pacer.wait(self.lease_lost)
+                    await self.sem.acquire()
+                    if self.lease_lost.is_set():
+                        self.sem.release()
+                        status = None
+                        break
+                    self._spawn(tg_id, attempts)
+
+                if self._should_abort():
+                    final = "failed"
+                    break
+
+                now = time.monotonic()
+                if now - last_cp >= CHECKPOINT_SECONDS:
+                    last_cp = now
+                    status = await self._checkpoint()
+                    if status != "running":
+                        break
+                if now - last_log >= LOG_SECONDS:
+                    last_log = now
+                    self._log_progress()
+
+            # τελειώνουν όσα είναι ήδη σε πτήση (τα retries τους δεν ξαναστέλνονται εδώ)
+            if self.tasks:
+                await asyncio.wait(set(self.tasks))
+            if status is not None:
+                status = await self._checkpoint()
+        except asyncio.CancelledError:
+            # shutdown: κρατάμε την πρόοδο και αφήνουμε το lease για να συνεχίσει
+            # αμέσως άλλο process (το broadcast μένει running)
+            for t in list(self.tasks):
+                t.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            try:
+                if await self._checkpoint() is not None:
+                    await asyncio.to_thread(db.release_broadcast, self.id, OWNER)
+            except Exception:
+                logger.exception("Broadcast %s: final checkpoint failed", self.id)
+            raise
+        finally:
+            heartbeat.cancel()
+            for t in list(self.tasks):
+                t.cancel()
+            try:
+                await asyncio.to_thread(targets.close)
+            except ValueError:
+                pass  # ο generator τρέχει ακόμα σε thread (ακυρωμένο fetch)· κλείνει με το GC
+            metrics.set_gauge("broadcast_send_rate", 0.0)
+
+        self._log_progress()
+        if status is None:
+            logger.warning("Broadcast %s: lease lost, stopping", self.id)
+            return
+        error = self.last_error if final == "failed" else None
+        await asyncio.to_thread(db.release_broadcast, self.id, OWNER, final, error)
+        logger.info("Broadcast %s: %s", self.id, final or status)
+
+
+# ----------------------
+# API
+# ----------------------
+def create(text: str, parse_mode: Optional[str] = None, reply_markup: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Νέο broadcast (sync: με asyncio.to_thread από async κώδικα). Ξεκινάει στο επόμενο poll."""
+    return db.create_broadcast(text, parse_mode, reply_markup)
+
+
+def status(row: Dict[str, Any]) -> Dict[str, Any]:
+    done = int(row["sent"]) + int(row["failed"]) + int(row["blocked"])
+    rate = float(row["send_rate"] or 0)
+    left = max(0, int(row["total"]) - done)
+    return {
+        "id": row["id"],
+        "status": row["status"],
+        "total": row["total"],
+        "done": done,
+        "sent": row["sent"],
+        "failed": row["failed"],
+        "blocked": row["blocked"],
+        "send_rate": round(rate, 2) if row["status"] == "running" else 0,
+        "eta_seconds": round(left / rate) if rate > 0 and row["status"] == "running" else None,
+        "running_on": row.get("lease_owner"),
+        "error": row.get("error"),
+        "created_at": str(row["created_at"]),
+        "started_at": str(row["started_at"]) if row.get("started_at") else None,
+        "finished_at": str(row["finished_at"]) if row.get("finished_at") else None,
+    }
+
+
+async def _loop() -> None:
+    while True:
+        try:
+            row = await asyncio.to_thread(db.claim_broadcast, OWNER, LEASE_SECONDS)
+            if row:
+                await _Run(row).run()
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Broadcast run failed")
+        await asyncio.sleep(POLL_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if ENABLED and _task is None:
+        _task = asyncio.get_running_loop().create_task(_loop())
+
+
+async def stop() -> None:
+    """Σταματάει στη μέση. Το broadcast μένει running και συνεχίζεται όταν λήξει το lease."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,306 @@
+# app/core/chat_memory.py
+"""Μνήμη συζήτησης ανά χρήστη για το Gemini chat.
+
+- sliding window με όριο tokens (CHAT_CONTEXT_TOKENS): όταν ξεπεραστεί, οι
+  παλαιότερες ανταλλαγές συμπτύσσονται σε σύνοψη (στο background, με Gemini)
+- compact αποθήκευση: τα turns κρατιούνται zlib-compressed JSON, τόσο στη
+  μνήμη όσο και στο Postgres (chat_sessions.turns BYTEA)
+- LRU στη μνήμη με όριο χρηστών και bytes, Postgres από πίσω
+- eviction λόγω αδράνειας: από τη μνήμη μετά από CHAT_MEMORY_IDLE_SECONDS,
+  από τη βάση μετά από CHAT_MEMORY_TTL_SECONDS
+- πολλά processes (webhook σε πολλούς workers + bot): κάθε save είναι
+  compare-and-set στο chat_sessions.version. Αν τη γραμμή την άλλαξε άλλο
+  process (ή ένα _compact εδώ), η session ξαναφορτώνεται από τη βάση και το
+  append ξαναγίνεται πάνω της, αντί να σβήσει τα turns του άλλου
+"""
+import os
+import json
+import time
+import zlib
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..db import (
+    get_chat_session,
+    save_chat_session,
+    delete_chat_session,
+    delete_idle_chat_sessions,
+)
+from .gemini_stream import generate_gemini_text
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
+
+CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "1500"))
+MAX_USERS = int(os.getenv("CHAT_MEMORY_MAX_USERS", "100000"))
+MAX_BYTES = int(os.getenv("CHAT_MEMORY_MAX_BYTES", str(96 * 1024 * 1024)))
+IDLE_SECONDS = int(os.getenv("CHAT_MEMORY_IDLE_SECONDS", "1800"))
+TTL_SECONDS = int(os.getenv("CHAT_MEMORY_TTL_SECONDS", str(3 * 24 * 3600)))
+
+Turn = Tuple[str, str]  # (role: "user" | "model", text)
+
+_SAVE_ATTEMPTS = 3
+
+
+def estimate_tokens(text: str) -> int:
+    # χωρίς tokenizer: ~3 chars/token είναι συντηρητικό και για ελληνικά
+    return len(text) // 3 + 1
+
+
+def _pack(turns: List[Turn]) -> bytes:
+    return zlib.compress(json.dumps(turns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack(blob: bytes) -> List[Turn]:
+    if not blob:
+        return []
+    return [tuple(t) for t in json.loads(zlib.decompress(blob).decode("utf-8"))]
+
+
+class _Session:
+    __slots__ = ("summary", "blob", "tokens", "version", "last_used")
+
+    def __init__(self, summary: str = "", blob: bytes = b"", tokens: int = 0, version: int = 0):
+        self.summary = summary
+        self.blob = blob
+        self.tokens = tokens
+        self.version = version  # chat_sessions.version πάνω στο οποίο βασίζεται
+        self.last_used = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return len(self.blob) + len(self.summary) * 2 + 64
+
+
+class ChatMemory:
+    def __init__(self):
+        self._sessions: "OrderedDict[int, _Session]" = OrderedDict()
+        self._bytes = 0
+        self._summarizing: set = set()
+        self._save_locks: Dict[int, list] = {}  # tg_user_id -> [asyncio.Lock, refs]
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- LRU ----
+    def _put(self, tg_user_id: int, sess: _Session) -> None:
+        old = self._sessions.pop(tg_user_id, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._sessions[tg_user_id] = sess
+        self._bytes += sess.size
+        while self._sessions and (len(self._sessions) > MAX_USERS or self._bytes > MAX_BYTES):
+            _, ev = self._sessions.popitem(last=False)
+            self._bytes -= ev.size
+
+    def _drop(self, tg_user_id: int) -> None:
+        old = self._sessions.pop(tg_user_id, None)
+        if old is not None:
+            self._bytes -= old.size
+
+    @asynccontextmanager
+    async def _saving(self, tg_user_id: int):
+        """Ένα read-modify-save τη φορά ανά χρήστη σε αυτό το process: τα versions διαδέχονται το ένα το άλλο."""
+        entry = self._save_locks.get(tg_user_id)
+        if entry is None:
+            entry = self._save_locks[tg_user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._save_locks.pop(tg_user_id, None)
+
+    async def _load(self, tg_user_id: int) -> _Session:
+        sess = self._sessions.get(tg_user_id)
+        if sess is not None:
+            self._sessions.move_to_end(tg_user_id)
+            sess.last_used = time.monotonic()
+            return sess
+
+        row = None
+        try:
+            row = await asyncio.to_thread(get_chat_session, tg_user_id, TTL_SECONDS)
+        except Exception:
+            logger.exception("chat memory load failed for %s", tg_user_id)
+        if row and not row["expired"]:
+            sess = _Session(row["summary"] or "", bytes(row["turns"]), int(row["tokens"] or 0), int(row["version"]))
+        else:
+            sess = _Session(version=int(row["version"]) if row else 0)
+        self._put(tg_user_id, sess)
+        return sess
+
+    async def _persist(self, tg_user_id: int, sess: _Session) -> bool:
+        """
+        False αν τη γραμμή την άλλαξε άλλος (version conflict): η session βγαίνει
+        από τη μνήμη ώστε το επόμενο _load να πάρει την τρέχουσα από τη βάση. Σε
+        σφάλμα της βάσης η session μένει μόνο στη μνήμη (True, χωρίς retry).
+        """
+        try:
+            version = await asyncio.to_thread(
+                save_chat_session, tg_user_id, sess.summary, sess.blob, sess.tokens, sess.version
+            )
+        except Exception:
+            logger.exception("chat memory save failed for %s", tg_user_id)
+            return True
+        if version is None:
+            self._drop(tg_user_id)
+            return False
+        sess.version = version
+        return True
+
+    # ---- API ----
+    async def get_context(self, tg_user_id: int, user_text: str) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        (system_instruction, contents) για το επόμενο request, με το νέο μήνυμα στο τέλος.
+        Τα turns κόβονται στο CONTEXT_TOKENS (μαζί με σύνοψη και νέο μήνυμα), κρατώντας
+        τις πιο πρόσφατες ολόκληρες ανταλλαγές: το _compact τρέχει στο background και
+        μέχρι να τελειώσει το blob μπορεί να είναι πάνω από το budget.
+        """
+        sess = await self._load(int(tg_user_id))
+        turns = _unpack(sess.blob)
+
+        system = None
+        if sess.summary:
+            system = "Σύνοψη της μέχρι τώρα συζήτησης με τον χρήστη:\n" + sess.summary
+        budget = CONTEXT_TOKENS - estimate_tokens(user_text) - (estimate_tokens(system) if system else 0)
+        start = len(turns)
+        while start >= 2:
+            cost = estimate_tokens(turns[start - 2][1]) + estimate_tokens(turns[start - 1][1])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 2
+
+        contents = [{"role": role, "parts": [{"text": text}]} for role, text in turns[start:]]
+        contents.append({"role": "user", "parts": [{"text": user_text}]})
+        return system, contents
+
+    async def append_turn(self, tg_user_id: int, user_text: str, model_text: str) -> None:
+        tg_user_id = int(tg_user_id)
+        async with self._saving(tg_user_id):
+            for _ in range(_SAVE_ATTEMPTS):
+                sess = await self._load(tg_user_id)
+                turns = _unpack(sess.blob)
+                turns += [("user", user_text), ("model", model_text)]
+                tokens = sess.tokens + estimate_tokens(user_text) + estimate_tokens(model_text)
+                sess = _Session(sess.summary, _pack(turns), tokens, sess.version)
+                self._put(tg_user_id, sess)
+                if await self._persist(tg_user_id, sess):
+                    break
+            else:
+                logger.warning("chat memory: turn for %s not saved after %d conflicts", tg_user_id, _SAVE_ATTEMPTS)
+                return
+
+        if tokens > CONTEXT_TOKENS and tg_user_id not in self._summarizing:
+            self._summarizing.add(tg_user_id)
+            asyncio.get_running_loop().create_task(self._compact(tg_user_id))
+
+    async def reset(self, tg_user_id: int) -> None:
+        tg_user_id = int(tg_user_id)
+        self._drop(tg_user_id)
+        await asyncio.to_thread(delete_chat_session, tg_user_id)
+
+    # ---- σύνοψη παλιών turns ----
+    async def _compact(self, tg_user_id: int) -> None:
+        try:
+            sess = self._sessions.get(tg_user_id)
+            if sess is None:
+                return
+            turns = _unpack(sess.blob)
+
+            # κράτα τα πιο πρόσφατα turns μέσα στο ~60% του budget, τα υπόλοιπα -> σύνοψη
+            keep_budget = int(CONTEXT_TOKENS * 0.6)
+            kept, n_fold = 0, len(turns)
+            for i in range(len(turns) - 1, -1, -1):
+                kept += estimate_tokens(turns[i][1])
+                if kept > keep_budget:
+                    break
+                n_fold = i
+            n_fold -= n_fold % 2  # ολόκληρες ανταλλαγές user/model
+            if n_fold <= 0:
+                n_fold = min(2, len(turns))
+            old_turns = turns[:n_fold]
+
+            summary = await self._summarize(sess.summary, old_turns)
+
+            # με το lock κανένα append δεν τρέχει ενδιάμεσα: τα νέα turns μπήκαν μόνο στο τέλος
+            async with self._saving(tg_user_id):
+                cur = self._sessions.get(tg_user_id)
+                if cur is None:
+                    return
+                cur_turns = _unpack(cur.blob)
+                if cur_turns[:n_fold] != old_turns:
+                    return  # έγινε reset/reload στο μεταξύ
+                rest = cur_turns[n_fold:]
+                tokens = sum(estimate_tokens(t) for _, t in rest)
+                sess = _Session(summary, _pack(rest), tokens, cur.version)
+                self._put(tg_user_id, sess)
+                # σε conflict η σύνοψη χάνεται: θα ξαναγίνει στο επόμενο append_turn
+                await self._persist(tg_user_id, sess)
+        except Exception:
+            logger.exception("chat memory compaction failed for %s", tg_user_id)
+        finally:
+            self._summarizing.discard(tg_user_id)
+
+    async def _summarize(self, previous: str, turns: List[Turn]) -> str:
+        transcript = "\n".join(f"{'Χρήστης' if r == 'user' else 'Βοηθός'}: {t}" for r, t in turns)
+        if GEMINI_API_KEY:
+            prompt = (
+                f"Γράψε μια σύντομη σύνοψη (έως {SUMMARY_MAX_CHARS} χαρακτήρες) της συζήτησης, "
+                "κρατώντας γεγονότα, ονόματα, αριθμούς και ό,τι έχει ζητήσει ο χρήστης. "
+                "Μόνο τη σύνοψη, χωρίς εισαγωγή.\n\n"
+                f"Προηγούμενη σύνοψη:\n{previous or '-'}\n\nΝέα μηνύματα:\n{transcript}"
+            )
+            try:
+                text = await generate_gemini_text([{"role": "user", "parts": [{"text": prompt}]}], GEMINI_API_KEY)
+                if text.strip():
+                    return text.strip()[:SUMMARY_MAX_CHARS]
+            except Exception:
+                logger.exception("chat summary failed, falling back to truncation")
+        # fallback: κράτα το τέλος της προηγούμενης σύνοψης + των παλιών μηνυμάτων
+        return (previous + "\n" + transcript).strip()[-SUMMARY_MAX_CHARS:]
+
+    # ---- idle eviction ----
+    async def _run(self) -> None:
+        last_db_sweep = 0.0
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.monotonic() - IDLE_SECONDS
+            # το OrderedDict είναι σε σειρά χρήσης: οι αδρανείς είναι στην αρχή
+            while self._sessions:
+                tg_user_id, sess = next(iter(self._sessions.items()))
+                if sess.last_used >= cutoff:
+                    break
+                self._sessions.popitem(last=False)
+                self._bytes -= sess.size
+
+            if time.monotonic() - last_db_sweep > 3600:
+                last_db_sweep = time.monotonic()
+                try:
+                    n = await asyncio.to_thread(delete_idle_chat_sessions, TTL_SECONDS)
+                    if n:
+                        logger.info("chat memory: deleted %d idle sessions", n)
+                except Exception:
+                    logger.exception("chat memory DB sweep failed")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+chat_memory = ChatMemory()
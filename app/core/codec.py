@@ -0,0 +1,121 @@
+# app/core/codec.py
+"""Base64 / data-URL helpers για μεγάλα payloads (εικόνες, βίντεο).
+
+Το binascii κρατάει το GIL για όλη τη διάρκεια μιας κλήσης, οπότε ένα
+b64encode 20MB "παγώνει" το event loop ακόμα κι αν τρέχει σε thread.
+Εδώ κάνουμε encode/decode σε chunks πάνω σε memoryview (χωρίς ενδιάμεσα
+αντίγραφα) και, πάνω από ένα όριο μεγέθους, τρέχουμε τη μετατροπή σε
+worker pool ώστε το loop να παίρνει το GIL ανάμεσα στα chunks.
+"""
+import os
+import re
+import asyncio
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# Πάνω από αυτό το μέγεθος (raw bytes ή base64 chars) η μετατροπή πάει σε worker.
+OFFLOAD_THRESHOLD = int(os.getenv("CODEC_OFFLOAD_THRESHOLD", str(256 * 1024)))
+
+# Raw bytes ανά chunk στο encode (πολλαπλάσιο του 3 => κανένα padding στη μέση).
+ENCODE_CHUNK = 3 * 128 * 1024
+# Base64 chars ανά chunk στο decode (πολλαπλάσιο του 4).
+DECODE_CHUNK = 4 * 128 * 1024
+_NON_B64 = re.compile(rb"[^A-Za-z0-9+/=]")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("CODEC_WORKERS", "4")),
+            thread_name_prefix="codec",
+        )
+    return _executor
+
+
+# ----------------------
+# Sync (chunked) codec
+# ----------------------
+def b64encode_chunked(data: BytesLike) -> str:
+    """Base64 encode σε chunks. Επιστρέφει ASCII str (όπως θέλει το JSON body)."""
+    mv = memoryview(data).cast("B")
+    n = len(mv)
+    if n <= ENCODE_CHUNK:
+        return binascii.b2a_base64(mv, newline=False).decode("ascii")
+
+    parts = [
+        binascii.b2a_base64(mv[i:i + ENCODE_CHUNK], newline=False)
+        for i in range(0, n, ENCODE_CHUNK)
+    ]
+    return b"".join(parts).decode("ascii")
+
+
+def b64decode_chunked(data: Union[str, BytesLike]) -> bytes:
+    """Base64 decode σε chunks. Δέχεται str ή bytes-like."""
+    mv = memoryview(data.encode("ascii") if isinstance(data, str) else data).cast("B")
+    n = len(mv)
+
+    # Με οποιοδήποτε byte εκτός alphabet (newlines, tabs, κενά, url-safe -_) τα
+    # chunks δεν είναι ευθυγραμμισμένα σε τετράδες, οπότε κάνουμε decode μονοκόμματα.
+    if n <= DECODE_CHUNK or _NON_B64.search(mv):
+        return binascii.a2b_base64(mv)
+
+    parts = [binascii.a2b_base64(mv[i:i + DECODE_CHUNK]) for i in range(0, n, DECODE_CHUNK)]
+    return b"".join(parts)
+
+
+# ----------------------
+# Async wrappers
+# ----------------------
+async def b64encode_async(data: BytesLike) -> str:
+    if len(data) < OFFLOAD_THRESHOLD:
+        return b64encode_chunked(data)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), b64encode_chunked, data)
+
+
+async def b64decode_async(data: Union[str, BytesLike]) -> bytes:
+    if len(data) < OFFLOAD_THRESHOLD:
+        return b64decode_chunked(data)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), b64decode_chunked, data)
+
+
+# ----------------------
+# Data URLs
+# ----------------------
+def split_data_url(du: str) -> Optional[Tuple[str, str]]:
+    """
+    "data:image/png;base64,AAAA" -> ("image/png", "AAAA")
+    Ψάχνει το "base64," μόνο στο header (όχι σε όλο το payload) και κάνει
+    strip μόνο όταν χρειάζεται, ώστε να μη δημιουργούνται επιπλέον αντίγραφα.
+    """
+    if not isinstance(du, str) or not du.startswith("data:"):
+        return None
+
+    idx = du.find("base64,", 0, 256)
+    if idx < 0:
+        return None
+
+    mime = du[5:idx].split(";", 1)[0].strip() or "image/png"
+    payload = du[idx + 7:]
+    if payload[:1].isspace() or payload[-1:].isspace():
+        payload = payload.strip()
+    return mime, payload
+
+
+async def to_data_url_async(data: BytesLike, mime: str) -> str:
+    return f"data:{mime};base64,{await b64encode_async(data)}"
+
+
+async def decode_data_url_async(du: str) -> Optional[Tuple[str, bytes]]:
+    parsed = split_data_url(du)
+    if not parsed:
+        return None
+    mime, payload = parsed
+    return mime, await b64decode_async(payload)
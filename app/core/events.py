@@ -0,0 +1,383 @@
+# app/core/events.py
+"""Buffered εγγραφή events στη βάση με COPY σε batches.
+
+Για ό,τι δεν είναι χρήματα (τα credits μένουν σύγχρονα στο db.py): lifecycle
+των jobs (started / polled / delivered / completed / failed), analytics events
+και ενημερώσεις status του generation_jobs. `record()` και `update_job()` μόνο
+προσθέτουν στο buffer: δεν ανοίγουν σύνδεση και δεν κάνουν round-trip.
+
+Ένα background task αδειάζει το buffer κάθε EVENTS_FLUSH_MS ή μόλις μαζευτούν
+EVENTS_BATCH_ROWS γραμμές, με ένα COPY στο job_events ανά batch και μία
+persistent σύνδεση ανά process. Τα updates του ίδιου job μέσα στο batch
+ενώνονται (το τελευταίο κερδίζει) και εφαρμόζονται με ένα UPDATE ... FROM.
+Το UPDATE εφαρμόζεται μόνο αν το ts του update δεν είναι παλαιότερο από το
+updated_at της γραμμής, ώστε ένα spill που ξαναπαίζεται μετά από νεότερο batch
+να μη γυρίζει το job σε παλιό status. Το πρώτο update μετά το INSERT περνάει
+πάντα (updated_at = created_at), ώστε να μην το κόβει διαφορά ρολογιού με τη βάση.
+
+Back-pressure / spill: όταν το buffer φτάσει EVENTS_MAX_BUFFER, ή όταν το flush
+αποτύχει (βάση down), τα events γράφονται (append + fsync) σε JSONL αρχεία στο
+EVENTS_SPILL_DIR. Τα αρχεία ξαναπαίζονται στα επόμενα flush, κι από άλλο process
+μετά από restart. Σε kill -9 χάνεται μόνο ό,τι ήταν στη μνήμη (≤ ένα flush).
+
+Μόνο τα transient σφάλματα (σύνδεση, OperationalError) κάνουν spill. Σε data
+error (π.χ. άκυρο UUID στο update_job) το batch χωρίζεται στα δύο μέχρι να
+απομονωθούν οι κακές γραμμές. Αυτές πάνε στο dead-<pid>.jsonl (δεν ξαναπαίζεται)
+και μετράνε στο events_dropped_total, ώστε μία κακή γραμμή να μην μπλοκάρει
+για πάντα το batch ή το spill αρχείο της.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+ENABLED = os.getenv("EVENTS_ENABLED", "1") == "1" and bool(DATABASE_URL)
+FLUSH_SECONDS = float(os.getenv("EVENTS_FLUSH_MS", "500")) / 1000
+BATCH_ROWS = int(os.getenv("EVENTS_BATCH_ROWS", "1000"))
+MAX_BUFFER = int(os.getenv("EVENTS_MAX_BUFFER", "50000"))
+SPILL_DIR = os.getenv("EVENTS_SPILL_DIR", "/tmp/app_events")
+SPILL_MAX_BYTES = int(float(os.getenv("EVENTS_SPILL_MAX_MB", "256")) * 1024 * 1024)
+
+_JOB_FIELDS = ("status", "progress", "provider_job_id", "result_url", "error")
+
+# ("e", ts, kind, model, job_id, user_id, data) | ("j", ts, job_id, fields)
+_buffer: deque = deque()
+_spill_lock = threading.Lock()
+_conn: Optional[psycopg.Connection] = None
+_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+# ----------------------
+# API
+# ----------------------
+def record(
+    kind: str,
+    *,
+    model: Optional[str] = None,
+    job_id: Optional[str] = None,
+    user_id: Optional[int] = None,
+    **data,
+) -> None:
+    """Analytics / lifecycle event. Thread-safe, δεν μπλοκάρει."""
+    if ENABLED:
+        _push(("e", time.time(), kind, model, job_id, user_id, data or None))
+
+
+def update_job(job_id: str, **fields) -> None:
+    """Buffered ενημέρωση του generation_jobs (μόνο status/progress/provider_job_id/result_url/error)."""
+    fields = {k: v for k, v in fields.items() if k in _JOB_FIELDS}
+    if ENABLED and fields:
+        _push(("j", time.time(), str(job_id), fields))
+
+
+def _push(item: tuple) -> None:
+    if len(_buffer) >= MAX_BUFFER:
+        # back-pressure: ο producer πληρώνει ένα append στο δίσκο αντί για μνήμη
+        _spill([item], fsync=False)
+        return
+    _buffer.append(item)
+    if len(_buffer) == BATCH_ROWS and _loop is not None and _wake is not None:
+        try:
+            _loop.call_soon_threadsafe(_wake.set)
+        except RuntimeError:  # loop έκλεισε
+            pass
+
+
+# ----------------------
+# Spill (JSONL)
+# ----------------------
+def _spill_path() -> str:
+    return os.path.join(SPILL_DIR, f"events-{os.getpid()}.jsonl")
+
+
+def _spill(items: List[tuple], fsync: bool = True) -> None:
+    path = _spill_path()
+    with _spill_lock:
+        try:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size >= SPILL_MAX_BYTES:
+                metrics.inc("events_dropped_total", len(items))
+                return
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(it, default=str) + "\n" for it in items))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            metrics.inc("events_spilled_total", len(items))
+        except OSError:
+            logger.exception("events: spill failed, dropping %d events", len(items))
+            metrics.inc("events_dropped_total", len(items))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _claim_spill() -> Optional[str]:
+    """
+    Παίρνει (atomic rename) ένα spill αρχείο για replay: το δικό μας ή ενός
+    process που δεν ζει πια (τα αρχεία ζωντανών processes μπορεί να γράφονται).
+    """
+    try:
+        names = sorted(os.listdir(SPILL_DIR))
+    except OSError:
+        return None
+    pid = os.getpid()
+    dst = os.path.join(SPILL_DIR, f"replay-{pid}.jsonl")
+    for name in names:
+        prefix, _, rest = name.partition("-")
+        if prefix not in ("events", "replay") or not rest.endswith(".jsonl"):
+            continue
+        try:
+            owner = int(rest[: -len(".jsonl")])
+        except ValueError:
+            continue
+        if owner != pid and _pid_alive(owner):
+            continue
+        if name == os.path.basename(dst):
+            return dst
+        with _spill_lock:
+            try:
+                os.replace(os.path.join(SPILL_DIR, name), dst)
+            except OSError:  # το πήρε άλλο process
+                continue
+        return dst
+    return None
+
+
+def _load_spill(path: str) -> List[tuple]:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                items.append(tuple(json.loads(line)))
+            except ValueError:  # μισή γραμμή από crash
+                continue
+    return items
+
+
+def _dead_letter(items: List[tuple], error: BaseException) -> None:
+    logger.error("events: dropping %d bad events: %s", len(items), error)
+    metrics.inc("events_dropped_total", len(items))
+    path = os.path.join(SPILL_DIR, f"dead-{os.getpid()}.jsonl")
+    with _spill_lock:
+        try:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps([str(error), it], default=str) + "\n" for it in items))
+        except OSError:
+            logger.exception("events: dead-letter write failed")
+
+
+# ----------------------
+# Flush
+# ----------------------
+# σύνδεση / server: ξαναδοκιμάζεται αργότερα (spill)
+_TRANSIENT = (psycopg.OperationalError, psycopg.InterfaceError)
+
+
+def _is_data_error(e: BaseException) -> bool:
+    if isinstance(e, _TRANSIENT):
+        return False
+    return isinstance(e, (psycopg.DatabaseError, ValueError, TypeError))
+
+
+class _FlushFailed(Exception):
+    """Transient σφάλμα: remaining = ό,τι δεν γράφτηκε (με τη σειρά του)."""
+
+    def __init__(self, remaining: List[tuple], written: int):
+        super().__init__(f"{len(remaining)} events not written")
+        self.remaining = remaining
+        self.written = written
+
+
+def _connection() -> psycopg.Connection:
+    global _conn
+    if _conn is None or _conn.closed or _conn.broken:
+        _conn = psycopg.connect(DATABASE_URL, autocommit=True, connect_timeout=5)
+    return _conn
+
+
+def _ts(x: float) -> datetime:
+    return datetime.fromtimestamp(x, timezone.utc)
+
+
+def _write(items: List[tuple]) -> None:
+    events = []
+    jobs: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+    for it in items:
+        if it[0] == "e":
+            _, ts, kind, model, job_id, user_id, data = it
+            events.append((_ts(ts), kind, model, job_id, user_id, Jsonb(data) if data else None))
+        elif it[0] == "j":
+            _, ts, job_id, fields = it
+            prev = jobs.get(job_id)
+            jobs[job_id] = (ts, {**prev[1], **fields} if prev else dict(fields))
+
+    conn = _connection()
+    with conn.transaction():
+        with conn.cursor() as cur:
+            if events:
+                with cur.copy("COPY job_events (ts, kind, model, job_id, user_id, data) FROM STDIN") as cp:
+                    for row in events:
+                        cp.write_row(row)
+            if jobs:
+                cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS _job_updates (
+                  id UUID, ts TIMESTAMPTZ, status TEXT, progress INTEGER,
+                  provider_job_id TEXT, result_url TEXT, error TEXT
+                ) ON COMMIT DELETE ROWS
+                """)
+                with cur.copy(
+                    "COPY _job_updates (id, ts, status, progress, provider_job_id, result_url, error) FROM STDIN"
+                ) as cp:
+                    for job_id, (ts, f) in jobs.items():
+                        cp.write_row((job_id, _ts(ts), *(f.get(k) for k in _JOB_FIELDS)))
+                cur.execute("""
+                UPDATE generation_jobs g
+                SET status = COALESCE(u.status, g.status),
+                    progress = COALESCE(u.progress, g.progress),
+                    provider_job_id = COALESCE(u.provider_job_id, g.provider_job_id),
+                    result_url = COALESCE(u.result_url, g.result_url),
+                    error = COALESCE(u.error, g.error),
+                    updated_at = u.ts
+                FROM _job_updates u
+                WHERE g.id = u.id
+                  AND (g.updated_at = g.created_at OR g.updated_at <= u.ts)
+                """)
+
+
+def _write_isolating(items: List[tuple]) -> int:
+    """
+    Γράφει τα items. Σε data error χωρίζει το κομμάτι στα δύο (με τη σειρά, ώστε
+    τα updates του ίδιου job να εφαρμόζονται όπως πριν), μέχρι να μείνουν οι
+    μεμονωμένες κακές γραμμές για dead-letter. Επιστρέφει πόσα γράφτηκαν. Σε
+    transient σφάλμα σηκώνει _FlushFailed με ό,τι έμεινε.
+    """
+    pending = [items]  # stack: το επόμενο κομμάτι είναι στο τέλος
+    written = 0
+    while pending:
+        chunk = pending.pop()
+        try:
+            _write(chunk)
+            written += len(chunk)
+        except Exception as e:
+            if not _is_data_error(e):
+                remaining = [it for c in [chunk, *reversed(pending)] for it in c]
+                raise _FlushFailed(remaining, written) from e
+            if len(chunk) == 1:
+                _dead_letter(chunk, e)
+                continue
+            mid = len(chunk) // 2
+            pending += [chunk[mid:], chunk[:mid]]
+    return written
+
+
+def _reset_connection() -> None:
+    global _conn
+    if _conn is not None:
+        _conn.close()
+    _conn = None
+
+
+def _flush_batch(items: List[tuple]) -> None:
+    t0 = time.perf_counter()
+    try:
+        written = _write_isolating(items)
+    except _FlushFailed as e:
+        logger.error("events: flush failed, spilling %d items: %s", len(e.remaining), e.__cause__)
+        metrics.inc("events_written_total", e.written)
+        _reset_connection()
+        _spill(e.remaining)
+        return
+    metrics.inc("events_written_total", written)
+    metrics.observe("events_flush_seconds", time.perf_counter() - t0)
+
+    # η βάση απαντάει: ξαναπαίζουμε ένα spill αρχείο (αν υπάρχει)
+    path = _claim_spill()
+    if path is not None:
+        replay = _load_spill(path)
+        try:
+            metrics.inc("events_written_total", _write_isolating(replay))
+        except _FlushFailed as e:
+            logger.error("events: replay of %s failed: %s", path, e.__cause__)
+            metrics.inc("events_written_total", e.written)
+            _reset_connection()
+            _spill(e.remaining)
+        os.remove(path)
+
+
+def _take() -> List[tuple]:
+    items = []
+    while _buffer and len(items) < BATCH_ROWS:
+        items.append(_buffer.popleft())
+    return items
+
+
+async def flush() -> None:
+    items = _take()
+    if items:
+        await asyncio.to_thread(_flush_batch, items)
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            while len(_buffer) >= BATCH_ROWS:
+                await flush()
+            await flush()
+            metrics.set_gauge("events_buffered", len(_buffer))
+        except Exception:
+            logger.exception("events: flush loop error")
+
+
+def start() -> None:
+    global _task, _wake, _loop
+    if ENABLED and _task is None:
+        _loop = asyncio.get_running_loop()
+        _wake = asyncio.Event()
+        _task = _loop.create_task(_run())
+
+
+async def stop() -> None:
+    global _task, _conn, _loop
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    _loop = None
+    while _buffer:
+        await flush()
+    if _conn is not None:
+        _conn.close()
+        _conn = None
@@ -0,0 +1,200 @@
+# app/core/gemini_stream.py
+"""Streaming απαντήσεις Gemini προς Telegram.
+
+`stream_gemini_text()` διαβάζει το `streamGenerateContent?alt=sse` και δίνει
+τα κομμάτια κειμένου όπως έρχονται. `TelegramStreamReply` τα γράφει στο
+placeholder μήνυμα με throttled edits (το Telegram κόβει όταν γίνονται πολλά
+edits στο ίδιο chat) και, όταν το κείμενο ξεπεράσει τα 4096 chars, κλείνει το
+τρέχον μήνυμα και συνεχίζει σε νέο.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from telegram.error import BadRequest, RetryAfter
+
+from ..config import GEMINI_API_BASE
+from .metrics import http_client
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BASE_URL = f"{GEMINI_API_BASE}/models"
+GEMINI_CHAT_MODEL = os.getenv("GEMINI_CHAT_MODEL", "gemini-2.5-flash").strip()
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "1") == "1"
+# ελάχιστο διάστημα ανάμεσα σε δύο edits του ίδιου μηνύματος
+STREAM_EDIT_INTERVAL = float(os.getenv("GEMINI_STREAM_EDIT_INTERVAL", "1.0"))
+
+TG_MAX_TEXT = 4096
+CURSOR = " ▌"
+
+
+def _candidate_text(data: Dict[str, Any]) -> str:
+    out = ""
+    for cand in (data.get("candidates") or [])[:1]:
+        for p in (cand.get("content") or {}).get("parts") or []:
+            if p.get("text") and not p.get("thought"):
+                out += p["text"]
+    return out
+
+
+def _body(contents: List[Dict[str, Any]], system_instruction: Optional[str]) -> Dict[str, Any]:
+    body: Dict[str, Any] = {"contents": contents}
+    if system_instruction:
+        body["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    return body
+
+
+def _timeout() -> httpx.Timeout:
+    # read = μέγιστη αναμονή ανάμεσα σε δύο chunks, όχι για όλη την απάντηση
+    return httpx.Timeout(connect=10, read=60, write=30, pool=10)
+
+
+async def stream_gemini_text(
+    contents: List[Dict[str, Any]],
+    api_key: str,
+    model: str = GEMINI_CHAT_MODEL,
+    system_instruction: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Async generator με τα text deltas της απάντησης."""
+    url = f"{GEMINI_BASE_URL}/{model}:streamGenerateContent"
+    async with http_client(timeout=_timeout()) as c:
+        async with c.stream(
+            "POST",
+            url,
+            params={"key": api_key, "alt": "sse"},
+            json=_body(contents, system_instruction),
+        ) as r:
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", "replace")
+                raise RuntimeError(f"Gemini error {r.status_code}: {body[:500]}")
+
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if not payload:
+                    continue
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    logger.warning("Gemini stream: bad SSE payload: %s", payload[:200])
+                    continue
+                if data.get("error"):
+                    raise RuntimeError(f"Gemini error: {data['error']}")
+                delta = _candidate_text(data)
+                if delta:
+                    yield delta
+
+
+async def generate_gemini_text(
+    contents: List[Dict[str, Any]],
+    api_key: str,
+    model: str = GEMINI_CHAT_MODEL,
+    system_instruction: Optional[str] = None,
+) -> str:
+    """Μη-streaming κλήση (GEMINI_STREAM=0)."""
+    async with http_client(timeout=60) as c:
+        r = await c.post(
+            f"{GEMINI_BASE_URL}/{model}:generateContent",
+            params={"key": api_key},
+            json=_body(contents, system_instruction),
+        )
+    data = r.json()
+    if r.status_code >= 400:
+        raise RuntimeError(f"Gemini error: {data}")
+    return _candidate_text(data)
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Πού να κοπεί ένα κείμενο > limit: προτιμά παράγραφο, μετά γραμμή, μετά κενό."""
+    window = text[:limit]
+    for sep in ("\n\n", "\n", " "):
+        idx = window.rfind(sep)
+        # μην κόβεις πολύ νωρίς (μήνυμα με λίγες λέξεις και τεράστια "λέξη")
+        if idx >= limit // 2:
+            return idx + len(sep)
+    return limit
+
+
+class TelegramStreamReply:
+    """Γράφει σταδιακά κείμενο σε ένα (ή περισσότερα) Telegram μηνύματα."""
+
+    def __init__(self, placeholder, edit_interval: float = STREAM_EDIT_INTERVAL):
+        self._msg = placeholder
+        self._edit_interval = edit_interval
+        self._text = ""       # κείμενο του τρέχοντος μηνύματος
+        self._shown = ""      # ό,τι έχει ήδη φανεί στο τρέχον μήνυμα
+        self._next_edit = 0.0
+        self.total_chars = 0
+
+    async def _edit(self, text: str) -> None:
+        if text == self._shown:
+            return
+        try:
+            await self._msg.edit_text(text)
+            self._shown = text
+        except RetryAfter as e:
+            # flood control: απλά καθυστέρησε το επόμενο edit
+            self._next_edit = time.monotonic() + float(e.retry_after)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+            self._shown = text
+
+    async def _send_overflow(self) -> None:
+        while len(self._text) > TG_MAX_TEXT:
+            cut = _split_point(self._text, TG_MAX_TEXT)
+            head, rest = self._text[:cut].rstrip(), self._text[cut:].lstrip()
+            await self._edit_final(head)
+            first = rest[:TG_MAX_TEXT] or "…"
+            self._msg = await self._msg.reply_text(first)
+            self._shown = first
+            self._text = rest
+            self._next_edit = time.monotonic() + self._edit_interval
+
+    async def _edit_final(self, text: str) -> None:
+        # το τελικό κείμενο ενός μηνύματος πρέπει να γραφτεί, ακόμα κι αν χρειαστεί αναμονή
+        for _ in range(3):
+            try:
+                if text != self._shown:
+                    await self._msg.edit_text(text)
+                    self._shown = text
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(float(e.retry_after))
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                self._shown = text
+                return
+
+    async def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        self._text += delta
+        self.total_chars += len(delta)
+
+        if len(self._text) > TG_MAX_TEXT:
+            await self._send_overflow()
+            return
+
+        now = time.monotonic()
+        if now < self._next_edit:
+            return
+        self._next_edit = now + self._edit_interval
+
+        preview = self._text
+        if len(preview) + len(CURSOR) <= TG_MAX_TEXT:
+            preview += CURSOR
+        await self._edit(preview)
+
+    async def finish(self, suffix: Optional[str] = None) -> None:
+        if suffix:
+            self._text += suffix
+            if len(self._text) > TG_MAX_TEXT:
+                await self._send_overflow()
+        await self._edit_final(self._text or "(Δεν λήφθηκε απάντηση)")
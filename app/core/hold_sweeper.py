@@ -0,0 +1,49 @@
+# app/core/hold_sweeper.py
+"""Αποδέσμευση credit holds που έμειναν ορφανά.
+
+Τα jobs τρέχουν ως BackgroundTasks: αν το process κάνει restart ανάμεσα στο
+hold και στο capture/release, τα credits μένουν δεσμευμένα. Κάθε
+CREDIT_HOLD_SWEEP_SECONDS αποδεσμεύονται τα holds παλαιότερα από
+CREDIT_HOLD_TTL_SECONDS (πολύ μεγαλύτερο από το πιο αργό job).
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from ..db import release_stale_credit_holds
+
+logger = logging.getLogger(__name__)
+
+HOLD_TTL_SECONDS = int(os.getenv("CREDIT_HOLD_TTL_SECONDS", "7200"))
+SWEEP_SECONDS = float(os.getenv("CREDIT_HOLD_SWEEP_SECONDS", "600"))
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run() -> None:
+    while True:
+        try:
+            n = await asyncio.to_thread(release_stale_credit_holds, HOLD_TTL_SECONDS)
+            if n:
+                logger.warning("Released stale credit holds for %d users", n)
+        except Exception:
+            logger.exception("Stale hold sweep failed")
+        await asyncio.sleep(SWEEP_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if _task is None and HOLD_TTL_SECONDS > 0:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
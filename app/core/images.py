@@ -0,0 +1,185 @@
+# app/core/images.py
+"""Κανονικοποίηση reference εικόνων πριν πάνε στον provider.
+
+- βρίσκει το πραγματικό format από τα magic bytes (όχι από το filename)
+- κάνει downscale στη μέγιστη χρήσιμη ανάλυση κάθε μοντέλου
+- ξανακάνει encode μόνο όταν χρειάζεται (μεγάλη εικόνα ή format που δεν δέχεται ο provider)
+- formats που δεν δέχεται ο provider (BMP, TIFF, HEIC, άγνωστα) μετατρέπονται, ή
+  απορρίπτονται με UnsupportedImage αν δεν ανοίγουν. Ποτέ δεν αλλάζει απλώς το mime.
+
+Η δουλειά του Pillow τρέχει σε process pool και τα αποτελέσματα κρατιούνται
+σε LRU cache με κλειδί το sha256 της εισόδου, ώστε η ίδια εικόνα να
+μετατρέπεται μία φορά. Αν δεν υπάρχει Pillow, περνάνε ως έχουν μόνο οι εικόνες
+σε format που δέχεται ο provider.
+"""
+import io
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow είναι προαιρετικό
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# profile -> (max πλευρά σε px, formats που δέχεται ο provider)
+IMAGE_PROFILES: Dict[str, Tuple[int, Tuple[str, ...]]] = {
+    "veo": (1920, ("image/jpeg", "image/png")),
+    "nanobanana": (2048, ("image/jpeg", "image/png", "image/webp")),
+    "sora": (1280, ("image/jpeg", "image/png", "image/webp")),
+    "kling_avatar": (1024, ("image/jpeg", "image/png")),
+}
+
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "90"))
+CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Μικρές εικόνες μέσα στο όριο δεν αξίζουν το round-trip στο process pool.
+INLINE_MAX_BYTES = 64 * 1024
+
+_executor: Optional[ProcessPoolExecutor] = None
+_cache: "OrderedDict[Tuple[str, str], Tuple[bytes, str]]" = OrderedDict()
+_cache_bytes = 0
+_inflight: Dict[Tuple[str, str], "asyncio.Future[Tuple[bytes, str]]"] = {}
+
+
+class UnsupportedImage(ValueError):
+    """Η εικόνα δεν είναι σε format του provider και δεν μετατρέπεται."""
+
+
+def sniff_image_mime(data: bytes) -> Optional[str]:
+    head = bytes(data[:16])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+
+def ext_for_mime(mime: str) -> str:
+    return {"image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif"}.get(mime, "png")
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "2")))
+    return _executor
+
+
+def _normalize_sync(data: bytes, max_side: int, accepted: Tuple[str, ...]) -> Tuple[bytes, str]:
+    """Τρέχει μέσα στο process pool."""
+    mime = sniff_image_mime(data)
+
+    try:
+        im = Image.open(io.BytesIO(data))
+    except Exception as e:
+        raise UnsupportedImage(f"unsupported image format ({mime or 'unknown'})") from e
+    with im:
+        w, h = im.size
+        if max(w, h) <= max_side and mime in accepted:
+            return data, mime
+
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        has_alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+        out = io.BytesIO()
+        if has_alpha and "image/png" in accepted:
+            im.save(out, format="PNG", optimize=True)
+            out_mime = "image/png"
+        else:
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+            im.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            out_mime = "image/jpeg"
+
+    encoded = out.getvalue()
+    # Αν για κάποιο λόγο βγήκε μεγαλύτερη και το αρχικό format γίνεται δεκτό, κράτα το αρχικό.
+    if len(encoded) >= len(data) and mime in accepted and max(w, h) <= max_side:
+        return data, mime
+    return encoded, out_mime
+
+
+def _cache_put(key: Tuple[str, str], value: Tuple[bytes, str]) -> None:
+    global _cache_bytes
+    size = len(value[0])
+    if size > CACHE_MAX_BYTES:
+        return
+    _cache[key] = value
+    _cache_bytes += size
+    while _cache_bytes > CACHE_MAX_BYTES and _cache:
+        _, (old, _) = _cache.popitem(last=False)
+        _cache_bytes -= len(old)
+
+
+async def normalize_image(data: bytes, profile: str) -> Tuple[bytes, str]:
+    """
+    Επιστρέφει (bytes, mime) έτοιμα για τον provider του profile.
+    Σε σφάλμα επιστρέφει την αρχική εικόνα αν το format της γίνεται δεκτό, ώστε
+    η προεπεξεργασία να μη ρίχνει ένα job. Αλλιώς σηκώνει UnsupportedImage.
+    """
+    max_side, accepted = IMAGE_PROFILES[profile]
+    mime = sniff_image_mime(data)
+    fallback = (data, mime) if mime in accepted else None
+    if Image is None or not data:
+        if fallback is None:
+            raise UnsupportedImage(f"unsupported image format ({mime or 'unknown'})")
+        return fallback
+
+    if len(data) <= INLINE_MAX_BYTES:
+        digest = hashlib.sha256(data).hexdigest()
+    else:
+        # το hashlib αφήνει το GIL για μεγάλα buffers
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+    key = (digest, profile)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        return cached
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    _inflight[key] = fut
+    result, error = fallback, None
+    try:
+        if len(data) <= INLINE_MAX_BYTES:
+            result = _normalize_sync(data, max_side, accepted)
+        else:
+            result = await loop.run_in_executor(_get_executor(), _normalize_sync, data, max_side, accepted)
+        _cache_put(key, result)
+    except Exception as e:
+        if fallback is not None:
+            logger.exception("Image normalization failed (profile=%s), sending original", profile)
+            result = fallback
+        else:
+            error = e if isinstance(e, UnsupportedImage) else UnsupportedImage(f"image conversion failed: {e}")
+            logger.warning("Image rejected (profile=%s, mime=%s): %s", profile, mime, error)
+    finally:
+        _inflight.pop(key, None)
+        if error is not None:
+            fut.set_exception(error)
+            fut.exception()  # οι waiters το παίρνουν από το await: όχι "never retrieved"
+        elif result is not None:
+            fut.set_result(result)
+        else:
+            fut.cancel()
+
+    if error is not None:
+        raise error
+    return result
@@ -0,0 +1,46 @@
+# app/core/ledger_partitions.py
+"""Δημιουργία των μηνιαίων partitions του credit_ledger εκ των προτέρων.
+
+Το run_migrations τα φτιάχνει στο startup, αλλά ένα process μπορεί να τρέχει
+για μήνες χωρίς restart: κάθε LEDGER_PARTITION_CHECK_SECONDS εξασφαλίζουμε ότι
+υπάρχουν partitions για τους επόμενους LEDGER_PARTITIONS_AHEAD μήνες, ώστε
+τίποτα να μην καταλήγει στο credit_ledger_default.
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from ..db import ensure_ledger_partitions
+
+logger = logging.getLogger(__name__)
+
+CHECK_SECONDS = float(os.getenv("LEDGER_PARTITION_CHECK_SECONDS", "86400"))
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run() -> None:
+    while True:
+        await asyncio.sleep(CHECK_SECONDS)
+        try:
+            await asyncio.to_thread(ensure_ledger_partitions)
+        except Exception:
+            logger.exception("Ledger partition maintenance failed")
+
+
+def start() -> None:
+    global _task
+    if _task is None and CHECK_SECONDS > 0:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
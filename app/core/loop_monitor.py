@@ -0,0 +1,170 @@
+# app/core/loop_monitor.py
+"""Παρακολούθηση event loop για web και bot.
+
+- ticker task μετράει συνεχώς το lag του loop (πόσο αργεί ένα sleep(interval))
+  και κρατάει τα τελευταία δείγματα για percentiles
+- watchdog thread: όταν το loop δεν "χτυπήσει" για LOOP_STALL_THRESHOLD_MS,
+  γράφει στο log το stack του thread του loop, δηλαδή τον κώδικα που μπλοκάρει
+  (sync DB, sync SDK, μεγάλο base64 κ.λπ.)
+- LOOP_ASYNCIO_DEBUG=1: ενεργοποιεί και το asyncio debug (slow_callback_duration)
+- sample_stacks(): sampling profiler, βγάζει collapsed stacks
+  (flamegraph.pl / speedscope) για N δευτερόλεπτα
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "250")) / 1000
+WINDOW = int(os.getenv("LOOP_MONITOR_WINDOW", "3000"))  # ~5 λεπτά με interval 100ms
+LOG_SECONDS = float(os.getenv("LOOP_MONITOR_LOG_SECONDS", "60"))
+ASYNCIO_DEBUG = os.getenv("LOOP_ASYNCIO_DEBUG", "0") == "1"
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_HZ = 250
+
+
+def _percentile(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(q * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+class LoopMonitor:
+    def __init__(self):
+        self._samples: deque = deque(maxlen=WINDOW)
+        self._beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._profile_lock = threading.Lock()
+        self.stalls = 0
+        self.max_stall = 0.0
+
+    # ---- lag sampling ----
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_log = loop.time()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(INTERVAL)
+            now = loop.time()
+            self._samples.append(max(0.0, now - t0 - INTERVAL))
+            self._beat = time.monotonic()
+
+            if LOG_SECONDS and now - last_log >= LOG_SECONDS:
+                last_log = now
+                s = self.stats()
+                logger.info(
+                    "loop lag ms p50=%.1f p90=%.1f p99=%.1f max=%.1f stalls=%d",
+                    s["p50_ms"], s["p90_ms"], s["p99_ms"], s["max_ms"], s["stalls"],
+                )
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stop.wait(INTERVAL):
+            blocked = time.monotonic() - self._beat - INTERVAL
+            if blocked < STALL_THRESHOLD:
+                reported = False
+                continue
+            self.max_stall = max(self.max_stall, blocked)
+            if reported:
+                continue
+            # ένα stack ανά stall: αρκεί για να φανεί ποιος κρατάει το loop
+            reported = True
+            self.stalls += 1
+            metrics.inc("event_loop_stalls_total")
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)"
+            logger.warning("Event loop blocked for %.0f ms, loop thread stack:\n%s", blocked * 1000, stack)
+
+    def stats(self) -> Dict[str, float]:
+        vals = sorted(self._samples)
+        return {
+            "samples": len(vals),
+            "interval_ms": INTERVAL * 1000,
+            "p50_ms": _percentile(vals, 0.50) * 1000,
+            "p90_ms": _percentile(vals, 0.90) * 1000,
+            "p99_ms": _percentile(vals, 0.99) * 1000,
+            "max_ms": (vals[-1] if vals else 0.0) * 1000,
+            "stalls": self.stalls,
+            "max_stall_ms": self.max_stall * 1000,
+        }
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if ASYNCIO_DEBUG:
+            loop.set_debug(True)
+            loop.slow_callback_duration = STALL_THRESHOLD
+
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = loop.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._watchdog = None
+
+    # ---- sampling profiler ----
+    def sample_stacks(self, seconds: float, hz: int = 100, all_threads: bool = False) -> str:
+        """
+        Μπλοκάρει για `seconds` (τρέξ' το σε thread) και επιστρέφει collapsed stacks:
+        "root;caller;callee count" ανά γραμμή.
+        """
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        period = 1.0 / max(1, min(int(hz), PROFILE_MAX_HZ))
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        counts: Counter = Counter()
+
+        if not self._profile_lock.acquire(blocking=False):
+            raise RuntimeError("profile already running")
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    if not all_threads and tid != self._loop_thread_id:
+                        continue
+                    parts = []
+                    f = frame
+                    while f is not None:
+                        code = f.f_code
+                        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        f = f.f_back
+                    parts.append(names.get(tid, str(tid)))
+                    counts[";".join(reversed(parts))] += 1
+                time.sleep(period)
+        finally:
+            self._profile_lock.release()
+
+        return "\n".join(f"{stack} {n}" for stack, n in counts.most_common()) + "\n"
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,597 @@
+# app/core/metrics.py
+"""In-process metrics με έξοδο σε Prometheus text format.
+
+Registry χωρίς locks: κάθε thread γράφει στο δικό του shard (threading.local)
+και τα shards ενώνονται μόνο όταν ζητηθεί snapshot. Κάθε uvicorn worker γράφει
+περιοδικά το snapshot του σε METRICS_DIR/<pid>.json, και το /metrics ενώνει
+όλα τα πρόσφατα αρχεία, οπότε βλέπουμε ολόκληρο το service από όποιον worker
+απαντήσει.
+
+Τι μετράμε χωρίς αλλαγές μέσα στα routes:
+- `@track_job("model")` στα background jobs: jobs, διάρκεια, χρόνος σε ουρά
+- τα httpx requests των clients του app (http_client / http_transport): status,
+  latency/bytes ανά model + stage (create / poll / download / deliver), polls ανά job
+- Telegram API latency ανά method (και του PTB bot, που πάει μέσω httpx)
+- refunds (db), συνδέσεις DB, lag του event loop
+
+Το lifecycle κάθε job (started / polled / delivered / completed / failed)
+γράφεται επιπλέον ως event στο job_events μέσω του core.events.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import functools
+import inspect
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import tracing
+from ..config import TELEGRAM_API_BASE
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", "/tmp/app_metrics")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+STALE_SECONDS = float(os.getenv("METRICS_STALE_SECONDS", "120"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+_BUCKETS: Dict[str, Tuple[float, ...]] = {"job_polls": COUNT_BUCKETS}
+
+_HELP = {
+    "jobs_total": ("counter", "Background jobs started"),
+    "job_errors_total": ("counter", "Background jobs that raised"),
+    "job_duration_seconds": ("histogram", "Background job wall time"),
+    "job_stage_seconds": ("histogram", "Latency per job stage (queue/create/poll/download/deliver)"),
+    "job_polls": ("histogram", "Provider poll requests per job"),
+    "provider_requests_total": ("counter", "Outgoing provider HTTP requests by status"),
+    "provider_bytes_total": ("counter", "Bytes sent/received to providers"),
+    "telegram_api_seconds": ("histogram", "Telegram Bot API call latency"),
+    "telegram_api_requests_total": ("counter", "Telegram Bot API calls by status"),
+    "credit_hold_capture_failures_total": ("counter", "Delivered jobs whose hold capture did not charge, by reason (not_held/error)"),
+    "refunds_total": ("counter", "Credit refunds (Refund ... fail paths and released holds)"),
+    "refunded_credits_total": ("counter", "Credits refunded"),
+    "db_connect_seconds": ("histogram", "Time to get a DB connection from the pool"),
+    "db_connections_opened_total": ("counter", "DB connections checked out of the pool"),
+    "db_connections_closed_total": ("counter", "DB connections returned to the pool"),
+    "db_connections_in_use": ("gauge", "DB connections currently checked out"),
+    "db_pool_size": ("gauge", "Connections held by the pool (busy + idle)"),
+    "db_pool_available": ("gauge", "Idle connections in the pool"),
+    "db_pool_waiting": ("gauge", "Requests waiting for a pool connection"),
+    "db_reads_total": ("counter", "Routed reads by target (primary/replica) and reason"),
+    "db_write_mark_errors_total": ("counter", "Writes whose commit LSN could not be read (the user's reads use the primary for the window)"),
+    "db_replica_lag_seconds": ("gauge", "Read replica lag (-1 = unreachable)"),
+    "db_replica_usable": ("gauge", "1 if reads are routed to the replica"),
+    "http_request_seconds": ("histogram", "Incoming HTTP request latency per route"),
+    "event_loop_lag_seconds": ("gauge", "Event loop lag percentiles (rolling window)"),
+    "event_loop_stalls_total": ("counter", "Event loop stalls over threshold"),
+    "events_written_total": ("counter", "Buffered events/job updates written to the DB"),
+    "events_spilled_total": ("counter", "Buffered events written to the local spill file"),
+    "events_dropped_total": ("counter", "Buffered events dropped (spill full or unwritable)"),
+    "events_flush_seconds": ("histogram", "Time to COPY one event batch"),
+    "events_buffered": ("gauge", "Events waiting in the in-process buffer"),
+    "notifications_total": ("counter", "Queued Telegram notifications by kind and result (sent/retry/failed)"),
+    "telegram_send_wait_seconds": ("histogram", "Time a Telegram send waited for its rate-limit slot"),
+    "telegram_send_budget_errors_total": ("counter", "Telegram sends paced locally because the shared send budget was unavailable"),
+    "broadcast_messages_total": ("counter", "Broadcast messages by result (sent/failed/blocked)"),
+    "broadcast_throttled_total": ("counter", "Broadcast rate cuts after a Telegram 429"),
+    "broadcast_send_rate": ("gauge", "Measured broadcast throughput (messages/s, last ~10s)"),
+    "broadcast_pacing_rate": ("gauge", "Current adaptive broadcast pacing rate (messages/s)"),
+    "referral_stats_drift_total": ("counter", "Referral links whose counters were corrected by reconciliation"),
+    "referral_commission_events_total": ("counter", "Referral purchase events whose commission was computed and paid"),
+    "referral_commission_failed_total": ("counter", "Referral purchase events set aside as failed (owner not found)"),
+    "referral_commission_eur_total": ("counter", "Referral commission paid (EUR, before conversion to credits)"),
+    "referral_commission_batch_seconds": ("histogram", "Time to process one referral commission batch"),
+    "payment_events_total": ("counter", "Payment webhook events received and applied, by provider and result"),
+    "payment_events_unapplied_total": ("counter", "Paid events with unknown order or sku, set aside as failed for review"),
+    "payment_event_lag_seconds": ("histogram", "Time from payment webhook receipt to order/credits being applied"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+Key = Tuple[str, Labels]
+
+
+# ----------------------
+# Registry
+# ----------------------
+class _Shard:
+    __slots__ = ("counters", "hists")
+
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}
+        # key -> [count ανά bucket (+Inf στο τέλος)..., sum, count]
+        self.hists: Dict[Key, List[float]] = {}
+
+
+_local = threading.local()
+_shards: List[_Shard] = []
+_gauges: Dict[Key, float] = {}
+_collectors: List[Callable[[], None]] = []
+
+
+def _shard() -> _Shard:
+    s = getattr(_local, "shard", None)
+    if s is None:
+        s = _local.shard = _Shard()
+        _shards.append(s)  # list.append είναι atomic
+    return s
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    c = _shard().counters
+    k = _key(name, labels)
+    c[k] = c.get(k, 0.0) + value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    buckets = _BUCKETS.get(name, LATENCY_BUCKETS)
+    h = _shard().hists
+    k = _key(name, labels)
+    row = h.get(k)
+    if row is None:
+        row = h[k] = [0.0] * (len(buckets) + 3)
+    i = 0
+    while i < len(buckets) and value > buckets[i]:
+        i += 1
+    row[i] += 1
+    row[-2] += value
+    row[-1] += 1
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    _gauges[_key(name, labels)] = float(value)
+
+
+def register_collector(fn: Callable[[], None]) -> None:
+    """Κλήση πριν από κάθε snapshot (για gauges που διαβάζονται on demand)."""
+    _collectors.append(fn)
+
+
+def snapshot() -> Dict[str, Any]:
+    for fn in list(_collectors):
+        try:
+            fn()
+        except Exception:
+            logger.exception("metrics collector failed")
+
+    counters: Dict[Key, float] = {}
+    hists: Dict[Key, List[float]] = {}
+    for s in list(_shards):
+        for k, v in list(s.counters.items()):
+            counters[k] = counters.get(k, 0.0) + v
+        for k, row in list(s.hists.items()):
+            acc = hists.get(k)
+            if acc is None:
+                hists[k] = list(row)
+            else:
+                for i, v in enumerate(row):
+                    acc[i] += v
+
+    return {
+        "pid": os.getpid(),
+        "ts": time.time(),
+        "counters": [[n, list(map(list, l)), v] for (n, l), v in counters.items()],
+        "hists": [[n, list(map(list, l)), row] for (n, l), row in hists.items()],
+        "gauges": [[n, list(map(list, l)), v] for (n, l), v in list(_gauges.items())],
+    }
+
+
+# ----------------------
+# Job context
+# ----------------------
+class _JobCtx:
+    """
+    id = το hold_id του job (ίδιο με το job_id του event "created" που γράφει το
+    db.create_credit_hold), ώστε τα job_events να ενώνονται με το credit_holds.
+    Jobs χωρίς hold παίρνουν τυχαίο id.
+    """
+
+    __slots__ = ("model", "polls", "id", "user_id", "error")
+
+    def __init__(self, model: str, hold_id: Optional[int] = None, user_id: Optional[int] = None):
+        self.model = model
+        self.polls = 0
+        self.id = str(hold_id) if hold_id is not None else uuid.uuid4().hex
+        self.user_id = user_id
+        self.error: Optional[str] = None
+
+
+def _job_event(kind: str, ctx: _JobCtx, **data) -> None:
+    from . import events
+
+    events.record(kind, model=ctx.model, job_id=ctx.id, user_id=ctx.user_id, **data)
+
+
+_job: ContextVar[Optional[_JobCtx]] = ContextVar("metrics_job", default=None)
+_stage: ContextVar[Optional[str]] = ContextVar("metrics_stage", default=None)
+_request_start: ContextVar[Optional[float]] = ContextVar("metrics_request_start", default=None)
+
+
+def mark_job_failed(error: str) -> None:
+    """Για jobs που πιάνουν μόνα τους το σφάλμα (fail_and_refund): το event γίνεται "failed"."""
+    ctx = _job.get()
+    if ctx is not None:
+        ctx.error = (error or "error")[:200]
+
+
+def current_model() -> str:
+    ctx = _job.get()
+    return ctx.model if ctx else "-"
+
+
+def track_job(model: str):
+    """
+    Decorator για τα async background jobs των εργαλείων. Τα ορίσματα hold_id και
+    db_user_id του job (αν υπάρχουν) γίνονται job_id / user_id των events.
+    """
+
+    def deco(fn):
+        sig = inspect.signature(fn)
+
+        def ids(args, kwargs) -> Tuple[Optional[int], Optional[int]]:
+            try:
+                bound = sig.bind_partial(*args, **kwargs).arguments
+            except TypeError:
+                return None, None
+            return bound.get("hold_id"), bound.get("db_user_id")
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            ctx = _JobCtx(model, *ids(args, kwargs))
+            token = _job.set(ctx)
+            t0 = time.perf_counter()
+            started = _request_start.get()
+            queued = t0 - started if started is not None else None
+            if queued is not None:
+                observe("job_stage_seconds", queued, model=model, stage="queue")
+            inc("jobs_total", model=model)
+            _job_event("started", ctx, queue_seconds=queued)
+            try:
+                with tracing.start_span(f"job {model}", "consumer", model=model) as span:
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        span.set("job.polls", ctx.polls)
+            except Exception as e:
+                inc("job_errors_total", model=model)
+                ctx.error = ctx.error or type(e).__name__
+                raise
+            finally:
+                elapsed = time.perf_counter() - t0
+                observe("job_duration_seconds", elapsed, model=model)
+                observe("job_polls", ctx.polls, model=model)
+                _job_event(
+                    "failed" if ctx.error else "completed", ctx, seconds=elapsed, polls=ctx.polls, error=ctx.error
+                )
+                _job.reset(token)
+
+        return wrapper
+
+    return deco
+
+
+class stage:
+    """Ρητό stage για requests που δεν μαντεύονται σωστά: `with stage("download"): ...`"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._token = None
+
+    def __enter__(self):
+        self._token = _stage.set(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        _stage.reset(self._token)
+        return False
+
+
+def record_refund(amount: float, kind: str = "credit") -> None:
+    model = current_model()
+    inc("refunds_total", model=model, kind=kind)
+    inc("refunded_credits_total", float(amount), model=model, kind=kind)
+
+
+# ----------------------
+# httpx instrumentation
+# ----------------------
+_MEDIA_PREFIXES = ("image/", "video/", "audio/", "application/octet-stream", "binary/")
+
+
+def _content_length(headers) -> int:
+    try:
+        return int(headers.get("content-length") or 0)
+    except ValueError:
+        return 0
+
+
+_TELEGRAM_HOST = urlsplit(TELEGRAM_API_BASE).hostname
+
+
+def _record_http(request, response, elapsed: float, status: str) -> str:
+    """Καταγράφει το request και επιστρέφει όνομα για το span του."""
+    url = urlsplit(str(request.url))
+    host = url.hostname or "-"
+
+    if host == _TELEGRAM_HOST and url.path.startswith("/bot"):
+        # /bot<token>/sendMessage -> sendMessage (το token δεν μπαίνει ποτέ σε label)
+        method = url.path.rsplit("/", 1)[-1] or "-"
+        observe("telegram_api_seconds", elapsed, method=method)
+        inc("telegram_api_requests_total", method=method, status=status)
+        ctx = _job.get()
+        if ctx is not None and method.startswith("send"):
+            observe("job_stage_seconds", elapsed, model=ctx.model, stage="deliver")
+            _job_event("delivered", ctx, method=method, status=status, seconds=elapsed)
+        return f"telegram {method}"
+
+    ctx = _job.get()
+    model = ctx.model if ctx else "-"
+    st = _stage.get()
+    if st is None:
+        if request.method in ("POST", "PUT", "PATCH"):
+            st = "create"
+        else:
+            ctype = (response.headers.get("content-type", "") if response is not None else "").lower()
+            st = "download" if ctype.startswith(_MEDIA_PREFIXES) else "poll"
+    if st == "poll" and ctx is not None:
+        ctx.polls += 1
+        _job_event("polled", ctx, status=status, seconds=elapsed)
+
+    inc("provider_requests_total", model=model, host=host, stage=st, status=status)
+    observe("job_stage_seconds", elapsed, model=model, stage=st)
+
+    sent = _content_length(request.headers)
+    if sent:
+        inc("provider_bytes_total", sent, model=model, direction="up")
+    if response is not None:
+        got = _content_length(response.headers)
+        if got:
+            inc("provider_bytes_total", got, model=model, direction="down")
+        else:
+            # χωρίς content-length (chunked): μετράμε ό,τι διαβαστεί από το body
+            response.stream = _CountingStream(response.stream, model)
+    return f"{st} {host}"
+
+
+class _CountingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, model: str):
+        self._stream = stream
+        self._model = model
+        self._bytes = 0
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._bytes += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._bytes:
+                inc("provider_bytes_total", self._bytes, model=self._model, direction="down")
+                self._bytes = 0
+
+
+class _InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Τυλίγει τον transport ενός client: span + status/latency/bytes ανά request."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with tracing.start_span(f"HTTP {request.method}", "client", child_only=True) as span:
+            t0 = time.perf_counter()
+            try:
+                response = await self._inner.handle_async_request(request)
+            except Exception as e:
+                span.name = _record_http(request, None, time.perf_counter() - t0, type(e).__name__)
+                raise
+            try:
+                span.name = _record_http(request, response, time.perf_counter() - t0, str(response.status_code))
+                span.set("http.method", request.method)
+                span.set("http.status_code", response.status_code)
+            except Exception:
+                logger.exception("metrics: http record failed")
+            return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+def http_transport(**kwargs) -> httpx.AsyncBaseTransport:
+    """httpx.AsyncHTTPTransport(**kwargs) με metrics (π.χ. για το HTTPXRequest του PTB)."""
+    return _InstrumentedTransport(httpx.AsyncHTTPTransport(**kwargs))
+
+
+_TRANSPORT_ARGS = ("verify", "cert", "http1", "http2", "limits")
+
+
+def http_client(**kwargs) -> httpx.AsyncClient:
+    """
+    httpx.AsyncClient με metrics στα requests του. Τα ορίσματα του transport
+    (limits, verify, http2, ...) περνάνε στον εσωτερικό transport, αφού το
+    httpx τα αγνοεί όταν δίνεται δικός μας.
+    """
+    transport_kwargs = {k: kwargs.pop(k) for k in _TRANSPORT_ARGS if k in kwargs}
+    return httpx.AsyncClient(transport=http_transport(**transport_kwargs), **kwargs)
+
+
+# ----------------------
+# HTTP middleware (web)
+# ----------------------
+async def http_middleware(request, call_next):
+    t0 = time.perf_counter()
+    token = _request_start.set(t0)
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        _request_start.reset(token)
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        observe("http_request_seconds", time.perf_counter() - t0, route=path, method=request.method, status=status)
+
+
+# ----------------------
+# Multi-worker aggregation
+# ----------------------
+def _write_snapshot() -> None:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _read_snapshots() -> List[Dict[str, Any]]:
+    out = [snapshot()]
+    me = os.getpid()
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return out
+    now = time.time()
+    for name in names:
+        if not name.endswith(".json") or name == f"{me}.json":
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > STALE_SECONDS:
+                continue
+            with open(path, encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def _labels_str(labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    snaps = _read_snapshots()
+    counters: Dict[Key, float] = {}
+    hists: Dict[Key, List[float]] = {}
+    gauges: Dict[Key, float] = {}
+
+    for snap in snaps:
+        pid = str(snap.get("pid"))
+        for n, l, v in snap.get("counters", []):
+            k = (n, tuple(map(tuple, l)))
+            counters[k] = counters.get(k, 0.0) + v
+        for n, l, row in snap.get("hists", []):
+            k = (n, tuple(map(tuple, l)))
+            acc = hists.get(k)
+            if acc is None or len(acc) != len(row):
+                hists[k] = list(row)
+            else:
+                for i, v in enumerate(row):
+                    acc[i] += v
+        for n, l, v in snap.get("gauges", []):
+            # gauges δεν αθροίζονται με νόημα (π.χ. p99): ένα series ανά worker
+            k = (n, tuple(sorted(list(map(tuple, l)) + [("worker", pid)])))
+            gauges[k] = v
+
+    lines: List[str] = []
+    seen = set()
+
+    def header(name: str, kind: str) -> None:
+        if name in seen:
+            return
+        seen.add(name)
+        help_kind, text = _HELP.get(name, (kind, name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {help_kind}")
+
+    for (n, l), v in sorted(counters.items()):
+        header(n, "counter")
+        lines.append(f"{n}{_labels_str(l)} {v:g}")
+
+    for (n, l), v in sorted(gauges.items()):
+        header(n, "gauge")
+        lines.append(f"{n}{_labels_str(l)} {v:g}")
+
+    for (n, l), row in sorted(hists.items()):
+        header(n, "histogram")
+        buckets = _BUCKETS.get(n, LATENCY_BUCKETS)
+        cum = 0.0
+        for le, c in zip(list(buckets) + ["+Inf"], row[:-2]):
+            cum += c
+            lines.append(f"{n}_bucket{_labels_str(l + (('le', str(le)),))} {cum:g}")
+        lines.append(f"{n}_sum{_labels_str(l)} {row[-2]:g}")
+        lines.append(f"{n}_count{_labels_str(l)} {row[-1]:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------
+# Lifecycle
+# ----------------------
+_task: Optional[asyncio.Task] = None
+
+
+def _collect_loop_lag() -> None:
+    from .loop_monitor import loop_monitor
+
+    s = loop_monitor.stats()
+    for q in ("p50", "p90", "p99", "max"):
+        set_gauge("event_loop_lag_seconds", s[f"{q}_ms"] / 1000, quantile=q)
+
+
+def _collect_db() -> None:
+    opened = closed = 0.0
+    for s in list(_shards):
+        opened += s.counters.get(("db_connections_opened_total", ()), 0.0)
+        closed += s.counters.get(("db_connections_closed_total", ()), 0.0)
+    set_gauge("db_connections_in_use", opened - closed)
+
+
+async def _run() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(_write_snapshot)
+        except Exception:
+            logger.exception("metrics snapshot write failed")
+
+
+def start() -> None:
+    global _task
+    if _task is None:
+        register_collector(_collect_loop_lag)
+        register_collector(_collect_db)
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    try:
+        os.remove(os.path.join(METRICS_DIR, f"{os.getpid()}.json"))
+    except OSError:
+        pass
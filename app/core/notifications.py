@@ -0,0 +1,209 @@
+# app/core/notifications.py
+"""Ουρά ειδοποιήσεων Telegram για τα events του marketplace.
+
+Οι routes δεν στέλνουν πια απευθείας: βάζουν τις ειδοποιήσεις στον πίνακα
+notifications (db.enqueue_notification) και ένα background task τις παραδίδει
+μέσω του core.telegram_sender (rate limit ανά chat και για όλο το bot, κοινό
+για όλα τα processes).
+
+Coalescing: οι νέες προτάσεις προς τον ίδιο πελάτη έχουν coalesce_key. Η πρώτη
+φεύγει αμέσως. Όσες έρθουν μέσα στα επόμενα NOTIFY_DIGEST_SECONDS ενώνονται σε
+ένα μήνυμα-σύνοψη με ένα κουμπί αποδοχής ανά πρόταση. Μια δημοφιλής αγγελία
+στέλνει έτσι το πολύ ένα μήνυμα ανά window, αντί για burst που χτυπάει το όριο
+του Telegram ανά chat.
+
+Retries: σε 429 / 5xx / network η ειδοποίηση ξαναμπαίνει στην ουρά
+(retry_after ή exponential backoff), έως NOTIFY_MAX_ATTEMPTS. Σε 400 / 403
+(π.χ. ο χρήστης μπλόκαρε το bot) σημειώνεται failed. Αν το process πέσει στη
+μέση μιας αποστολής, η ειδοποίηση ξαναδίνεται μετά από NOTIFY_STALE_SECONDS,
+οπότε σπάνια μπορεί να φτάσει δύο φορές αλλά δεν χάνεται.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from .. import db
+from . import metrics, telegram_sender
+from .telegram_sender import TelegramSendError
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("NOTIFY_ENABLED", "1") == "1"
+DIGEST_SECONDS = float(os.getenv("NOTIFY_DIGEST_SECONDS", "60"))
+POLL_SECONDS = float(os.getenv("NOTIFY_POLL_MS", "1000")) / 1000
+BATCH = int(os.getenv("NOTIFY_BATCH", "50"))
+MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+STALE_SECONDS = float(os.getenv("NOTIFY_STALE_SECONDS", "300"))
+RETENTION_SECONDS = int(float(os.getenv("NOTIFY_RETENTION_DAYS", "7")) * 86400)
+
+KIND_NEW_OFFER = "new_offer"
+KIND_OFFER_ACCEPTED = "offer_accepted"
+
+_DIGEST_MAX_ITEMS = 10
+
+_task: Optional[asyncio.Task] = None
+
+
+# ----------------------
+# Enqueue (sync: καλούνται με asyncio.to_thread από async κώδικα)
+# ----------------------
+def new_offer(
+    client_tg_id: int,
+    job_title: str,
+    offer_id: str,
+    freelancer_name: str,
+    message: str,
+    price_eur=None,
+) -> None:
+    db.enqueue_notification(
+        client_tg_id,
+        KIND_NEW_OFFER,
+        {
+            "offer_id": str(offer_id),
+            "job_title": job_title,
+            "freelancer_name": freelancer_name,
+            "message": message,
+            "price_eur": float(price_eur) if price_eur else None,
+        },
+        coalesce_key="offers",
+        window_seconds=DIGEST_SECONDS,
+    )
+
+
+def offer_accepted(freelancer_tg_id: int, job_title: str) -> None:
+    db.enqueue_notification(freelancer_tg_id, KIND_OFFER_ACCEPTED, {"job_title": job_title})
+
+
+# ----------------------
+# Render
+# ----------------------
+def _cut(s: str, n: int) -> str:
+    s = s or ""
+    return s if len(s) <= n else s[: n - 1] + "…"
+
+
+def _render_new_offer(items: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    if len(items) == 1:
+        it = items[0]
+        price_text = f"\n💰 Τιμή: {it['price_eur']:.0f}€" if it.get("price_eur") else ""
+        text = (
+            f"📩 Νέα πρόταση στην αγγελία σου!\n\n"
+            f"📋 {it['job_title']}\n"
+            f"👤 Από: {it['freelancer_name']}\n"
+            f"💬 {_cut(it['message'], 1500)}"
+            f"{price_text}\n\n"
+            f"Μπες στις Εργασίες για να δεις & αποδεχτείς."
+        )
+        kb = {"inline_keyboard": [[{"text": "✅ Αποδοχή", "callback_data": f"jobs:accept:{it['offer_id']}"}]]}
+        return text, kb
+
+    shown = items[:_DIGEST_MAX_ITEMS]
+    lines = [f"📩 {len(items)} νέες προτάσεις στις αγγελίες σου!\n"]
+    buttons = []
+    for n, it in enumerate(shown, 1):
+        price = f" · 💰 {it['price_eur']:.0f}€" if it.get("price_eur") else ""
+        lines.append(
+            f"{n}. 📋 {_cut(it['job_title'], 60)}\n"
+            f"   👤 {it['freelancer_name']}{price}\n"
+            f"   💬 {_cut(it['message'], 200)}\n"
+        )
+        buttons.append([{
+            "text": f"✅ {n}. {_cut(it['freelancer_name'], 20)} — {_cut(it['job_title'], 24)}",
+            "callback_data": f"jobs:accept:{it['offer_id']}",
+        }])
+    if len(items) > len(shown):
+        lines.append(f"…και άλλες {len(items) - len(shown)}.\n")
+    lines.append("Μπες στις Εργασίες για να δεις & αποδεχτείς.")
+    return "\n".join(lines), {"inline_keyboard": buttons}
+
+
+def _render_offer_accepted(items: List[Dict[str, Any]]) -> Tuple[str, Optional[Dict[str, Any]]]:
+    titles = ", ".join(it.get("job_title") or "—" for it in items)
+    text = (
+        f"✅ Η πρότασή σου έγινε δεκτή!\n\n"
+        f"📋 Εργασία: {titles}\n\n"
+        f"Επικοινώνησε με τον πελάτη για τις λεπτομέρειες."
+    )
+    return text, None
+
+
+_RENDERERS = {
+    KIND_NEW_OFFER: _render_new_offer,
+    KIND_OFFER_ACCEPTED: _render_offer_accepted,
+}
+
+
+# ----------------------
+# Dispatcher
+# ----------------------
+def _backoff(attempts: int) -> float:
+    return min(5.0 * 2 ** (attempts - 1), 1800.0)
+
+
+async def _deliver(row: Dict[str, Any]) -> tuple:
+    kind = row["kind"]
+    render = _RENDERERS.get(kind)
+    if render is None:
+        metrics.inc("notifications_total", kind=kind, result="failed")
+        return (row["id"], "failed", 0.0, f"unknown kind {kind}")
+
+    try:
+        text, markup = render(row["payload"]["items"])
+        await telegram_sender.send_message(row["chat_id"], text, reply_markup=markup)
+    except Exception as e:
+        if not isinstance(e, TelegramSendError):
+            logger.exception("Notification %s: unexpected error", row["id"])
+            e = TelegramSendError(f"{type(e).__name__}: {e}")
+        if e.permanent or row["attempts"] >= MAX_ATTEMPTS:
+            logger.warning("Notification %s to %s failed: %s", row["id"], row["chat_id"], e)
+            metrics.inc("notifications_total", kind=kind, result="failed")
+            return (row["id"], "failed", 0.0, str(e)[:500])
+        metrics.inc("notifications_total", kind=kind, result="retry")
+        return (row["id"], "retry", e.retry_after or _backoff(row["attempts"]), str(e)[:500])
+
+    metrics.inc("notifications_total", kind=kind, result="sent")
+    return (row["id"], "sent", 0.0, None)
+
+
+async def dispatch_once() -> int:
+    rows = await asyncio.to_thread(db.claim_notifications, BATCH, STALE_SECONDS)
+    if rows:
+        results = await asyncio.gather(*(_deliver(r) for r in rows))
+        await asyncio.to_thread(db.finish_notifications, list(results))
+    return len(rows)
+
+
+async def _run() -> None:
+    last_cleanup = 0.0
+    while True:
+        n = 0
+        try:
+            n = await dispatch_once()
+            if time.monotonic() - last_cleanup > 3600:
+                last_cleanup = time.monotonic()
+                await asyncio.to_thread(db.delete_old_notifications, RETENTION_SECONDS)
+                await asyncio.to_thread(db.prune_telegram_send_slots, 3600)
+        except Exception:
+            logger.exception("Notification dispatch failed")
+        if n < BATCH:
+            await asyncio.sleep(POLL_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if ENABLED and _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    await telegram_sender.close()
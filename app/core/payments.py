@@ -0,0 +1,99 @@
+# app/core/payments.py
+"""Ασύγχρονη εφαρμογή των webhooks πληρωμών.
+
+Τα webhooks (routes.billing) ελέγχουν μόνο την υπογραφή, γράφουν το raw event
+στο payment_events και απαντάνε 200. Το UNIQUE (provider, event_id) κάνει τα
+retries του provider no-op. Αυτό το task εφαρμόζει τα events ένα-ένα με
+db.process_payment_event: order paid, credits + ledger, πλάνο και referral event
+σε ΕΝΑ transaction. Αν το process πέσει στη μέση, δεν χάνονται credits. Το event
+μένει pending και ξαναπαίζεται, και το lock στο order αποτρέπει διπλή πίστωση.
+
+Ξυπνάει αμέσως με wake() από το webhook. Το PAYMENTS_POLL_SECONDS είναι μόνο
+fallback, π.χ. για events που έγραψε άλλο worker ή για retries. Σε σφάλμα το
+event ξαναδοκιμάζεται με exponential backoff, έως PAYMENTS_MAX_ATTEMPTS, και μετά
+σημειώνεται failed για χειροκίνητο έλεγχο. Πληρωμή για άγνωστη παραγγελία ή sku
+γίνεται κατευθείαν failed (δεν αλλάζει με retry). Μόνο τα μη-πληρωμής event_type
+γίνονται ignored.
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from .. import db
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.getenv("PAYMENTS_POLL_SECONDS", "5"))
+MAX_ATTEMPTS = int(os.getenv("PAYMENTS_MAX_ATTEMPTS", "10"))
+
+# event_type που σημαίνουν πληρωμή. Για το CryptoCloud το event_type είναι το status.
+PAID_TYPES = ("checkout.session.completed", "paid")
+
+_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+
+
+def wake() -> None:
+    if _wake is not None:
+        _wake.set()
+
+
+def _backoff(attempts: int) -> float:
+    return min(5.0 * 2 ** (attempts - 1), 3600.0)
+
+
+async def process_once() -> bool:
+    """Εφαρμόζει ένα event. False αν η ουρά είναι άδεια."""
+    try:
+        ev = await asyncio.to_thread(db.process_payment_event, PAID_TYPES)
+    except db.PaymentEventError as e:
+        final = e.attempts >= MAX_ATTEMPTS
+        logger.error("Payment event %s failed (attempt %d): %s", e.event_id, e.attempts, e.__cause__ or e)
+        await asyncio.to_thread(db.fail_payment_event, e.event_id, str(e), None if final else _backoff(e.attempts))
+        metrics.inc("payment_events_total", provider=e.provider, result="failed" if final else "retry")
+        return True
+    if ev is None:
+        return False
+    metrics.inc("payment_events_total", provider=ev["provider"], result=ev["result"])
+    metrics.observe("payment_event_lag_seconds", ev["lag_seconds"])
+    if ev["result"] in db.PAYMENT_UNAPPLIED:
+        metrics.inc("payment_events_unapplied_total", provider=ev["provider"], result=ev["result"])
+        logger.error(
+            "Payment event %s (%s %s, order %s) not applied: %s; marked failed for review",
+            ev["id"], ev["provider"], ev["event_id"], ev["order_id"], ev["result"],
+        )
+    return True
+
+
+async def _run() -> None:
+    while True:
+        _wake.clear()
+        try:
+            while await process_once():
+                pass
+        except Exception:
+            logger.exception("Payment event processing failed")
+        try:
+            await asyncio.wait_for(_wake.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start() -> None:
+    global _task, _wake
+    if _task is None:
+        _wake = asyncio.Event()
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
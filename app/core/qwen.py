@@ -0,0 +1,131 @@
+# app/core/qwen.py
+"""Qwen AI (DashScope) εικόνες για το inline mode του bot.
+
+Το DashScope με `X-DashScope-Async: enable` επιστρέφει μόνο task_id, οπότε:
+create task -> polling στο /api/v1/tasks/{id} με backoff -> αποστολή φωτογραφίας.
+Όλο το job τρέχει ως background task, όπως τα jobs των web tools: ο bot handler
+επιστρέφει αμέσως.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Any, Dict
+
+import httpx
+
+from ..config import QWEN_API_KEY
+from ..db import add_credits_by_tg_id, get_user, set_last_result
+from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..web_shared import public_base_url
+from .paths import IMAGES_DIR
+from .images import sniff_image_mime, ext_for_mime
+from .telegram_client import tg_send_message, tg_send_photo
+from .metrics import track_job, http_client
+
+logger = logging.getLogger(__name__)
+
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com").rstrip("/")
+QWEN_IMAGE_MODEL = os.getenv("QWEN_IMAGE_MODEL", "wanx-v1").strip()
+QWEN_POLL_TIMEOUT = float(os.getenv("QWEN_POLL_TIMEOUT", "300"))
+
+_DONE_OK = "SUCCEEDED"
+_DONE_FAIL = ("FAILED", "CANCELED", "UNKNOWN")
+
+
+def _headers() -> Dict[str, str]:
+    if not QWEN_API_KEY:
+        raise RuntimeError("QWEN_API_KEY missing (set it in Railway env)")
+    return {"Authorization": f"Bearer {QWEN_API_KEY}", "Content-Type": "application/json"}
+
+
+async def _create_task(c: httpx.AsyncClient, prompt: str) -> str:
+    r = await c.post(
+        f"{DASHSCOPE_BASE_URL}/api/v1/services/aigc/text2image/image-synthesis",
+        headers={**_headers(), "X-DashScope-Async": "enable"},
+        json={
+            "model": QWEN_IMAGE_MODEL,
+            "input": {"prompt": prompt},
+            "parameters": {"n": 1, "size": "1024*1024"},
+        },
+    )
+    data = r.json()
+    if r.status_code >= 400:
+        raise RuntimeError(f"Qwen create error {r.status_code}: {data}")
+    task_id = (data.get("output") or {}).get("task_id")
+    if not task_id:
+        raise RuntimeError(f"Qwen: no task_id: {data}")
+    return task_id
+
+
+async def _poll_task(c: httpx.AsyncClient, task_id: str) -> Dict[str, Any]:
+    """Polling με exponential backoff (1s -> 8s) μέχρι QWEN_POLL_TIMEOUT."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + QWEN_POLL_TIMEOUT
+    delay = 1.0
+    while True:
+        await asyncio.sleep(delay)
+        r = await c.get(f"{DASHSCOPE_BASE_URL}/api/v1/tasks/{task_id}", headers=_headers())
+        if r.status_code >= 500 or r.status_code == 429:
+            data = {}
+        else:
+            data = r.json()
+            if r.status_code >= 400:
+                raise RuntimeError(f"Qwen poll error {r.status_code}: {data}")
+
+        output = data.get("output") or {}
+        status = (output.get("task_status") or "").upper()
+        if status == _DONE_OK:
+            return output
+        if status in _DONE_FAIL:
+            raise RuntimeError(f"Qwen task {status}: {output.get('message') or output}")
+
+        if loop.time() + delay > deadline:
+            raise RuntimeError(f"Qwen task timeout ({task_id})")
+        delay = min(delay * 1.6, 8.0)
+
+
+@track_job("qwen_ai")
+async def run_qwen_job(chat_id: int, tg_user_id: int, prompt: str, cost: Decimal) -> None:
+    """Background job: τα credits έχουν ήδη χρεωθεί, σε αποτυχία γίνεται refund."""
+    try:
+        async with http_client(timeout=60, follow_redirects=True) as c:
+            task_id = await _create_task(c, prompt)
+            output = await _poll_task(c, task_id)
+
+            results = [x for x in (output.get("results") or []) if x.get("url")]
+            if not results:
+                raise RuntimeError(f"Qwen: no image URL: {output}")
+            ir = await c.get(results[0]["url"], timeout=120)
+            if ir.status_code >= 400:
+                raise RuntimeError(f"Image download error {ir.status_code}")
+            img_bytes = ir.content
+
+        # τα URLs του DashScope λήγουν: κράτα αντίγραφο για το "resend"
+        mime = sniff_image_mime(img_bytes) or "image/png"
+        name = f"qwen_{uuid.uuid4().hex}.{ext_for_mime(mime)}"
+        (IMAGES_DIR / name).write_bytes(img_bytes)
+        try:
+            u = get_user(tg_user_id)
+            if u:
+                set_last_result(u["id"], "qwen_ai", f"{public_base_url()}/static/images/{name}")
+        except Exception:
+            logger.exception("Qwen: set_last_result failed")
+
+        kb = {"inline_keyboard": [[{"text": "← Πίσω", "callback_data": "menu:images"}]]}
+        await tg_send_photo(chat_id, img_bytes, caption="✅ Qwen AI: Έτοιμο", reply_markup=kb)
+
+    except Exception as e:
+        logger.exception("Qwen AI job error")
+        refunded = None
+        try:
+            add_credits_by_tg_id(tg_user_id, cost, "Refund Qwen AI fail", "system", None)
+            refunded = float(cost)
+        except Exception:
+            logger.exception("Refund failed")
+        try:
+            reason, tips = map_provider_error_to_gr(str(e))
+            await tg_send_message(chat_id, tool_error_message_gr(reason=reason, tips=tips, refunded=refunded))
+        except Exception:
+            logger.exception("Error sending failure message")
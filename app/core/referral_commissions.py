@@ -0,0 +1,86 @@
+# app/core/referral_commissions.py
+"""Πληρωμή προμηθειών referral σύμφωνα με το referral_pct του πλάνου του owner.
+
+Το core.payments γράφει, στο transaction που σημειώνει την παραγγελία paid,
+ένα pending purchase event για το referral link του αγοραστή
+(db.emit_referral_purchase). Κάθε REFERRAL_COMMISSION_SECONDS αυτό το task
+τρέχει db.pay_referral_commissions σε batches των REFERRAL_COMMISSION_BATCH
+μέχρι να αδειάσει η ουρά. Κάθε batch κοστίζει μερικά statements ανεξάρτητα από
+το μέγεθός του (μία γραμμή ledger ανά owner).
+
+Η προμήθεια πιστώνεται σε credits: commission_eur * REFERRAL_CREDITS_PER_EUR
+(default: η τιμή του μικρότερου πακέτου credits, π.χ. 100 credits / 7€).
+"""
+import os
+import time
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Optional
+
+from ..db import pay_referral_commissions
+from ..web_shared import CREDITS_PACKS
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _default_credits_per_eur() -> str:
+    base = min(CREDITS_PACKS.values(), key=lambda p: p["amount_eur"])
+    return str(round(base["credits"] / base["amount_eur"], 4))
+
+
+INTERVAL_SECONDS = float(os.getenv("REFERRAL_COMMISSION_SECONDS", "30"))
+BATCH = int(os.getenv("REFERRAL_COMMISSION_BATCH", "5000"))
+CREDITS_PER_EUR = Decimal(os.getenv("REFERRAL_CREDITS_PER_EUR", "") or _default_credits_per_eur())
+
+_task: Optional[asyncio.Task] = None
+
+
+async def run_once() -> int:
+    """Αδειάζει την ουρά. Επιστρέφει πόσα events επεξεργάστηκαν."""
+    total = 0
+    while True:
+        t0 = time.perf_counter()
+        r = await asyncio.to_thread(pay_referral_commissions, BATCH, CREDITS_PER_EUR)
+        if not r["events"]:
+            return total
+        total += r["events"]
+        metrics.observe("referral_commission_batch_seconds", time.perf_counter() - t0)
+        metrics.inc("referral_commission_events_total", r["events"] - r["failed"])
+        if r["failed"]:
+            metrics.inc("referral_commission_failed_total", r["failed"])
+            logger.error("Referral commissions: %d events without a referral owner marked failed", r["failed"])
+        metrics.inc("referral_commission_eur_total", float(r["commission_eur"]))
+        logger.info(
+            "Referral commissions: %d events, %s EUR, %s credits to %d owners",
+            r["events"], r["commission_eur"], r["credits"], r["owners"],
+        )
+        if r["events"] < BATCH:
+            return total
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await run_once()
+        except Exception:
+            logger.exception("Referral commission run failed")
+        await asyncio.sleep(INTERVAL_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if _task is None and INTERVAL_SECONDS > 0:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
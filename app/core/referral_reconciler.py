@@ -0,0 +1,51 @@
+# app/core/referral_reconciler.py
+"""Περιοδικός έλεγχος του referral_stats απέναντι στα raw referral_events.
+
+Οι μετρητές ενημερώνονται στο ίδιο transaction με κάθε event, οπότε κανονικά
+δεν αποκλίνουν. Απόκλιση σημαίνει χειροκίνητη αλλαγή στη βάση, ή εγγραφές από
+process με παλιό κώδικα κατά το deploy. Κάθε REFERRAL_RECONCILE_SECONDS οι
+αποκλίσεις διορθώνονται, γράφονται στο log και μετριούνται στο
+referral_stats_drift_total.
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from ..db import reconcile_referral_stats
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_SECONDS = float(os.getenv("REFERRAL_RECONCILE_SECONDS", "3600"))
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run() -> None:
+    while True:
+        try:
+            fixed = await asyncio.to_thread(reconcile_referral_stats)
+            if fixed:
+                metrics.inc("referral_stats_drift_total", len(fixed))
+                logger.warning("Referral stats drifted for %d links, fixed: %s", len(fixed), fixed[:50])
+        except Exception:
+            logger.exception("Referral stats reconciliation failed")
+        await asyncio.sleep(RECONCILE_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if _task is None and RECONCILE_SECONDS > 0:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
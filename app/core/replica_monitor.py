@@ -0,0 +1,57 @@
+# app/core/replica_monitor.py
+"""Παρακολούθηση του lag του read replica.
+
+Κάθε DB_REPLICA_CHECK_SECONDS μετράμε το lag (db.check_replica_lag). Το db._read
+στέλνει reads στο replica μόνο όσο η τελευταία μέτρηση είναι πρόσφατη και κάτω
+από DB_REPLICA_MAX_LAG_SECONDS, οπότε αν το replica μείνει πίσω ή πέσει, όλα
+γυρνάνε αυτόματα στο primary και επιστρέφουν όταν συνέλθει.
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from .. import db
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "2"))
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run() -> None:
+    usable = None
+    while True:
+        try:
+            lag = await asyncio.to_thread(db.check_replica_lag)
+            metrics.set_gauge("db_replica_lag_seconds", lag if lag is not None else -1)
+            now_usable = db.replica_usable()
+            metrics.set_gauge("db_replica_usable", 1 if now_usable else 0)
+            if now_usable != usable:
+                if now_usable:
+                    logger.info("Read replica in use (lag %.2fs)", lag)
+                else:
+                    logger.warning("Read replica not usable (lag=%s), reads go to primary", lag)
+                usable = now_usable
+        except Exception:
+            logger.exception("Replica lag check failed")
+        await asyncio.sleep(CHECK_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if _task is None and db.DATABASE_REPLICA_URL:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -6,6 +6,7 @@ from fastapi import HTTPException
 
 from ..config import BOT_TOKEN
 from ..db import ensure_user, get_user
+from .tracing import traced
 
 def verify_telegram_init_data(init_data: str) -> dict:
     if not init_data:
@@ -32,12 +33,18 @@ def verify_telegram_init_data(init_data: str) -> dict:
     except Exception:
         raise HTTPException(401, "Bad user json")
 
+@traced("db_user_from_webapp")
 def db_user_from_webapp(init_data: str):
     tg_user = verify_telegram_init_data(init_data)
     tg_id = int(tg_user["id"])
 
-    ensure_user(tg_id, tg_user.get("username"), tg_user.get("first_name"))
-    dbu = get_user(tg_id)
+    username, first_name = tg_user.get("username"), tg_user.get("first_name")
+
+    # συνήθης περίπτωση: ο χρήστης υπάρχει και δεν άλλαξε όνομα -> ένα read (replica
+    # αν υπάρχει), χωρίς εγγραφή στο primary
+    dbu = get_user(tg_id, replica=True)
+    if not dbu or dbu.get("tg_username") != username or dbu.get("tg_first_name") != first_name:
+        dbu = ensure_user(tg_id, username, first_name)
     if not dbu:
         raise HTTPException(500, "User not found after ensure_user")
     return dbu
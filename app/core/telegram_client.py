@@ -1,10 +1,33 @@
 # tg_send_message, tg_send_photo, tg_send_video
 # app/core/telegram_client.py
 import json
+import asyncio
 import httpx
 from typing import Optional, Dict, Any
 
-from ..config import BOT_TOKEN
+from ..config import BOT_TOKEN, TELEGRAM_API_BASE
+from .telegram_sender import reserve_send
+from .metrics import http_client
+
+# Το όριο του Telegram είναι κοινό για όλα τα processes (π.χ. ένα broadcast σε
+# άλλο process): σε 429 περιμένουμε το retry_after αντί να χαθεί η παράδοση.
+_MAX_429_RETRIES = 3
+_MAX_RETRY_AFTER = 60.0
+
+
+async def _post(c: httpx.AsyncClient, method: str, **kwargs) -> Dict[str, Any]:
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/{method}"
+    for attempt in range(_MAX_429_RETRIES + 1):
+        await reserve_send()
+        r = await c.post(url, **kwargs)
+        j = r.json()
+        retry_after = (j.get("parameters") or {}).get("retry_after")
+        if r.status_code != 429 or not retry_after or attempt == _MAX_429_RETRIES:
+            break
+        await asyncio.sleep(min(float(retry_after), _MAX_RETRY_AFTER))
+    if not j.get("ok"):
+        raise RuntimeError(f"Telegram {method} failed: {j}")
+    return j
 
 async def tg_send_message(
     chat_id: int,
@@ -12,17 +35,13 @@ async def tg_send_message(
     reply_markup: Optional[Dict[str, Any]] = None,
     parse_mode: Optional[str] = None,
 ) -> Dict[str, Any]:
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
     body: Dict[str, Any] = {"chat_id": chat_id, "text": text}
     if reply_markup:
         body["reply_markup"] = reply_markup
     if parse_mode:
         body["parse_mode"] = parse_mode
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.post(url, json=body)
-        j = r.json()
-        if not j.get("ok"):
-            raise RuntimeError(f"Telegram sendMessage failed: {j}")
+    async with http_client(timeout=30) as c:
+        j = await _post(c, "sendMessage", json=body)
         return j.get("result", {})
 
 async def tg_send_photo(
@@ -31,17 +50,13 @@ async def tg_send_photo(
     caption: str = "",
     reply_markup: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
     data = {"chat_id": str(chat_id), "caption": caption}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
     files = {"photo": ("photo.png", img_bytes, "image/png")}
 
-    async with httpx.AsyncClient(timeout=90) as c:
-        r = await c.post(url, data=data, files=files)
-        j = r.json()
-        if not j.get("ok"):
-            raise RuntimeError(f"Telegram sendPhoto failed: {j}")
+    async with http_client(timeout=90) as c:
+        j = await _post(c, "sendPhoto", data=data, files=files)
         return j["result"]
 
 async def tg_send_video(
@@ -50,17 +65,13 @@ async def tg_send_video(
     caption: str = "",
     reply_markup: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendVideo"
     data = {"chat_id": str(chat_id), "caption": caption}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
     files = {"video": ("video.mp4", video_bytes, "video/mp4")}
 
-    async with httpx.AsyncClient(timeout=120) as c:
-        r = await c.post(url, data=data, files=files)
-        j = r.json()
-        if not j.get("ok"):
-            raise RuntimeError(f"Telegram sendVideo failed: {j}")
+    async with http_client(timeout=120) as c:
+        j = await _post(c, "sendVideo", data=data, files=files)
         return j["result"]
 
 
@@ -73,17 +84,13 @@ async def tg_send_document(
     reply_markup: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     """Send a file as document (downloadable) to Telegram."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument"
     data = {"chat_id": str(chat_id), "caption": caption}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
     files = {"document": (filename, file_bytes, mime_type)}
 
-    async with httpx.AsyncClient(timeout=120) as c:
-        r = await c.post(url, data=data, files=files)
-        j = r.json()
-        if not j.get("ok"):
-            raise RuntimeError(f"Telegram sendDocument failed: {j}")
+    async with http_client(timeout=120) as c:
+        j = await _post(c, "sendDocument", data=data, files=files)
         return j["result"]
 
 
@@ -0,0 +1,169 @@
+# app/core/telegram_sender.py
+"""Κοινός, rate-limited αποστολέας μηνυμάτων Telegram.
+
+Ένας httpx.AsyncClient ανά process (keep-alive) αντί για νέο client σε κάθε
+μήνυμα. Πριν από κάθε αποστολή κλείνεται χρονικό slot:
+  - συνολικά έως TELEGRAM_SEND_RATE μηνύματα/δευτερόλεπτο για όλο το bot (όριο Bot API ~30/s)
+  - ανά chat ένα μήνυμα κάθε TELEGRAM_CHAT_INTERVAL_SECONDS (όριο ~1/s)
+Τα slots κλείνονται στον πίνακα telegram_send_slots (db.reserve_telegram_send_slot),
+άρα τα όρια είναι κοινά για όλα τα processes (uvicorn workers + bot) και τα
+μηνύματα ενός chat φεύγουν με τη σειρά που ζητήθηκαν. Αν η βάση δεν απαντά,
+το slot κλείνεται τοπικά (όρια ανά process) ώστε οι αποστολές να μη σταματούν.
+Σε 429 το chat μπλοκάρεται για retry_after.
+
+Οι παραδόσεις αποτελεσμάτων (core.telegram_client) παίρνουν slot από το ίδιο
+budget με reserve_send(). Τα bulk μηνύματα (core.broadcast) δεν κλείνουν
+global slot: το broadcast έχει δικό του pacing και μένει κάτω από το όριο του
+bot μείον ένα κρατημένο περιθώριο μείον ό,τι στέλνουν τα υπόλοιπα σε όλα τα
+processes (bot_rate(), από τον μετρητή του telegram_send_slots).
+
+Δεν κάνει retries: σηκώνει TelegramSendError με permanent / retry_after και ο
+caller (core.notifications) αποφασίζει, ώστε τα retries να επιβιώνουν restart.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from .. import db
+from ..config import BOT_TOKEN, TELEGRAM_API_BASE
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SEND_RATE = float(os.getenv("TELEGRAM_SEND_RATE", "25"))
+CHAT_INTERVAL_SECONDS = float(os.getenv("TELEGRAM_CHAT_INTERVAL_SECONDS", "1.0"))
+
+_client: Optional[httpx.AsyncClient] = None
+_global_next = 0.0
+_chat_next: Dict[int, float] = {}
+_samples: Deque[Tuple[float, int]] = deque()  # (monotonic, db.telegram_sent_total) για το bot_rate
+
+_RECENT_WINDOW = 5.0
+
+
+class TelegramSendError(RuntimeError):
+    """permanent: δεν έχει νόημα retry (π.χ. ο χρήστης μπλόκαρε το bot)."""
+
+    def __init__(
+        self,
+        message: str,
+        permanent: bool = False,
+        retry_after: Optional[float] = None,
+        status_code: Optional[int] = None,
+    ):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = metrics.http_client(
+            timeout=httpx.Timeout(30, connect=10),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def bot_rate() -> float:
+    """
+    Μηνύματα/δευτερόλεπτο εκτός broadcast, από όλα τα processes, στα τελευταία
+    ~_RECENT_WINDOW s. Διαβάζει τον κοινό μετρητή το πολύ μία φορά το δευτερόλεπτο.
+    """
+    now = time.monotonic()
+    if not _samples or now - _samples[-1][0] >= 1.0:
+        try:
+            sent = await asyncio.to_thread(db.telegram_sent_total)
+        except Exception:
+            logger.warning("telegram_sender: cannot read the shared send counter", exc_info=True)
+            metrics.inc("telegram_send_budget_errors_total")
+            sent = None
+        if sent is not None:
+            _samples.append((now, sent))
+        while len(_samples) > 1 and _samples[0][0] < now - _RECENT_WINDOW:
+            _samples.popleft()
+    if len(_samples) < 2:
+        return 0.0
+    (t0, n0), (t1, n1) = _samples[0], _samples[-1]
+    return max(0.0, (n1 - n0) / (t1 - t0)) if t1 > t0 else 0.0
+
+
+async def _wait_turn(chat_id: Optional[int], bulk: bool = False) -> None:
+    global _global_next
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    # 429 (retry_after) / bulk: τοπικά, ανά chat
+    slot = max(now, _chat_next.get(chat_id, 0.0)) if chat_id is not None else now
+    if not bulk:
+        try:
+            wait = await asyncio.to_thread(db.reserve_telegram_send_slot, chat_id, 1.0 / SEND_RATE, CHAT_INTERVAL_SECONDS)
+            slot = max(slot, now + wait)
+        except Exception:
+            logger.warning("telegram_sender: shared send budget unavailable, pacing locally", exc_info=True)
+            metrics.inc("telegram_send_budget_errors_total")
+            slot = max(slot, _global_next)
+            _global_next = slot + 1.0 / SEND_RATE
+    if chat_id is not None:
+        _chat_next[chat_id] = max(_chat_next.get(chat_id, 0.0), slot + CHAT_INTERVAL_SECONDS)
+
+    if len(_chat_next) > 10_000:
+        for cid, t in list(_chat_next.items()):
+            if t < now:
+                _chat_next.pop(cid, None)
+
+    if slot > now:
+        metrics.observe("telegram_send_wait_seconds", slot - now)
+        await asyncio.sleep(slot - now)
+
+
+async def reserve_send() -> None:
+    """Slot για μια αποστολή εκτός broadcast που δεν περνάει από το send_message (π.χ. sendPhoto)."""
+    await _wait_turn(None)
+
+
+async def send_message(
+    chat_id: int,
+    text: str,
+    reply_markup: Optional[Dict[str, Any]] = None,
+    parse_mode: Optional[str] = None,
+    bulk: bool = False,
+) -> Dict[str, Any]:
+    chat_id = int(chat_id)
+    await _wait_turn(chat_id, bulk)
+
+    body: Dict[str, Any] = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True}
+    if reply_markup:
+        body["reply_markup"] = reply_markup
+    if parse_mode:
+        body["parse_mode"] = parse_mode
+
+    try:
+        r = await _get_client().post(f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendMessage", json=body)
+        j = r.json()
+    except (httpx.HTTPError, ValueError) as e:
+        raise TelegramSendError(f"{type(e).__name__}: {e}") from e
+
+    if j.get("ok"):
+        return j.get("result", {})
+
+    desc = j.get("description") or str(j)
+    if r.status_code == 429:
+        retry_after = float((j.get("parameters") or {}).get("retry_after") or 5)
+        _chat_next[chat_id] = asyncio.get_running_loop().time() + retry_after
+        raise TelegramSendError(desc, retry_after=retry_after, status_code=429)
+    # 400 (chat not found, κακό markup), 403 (bot blocked): δεν θα πετύχει ποτέ
+    raise TelegramSendError(desc, permanent=r.status_code in (400, 403), status_code=r.status_code)
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
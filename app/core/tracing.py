@@ -0,0 +1,340 @@
+# app/core/tracing.py
+"""Ελαφρύ tracing συμβατό με OpenTelemetry (W3C traceparent, OTLP/JSON).
+
+Ένα generate περνάει από request -> DB -> background job -> provider polls ->
+download -> Telegram. Τα spans κρατιούνται σε contextvar, οπότε περνάνε
+αυτόματα στα BackgroundTasks και στα asyncio.to_thread. Για ουρές/workers
+εκτός process: `inject()` -> αποθήκευση του traceparent με το job ->
+`continue_trace(traceparent)` στον worker.
+
+Sampling στο root span (TRACE_SAMPLE_RATE). Τα spans που δεν γίνονται sample
+δεν καταγράφονται καθόλου (μόνο τα ids για propagation). Export σε batches
+από background task: JSONL αρχείο (TRACE_EXPORT_FILE) ή OTLP/HTTP collector
+(TRACE_OTLP_ENDPOINT, π.χ. http://otel-collector:4318/v1/traces).
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import functools
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "").strip()
+OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "").strip()
+FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "2"))
+MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "20000"))
+
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "").strip()
+
+_ENABLED = bool(EXPORT_FILE or OTLP_ENDPOINT) and SAMPLE_RATE > 0
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, span_id: str, parent_id: Optional[str], sampled: bool, name: str, kind: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns() if sampled else 0
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        if self.sampled:
+            self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+_queue: deque = deque(maxlen=MAX_QUEUE)
+_dropped = 0
+
+
+def _new_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+_NOOP = Span("0" * 32, "0" * 16, None, False, "noop", "internal")
+
+
+def is_enabled() -> bool:
+    return _ENABLED
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def is_recording() -> bool:
+    """True αν υπάρχει τρέχον span που γίνεται sample (για να μη δημιουργούμε root spans παντού)."""
+    span = _current.get()
+    return span is not None and span.sampled
+
+
+def _parse_traceparent(value: str) -> Optional[Span]:
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    # "remote" parent: δεν καταγράφεται, μόνο δίνει ids
+    return Span(parts[1], parts[2], None, sampled, "remote", "internal")
+
+
+class start_span:
+    """
+    `with start_span("name", attr=...) as span:` — χρησιμοποιείται και σε sync
+    και σε async κώδικα. parent = το τρέχον span ή το `parent` (π.χ. από traceparent).
+    child_only=True: span μόνο μέσα σε trace που γίνεται ήδη sample (για DB/HTTP
+    calls που αλλιώς θα άνοιγαν ένα root trace το καθένα).
+    """
+
+    __slots__ = ("span", "_token")
+
+    def __init__(
+        self,
+        name: str,
+        kind: str = "internal",
+        parent: Optional[Span] = None,
+        child_only: bool = False,
+        **attrs,
+    ):
+        self._token = None
+        parent = parent or _current.get()
+        if not _ENABLED or (child_only and (parent is None or not parent.sampled)):
+            self.span = _NOOP
+            return
+        if parent is not None:
+            sampled = parent.sampled
+            trace_id = parent.trace_id
+            parent_id = parent.span_id
+        else:
+            sampled = _ENABLED and random.random() < SAMPLE_RATE
+            trace_id = _new_id(16)
+            parent_id = None
+        self.span = Span(trace_id, _new_id(8), parent_id, sampled, name, kind)
+        if sampled and attrs:
+            self.span.attributes.update(attrs)
+
+    def __enter__(self) -> Span:
+        if self.span is not _NOOP:
+            self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if self._token is None:
+            return False
+        _current.reset(self._token)
+        span = self.span
+        if span.sampled:
+            span.end_ns = time.time_ns()
+            if exc is not None:
+                span.error = f"{exc_type.__name__}: {exc}"[:500]
+            _enqueue(span)
+        return False
+
+
+def traced(name: Optional[str] = None, kind: str = "internal"):
+    """Decorator για sync ή async συναρτήσεις."""
+
+    def deco(fn):
+        span_name = name or fn.__qualname__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with start_span(span_name, kind):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return deco
+
+
+def inject(carrier: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Προσθέτει traceparent στο carrier (headers, payload ενός queued job)."""
+    carrier = {} if carrier is None else carrier
+    span = _current.get()
+    if span is not None:
+        carrier["traceparent"] = span.traceparent
+    return carrier
+
+
+def continue_trace(traceparent: Optional[str], name: str, kind: str = "consumer", **attrs) -> start_span:
+    """Συνέχεια ενός trace σε άλλο process/worker από αποθηκευμένο traceparent."""
+    return start_span(name, kind, parent=_parse_traceparent(traceparent or ""), **attrs)
+
+
+# ----------------------
+# Export
+# ----------------------
+def _enqueue(span: Span) -> None:
+    global _dropped
+    if len(_queue) == _queue.maxlen:
+        _dropped += 1
+    _queue.append(span)
+
+
+def _to_dict(span: Span) -> Dict[str, Any]:
+    return {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": span.start_ns,
+        "endTimeUnixNano": span.end_ns,
+        "durationMs": round((span.end_ns - span.start_ns) / 1e6, 3),
+        "attributes": span.attributes,
+        "status": {"code": "ERROR", "message": span.error} if span.error else {"code": "OK"},
+        "service": SERVICE_NAME,
+    }
+
+
+_OTLP_KIND = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "app.core.tracing"},
+                "spans": [
+                    {
+                        "traceId": s.trace_id,
+                        "spanId": s.span_id,
+                        "parentSpanId": s.parent_id or "",
+                        "name": s.name,
+                        "kind": _OTLP_KIND.get(s.kind, 1),
+                        "startTimeUnixNano": str(s.start_ns),
+                        "endTimeUnixNano": str(s.end_ns),
+                        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                    }
+                    for s in spans
+                ],
+            }],
+        }]
+    }
+
+
+def _write_file(spans: List[Span]) -> None:
+    with open(EXPORT_FILE, "a", encoding="utf-8") as f:
+        for s in spans:
+            f.write(json.dumps(_to_dict(s), ensure_ascii=False, default=str) + "\n")
+
+
+async def _post_otlp(spans: List[Span]) -> None:
+    import httpx
+
+    # το export δεν πρέπει να κάνει trace τον εαυτό του
+    token = _current.set(_NOOP)
+    try:
+        async with httpx.AsyncClient(timeout=10) as c:
+            r = await c.post(OTLP_ENDPOINT, json=_to_otlp(spans))
+            if r.status_code >= 400:
+                logger.warning("OTLP export failed %s: %s", r.status_code, r.text[:300])
+    finally:
+        _current.reset(token)
+
+
+async def flush() -> None:
+    global _dropped
+    if not _queue:
+        return
+    spans = []
+    while _queue and len(spans) < 2000:
+        spans.append(_queue.popleft())
+    if _dropped:
+        logger.warning("tracing: dropped %d spans (queue full)", _dropped)
+        _dropped = 0
+    try:
+        if EXPORT_FILE:
+            await asyncio.to_thread(_write_file, spans)
+        if OTLP_ENDPOINT:
+            await _post_otlp(spans)
+    except Exception:
+        logger.exception("trace export failed")
+
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        while len(_queue) >= 2000:
+            await flush()
+        await flush()
+
+
+def start(service: str = "web") -> None:
+    global _task, SERVICE_NAME
+    SERVICE_NAME = SERVICE_NAME or service
+    if _ENABLED and _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    while _queue:
+        await flush()
+
+
+# ----------------------
+# Web middleware
+# ----------------------
+async def http_middleware(request, call_next):
+    if not _ENABLED:
+        return await call_next(request)
+    parent = _parse_traceparent(request.headers.get("traceparent", ""))
+    with start_span(f"{request.method} {request.url.path}", "server", parent=parent) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if getattr(route, "path", None):
+            span.name = f"{request.method} {route.path}"
+        span.set("http.method", request.method)
+        span.set("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.error = f"HTTP {response.status_code}"
+        return response
@@ -0,0 +1,110 @@
+# app/core/user_sessions.py
+"""Bot-side cache χρηστών με write-behind στο Postgres.
+
+Κάθε update (click σε μενού κ.λπ.) κάνει μόνο `touch()` στη μνήμη. Οι νέοι
+χρήστες και οι αλλαγές username/first_name γράφονται μαζικά (upsert_users_bulk)
+κάθε USER_SESSIONS_FLUSH_SECONDS δευτερόλεπτα. Όταν ένα action χρειάζεται τον χρήστη στη
+βάση (χρέωση/πίστωση credits), καλεί πρώτα `ensure_persisted()`.
+"""
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from ..db import ensure_user, upsert_users_bulk
+
+logger = logging.getLogger(__name__)
+
+Profile = Tuple[Optional[str], Optional[str]]  # (username, first_name)
+
+
+class UserSessionCache:
+    def __init__(
+        self,
+        max_size: int = int(os.getenv("USER_SESSIONS_MAX", "200000")),
+        flush_interval: float = float(os.getenv("USER_SESSIONS_FLUSH_SECONDS", "2")),
+        flush_batch: int = 1000,
+    ):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        # tg_user_id -> profile όπως το ξέρουμε (γραμμένο ή σε αναμονή)
+        self._known: "OrderedDict[int, Profile]" = OrderedDict()
+        # tg_user_id -> profile που δεν έχει γραφτεί ακόμα
+        self._dirty: Dict[int, Profile] = {}
+        # εγγραφές που γράφονται αυτή τη στιγμή από το flush
+        self._flushing: Dict[int, Profile] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, tg_user_id: int, username: Optional[str], first_name: Optional[str]) -> None:
+        """O(1), χωρίς DB. Σημειώνει τον χρήστη για γράψιμο μόνο αν είναι νέος ή άλλαξε."""
+        tg_user_id = int(tg_user_id)
+        prof = (username, first_name)
+        if self._known.get(tg_user_id) != prof:
+            self._known[tg_user_id] = prof
+            self._dirty[tg_user_id] = prof
+        self._known.move_to_end(tg_user_id)
+
+        # οι dirty εγγραφές μένουν στο _dirty μέχρι το flush, οπότε το eviction είναι ασφαλές
+        while len(self._known) > self.max_size:
+            self._known.popitem(last=False)
+
+    async def ensure_persisted(self, tg_user_id: int) -> None:
+        """Για actions με credits: ο χρήστης πρέπει να υπάρχει στη βάση τώρα."""
+        tg_user_id = int(tg_user_id)
+        prof = self._dirty.pop(tg_user_id, None) or self._flushing.get(tg_user_id)
+        if prof is None:
+            return
+        try:
+            await asyncio.to_thread(ensure_user, tg_user_id, prof[0], prof[1])
+        except Exception:
+            self._dirty.setdefault(tg_user_id, prof)
+            raise
+
+    async def flush(self) -> int:
+        if not self._dirty:
+            return 0
+
+        batch = []
+        for tg_user_id in list(self._dirty)[: self.flush_batch]:
+            prof = self._dirty.pop(tg_user_id)
+            batch.append((tg_user_id, prof[0], prof[1]))
+
+        self._flushing = {tg_user_id: (username, first_name) for tg_user_id, username, first_name in batch}
+        try:
+            await asyncio.to_thread(upsert_users_bulk, batch)
+        except Exception:
+            logger.exception("User sessions flush failed (%d rows), will retry", len(batch))
+            for tg_user_id, username, first_name in batch:
+                # αν ήρθε νεότερο profile στο μεταξύ, κράτα το νεότερο
+                self._dirty.setdefault(tg_user_id, (username, first_name))
+            return 0
+        finally:
+            self._flushing = {}
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            while await self.flush() >= self.flush_batch:
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._dirty:
+            if not await self.flush():
+                break
+
+
+user_sessions = UserSessionCache()
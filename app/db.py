@@ -2,37 +2,345 @@
 import os
 from pathlib import Path
 from decimal import Decimal
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 import secrets
 import json
+import sys
 import uuid
-from datetime import datetime, timezone
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
 
 import psycopg
 import psycopg.rows
+from psycopg import sql
+from psycopg_pool import ConnectionPool
+
+from . import db_queries
+from .web_shared import CREDITS_PACKS, SUBSCRIPTION_PLANS
+from .core import metrics, tracing, events
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("Λείπει το DATABASE_URL")
 
+# Προαιρετικό read replica (streaming replication του primary)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "").strip()
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_STALE_SECONDS = float(os.getenv("DB_REPLICA_STALE_SECONDS", "30"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+
 MIGRATIONS_DIR = Path(__file__).parent / "migrations"
 MAX_REF_LINKS = 10
+MIGRATIONS_LOCK_ID = 7_301_001
 
 # Start credits for new users
 START_FREE_CREDITS = Decimal("5.00")
 
 
+class InsufficientCredits(RuntimeError):
+    """Τα διαθέσιμα credits (credits - credits_held) δεν φτάνουν."""
+
+
 # ----------------------
 # Connections
 # ----------------------
+# Ένα pool ανά process (και ένα για το replica): οι συνδέσεις ξαναχρησιμοποιούνται,
+# οπότε τα prepared statements του db_queries μένουν στον server και η Postgres
+# δεν ξανακάνει parse/plan σε κάθε κλήση. Τα pools ανοίγουν στην πρώτη χρήση (και
+# ξανά μετά από fork). DB_PREPARE=0 για poolers που δεν κρατάνε prepared statements
+# (π.χ. pgbouncer transaction mode < 1.21).
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+PREPARE = os.getenv("DB_PREPARE", "1") == "1"
+
+_pools: Dict[str, Tuple[int, ConnectionPool]] = {}
+_pools_lock = threading.Lock()
+
+
 def _conn_autocommit():
     # Για migrations / απλά queries
     return psycopg.connect(DATABASE_URL, autocommit=True)
 
 
+def _configure_conn(conn: psycopg.Connection) -> None:
+    if not PREPARE:
+        conn.prepare_threshold = None
+
+
+def _pool(name: str = "primary") -> ConnectionPool:
+    entry = _pools.get(name)
+    if entry is not None and entry[0] == os.getpid():
+        return entry[1]
+    with _pools_lock:
+        entry = _pools.get(name)
+        if entry is None or entry[0] != os.getpid():
+            pool = ConnectionPool(
+                DATABASE_URL if name == "primary" else DATABASE_REPLICA_URL,
+                min_size=POOL_MIN,
+                max_size=POOL_MAX,
+                # replica: αν δεν απαντά, γρήγορα πίσω στο primary (βλ. _read)
+                timeout=POOL_TIMEOUT if name == "primary" else 3,
+                kwargs={"row_factory": psycopg.rows.dict_row},
+                configure=_configure_conn,
+                name=name,
+                open=False,
+            )
+            pool.open()
+            entry = _pools[name] = (os.getpid(), pool)
+    return entry[1]
+
+
+def close_pools() -> None:
+    for pid, pool in list(_pools.values()):
+        if pid == os.getpid():
+            pool.close()
+    _pools.clear()
+
+
+def _collect_pools() -> None:
+    for name, (pid, pool) in list(_pools.items()):
+        if pid != os.getpid():
+            continue
+        stats = pool.get_stats()
+        metrics.set_gauge("db_pool_size", stats.get("pool_size", 0), pool=name)
+        metrics.set_gauge("db_pool_available", stats.get("pool_available", 0), pool=name)
+        metrics.set_gauge("db_pool_waiting", stats.get("requests_waiting", 0), pool=name)
+
+
+metrics.register_collector(_collect_pools)
+
+
+@contextmanager
 def get_conn():
-    # Για app transactions (dict_row) + autocommit=False by default
-    return psycopg.connect(DATABASE_URL, row_factory=psycopg.rows.dict_row)
+    # Για app transactions (dict_row) + autocommit=False by default.
+    # Commit στην έξοδο αν δεν υπήρξε exception, αλλιώς rollback· μετά η σύνδεση γυρνάει στο pool.
+    span_name = "db"
+    if tracing.is_recording():
+        # frame 0 = get_conn, 1 = contextmanager.__enter__, 2 = η db συνάρτηση που το κάλεσε
+        span_name = f"db {sys._getframe(2).f_code.co_name}"
+    with tracing.start_span(span_name, "client", child_only=True):
+        t0 = time.perf_counter()
+        with _pool().connection() as conn:
+            metrics.observe("db_connect_seconds", time.perf_counter() - t0)
+            metrics.inc("db_connections_opened_total")
+            try:
+                yield conn
+            finally:
+                metrics.inc("db_connections_closed_total")
+
+
+def _cur(conn: psycopg.Connection):
+    """Cursor για statements του db_queries: γραμμές Row αντί για dict."""
+    return conn.cursor(row_factory=db_queries.row_factory)
+
+
+# ----------------------
+# Read replica + read-your-writes
+# ----------------------
+# Μόνο τα reads που περνάνε ρητά από το _read() πάνε στο replica, και μόνο όταν:
+#  - υπάρχει DATABASE_REPLICA_URL και το τελευταίο μετρημένο lag (core.replica_monitor,
+#    πριν από λιγότερα από DB_REPLICA_STALE_SECONDS) είναι <= DB_REPLICA_MAX_LAG_SECONDS
+#  - το replica έχει κάνει replay την τελευταία γνωστή εγγραφή (read-your-writes).
+#
+# Read-your-writes χωρίς κόστος στο primary για τα reads: κάθε εγγραφή που αφορά
+# χρήστες καλεί _mark_write(conn, ...) αμέσως μετά το commit, στην ίδια σύνδεση, και
+# κρατάει το WAL insert LSN (>= του commit record της) ως mark:
+#  - στο process (ανά χρήστη), για reads από το ίδιο process
+#  - στο HTTP request (cookie, βλ. client_marks_begin/end): ο client το στέλνει
+#    πίσω και το επόμενο request του βλέπει την εγγραφή από όποιον worker κι αν πάει
+# Το _read συγκρίνει το mark με το pg_last_wal_replay_lsn() του replica, στην ίδια
+# σύνδεση πριν το query. Αν δεν διαβαστεί LSN (σφάλμα), ο χρήστης διαβάζει από το
+# primary για DB_READ_YOUR_WRITES_SECONDS (time window). Εγγραφές άλλου process
+# χωρίς cookie (π.χ. webhook πληρωμής -> bot) φαίνονται με καθυστέρηση έως το lag.
+# Ό,τι κλειδώνει credits ή διαβάζει-για-να-γράψει μένει πάντα στο primary.
+_replica_lag: Optional[float] = None
+_replica_checked = 0.0
+_recent_writes: Dict[int, Tuple[Optional[int], float]] = {}  # user_id -> (lsn | None, λήξη)
+# mutable holder ανά HTTP request: {"read": lsn του client, "write": lsn εγγραφών του request}
+_client_marks: "ContextVar[Optional[Dict[str, Optional[int]]]]" = ContextVar("db_client_marks", default=None)
+
+RYW_COOKIE = "rw_lsn"
+
+
+def _lsn(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    hi, lo = str(value).split("/")
+    return (int(hi, 16) << 32) + int(lo, 16)
+
+
+def _lsn_text(value: int) -> str:
+    return f"{value >> 32:X}/{value & 0xFFFFFFFF:X}"
+
+
+def client_marks_begin(cookie: Optional[str]):
+    """Αρχή HTTP request: το mark που έστειλε ο client (cookie RYW_COOKIE). Επιστρέφει token."""
+    try:
+        read = _lsn(cookie)
+    except ValueError:
+        read = None
+    return _client_marks.set({"read": read, "write": None})
+
+
+def client_marks_end(token) -> Optional[str]:
+    """Τέλος request: το νέο mark για το cookie, αν το request έκανε εγγραφές."""
+    holder = _client_marks.get()
+    _client_marks.reset(token)
+    if holder and holder["write"] is not None:
+        return _lsn_text(max(holder["write"], holder["read"] or 0))
+    return None
+
+
+async def http_middleware(request, call_next):
+    """Read-your-writes για το web: mark από/προς το cookie RYW_COOKIE (βλ. _read)."""
+    token = client_marks_begin(request.cookies.get(RYW_COOKIE))
+    try:
+        response = await call_next(request)
+    finally:
+        mark = client_marks_end(token)
+    if mark is not None:
+        response.set_cookie(
+            RYW_COOKIE,
+            mark,
+            max_age=max(1, int(READ_YOUR_WRITES_SECONDS)),
+            httponly=True,
+            samesite="lax",
+            secure=request.url.scheme == "https",
+        )
+    return response
+
+
+def _mark_write(conn: psycopg.Connection, *user_ids) -> None:
+    """Μετά το commit μιας εγγραφής, στην ίδια σύνδεση: mark για read-your-writes."""
+    if not DATABASE_REPLICA_URL:
+        return
+    ids = {int(uid) for uid in user_ids if uid is not None}
+    if not ids:
+        return
+    lsn = None
+    try:
+        lsn = _lsn(conn.execute("SELECT pg_current_wal_insert_lsn()::text AS lsn").fetchone()["lsn"])
+        conn.commit()
+    except psycopg.Error:
+        # χωρίς LSN: time window στο primary για τους χρήστες (βλ. _read)
+        metrics.inc("db_write_mark_errors_total")
+        conn.rollback()
+
+    now = time.monotonic()
+    until = now + READ_YOUR_WRITES_SECONDS
+    for uid in ids:
+        _recent_writes[uid] = (lsn, until)
+    if len(_recent_writes) > 50_000:
+        for uid, (_, t) in list(_recent_writes.items()):
+            if t < now:
+                _recent_writes.pop(uid, None)
+
+    holder = _client_marks.get()
+    if holder is not None and lsn is not None:
+        holder["write"] = max(holder["write"] or 0, lsn)
+
+
+def _local_mark(user_id: Optional[int]) -> Tuple[Optional[int], bool]:
+    """(lsn mark, primary_only) του χρήστη από αυτό το process."""
+    entry = _recent_writes.get(int(user_id)) if user_id is not None else None
+    if entry is None or entry[1] <= time.monotonic():
+        return None, False
+    return entry[0], entry[0] is None
+
+
+def replica_usable() -> bool:
+    return (
+        bool(DATABASE_REPLICA_URL)
+        and _replica_lag is not None
+        and _replica_lag <= REPLICA_MAX_LAG_SECONDS
+        and time.monotonic() - _replica_checked < REPLICA_STALE_SECONDS
+    )
+
+
+def check_replica_lag() -> Optional[float]:
+    """
+    Μετράει το lag του replica (δευτερόλεπτα)· None αν δεν απαντά.
+    Όταν έχει κάνει replay ό,τι έχει λάβει, το lag είναι 0 (αλλιώς ένας primary
+    χωρίς κίνηση θα φαινόταν να "καθυστερεί" όλο και περισσότερο).
+    """
+    global _replica_lag, _replica_checked
+    lag = None
+    try:
+        with psycopg.connect(DATABASE_REPLICA_URL, autocommit=True, connect_timeout=3) as conn:
+            lag = float(conn.execute(
+                """
+                SELECT CASE
+                  WHEN NOT pg_is_in_recovery() THEN 0
+                  WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                  ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 1e9)
+                END
+                """
+            ).fetchone()[0])
+    except psycopg.Error:
+        pass
+    _replica_lag = lag
+    _replica_checked = time.monotonic()
+    return lag
+
+
+def _primary_read(run, reason: str):
+    metrics.inc("db_reads_total", target="primary", reason=reason)
+    with get_conn() as conn:
+        return run(conn)
+
+
+def _read(run, user_id: Optional[int] = None, owner=None):
+    """
+    Τρέχει το run(conn) (μόνο SELECT) στο replica όταν επιτρέπεται, αλλιώς στο primary.
+    user_id: ο χρήστης του read, γνωστός από πριν (read-your-writes πριν το query).
+    owner(result) -> user_id | None: για reads όπου ο χρήστης φαίνεται μόνο στο
+    αποτέλεσμα (π.χ. by tg_user_id). Αν το replica δεν έχει φτάσει το mark (του
+    χρήστη ή του client), ή αν δεν βρήκε τίποτα (μπορεί να μην έχει φτάσει ακόμα
+    η εγγραφή), ξαναρωτάμε το primary. Κανένα query στο primary όταν το replica
+    είναι ενημερωμένο.
+    """
+    global _replica_lag
+    if not replica_usable():
+        return _primary_read(run, "no_replica" if not DATABASE_REPLICA_URL else "lag")
+    mark, primary_only = _local_mark(user_id)
+    if primary_only:
+        return _primary_read(run, "ryw")
+    holder = _client_marks.get()
+    if holder is not None and holder["read"] is not None:
+        mark = max(mark or 0, holder["read"])
+
+    replayed = None
+    try:
+        with tracing.start_span("db replica", "client", child_only=True):
+            with _pool("replica").connection() as conn:
+                if mark is not None or owner is not None:
+                    # το snapshot του query περιέχει ό,τι είχε γίνει replay πριν από αυτό
+                    replayed = _lsn(conn.execute("SELECT pg_last_wal_replay_lsn()::text AS lsn").fetchone()["lsn"])
+                if mark is not None and replayed is not None and replayed < mark:
+                    result, behind = None, True
+                else:
+                    result, behind = run(conn), False
+    except psycopg.OperationalError:
+        # replica down / recovery conflict: εκτός μέχρι τον επόμενο έλεγχο του monitor
+        _replica_lag = None
+        return _primary_read(run, "replica_error")
+    if behind:
+        return _primary_read(run, "ryw")
+
+    if owner is not None:
+        uid = owner(result)
+        if uid is None:
+            return _primary_read(run, "not_found")
+        mark, primary_only = _local_mark(uid)
+        if primary_only or (mark is not None and replayed is not None and replayed < mark):
+            return _primary_read(run, "ryw")
+
+    metrics.inc("db_reads_total", target="replica", reason="ok")
+    return result
 
 
 # ----------------------
@@ -62,6 +370,9 @@ def run_migrations():
 
     with _conn_autocommit() as conn:
         with conn.cursor() as cur:
+            # πολλά replicas (web/bot) ξεκινούν μαζί: ένα-ένα τρέχει τα DDL
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+
             # -------------------------
             # users (base)
             # -------------------------
@@ -81,27 +392,13 @@ def run_migrations():
             cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();")
             cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS extra_credits NUMERIC(10,2) NOT NULL DEFAULT 0;")
             cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS plan_sku TEXT NOT NULL DEFAULT 'FREE';")
+            # ο χρήστης μπλόκαρε το bot ή ο λογαριασμός διαγράφηκε (NULL = reachable)
+            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMPTZ;")
 
             # -------------------------
             # credit_ledger
             # -------------------------
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS credit_ledger (
-              id SERIAL PRIMARY KEY,
-              user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-              delta NUMERIC(10,2) NOT NULL,
-              balance_after NUMERIC(10,2) NOT NULL,
-              reason TEXT NOT NULL,
-              provider TEXT,
-              provider_ref TEXT,
-              created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-            );
-            """)
-
-            cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_credit_ledger_user_id_created_at
-            ON credit_ledger(user_id, created_at DESC);
-            """)
+            _migrate_credit_ledger(cur)
 
             # -------------------------
             # last_results
@@ -176,6 +473,31 @@ def run_migrations():
             ON generation_jobs(user_id, created_at DESC);
             """)
 
+            # -------------------------
+            # job_events (append-only, γράφεται με COPY από το core.events)
+            # -------------------------
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS job_events (
+              ts TIMESTAMPTZ NOT NULL,
+              kind TEXT NOT NULL,
+              model TEXT,
+              job_id TEXT,
+              user_id INTEGER,
+              data JSONB
+            );
+            """)
+
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_job_events_job_id
+            ON job_events(job_id, ts);
+            """)
+
+            # BRIN: σχεδόν μηδενικό κόστος στα inserts, αρκεί για range queries σε χρόνο
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS brin_job_events_ts
+            ON job_events USING brin(ts);
+            """)
+
             # -------------------------
             # referrals
             # -------------------------
@@ -213,6 +535,8 @@ def run_migrations():
             ON referral_events(referral_id, created_at DESC);
             """)
 
+            _migrate_referral_stats(cur)
+
             # -------------------------
             # marketplace_jobs
             # -------------------------
@@ -230,9 +554,15 @@ def run_migrations():
             );
             """)
 
+            # keyset σελιδοποίηση του board: (status, created_at, id)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_marketplace_jobs_status_created_id
+            ON marketplace_jobs(status, created_at DESC, id DESC);
+            """)
+            cur.execute("DROP INDEX IF EXISTS idx_marketplace_jobs_status_created;")
             cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_marketplace_jobs_status_created
-            ON marketplace_jobs(status, created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_marketplace_jobs_client_created
+            ON marketplace_jobs(client_user_id, created_at DESC);
             """)
 
             # -------------------------
@@ -255,7 +585,148 @@ def run_migrations():
             ON job_offers(job_id, created_at DESC);
             """)
 
-            print(">>> ensured base tables exist (users/ledger/holds/jobs/referrals/last_results/marketplace)", flush=True)
+            _migrate_marketplace_timestamps(cur)
+            _migrate_marketplace(cur)
+
+            # -------------------------
+            # notifications (ουρά Telegram ειδοποιήσεων, βλ. core.notifications)
+            # -------------------------
+            # status: pending (μπορεί να ενωθεί με επόμενες) -> sending -> sent | retry | failed
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS notifications (
+              id BIGSERIAL PRIMARY KEY,
+              chat_id BIGINT NOT NULL,
+              kind TEXT NOT NULL,
+              coalesce_key TEXT,
+              payload JSONB NOT NULL,
+              status TEXT NOT NULL DEFAULT 'pending',
+              attempts INTEGER NOT NULL DEFAULT 0,
+              not_before TIMESTAMPTZ NOT NULL DEFAULT now(),
+              claimed_at TIMESTAMPTZ,
+              sent_at TIMESTAMPTZ,
+              last_error TEXT,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+            # μία pending γραμμή ανά (chat, coalesce_key): εκεί μαζεύονται οι επόμενες
+            cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_notifications_pending_key
+            ON notifications(chat_id, coalesce_key) WHERE status = 'pending';
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notifications_due
+            ON notifications(not_before) WHERE status IN ('pending', 'retry');
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notifications_sending
+            ON notifications(claimed_at) WHERE status = 'sending';
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notifications_key_claimed
+            ON notifications(chat_id, coalesce_key, claimed_at DESC) WHERE coalesce_key IS NOT NULL;
+            """)
+
+            # -------------------------
+            # telegram_send_slots (κοινό rate limit αποστολών, βλ. core.telegram_sender)
+            # -------------------------
+            # chat_id = 0: το budget όλου του bot (sent = σύνολο αποστολών εκτός broadcast)
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS telegram_send_slots (
+              chat_id BIGINT PRIMARY KEY,
+              next_at TIMESTAMPTZ NOT NULL,
+              sent BIGINT NOT NULL DEFAULT 0
+            );
+            """)
+            cur.execute("""
+            INSERT INTO telegram_send_slots (chat_id, next_at) VALUES (0, now())
+            ON CONFLICT (chat_id) DO NOTHING;
+            """)
+
+            # παλιός πίνακας read-your-writes marks (τα marks είναι πλέον εκτός primary, βλ. _mark_write)
+            cur.execute("DROP TABLE IF EXISTS user_write_marks;")
+
+            # -------------------------
+            # payment_events (webhooks πληρωμών, βλ. core.payments)
+            # -------------------------
+            # Ένα event ανά (provider, event_id): τα retries του provider δεν
+            # ξαναγράφονται. status: pending -> done | ignored | failed
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS payment_events (
+              id BIGSERIAL PRIMARY KEY,
+              provider TEXT NOT NULL,
+              event_id TEXT NOT NULL,
+              event_type TEXT NOT NULL,
+              order_id BIGINT,
+              payload JSONB NOT NULL,
+              status TEXT NOT NULL DEFAULT 'pending',
+              result TEXT,
+              attempts INTEGER NOT NULL DEFAULT 0,
+              not_before TIMESTAMPTZ NOT NULL DEFAULT now(),
+              last_error TEXT,
+              received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+              processed_at TIMESTAMPTZ,
+              UNIQUE (provider, event_id)
+            );
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_payment_events_pending
+            ON payment_events(not_before, id) WHERE status = 'pending';
+            """)
+
+            # -------------------------
+            # broadcasts (μαζικά μηνύματα, βλ. core.broadcast)
+            # -------------------------
+            # status: running -> done | failed, ή paused / cancelled από admin.
+            # last_tg_user_id: checkpoint, όλοι οι χρήστες <= αυτό έχουν τελειώσει.
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+              id BIGSERIAL PRIMARY KEY,
+              text TEXT NOT NULL,
+              parse_mode TEXT,
+              reply_markup JSONB,
+              status TEXT NOT NULL DEFAULT 'running',
+              total INTEGER NOT NULL DEFAULT 0,
+              last_tg_user_id BIGINT NOT NULL DEFAULT 0,
+              sent INTEGER NOT NULL DEFAULT 0,
+              failed INTEGER NOT NULL DEFAULT 0,
+              blocked INTEGER NOT NULL DEFAULT 0,
+              send_rate REAL NOT NULL DEFAULT 0,
+              lease_owner TEXT,
+              lease_until TIMESTAMPTZ,
+              error TEXT,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+              started_at TIMESTAMPTZ,
+              finished_at TIMESTAMPTZ,
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_broadcasts_running
+            ON broadcasts(id) WHERE status = 'running';
+            """)
+
+            # -------------------------
+            # chat_sessions (Gemini chat memory)
+            # -------------------------
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+              tg_user_id BIGINT PRIMARY KEY,
+              summary TEXT NOT NULL DEFAULT '',
+              turns BYTEA NOT NULL,
+              tokens INTEGER NOT NULL DEFAULT 0,
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+
+            # version: compare-and-set στο save_chat_session (πολλά processes, ίδιος χρήστης)
+            cur.execute("ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;")
+
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at
+            ON chat_sessions(updated_at);
+            """)
+
+            print(">>> ensured base tables exist (users/ledger/holds/jobs/referrals/last_results/marketplace/chat_sessions)", flush=True)
 
     # Apply .sql migrations if any
     if not MIGRATIONS_DIR.exists():
@@ -279,6 +750,412 @@ def run_migrations():
                 cur.execute(f.read_text(encoding="utf-8"))
 
 
+# ======================
+# credit_ledger: μηνιαία partitions + rollup ανά χρήστη/μήνα
+# ======================
+# Τα partitions είναι RANGE(created_at) ανά ημερολογιακό μήνα (UTC). Τα παλιά
+# μένουν ανέγγιχτα (frozen) οπότε vacuum/backup/queries δουλεύουν μόνο στον
+# τρέχοντα μήνα· ένα παλιό partition αρχειοθετείται με DETACH PARTITION.
+LEDGER_PARTITIONS_AHEAD = int(os.getenv("LEDGER_PARTITIONS_AHEAD", "3"))
+
+
+def _month_start(dt: datetime, add: int = 0) -> datetime:
+    # τα timestamptz έρχονται στο TimeZone του session: ο μήνας μετράει σε UTC
+    dt = dt.astimezone(timezone.utc)
+    m = dt.year * 12 + (dt.month - 1) + add
+    return datetime(m // 12, m % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+# Το parent ενός νέου install. Με υπάρχον credit_ledger οι τύποι (και τα NOT NULL)
+# βγαίνουν από τον κατάλογο του παλιού πίνακα, αλλιώς το ATTACH PARTITION αποτυγχάνει
+# (π.χ. 001_base.sql: BIGSERIAL, NUMERIC(12,2), nullable balance_after).
+_LEDGER_COLUMNS = (
+    ("id", "INTEGER", True),
+    ("user_id", "INTEGER", True),
+    ("delta", "NUMERIC(10,2)", True),
+    ("balance_after", "NUMERIC(10,2)", True),
+    ("reason", "TEXT", True),
+    ("provider", "TEXT", False),
+    ("provider_ref", "TEXT", False),
+    ("created_at", "TIMESTAMPTZ", True),
+)
+_LEDGER_DEFAULTS = {"created_at": "now()"}
+
+
+def _legacy_ledger_columns(cur) -> Optional[List[Tuple[str, str, bool]]]:
+    """
+    (name, type, not_null) των στηλών του υπάρχοντος απλού credit_ledger, ή None
+    αν δεν μπορεί να γίνει partition (λείπουν στήλες ή το PK (id, created_at)
+    θα έπεφτε σε nullable στήλη). Το αποτέλεσμα γράφεται στο log.
+    """
+    cur.execute("""
+    SELECT a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull
+    FROM pg_attribute a
+    WHERE a.attrelid = 'credit_ledger'::regclass AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+    """)
+    cols = [(r[0], r[1], r[2]) for r in cur.fetchall()]
+    by_name = {c[0]: c for c in cols}
+
+    missing = [name for name, _, _ in _LEDGER_COLUMNS if name not in by_name]
+    if missing:
+        print(f">>> credit_ledger: ERROR legacy table lacks columns {missing}, not partitioning", flush=True)
+        return None
+    if by_name["created_at"][1] != "timestamp with time zone":
+        print(f">>> credit_ledger: ERROR created_at is {by_name['created_at'][1]}, not partitioning", flush=True)
+        return None
+    nullable = [k for k in ("id", "created_at") if not by_name[k][2]]
+    if nullable:
+        cur.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM credit_ledger WHERE {})").format(
+            sql.SQL(" OR ").join(sql.SQL("{} IS NULL").format(sql.Identifier(k)) for k in nullable)
+        ))
+        if cur.fetchone()[0]:
+            print(f">>> credit_ledger: ERROR NULLs in {nullable}, not partitioning", flush=True)
+            return None
+        # χωρίς NULL: το SET NOT NULL του ATTACH απλώς επιβεβαιώνει
+        for k in nullable:
+            cur.execute(sql.SQL("ALTER TABLE credit_ledger ALTER COLUMN {} SET NOT NULL").format(sql.Identifier(k)))
+    return [(name, typ, not_null or name in ("id", "created_at")) for name, typ, not_null in cols]
+
+
+def _migrate_credit_ledger(cur) -> None:
+    """
+    Δημιουργεί το partitioned credit_ledger. Ένα υπάρχον (απλό) credit_ledger
+    γίνεται rename σε credit_ledger_legacy και προσαρτάται ως partition για ό,τι
+    είναι πριν τον επόμενο μήνα: χωρίς αντιγραφή γραμμών, μόνο ένα index build.
+    Αν ο παλιός πίνακας δεν είναι συμβατός, μένει ως έχει (απλός) με error στο log.
+    """
+    next_month = _month_start(_now_utc(), 1)
+
+    with cur.connection.transaction():
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('credit_ledger')")
+        row = cur.fetchone()
+        legacy = row is not None and row[0] == "r"
+
+        columns = _legacy_ledger_columns(cur) if legacy else list(_LEDGER_COLUMNS)
+        partitioned = columns is not None
+
+        if partitioned and legacy:
+            cur.execute("ALTER TABLE credit_ledger RENAME TO credit_ledger_legacy;")
+            cur.execute("ALTER TABLE credit_ledger_legacy RENAME CONSTRAINT credit_ledger_pkey TO credit_ledger_legacy_pkey;")
+            cur.execute("DROP INDEX IF EXISTS idx_credit_ledger_user_id_created_at;")
+            cur.execute("ALTER SEQUENCE IF EXISTS credit_ledger_id_seq OWNED BY NONE;")
+
+        if partitioned:
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS credit_ledger_id_seq AS INTEGER;")
+            defs = []
+            for name, typ, not_null in columns:
+                default = "nextval('credit_ledger_id_seq')" if name == "id" else _LEDGER_DEFAULTS.get(name)
+                defs.append(sql.SQL("{} {}{}{}{}").format(
+                    sql.Identifier(name),
+                    sql.SQL(typ),
+                    sql.SQL(" NOT NULL" if not_null else ""),
+                    sql.SQL(f" DEFAULT {default}" if default else ""),
+                    sql.SQL(" REFERENCES users(id) ON DELETE CASCADE" if name == "user_id" else ""),
+                ))
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS credit_ledger ({}, PRIMARY KEY (id, created_at)) "
+                "PARTITION BY RANGE (created_at);"
+            ).format(sql.SQL(", ").join(defs)))
+            cur.execute("ALTER SEQUENCE credit_ledger_id_seq OWNED BY credit_ledger.id;")
+
+        # keyset pagination: (created_at, id) DESC ανά χρήστη
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_credit_ledger_user_created_id
+        ON credit_ledger(user_id, created_at DESC, id DESC);
+        """)
+
+        if partitioned and legacy:
+            print(">>> credit_ledger: attaching legacy table as partition", flush=True)
+            cur.execute(sql.SQL(
+                "ALTER TABLE credit_ledger ATTACH PARTITION credit_ledger_legacy "
+                "FOR VALUES FROM (MINVALUE) TO ({});"
+            ).format(sql.Literal(next_month)))
+
+        if partitioned:
+            # δίχτυ ασφαλείας αν το maintenance δεν πρόλαβε να φτιάξει τον μήνα
+            cur.execute("CREATE TABLE IF NOT EXISTS credit_ledger_default PARTITION OF credit_ledger DEFAULT;")
+
+    _ensure_ledger_partitions(cur, LEDGER_PARTITIONS_AHEAD)
+
+    # -------------------------
+    # credit_ledger_monthly (rollup για statements)
+    # -------------------------
+    with cur.connection.transaction():
+        cur.execute("SELECT to_regclass('credit_ledger_monthly') IS NULL AS missing")
+        backfill = cur.fetchone()[0]
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS credit_ledger_monthly (
+          user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+          month DATE NOT NULL,
+          credits_in NUMERIC(14,2) NOT NULL DEFAULT 0,
+          credits_out NUMERIC(14,2) NOT NULL DEFAULT 0,
+          entries INTEGER NOT NULL DEFAULT 0,
+          closing_balance NUMERIC(12,2),
+          updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+          PRIMARY KEY (user_id, month)
+        );
+        """)
+
+        # η γραμμή του users είναι ήδη κλειδωμένη από όποιον γράφει στο ledger,
+        # οπότε το upsert εδώ δεν προσθέτει contention και το closing_balance
+        # είναι πάντα το balance_after της τελευταίας κίνησης του μήνα
+        cur.execute("""
+        CREATE OR REPLACE FUNCTION credit_ledger_rollup() RETURNS trigger AS $$
+        BEGIN
+          INSERT INTO credit_ledger_monthly AS m
+            (user_id, month, credits_in, credits_out, entries, closing_balance)
+          VALUES (
+            NEW.user_id,
+            date_trunc('month', NEW.created_at AT TIME ZONE 'UTC')::date,
+            GREATEST(NEW.delta, 0),
+            GREATEST(-NEW.delta, 0),
+            1,
+            NEW.balance_after
+          )
+          ON CONFLICT (user_id, month) DO UPDATE
+          SET credits_in = m.credits_in + EXCLUDED.credits_in,
+              credits_out = m.credits_out + EXCLUDED.credits_out,
+              entries = m.entries + 1,
+              closing_balance = COALESCE(EXCLUDED.closing_balance, m.closing_balance),
+              updated_at = now();
+          RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        """)
+
+        # παλιές κινήσεις χωρίς balance_after (003_credit_ledger_balance_after.sql)
+        cur.execute("ALTER TABLE credit_ledger_monthly ALTER COLUMN closing_balance DROP NOT NULL;")
+
+        if backfill:
+            # κανένα insert ανάμεσα στο backfill και στο trigger
+            cur.execute("LOCK TABLE credit_ledger IN SHARE ROW EXCLUSIVE MODE;")
+            cur.execute("""
+            INSERT INTO credit_ledger_monthly (user_id, month, credits_in, credits_out, entries, closing_balance)
+            SELECT user_id,
+                   date_trunc('month', created_at AT TIME ZONE 'UTC')::date,
+                   SUM(GREATEST(delta, 0)),
+                   SUM(GREATEST(-delta, 0)),
+                   COUNT(*),
+                   (array_agg(balance_after ORDER BY created_at DESC, id DESC)
+                      FILTER (WHERE balance_after IS NOT NULL))[1]
+            FROM credit_ledger
+            GROUP BY 1, 2;
+            """)
+            print(f">>> credit_ledger_monthly: backfilled {cur.rowcount} rows", flush=True)
+
+        cur.execute("DROP TRIGGER IF EXISTS trg_credit_ledger_rollup ON credit_ledger;")
+        cur.execute("""
+        CREATE TRIGGER trg_credit_ledger_rollup
+        AFTER INSERT ON credit_ledger
+        FOR EACH ROW EXECUTE FUNCTION credit_ledger_rollup();
+        """)
+
+
+def _ensure_ledger_partitions(cur, months_ahead: int) -> List[str]:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('credit_ledger')")
+    row = cur.fetchone()
+    if row is None or row[0] != "p":
+        return []  # απλός πίνακας (βλ. _legacy_ledger_columns)
+
+    # το μεγαλύτερο upper bound των υπαρχόντων partitions (το DEFAULT δεν έχει)
+    cur.execute("""
+    SELECT max((regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'credit_ledger'::regclass
+    """)
+    upper = cur.fetchone()[0]
+
+    now = _now_utc()
+    month = _month_start(now)
+    if upper is not None and upper > month:
+        month = _month_start(upper)
+    end = _month_start(now, months_ahead + 1)
+
+    created = []
+    while month < end:
+        nxt = _month_start(month, 1)
+        name = f"credit_ledger_p{month:%Y%m}"
+        # τα DDL δεν δέχονται server-side parameters: literals από το psycopg.sql
+        cur.execute(sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {} PARTITION OF credit_ledger FOR VALUES FROM ({}) TO ({});"
+        ).format(sql.Identifier(name), sql.Literal(month), sql.Literal(nxt)))
+        created.append(name)
+        month = nxt
+    return created
+
+
+def ensure_ledger_partitions(months_ahead: int = LEDGER_PARTITIONS_AHEAD) -> List[str]:
+    """Φτιάχνει τα μηνιαία partitions μέχρι months_ahead μήνες μπροστά. Idempotent."""
+    with _conn_autocommit() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            try:
+                return _ensure_ledger_partitions(cur, months_ahead)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+
+
+# Οι μετρητές του referral_stats όπως προκύπτουν από τα raw referral_events
+# (backfill + reconciliation). Προϋποθέτει LEFT JOIN referral_events e.
+_REFERRAL_AGGREGATES = """
+  COUNT(e.id) FILTER (WHERE e.event_type = 'start') AS starts,
+  COUNT(e.id) FILTER (WHERE e.event_type = 'purchase') AS purchases,
+  COALESCE(SUM(e.amount_eur) FILTER (WHERE e.event_type = 'purchase'), 0) AS purchases_amount,
+  COALESCE(SUM(e.commission_eur) FILTER (WHERE e.event_type = 'purchase'), 0) AS earnings_eur
+"""
+
+
+def _migrate_marketplace_timestamps(cur) -> None:
+    """
+    Πίνακες που έφτιαξε το παλιό 008_marketplace_jobs.sql έχουν created_at /
+    updated_at TIMESTAMP (χωρίς ζώνη), που δεν συγκρίνεται με τα timezone-aware
+    keyset cursors. Γίνονται TIMESTAMPTZ (οι τιμές θεωρούνται UTC) και NOT NULL.
+    """
+    cur.execute("""
+    SELECT table_name, column_name FROM information_schema.columns
+    WHERE table_schema = current_schema()
+      AND table_name IN ('marketplace_jobs', 'job_offers')
+      AND column_name IN ('created_at', 'updated_at')
+      AND data_type = 'timestamp without time zone'
+    ORDER BY 1, 2
+    """)
+    for table, column in cur.fetchall():
+        print(f">>> {table}.{column}: TIMESTAMP -> TIMESTAMPTZ", flush=True)
+        ident = {"t": sql.Identifier(table), "c": sql.Identifier(column)}
+        with cur.connection.transaction():
+            cur.execute(sql.SQL("UPDATE {t} SET {c} = now() WHERE {c} IS NULL;").format(**ident))
+            cur.execute(sql.SQL(
+                "ALTER TABLE {t} ALTER COLUMN {c} TYPE TIMESTAMPTZ USING {c} AT TIME ZONE 'UTC', "
+                "ALTER COLUMN {c} SET DEFAULT now(), ALTER COLUMN {c} SET NOT NULL;"
+            ).format(**ident))
+
+
+def _migrate_marketplace(cur) -> None:
+    """
+    Full-text αναζήτηση και offer_count για το board των αγγελιών.
+
+    - marketplace_search: text search configuration, αντίγραφο του greek (Snowball:
+      stemming + αφαίρεση τόνων), ή του simple σε Postgres χωρίς greek. Column,
+      index και queries χρησιμοποιούν το ίδιο όνομα, οπότε αλλάζει σε ένα σημείο.
+    - search_tsv: generated column, title (βάρος A) + description (B), με GIN index.
+    - offer_count: denormalized. Το ενημερώνει trigger στο job_offers μέσα στο ίδιο
+      transaction με το INSERT/DELETE της πρότασης. Backfill μία φορά.
+    """
+    with cur.connection.transaction():
+        cur.execute("SELECT 1 FROM pg_ts_config WHERE cfgname = 'marketplace_search'")
+        if cur.fetchone() is None:
+            cur.execute("SELECT 1 FROM pg_ts_config WHERE cfgname = 'greek'")
+            base = "greek" if cur.fetchone() else "simple"
+            cur.execute(sql.SQL("CREATE TEXT SEARCH CONFIGURATION marketplace_search (COPY = {});").format(
+                sql.Identifier("pg_catalog", base)
+            ))
+            print(f">>> marketplace_search: text search config from {base}", flush=True)
+
+        cur.execute("""
+        ALTER TABLE marketplace_jobs ADD COLUMN IF NOT EXISTS search_tsv tsvector
+        GENERATED ALWAYS AS (
+          setweight(to_tsvector('marketplace_search', title), 'A') ||
+          setweight(to_tsvector('marketplace_search', description), 'B')
+        ) STORED;
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_marketplace_jobs_search
+        ON marketplace_jobs USING GIN (search_tsv);
+        """)
+
+    with cur.connection.transaction():
+        cur.execute("""
+        SELECT NOT EXISTS (
+          SELECT 1 FROM information_schema.columns
+          WHERE table_name = 'marketplace_jobs' AND column_name = 'offer_count'
+        )
+        """)
+        backfill = cur.fetchone()[0]
+        cur.execute("ALTER TABLE marketplace_jobs ADD COLUMN IF NOT EXISTS offer_count INTEGER NOT NULL DEFAULT 0;")
+
+        cur.execute("""
+        CREATE OR REPLACE FUNCTION marketplace_offer_count() RETURNS trigger AS $$
+        BEGIN
+          IF TG_OP = 'INSERT' THEN
+            UPDATE marketplace_jobs SET offer_count = offer_count + 1 WHERE id = NEW.job_id;
+          ELSE
+            UPDATE marketplace_jobs SET offer_count = offer_count - 1 WHERE id = OLD.job_id;
+          END IF;
+          RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        """)
+
+        if backfill:
+            # καμία πρόταση ανάμεσα στο backfill και στο trigger
+            cur.execute("LOCK TABLE job_offers IN SHARE ROW EXCLUSIVE MODE;")
+            cur.execute("""
+            UPDATE marketplace_jobs j
+            SET offer_count = c.n
+            FROM (SELECT job_id, COUNT(*) AS n FROM job_offers GROUP BY job_id) c
+            WHERE j.id = c.job_id;
+            """)
+            print(f">>> marketplace_jobs.offer_count: backfilled {cur.rowcount} jobs", flush=True)
+
+        cur.execute("DROP TRIGGER IF EXISTS trg_marketplace_offer_count ON job_offers;")
+        cur.execute("""
+        CREATE TRIGGER trg_marketplace_offer_count
+        AFTER INSERT OR DELETE ON job_offers
+        FOR EACH ROW EXECUTE FUNCTION marketplace_offer_count();
+        """)
+
+
+def _migrate_referral_stats(cur) -> None:
+    """
+    referral_stats: μετρητές ανά referral link, ενημερώνονται στο ίδιο transaction
+    με κάθε referral event (βλ. apply_referral_start / record_referral_purchase),
+    οπότε το /api/ref/list διαβάζει μία γραμμή ανά link αντί για όλο το ιστορικό.
+    Τα purchase events κρατάνε το referral_pct του πλάνου του owner και την
+    προμήθεια (όταν πληρωθεί), ώστε τα earnings να επαληθεύονται από τα raw events.
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_referrals_owner ON referrals(owner_user_id, created_at DESC);")
+    cur.execute("ALTER TABLE referral_events ADD COLUMN IF NOT EXISTS referral_pct INTEGER;")
+    cur.execute("ALTER TABLE referral_events ADD COLUMN IF NOT EXISTS commission_eur NUMERIC(10,2);")
+    # commission pipeline (βλ. pay_referral_commissions): pending -> paid | failed. NULL στα
+    # παλιά events, που δεν πληρώνονται αναδρομικά.
+    cur.execute("ALTER TABLE referral_events ADD COLUMN IF NOT EXISTS order_id BIGINT;")
+    cur.execute("ALTER TABLE referral_events ADD COLUMN IF NOT EXISTS commission_status TEXT;")
+    cur.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_referral_events_order
+    ON referral_events(order_id) WHERE order_id IS NOT NULL;
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_referral_events_commission_pending
+    ON referral_events(id) WHERE commission_status = 'pending';
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_referral_joins_invited ON referral_joins(invited_user_id, created_at);")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS referral_stats (
+      referral_id INTEGER PRIMARY KEY REFERENCES referrals(id) ON DELETE CASCADE,
+      starts INTEGER NOT NULL DEFAULT 0,
+      purchases INTEGER NOT NULL DEFAULT 0,
+      purchases_amount NUMERIC(12,2) NOT NULL DEFAULT 0,
+      earnings_eur NUMERIC(12,2) NOT NULL DEFAULT 0,
+      updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+    # backfill όσων links δεν έχουν γραμμή (πρώτο deploy): ό,τι γραφτεί από
+    # παλιά processes στο μεταξύ το διορθώνει το reconcile_referral_stats
+    cur.execute(f"""
+    INSERT INTO referral_stats (referral_id, starts, purchases, purchases_amount, earnings_eur)
+    SELECT r.id, {_REFERRAL_AGGREGATES}
+    FROM referrals r
+    LEFT JOIN referral_events e ON e.referral_id = r.id
+    WHERE NOT EXISTS (SELECT 1 FROM referral_stats s WHERE s.referral_id = r.id)
+    GROUP BY r.id
+    ON CONFLICT (referral_id) DO NOTHING
+    """)
+
+
 # ======================
 # Users
 # ======================
@@ -287,106 +1164,187 @@ def ensure_user(tg_user_id: int, tg_username: Optional[str], tg_first_name: Opti
     Creates user if missing.
     If new user -> gives START_FREE_CREDITS and writes credit_ledger entry.
     Always updates username/first_name on existing users.
-    Returns user row (dict).
+    Returns user row (db_queries.Row, πρόσβαση όπως σε dict).
     """
     with get_conn() as conn:
-        with conn.cursor() as cur:
+        with _cur(conn) as cur:
             cur.execute(
-                """
-                INSERT INTO users (tg_user_id, tg_username, tg_first_name, credits, credits_held)
-                VALUES (%s, %s, %s, %s, 0)
-                ON CONFLICT (tg_user_id) DO NOTHING
-                RETURNING *;
-                """,
+                db_queries.USER_INSERT,
                 (tg_user_id, tg_username, tg_first_name, START_FREE_CREDITS),
+                prepare=True,
             )
             inserted = cur.fetchone()
 
             if inserted:
                 cur.execute(
-                    """
-                    INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
-                    VALUES (%s, %s, %s, %s, %s, %s);
-                    """,
-                    (
-                        inserted["id"],
-                        START_FREE_CREDITS,
-                        inserted["credits"],
-                        "Free start credits",
-                        "system",
-                        None,
-                    ),
+                    db_queries.USER_START_LEDGER,
+                    (inserted["id"], START_FREE_CREDITS, inserted["credits"]),
+                    prepare=True,
                 )
                 conn.commit()
+                _mark_write(conn, inserted["id"])
                 return inserted
 
-            cur.execute(
-                """
-                UPDATE users
-                SET tg_username = %s,
-                    tg_first_name = %s
-                WHERE tg_user_id = %s
-                RETURNING *;
-                """,
-                (tg_username, tg_first_name, tg_user_id),
-            )
+            cur.execute(db_queries.USER_TOUCH, (tg_username, tg_first_name, tg_user_id), prepare=True)
             row = cur.fetchone()
             conn.commit()
+            if row:
+                _mark_write(conn, row["id"])
             return row
 
 
-def get_user(tg_user_id: int) -> Optional[Dict[str, Any]]:
+def upsert_users_bulk(rows: List[tuple]) -> None:
+    """
+    Μαζικό ensure_user για πολλούς χρήστες σε ένα statement.
+    rows: [(tg_user_id, tg_username, tg_first_name), ...] (μοναδικά tg_user_id)
+    Νέοι χρήστες παίρνουν START_FREE_CREDITS + ledger entry, υπάρχοντες ενημερώνονται
+    μόνο αν άλλαξε username/first_name.
+    """
+    if not rows:
+        return
+    tg_ids = [int(r[0]) for r in rows]
+    usernames = [r[1] for r in rows]
+    first_names = [r[2] for r in rows]
+
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE tg_user_id=%s", (tg_user_id,))
+            cur.execute(
+                """
+                WITH data AS (
+                  SELECT * FROM unnest(%s::bigint[], %s::text[], %s::text[])
+                    AS d(tg_user_id, tg_username, tg_first_name)
+                ),
+                ins AS (
+                  INSERT INTO users (tg_user_id, tg_username, tg_first_name, credits, credits_held)
+                  SELECT tg_user_id, tg_username, tg_first_name, %s, 0 FROM data
+                  ON CONFLICT (tg_user_id) DO NOTHING
+                  RETURNING id, credits
+                ),
+                led AS (
+                  INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
+                  SELECT id, %s, credits, 'Free start credits', 'system', NULL FROM ins
+                )
+                UPDATE users u
+                SET tg_username = d.tg_username,
+                    tg_first_name = d.tg_first_name
+                FROM data d
+                WHERE u.tg_user_id = d.tg_user_id
+                  AND (u.tg_username IS DISTINCT FROM d.tg_username
+                       OR u.tg_first_name IS DISTINCT FROM d.tg_first_name)
+                """,
+                (tg_ids, usernames, first_names, START_FREE_CREDITS, START_FREE_CREDITS),
+            )
+            conn.commit()
+
+
+def get_user(tg_user_id: int, replica: bool = False) -> Optional[Dict[str, Any]]:
+    """replica=True για reads χωρίς επόμενη εγγραφή (π.χ. εμφάνιση στο /api/me)."""
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(db_queries.USER_BY_TG, (tg_user_id,), prepare=True)
             return cur.fetchone()
 
+    if replica:
+        return _read(run, owner=lambda u: u["id"] if u else None)
+    with get_conn() as conn:
+        return run(conn)
+
 
 def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE id=%s", (user_id,))
+        with _cur(conn) as cur:
+            cur.execute(db_queries.USER_BY_ID, (user_id,), prepare=True)
             return cur.fetchone()
 
 
 # ======================
 # Credits + Ledger (atomic)
 # ======================
-def add_credits_by_user_id(
-    user_id: int,
+# Ένα statement ανά κίνηση: UPDATE ... RETURNING + INSERT στο ledger μέσα σε CTE.
+# Ένα round-trip αντί για SELECT FOR UPDATE -> υπολογισμός στην Python -> UPDATE
+# -> INSERT, οπότε το row lock του users κρατιέται μόνο μέχρι το αμέσως επόμενο
+# commit. Το balance_after είναι η τιμή που επέστρεψε το UPDATE, άρα σωστό και
+# με ταυτόχρονες κινήσεις.
+_USER_KEYS = ("id", "tg_user_id")
+# Τα statements (ένα ανά key / extra) είναι στο db_queries.CREDIT / SPEND.
+
+
+def _credit(
+    key: str,
+    value: int,
     amount,
     reason: str,
-    provider: Optional[str] = None,
-    provider_ref: Optional[str] = None,
+    provider: Optional[str],
+    provider_ref: Optional[str],
+    extra: bool = False,
 ) -> Decimal:
-    """
-    Adds credits and writes credit_ledger entry atomically.
-    Returns new balance (Decimal).
-    """
+    if key not in _USER_KEYS:
+        raise ValueError(f"bad user key: {key!r}")
     amount = _to_decimal(amount)
     if amount <= 0:
         raise ValueError("amount must be > 0")
 
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, credits FROM users WHERE id=%s FOR UPDATE", (user_id,))
-            u = cur.fetchone()
-            if not u:
+        with _cur(conn) as cur:
+            cur.execute(
+                db_queries.CREDIT[key, bool(extra)],
+                {"amount": amount, "value": value, "reason": reason, "provider": provider, "provider_ref": provider_ref},
+                prepare=True,
+            )
+            row = cur.fetchone()
+            if not row:
                 raise RuntimeError("User not found")
+            conn.commit()
+            _mark_write(conn, row["id"])
+
+    if reason.startswith("Refund"):
+        metrics.record_refund(float(amount))
+    return _to_decimal(row["credits"])
+
 
-            new_balance = _to_decimal(u["credits"]) + amount
+def _spend(
+    key: str,
+    value: int,
+    amount,
+    reason: str,
+    provider: Optional[str],
+    provider_ref: Optional[str],
+) -> Decimal:
+    if key not in _USER_KEYS:
+        raise ValueError(f"bad user key: {key!r}")
+    amount = _to_decimal(amount)
+    if amount <= 0:
+        raise ValueError("amount must be > 0")
 
-            cur.execute("UPDATE users SET credits=%s WHERE id=%s", (new_balance, user_id))
+    with get_conn() as conn:
+        with _cur(conn) as cur:
             cur.execute(
-                """
-                INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
-                VALUES (%s, %s, %s, %s, %s, %s);
-                """,
-                (user_id, amount, new_balance, reason, provider, provider_ref),
+                db_queries.SPEND[key],
+                {"amount": amount, "value": value, "reason": reason, "provider": provider, "provider_ref": provider_ref},
+                prepare=True,
             )
-
+            row = cur.fetchone()
+            if row["new_balance"] is None:
+                if row["have"] is None:
+                    raise RuntimeError("User not found")
+                raise InsufficientCredits(f"Insufficient credits: have {_to_decimal(row['have'])}, need {amount}")
             conn.commit()
-            return new_balance
+            _mark_write(conn, row["user_id"])
+    return _to_decimal(row["new_balance"])
+
+
+def add_credits_by_user_id(
+    user_id: int,
+    amount,
+    reason: str,
+    provider: Optional[str] = None,
+    provider_ref: Optional[str] = None,
+) -> Decimal:
+    """
+    Adds credits and writes credit_ledger entry atomically.
+    Returns new balance (Decimal).
+    """
+    return _credit("id", user_id, amount, reason, provider, provider_ref)
 
 
 def add_extra_credits_by_user_id(
@@ -401,34 +1359,7 @@ def add_extra_credits_by_user_id(
     Updates both credits (total) and extra_credits (tracking).
     Returns new total balance.
     """
-    amount = _to_decimal(amount)
-    if amount <= 0:
-        raise ValueError("amount must be > 0")
-
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, credits, extra_credits FROM users WHERE id=%s FOR UPDATE", (user_id,))
-            u = cur.fetchone()
-            if not u:
-                raise RuntimeError("User not found")
-
-            new_balance = _to_decimal(u["credits"]) + amount
-            new_extra = _to_decimal(u.get("extra_credits", 0)) + amount
-
-            cur.execute(
-                "UPDATE users SET credits=%s, extra_credits=%s WHERE id=%s",
-                (new_balance, new_extra, user_id),
-            )
-            cur.execute(
-                """
-                INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
-                VALUES (%s, %s, %s, %s, %s, %s);
-                """,
-                (user_id, amount, new_balance, reason, provider, provider_ref),
-            )
-
-            conn.commit()
-            return new_balance
+    return _credit("id", user_id, amount, reason, provider, provider_ref, extra=True)
 
 
 def set_user_plan(user_id: int, plan_sku: str) -> None:
@@ -437,6 +1368,7 @@ def set_user_plan(user_id: int, plan_sku: str) -> None:
         with conn.cursor() as cur:
             cur.execute("UPDATE users SET plan_sku=%s WHERE id=%s", (plan_sku, user_id))
             conn.commit()
+            _mark_write(conn, user_id)
 
 
 def spend_credits_by_user_id(
@@ -448,37 +1380,10 @@ def spend_credits_by_user_id(
 ) -> Decimal:
     """
     Subtracts credits (spend) and writes credit_ledger entry atomically.
-    Raises RuntimeError if insufficient.
+    Raises InsufficientCredits if available (credits - credits_held) is not enough.
     Returns new balance.
     """
-    amount = _to_decimal(amount)
-    if amount <= 0:
-        raise ValueError("amount must be > 0")
-
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, credits FROM users WHERE id=%s FOR UPDATE", (user_id,))
-            u = cur.fetchone()
-            if not u:
-                raise RuntimeError("User not found")
-
-            bal = _to_decimal(u["credits"])
-            if bal < amount:
-                raise RuntimeError(f"Insufficient credits: have {bal}, need {amount}")
-
-            new_balance = bal - amount
-
-            cur.execute("UPDATE users SET credits=%s WHERE id=%s", (new_balance, user_id))
-            cur.execute(
-                """
-                INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
-                VALUES (%s, %s, %s, %s, %s, %s);
-                """,
-                (user_id, -amount, new_balance, reason, provider, provider_ref),
-            )
-
-            conn.commit()
-            return new_balance
+    return _spend("id", user_id, amount, reason, provider, provider_ref)
 
 
 def add_credits_by_tg_id(
@@ -488,10 +1393,7 @@ def add_credits_by_tg_id(
     provider: Optional[str] = None,
     provider_ref: Optional[str] = None,
 ) -> Decimal:
-    u = get_user(tg_user_id)
-    if not u:
-        raise RuntimeError("User not found")
-    return add_credits_by_user_id(u["id"], amount, reason, provider, provider_ref)
+    return _credit("tg_user_id", tg_user_id, amount, reason, provider, provider_ref)
 
 
 def spend_credits_by_tg_id(
@@ -501,30 +1403,105 @@ def spend_credits_by_tg_id(
     provider: Optional[str] = None,
     provider_ref: Optional[str] = None,
 ) -> Decimal:
-    u = get_user(tg_user_id)
-    if not u:
-        raise RuntimeError("User not found")
-    return spend_credits_by_user_id(u["id"], amount, reason, provider, provider_ref)
+    return _spend("tg_user_id", tg_user_id, amount, reason, provider, provider_ref)
 
 
-def get_ledger_by_tg_id(tg_user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-    u = get_user(tg_user_id)
-    if not u:
-        return []
-    with get_conn() as conn:
+# ======================
+# Ledger history (keyset pagination)
+# ======================
+# Cursor = "<created_at σε μs από epoch>.<id>" της τελευταίας γραμμής της
+# σελίδας. Το WHERE (created_at, id) < cursor πάει κατευθείαν στο index
+# (user_id, created_at DESC, id DESC), οπότε η σελίδα 1000 κοστίζει όσο η
+# πρώτη (σε αντίθεση με OFFSET).
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _keyset_cursor(row: Dict[str, Any]) -> str:
+    us = (row["created_at"] - _EPOCH) // timedelta(microseconds=1)
+    return f"{us}.{row['id']}"
+
+
+def _parse_keyset_cursor(cursor: str, id_type=int):
+    try:
+        us, row_id = cursor.split(".", 1)
+        return _EPOCH + timedelta(microseconds=int(us)), id_type(row_id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("bad cursor") from None
+
+
+def _ledger_page(
+    by_tg: bool,
+    user_value: int,
+    limit: int,
+    cursor: Optional[str],
+    user_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    limit = max(1, min(int(limit), 200))
+    params: Dict[str, Any] = {"v": user_value, "limit": limit + 1}
+    if cursor:
+        params["ts"], params["id"] = _parse_keyset_cursor(cursor)
+    query = db_queries.LEDGER_PAGE[by_tg, bool(cursor)]
+
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(query, params, prepare=True)
+            return cur.fetchall()
+
+    if user_id is not None:
+        rows = _read(run, user_id=user_id)
+    else:
+        rows = _read(run, owner=lambda r: r[0]["user_id"] if r else None)
+
+    # μία γραμμή παραπάνω: ξέρουμε αν υπάρχει επόμενη σελίδα χωρίς COUNT
+    next_cursor = _keyset_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+
+def get_ledger_page(user_id: int, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Σελίδα ιστορικού (νεότερα πρώτα): {"items": [...], "next_cursor": str | None}."""
+    return _ledger_page(False, user_id, limit, cursor, user_id=user_id)
+
+
+def get_ledger_page_by_tg_id(tg_user_id: int, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+    return _ledger_page(True, tg_user_id, limit, cursor)
+
+
+def get_ledger_by_tg_id(tg_user_id: int, limit: int = 50, cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+    return get_ledger_page_by_tg_id(tg_user_id, limit, cursor)["items"]
+
+
+def get_monthly_statements(user_id: int, limit: int = 12, before: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Μηνιαία statements από το credit_ledger_monthly (νεότερος μήνας πρώτα).
+    before: "YYYY-MM" για τους μήνες πριν από αυτόν (keyset).
+    opening_balance = closing_balance - credits_in + credits_out.
+    """
+    limit = max(1, min(int(limit), 120))
+    before_month = None
+    if before:
+        try:
+            before_month = datetime.strptime(before, "%Y-%m").date()
+        except ValueError:
+            raise ValueError("bad month") from None
+
+    def run(conn):
         with conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT id, delta, balance_after, reason, provider, provider_ref, created_at
-                FROM credit_ledger
-                WHERE user_id=%s
-                ORDER BY created_at DESC
-                LIMIT %s
+                SELECT month, credits_in, credits_out, entries, closing_balance,
+                       closing_balance - credits_in + credits_out AS opening_balance
+                FROM credit_ledger_monthly
+                WHERE user_id = %(user_id)s
+                  AND (%(before)s::date IS NULL OR month < %(before)s::date)
+                ORDER BY month DESC
+                LIMIT %(limit)s
                 """,
-                (u["id"], limit),
+                {"user_id": user_id, "before": before_month, "limit": limit},
             )
             return cur.fetchall()
 
+    return _read(run, user_id=user_id)
+
 
 # ======================
 # HOLD / CAPTURE / RELEASE (Billing-safe for async jobs)
@@ -540,6 +1517,7 @@ def create_credit_hold(
     """
     HOLD: Δεσμεύει credits (credits_held) και δημιουργεί εγγραφή credit_holds.
     Idempotent per user_id + idempotency_key (αν δοθεί).
+    Raises InsufficientCredits αν τα διαθέσιμα (credits - credits_held) δεν φτάνουν.
     """
     amount = _to_decimal(amount)
     if amount <= 0:
@@ -557,37 +1535,52 @@ def create_credit_hold(
                     conn.commit()
                     return existing
 
-            cur.execute("SELECT id, credits, credits_held FROM users WHERE id=%s FOR UPDATE", (user_id,))
-            u = cur.fetchone()
-            if not u:
-                raise RuntimeError("User not found")
-
-            credits = _to_decimal(u["credits"])
-            held = _to_decimal(u["credits_held"])
-            available = credits - held
-
-            if available < amount:
-                raise RuntimeError(f"Insufficient credits: have {available}, need {amount}")
-
-            new_held = held + amount
-            cur.execute("UPDATE users SET credits_held=%s WHERE id=%s", (new_held, user_id))
-
             cur.execute(
                 """
+                WITH u AS (
+                  UPDATE users
+                  SET credits_held = credits_held + %(amount)s
+                  WHERE id = %(user_id)s AND credits - credits_held >= %(amount)s
+                  RETURNING id
+                )
                 INSERT INTO credit_holds (user_id, amount, status, reason, provider, provider_ref, idempotency_key)
-                VALUES (%s, %s, 'held', %s, %s, %s, %s)
+                SELECT id, %(amount)s, 'held', %(reason)s, %(provider)s, %(provider_ref)s, %(key)s FROM u
                 RETURNING *;
                 """,
-                (user_id, amount, reason, provider, provider_ref, idempotency_key),
+                {
+                    "amount": amount,
+                    "user_id": user_id,
+                    "reason": reason,
+                    "provider": provider,
+                    "provider_ref": provider_ref,
+                    "key": idempotency_key,
+                },
             )
             hold = cur.fetchone()
+            if not hold:
+                cur.execute("SELECT credits - credits_held AS available FROM users WHERE id=%s", (user_id,))
+                u = cur.fetchone()
+                if not u:
+                    raise RuntimeError("User not found")
+                raise InsufficientCredits(f"Insufficient credits: have {_to_decimal(u['available'])}, need {amount}")
             conn.commit()
-            return hold
+            _mark_write(conn, user_id)
+    # job_id = hold_id: ίδιο με τα events του job (metrics.track_job)
+    events.record("created", job_id=str(hold["id"]), user_id=user_id, reason=reason, amount=float(amount))
+    return hold
+
+
+def _hold_status(cur, hold_id: int) -> str:
+    cur.execute("SELECT status FROM credit_holds WHERE id=%s", (hold_id,))
+    h = cur.fetchone()
+    if not h:
+        raise RuntimeError("Hold not found")
+    return h["status"]
 
 
 def capture_credit_hold(
     hold_id: int,
-    reason: str,
+    reason: Optional[str] = None,
     provider: Optional[str] = None,
     provider_ref: Optional[str] = None,
 ) -> bool:
@@ -596,60 +1589,56 @@ def capture_credit_hold(
     - Μειώνει credits_held
     - Μειώνει credits
     - Γράφει credit_ledger delta = -amount
+    reason/provider/provider_ref: αν λείπουν, κρατιούνται αυτά του hold.
     """
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM credit_holds WHERE id=%s FOR UPDATE", (hold_id,))
-            h = cur.fetchone()
-            if not h:
-                raise RuntimeError("Hold not found")
-
-            if h["status"] == "captured":
-                conn.commit()
-                return True
-            if h["status"] != "held":
-                # released/canceled -> δεν κάνουμε capture
-                conn.commit()
-                return False
-
-            user_id = int(h["user_id"])
-            amount = _to_decimal(h["amount"])
-
-            cur.execute("SELECT id, credits, credits_held FROM users WHERE id=%s FOR UPDATE", (user_id,))
+            # hold -> users -> ledger σε ένα statement· το status='held' στο WHERE
+            # κάνει το capture idempotent και αμοιβαία αποκλειόμενο με το release
+            cur.execute(
+                """
+                WITH h AS (
+                  UPDATE credit_holds
+                  SET status = 'captured',
+                      provider = COALESCE(%(provider)s, provider),
+                      provider_ref = COALESCE(%(provider_ref)s, provider_ref),
+                      updated_at = now()
+                  WHERE id = %(hold_id)s AND status = 'held'
+                  RETURNING user_id, amount, reason, provider, provider_ref
+                ),
+                u AS (
+                  UPDATE users
+                  SET credits = users.credits - h.amount,
+                      credits_held = users.credits_held - h.amount
+                  FROM h
+                  WHERE users.id = h.user_id
+                  RETURNING users.id, users.credits, users.credits_held, h.amount, h.reason, h.provider, h.provider_ref
+                ),
+                led AS (
+                  INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
+                  SELECT id, -amount, credits, COALESCE(%(reason)s, reason, 'Hold capture'), provider, provider_ref
+                  FROM u
+                )
+                SELECT credits, credits_held FROM u
+                """,
+                {"hold_id": hold_id, "reason": reason, "provider": provider, "provider_ref": provider_ref},
+            )
             u = cur.fetchone()
             if not u:
-                raise RuntimeError("User not found")
-
-            credits = _to_decimal(u["credits"])
-            held = _to_decimal(u["credits_held"])
+                status = _hold_status(cur, hold_id)
+                conn.commit()
+                # released/canceled -> δεν κάνουμε capture
+                return status == "captured"
 
-            if held < amount:
+            # το raise κάνει rollback όλο το statement
+            if _to_decimal(u["credits_held"]) < 0:
                 raise RuntimeError("credits_held invariant broken")
-
-            new_held = held - amount
-            new_credits = credits - amount
-            if new_credits < 0:
+            if _to_decimal(u["credits"]) < 0:
                 raise RuntimeError("credits invariant broken")
 
-            cur.execute(
-                "UPDATE users SET credits=%s, credits_held=%s WHERE id=%s",
-                (new_credits, new_held, user_id),
-            )
-
-            cur.execute(
-                """
-                INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
-                VALUES (%s, %s, %s, %s, %s, %s);
-                """,
-                (user_id, -amount, new_credits, reason, provider, provider_ref),
-            )
-
-            cur.execute(
-                "UPDATE credit_holds SET status='captured', provider=%s, provider_ref=%s, updated_at=now() WHERE id=%s",
-                (provider, provider_ref, hold_id),
-            )
             conn.commit()
-            return True
+            _mark_write(conn, u["id"])
+    return True
 
 
 def release_credit_hold(
@@ -665,46 +1654,72 @@ def release_credit_hold(
     """
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM credit_holds WHERE id=%s FOR UPDATE", (hold_id,))
-            h = cur.fetchone()
-            if not h:
-                raise RuntimeError("Hold not found")
-
-            if h["status"] == "released":
-                conn.commit()
-                return True
-            if h["status"] != "held":
+            cur.execute(
+                """
+                WITH h AS (
+                  UPDATE credit_holds
+                  SET status = 'released',
+                      provider = %(provider)s,
+                      provider_ref = %(provider_ref)s,
+                      reason = COALESCE(%(reason)s, reason),
+                      updated_at = now()
+                  WHERE id = %(hold_id)s AND status = 'held'
+                  RETURNING user_id, amount
+                )
+                UPDATE users
+                SET credits_held = GREATEST(users.credits_held - h.amount, 0)
+                FROM h
+                WHERE users.id = h.user_id
+                RETURNING users.id, h.amount
+                """,
+                {"hold_id": hold_id, "provider": provider, "provider_ref": provider_ref, "reason": reason},
+            )
+            row = cur.fetchone()
+            if not row:
+                # ήδη released/captured: τίποτα να αποδεσμευτεί
+                _hold_status(cur, hold_id)
                 conn.commit()
                 return True
+            conn.commit()
+            _mark_write(conn, row["id"])
+    metrics.record_refund(float(row["amount"]), kind="hold")
+    return True
 
-            user_id = int(h["user_id"])
-            amount = _to_decimal(h["amount"])
-
-            cur.execute("SELECT id, credits_held FROM users WHERE id=%s FOR UPDATE", (user_id,))
-            u = cur.fetchone()
-            if not u:
-                raise RuntimeError("User not found")
-
-            held = _to_decimal(u["credits_held"])
-            new_held = held - amount
-            if new_held < 0:
-                new_held = Decimal("0")
 
-            cur.execute("UPDATE users SET credits_held=%s WHERE id=%s", (new_held, user_id))
+def release_stale_credit_holds(max_age_seconds: int) -> int:
+    """
+    Αποδεσμεύει holds που έμειναν 'held' πάνω από max_age_seconds
+    (job που χάθηκε σε restart/crash πριν κάνει capture ή release).
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
             cur.execute(
                 """
-                UPDATE credit_holds
-                SET status='released',
-                    provider=%s,
-                    provider_ref=%s,
-                    reason=COALESCE(%s, reason),
-                    updated_at=now()
-                WHERE id=%s
+                WITH h AS (
+                  UPDATE credit_holds
+                  SET status = 'released',
+                      reason = COALESCE(reason, '') || ' (expired)',
+                      updated_at = now()
+                  WHERE status = 'held' AND created_at < now() - make_interval(secs => %s)
+                  RETURNING user_id, amount
+                ),
+                per_user AS (
+                  SELECT user_id, SUM(amount) AS amount FROM h GROUP BY user_id
+                )
+                UPDATE users
+                SET credits_held = GREATEST(users.credits_held - p.amount, 0)
+                FROM per_user p
+                WHERE users.id = p.user_id
+                RETURNING users.id, p.amount
                 """,
-                (provider, provider_ref, reason, hold_id),
+                (max_age_seconds,),
             )
+            rows = cur.fetchall()
             conn.commit()
-            return True
+            _mark_write(conn, *(r["id"] for r in rows))
+    for r in rows:
+        metrics.record_refund(float(r["amount"]), kind="hold")
+    return len(rows)
 
 
 def get_credit_summary_by_user_id(user_id: int) -> Dict[str, Any]:
@@ -746,22 +1761,30 @@ def create_generation_job(
     return job_id
 
 
+_JOB_UPDATE_FIELDS = ("status", "progress", "provider_job_id", "result_url", "error")
+
+
 def update_generation_job(job_id: str, **fields) -> None:
-    allowed = {"status", "progress", "provider_job_id", "result_url", "error"}
-    sets = []
-    vals = []
-    for k, v in fields.items():
-        if k in allowed:
-            sets.append(f"{k}=%s")
-            vals.append(v)
-    if not sets:
+    """
+    Buffered μέσω core.events: τα updates μαζεύονται και γράφονται σε batch
+    (COPY + ένα UPDATE) στο επόμενο flush, οπότε το get_job μπορεί να δει την
+    παλιά τιμή για έως EVENTS_FLUSH_MS. Ένα update παλαιότερο από ό,τι έχει ήδη
+    γραφτεί (π.χ. από replay spill αρχείου) αγνοείται. Με EVENTS_ENABLED=0
+    γράφεται αμέσως. None σημαίνει "δεν αλλάζει" (COALESCE).
+    """
+    if events.ENABLED:
+        events.update_job(job_id, **fields)
+        if "status" in fields:
+            events.record("status", job_id=str(job_id), status=fields["status"])
+        return
+
+    if not fields.keys() & _JOB_UPDATE_FIELDS:
         return
+    params = {k: fields.get(k) for k in _JOB_UPDATE_FIELDS}
+    params["id"] = job_id
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                f"UPDATE generation_jobs SET {', '.join(sets)}, updated_at=now() WHERE id=%s",
-                (*vals, job_id),
-            )
+            cur.execute(db_queries.GENERATION_JOB_UPDATE, params, prepare=True)
             conn.commit()
 
 
@@ -774,17 +1797,8 @@ def get_job(job_id: str) -> Optional[Dict[str, Any]]:
 
 def list_jobs_by_user_id(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, model, mode, status, progress, result_url, error, created_at, updated_at
-                FROM generation_jobs
-                WHERE user_id=%s
-                ORDER BY created_at DESC
-                LIMIT %s
-                """,
-                (user_id, limit),
-            )
+        with _cur(conn) as cur:
+            cur.execute(db_queries.GENERATION_JOBS_BY_USER, (user_id, limit), prepare=True)
             return cur.fetchall()
 
 
@@ -808,35 +1822,41 @@ def create_referral_link(owner_user_id: int) -> dict:
                 (owner_user_id, code),
             )
             row = cur.fetchone()
+            cur.execute("INSERT INTO referral_stats (referral_id) VALUES (%s)", (row["id"],))
             conn.commit()
-            return {"ok": True, **row}
+            _mark_write(conn, owner_user_id)
+    return {"ok": True, **row}
 
 
 def list_referrals(owner_user_id: int) -> list:
     """
-    Λίστα links + μετρήσεις (starts, purchases_amount)
+    Λίστα links + μετρήσεις (starts, purchases, purchases_amount, earnings_eur)
+    από το referral_stats: O(links), ανεξάρτητο από το πλήθος των events.
     """
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT r.id, r.code, r.created_at,
-                  COALESCE(SUM(CASE WHEN e.event_type='start' THEN 1 ELSE 0 END),0) AS starts,
-                  COALESCE(SUM(CASE WHEN e.event_type='purchase' THEN e.amount_eur ELSE 0 END),0) AS purchases_amount
-                FROM referrals r
-                LEFT JOIN referral_events e ON e.referral_id = r.id
-                WHERE r.owner_user_id=%s
-                GROUP BY r.id
-                ORDER BY r.created_at DESC
-                """,
-                (owner_user_id,),
-            )
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(db_queries.REFERRALS_BY_OWNER, (owner_user_id,), prepare=True)
             return cur.fetchall()
 
+    return _read(run, user_id=owner_user_id)
+
+
+def _referral_pct(plan_sku: Optional[str]) -> int:
+    return int(SUBSCRIPTION_PLANS.get(plan_sku or "FREE", {}).get("referral_pct", 0))
+
+
+# plan_sku -> referral_pct για τα purchase statements (το pct μπαίνει στο event
+# τη στιγμή της αγοράς, όχι της πληρωμής της προμήθειας)
+_REFERRAL_PCT_PARAMS = {
+    "plan_skus": list(SUBSCRIPTION_PLANS),
+    "plan_pcts": [_referral_pct(sku) for sku in SUBSCRIPTION_PLANS],
+}
+
 
 def record_referral_purchase(code: str, amount_eur) -> bool:
     """
-    Καταγράφει purchase amount για code.
+    Καταγράφει purchase amount για code (pending event + μετρητές στο ίδιο
+    transaction). Η προμήθεια υπολογίζεται από το pay_referral_commissions.
     """
     with get_conn() as conn:
         with conn.cursor() as cur:
@@ -845,13 +1865,34 @@ def record_referral_purchase(code: str, amount_eur) -> bool:
             if not r:
                 return False
             cur.execute(
-                "INSERT INTO referral_events (referral_id, event_type, amount_eur) VALUES (%s,'purchase',%s)",
-                (r["id"], amount_eur),
+                db_queries.REFERRAL_PURCHASE_BY_CODE,
+                {"referral_id": r["id"], "amount": _to_decimal(amount_eur), **_REFERRAL_PCT_PARAMS},
+                prepare=True,
             )
             conn.commit()
             return True
 
 
+def emit_referral_purchase(cur, order_id: int, buyer_user_id: int, amount_eur) -> None:
+    """
+    Μέσα στο transaction του caller (db.process_payment_event, που σημειώνει την παραγγελία paid):
+    αν ο αγοραστής ήρθε από referral link, γράφει pending purchase event για την
+    παραγγελία, με το referral_pct του πλάνου του owner εκείνη τη στιγμή, και
+    ενημερώνει τους μετρητές. Ένα event ανά order_id (unique), άρα ένα webhook
+    retry δεν το διπλασιάζει.
+    """
+    cur.execute(
+        db_queries.REFERRAL_PURCHASE_BY_ORDER,
+        {
+            "order_id": int(order_id),
+            "buyer": int(buyer_user_id),
+            "amount": _to_decimal(amount_eur),
+            **_REFERRAL_PCT_PARAMS,
+        },
+        prepare=True,
+    )
+
+
 def apply_referral_start(invited_user_id: int, code: str, bonus_credits: int = 1) -> dict:
     """
     Αν ο invited_user ΔΕΝ έχει ξαναμπεί από referral, τότε:
@@ -908,8 +1949,10 @@ def apply_referral_start(invited_user_id: int, code: str, bonus_credits: int = 1
             """,
             (referral_id,),
         )
+        cur.execute(db_queries.REFERRAL_STATS_START, (referral_id,), prepare=True)
 
         conn.commit()
+        _mark_write(conn, invited_user_id)
 
     # δώσε bonus στον owner (γράφει και ledger)
     add_credits_by_user_id(
@@ -929,6 +1972,185 @@ def apply_referral_start(invited_user_id: int, code: str, bonus_credits: int = 1
     }
 
 
+def reconcile_referral_stats(batch: int = 1000) -> List[int]:
+    """
+    Ελέγχει το referral_stats απέναντι στα raw referral_events, σε batches links
+    (keyset στο id), και διορθώνει όσα αποκλίνουν. Επιστρέφει τα referral_id που
+    διορθώθηκαν. Οι γραμμές που θα διορθωθούν κλειδώνονται πρώτα και μετά
+    ξαναμετριούνται. Ένα event που γράφεται ταυτόχρονα είτε έχει ήδη γίνει commit
+    (μετριέται), είτε περιμένει το lock και προσθέτει το +1 του μετά τη διόρθωση.
+    """
+    fixed: List[int] = []
+    after = 0
+    while True:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    WITH ids AS (
+                      SELECT id FROM referrals WHERE id > %s ORDER BY id LIMIT %s
+                    ),
+                    agg AS (
+                      SELECT i.id AS referral_id, {_REFERRAL_AGGREGATES}
+                      FROM ids i
+                      LEFT JOIN referral_events e ON e.referral_id = i.id
+                      GROUP BY i.id
+                    )
+                    SELECT (SELECT max(id) FROM ids) AS last_id,
+                           array_agg(a.referral_id) FILTER (
+                             WHERE s.referral_id IS NULL
+                                OR (s.starts, s.purchases, s.purchases_amount, s.earnings_eur)
+                                   IS DISTINCT FROM (a.starts, a.purchases, a.purchases_amount, a.earnings_eur)
+                           ) AS drifted
+                    FROM agg a
+                    LEFT JOIN referral_stats s ON s.referral_id = a.referral_id
+                    """,
+                    (after, batch),
+                )
+                row = cur.fetchone()
+                conn.commit()
+                if not row or row["last_id"] is None:
+                    return fixed
+                after = row["last_id"]
+                drifted = sorted(row["drifted"] or [])
+                if not drifted:
+                    continue
+
+                cur.execute(
+                    "INSERT INTO referral_stats (referral_id) SELECT unnest(%s::int[]) ON CONFLICT DO NOTHING",
+                    (drifted,),
+                )
+                cur.execute(
+                    "SELECT referral_id FROM referral_stats WHERE referral_id = ANY(%s) ORDER BY referral_id FOR UPDATE",
+                    (drifted,),
+                )
+                cur.execute(
+                    f"""
+                    UPDATE referral_stats s
+                    SET starts = a.starts,
+                        purchases = a.purchases,
+                        purchases_amount = a.purchases_amount,
+                        earnings_eur = a.earnings_eur,
+                        updated_at = now()
+                    FROM (
+                      SELECT i.id AS referral_id, {_REFERRAL_AGGREGATES}
+                      FROM unnest(%s::int[]) AS i(id)
+                      LEFT JOIN referral_events e ON e.referral_id = i.id
+                      GROUP BY i.id
+                    ) a
+                    WHERE s.referral_id = a.referral_id
+                      AND (s.starts, s.purchases, s.purchases_amount, s.earnings_eur)
+                          IS DISTINCT FROM (a.starts, a.purchases, a.purchases_amount, a.earnings_eur)
+                    RETURNING s.referral_id
+                    """,
+                    (drifted,),
+                )
+                fixed.extend(r["referral_id"] for r in cur.fetchall())
+                conn.commit()
+
+
+# referral_id -> owner_user_id. Ο owner ενός link δεν αλλάζει ποτέ, οπότε το
+# index μένει σωστό για πάντα (ανά process) και το commission batch δεν κάνει
+# join στο referrals για κάθε event: φορτώνει μόνο όσα links δεν έχει δει.
+_referral_owners: Dict[int, int] = {}
+_REFERRAL_OWNERS_MAX = 500_000
+
+
+def _resolve_referral_owners(cur, referral_ids: List[int]) -> Dict[int, int]:
+    missing = [r for r in referral_ids if r not in _referral_owners]
+    if missing:
+        if len(_referral_owners) + len(missing) > _REFERRAL_OWNERS_MAX:
+            _referral_owners.clear()
+        cur.execute("SELECT id, owner_user_id FROM referrals WHERE id = ANY(%s)", (missing,))
+        for row in cur.fetchall():
+            _referral_owners[row["id"]] = row["owner_user_id"]
+    return {r: _referral_owners[r] for r in referral_ids if r in _referral_owners}
+
+
+def pay_referral_commissions(limit: int, credits_per_eur: Decimal) -> Dict[str, Any]:
+    """
+    Ένα batch του commission pipeline, σε ένα transaction:
+      - παίρνει έως limit pending purchase events (SKIP LOCKED: ασφαλές από πολλά processes)
+      - προμήθεια = amount_eur * referral_pct του event (το πλάνο του owner τη
+        στιγμή της αγοράς). Events πριν από τη στήλη (NULL) παίρνουν το τρέχον πλάνο.
+      - σημειώνει τα events paid και προσθέτει τα earnings στο referral_stats
+      - events χωρίς owner (π.χ. link που σβήστηκε) γίνονται failed, όχι paid με 0
+      - πιστώνει credits (προμήθεια * credits_per_eur) με μία γραμμή ledger ανά owner
+    Idempotent: ένα event πληρώνεται μόνο μαζί με την αλλαγή του σε paid.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(db_queries.REFERRAL_COMMISSIONS_CLAIM, (int(limit),), prepare=True)
+            events = cur.fetchall()
+            if not events:
+                conn.commit()
+                return {"events": 0, "failed": 0, "owners": 0, "commission_eur": Decimal("0"), "credits": Decimal("0")}
+
+            owners = _resolve_referral_owners(cur, sorted({e["referral_id"] for e in events}))
+            legacy_owners = sorted({
+                owners[e["referral_id"]] for e in events
+                if e["referral_pct"] is None and e["referral_id"] in owners
+            })
+            current_pcts: Dict[int, int] = {}
+            if legacy_owners:
+                cur.execute("SELECT id, plan_sku FROM users WHERE id = ANY(%s)", (legacy_owners,))
+                current_pcts = {r["id"]: _referral_pct(r["plan_sku"]) for r in cur.fetchall()}
+
+            ids: List[int] = []
+            ev_pcts: List[int] = []
+            commissions: List[Decimal] = []
+            statuses: List[str] = []
+            failed = 0
+            per_owner: Dict[int, List[Any]] = {}  # owner -> [commission_eur, count]
+            for e in events:
+                owner = owners.get(e["referral_id"])
+                ids.append(e["id"])
+                if owner is None:
+                    ev_pcts.append(e["referral_pct"])
+                    commissions.append(Decimal("0"))
+                    statuses.append("failed")
+                    failed += 1
+                    continue
+                pct = e["referral_pct"] if e["referral_pct"] is not None else current_pcts.get(owner, 0)
+                commission = (_to_decimal(e["amount_eur"] or 0) * pct / 100).quantize(Decimal("0.01"))
+                ev_pcts.append(pct)
+                commissions.append(commission)
+                statuses.append("paid")
+                if commission > 0:
+                    acc = per_owner.setdefault(owner, [Decimal("0"), 0])
+                    acc[0] += commission
+                    acc[1] += 1
+
+            cur.execute(
+                db_queries.REFERRAL_COMMISSIONS_APPLY,
+                {"ids": ids, "pcts": ev_pcts, "commissions": commissions, "statuses": statuses},
+                prepare=True,
+            )
+
+            users, amounts, counts = [], [], []
+            for owner in sorted(per_owner):
+                credits = (per_owner[owner][0] * credits_per_eur).quantize(Decimal("0.01"))
+                if credits > 0:
+                    users.append(owner)
+                    amounts.append(credits)
+                    counts.append(per_owner[owner][1])
+            if users:
+                cur.execute(
+                    db_queries.REFERRAL_COMMISSIONS_CREDIT,
+                    {"users": users, "amounts": amounts, "counts": counts, "ref": f"events:{ids[0]}-{ids[-1]}"},
+                    prepare=True,
+                )
+            conn.commit()
+            _mark_write(conn, *users)
+    return {
+        "events": len(events),
+        "failed": failed,
+        "owners": len(users),
+        "commission_eur": sum(commissions, Decimal("0")),
+        "credits": sum(amounts, Decimal("0")),
+    }
+
+
 def get_referral_owner_by_code(code: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
         cur = conn.cursor()
@@ -936,32 +2158,102 @@ def get_referral_owner_by_code(code: str) -> Optional[Dict[str, Any]]:
         return cur.fetchone()
 
 def set_last_result(user_id: int, model: str, result_url: str) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(db_queries.LAST_RESULT_UPSERT, (user_id, model, result_url), prepare=True)
+            conn.commit()
+            _mark_write(conn, user_id)
+
+
+def get_last_result_by_tg_id(tg_user_id: int, model: str) -> Optional[str]:
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(db_queries.LAST_RESULT_BY_TG, (model, tg_user_id), prepare=True)
+            return cur.fetchone()
+
+    # χωρίς result στο replica: ίσως το set_last_result δεν έχει φτάσει ακόμα
+    row = _read(run, owner=lambda r: r["user_id"] if r and r["result_url"] else None)
+    return row["result_url"] if row else None
+
+# ======================
+# Chat sessions (Gemini memory)
+# ======================
+def get_chat_session(tg_user_id: int, max_idle_seconds: int) -> Optional[Dict[str, Any]]:
+    """
+    Η γραμμή με το version της. Αν είναι αδρανής πάνω από max_idle_seconds,
+    expired = true: ο caller ξεκινάει από την αρχή αλλά κρατάει το version για το save.
+    """
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
-                INSERT INTO last_results (user_id, model, result_url)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, model)
-                DO UPDATE SET result_url = EXCLUDED.result_url, created_at = now()
+                SELECT summary, turns, tokens, version,
+                       updated_at <= now() - make_interval(secs => %s) AS expired
+                FROM chat_sessions
+                WHERE tg_user_id=%s
                 """,
-                (user_id, model, result_url),
+                (max_idle_seconds, tg_user_id),
             )
+            return cur.fetchone()
+
+
+def save_chat_session(tg_user_id: int, summary: str, turns: bytes, tokens: int, version: int) -> Optional[int]:
+    """
+    Compare-and-set: γράφει μόνο αν η γραμμή είναι ακόμα στο version που
+    φορτώθηκε (0 = δεν υπήρχε γραμμή). Επιστρέφει το νέο version, ή None αν την
+    άλλαξε (ή τη διέγραψε) άλλος στο μεταξύ, οπότε ο caller ξαναφορτώνει.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if version == 0:
+                cur.execute(
+                    """
+                    INSERT INTO chat_sessions AS c (tg_user_id, summary, turns, tokens, version, updated_at)
+                    VALUES (%s, %s, %s, %s, 1, now())
+                    ON CONFLICT (tg_user_id)
+                    DO UPDATE SET summary = EXCLUDED.summary,
+                                  turns = EXCLUDED.turns,
+                                  tokens = EXCLUDED.tokens,
+                                  version = c.version + 1,
+                                  updated_at = now()
+                    WHERE c.version = 0
+                    RETURNING version
+                    """,
+                    (tg_user_id, summary, turns, tokens),
+                )
+            else:
+                cur.execute(
+                    """
+                    UPDATE chat_sessions
+                    SET summary = %s, turns = %s, tokens = %s, version = version + 1, updated_at = now()
+                    WHERE tg_user_id = %s AND version = %s
+                    RETURNING version
+                    """,
+                    (summary, turns, tokens, tg_user_id, version),
+                )
+            row = cur.fetchone()
             conn.commit()
+    return int(row["version"]) if row else None
 
 
-def get_last_result_by_tg_id(tg_user_id: int, model: str) -> Optional[str]:
-    u = get_user(tg_user_id)
-    if not u:
-        return None
+def delete_chat_session(tg_user_id: int) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM chat_sessions WHERE tg_user_id=%s", (tg_user_id,))
+            conn.commit()
+
+
+def delete_idle_chat_sessions(max_idle_seconds: int) -> int:
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT result_url FROM last_results WHERE user_id=%s AND model=%s",
-                (u["id"], model),
+                "DELETE FROM chat_sessions WHERE updated_at < now() - make_interval(secs => %s)",
+                (max_idle_seconds,),
             )
-            row = cur.fetchone()
-            return (row or {}).get("result_url")
+            n = cur.rowcount
+            conn.commit()
+            return n
+
 
 # ======================
 # Marketplace Jobs
@@ -977,66 +2269,75 @@ def create_marketplace_job(
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                INSERT INTO marketplace_jobs (id, client_user_id, title, description, budget_eur, deadline_days, status)
-                VALUES (%s, %s, %s, %s, %s, %s, 'open')
-                RETURNING *
-                """,
+                db_queries.MARKETPLACE_JOB_INSERT,
                 (job_id, client_user_id, title, description, budget_eur, deadline_days),
             )
             row = cur.fetchone()
             conn.commit()
-            return row
+            _mark_write(conn, client_user_id)
+    return row
+
+
+def get_marketplace_jobs_page(
+    status: str = "open",
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    min_budget=None,
+    max_budget=None,
+    max_deadline_days: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Σελίδα αγγελιών (νεότερες πρώτα): {"items": [...], "next_cursor": str | None}.
+    q: αναζήτηση σε τίτλο + περιγραφή με σύνταξη websearch (λέξεις, "φράση", -λέξη).
+    Τα αποτελέσματα μένουν σε σειρά created_at, οπότε ο cursor δουλεύει και με q.
+    Raises ValueError για άκυρο cursor.
+    """
+    limit = max(1, min(int(limit), 50))
+    q = (q or "").strip()[:200] or None
+    params: Dict[str, Any] = {
+        "status": status,
+        "q": q,
+        "min_budget": _to_decimal(min_budget) if min_budget is not None else None,
+        "max_budget": _to_decimal(max_budget) if max_budget is not None else None,
+        "max_deadline": int(max_deadline_days) if max_deadline_days is not None else None,
+        "limit": limit + 1,
+    }
+    if cursor:
+        params["ts"], params["id"] = _parse_keyset_cursor(cursor, uuid.UUID)
+    query = db_queries.MARKETPLACE_JOBS_PAGE[q is not None, bool(cursor)]
+
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(query, params, prepare=True)
+            return cur.fetchall()
+
+    rows = _read(run)
+    next_cursor = _keyset_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
 
 
 def list_marketplace_jobs(status: str = "open", limit: int = 20) -> List[Dict[str, Any]]:
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT j.*, u.tg_username, u.tg_first_name, u.tg_user_id
-                FROM marketplace_jobs j
-                JOIN users u ON u.id = j.client_user_id
-                WHERE j.status = %s
-                ORDER BY j.created_at DESC
-                LIMIT %s
-                """,
-                (status, limit),
-            )
-            return cur.fetchall()
+    return get_marketplace_jobs_page(status, limit)["items"]
 
 
 def get_marketplace_job(job_id: str) -> Optional[Dict[str, Any]]:
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT j.*, u.tg_username, u.tg_first_name, u.tg_user_id
-                FROM marketplace_jobs j
-                JOIN users u ON u.id = j.client_user_id
-                WHERE j.id = %s
-                """,
-                (job_id,),
-            )
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(db_queries.MARKETPLACE_JOB_BY_ID, (job_id,), prepare=True)
             return cur.fetchone()
 
+    return _read(run, owner=lambda j: j["client_user_id"] if j else None)
+
 
 def get_my_marketplace_jobs(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT j.*,
-                  (SELECT COUNT(*) FROM job_offers o WHERE o.job_id = j.id) AS offer_count
-                FROM marketplace_jobs j
-                WHERE j.client_user_id = %s
-                ORDER BY j.created_at DESC
-                LIMIT %s
-                """,
-                (user_id, limit),
-            )
+    def run(conn):
+        with _cur(conn) as cur:
+            cur.execute(db_queries.MARKETPLACE_JOBS_BY_CLIENT, (user_id, limit), prepare=True)
             return cur.fetchall()
 
+    return _read(run, user_id=user_id)
+
 
 def create_job_offer(
     job_id: str,
@@ -1057,11 +2358,12 @@ def create_job_offer(
             )
             row = cur.fetchone()
             conn.commit()
-            return row
+            _mark_write(conn, freelancer_user_id)
+    return row
 
 
 def list_offers_for_job(job_id: str) -> List[Dict[str, Any]]:
-    with get_conn() as conn:
+    def run(conn):
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1075,6 +2377,8 @@ def list_offers_for_job(job_id: str) -> List[Dict[str, Any]]:
             )
             return cur.fetchall()
 
+    return _read(run)
+
 
 def accept_job_offer(offer_id: str) -> Optional[Dict[str, Any]]:
     """Accept an offer: mark offer as accepted, mark job as assigned. Returns offer+job info."""
@@ -1123,11 +2427,14 @@ def accept_job_offer(offer_id: str) -> Optional[Dict[str, Any]]:
                 """,
                 (offer_id,),
             )
-            return cur.fetchone()
+            row = cur.fetchone()
+            if row:
+                _mark_write(conn, row["client_user_id"], row["freelancer_user_id"])
+    return row
 
 
 def get_my_offers(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-    with get_conn() as conn:
+    def run(conn):
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1141,3 +2448,586 @@ def get_my_offers(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
                 (user_id, limit),
             )
             return cur.fetchall()
+
+    return _read(run, user_id=user_id)
+
+
+# ======================
+# Notifications (ουρά για core.notifications)
+# ======================
+def enqueue_notification(
+    chat_id: int,
+    kind: str,
+    item: Dict[str, Any],
+    coalesce_key: Optional[str] = None,
+    window_seconds: float = 0,
+) -> None:
+    """
+    Βάζει μια ειδοποίηση στην ουρά (ένα statement).
+    Με coalesce_key: αν υπάρχει ήδη pending ειδοποίηση για (chat_id, coalesce_key),
+    το item προστίθεται στο payload.items της και δεν φτιάχνεται νέα γραμμή. Η
+    πρώτη φεύγει αμέσως, οι επόμενες όχι νωρίτερα από window_seconds μετά την
+    προηγούμενη αποστολή, άρα το πολύ ένα μήνυμα ανά window για κάθε chat + key.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO notifications AS n (chat_id, kind, coalesce_key, payload, not_before)
+                VALUES (
+                  %(chat_id)s, %(kind)s, %(key)s,
+                  jsonb_build_object('items', jsonb_build_array(%(item)s::jsonb)),
+                  GREATEST(
+                    now(),
+                    (SELECT max(claimed_at) + make_interval(secs => %(window)s)
+                     FROM notifications
+                     WHERE chat_id = %(chat_id)s AND coalesce_key = %(key)s AND status <> 'pending')
+                  )
+                )
+                ON CONFLICT (chat_id, coalesce_key) WHERE status = 'pending'
+                DO UPDATE SET payload = jsonb_set(n.payload, '{items}', (n.payload -> 'items') || (EXCLUDED.payload -> 'items'))
+                """,
+                {
+                    "chat_id": int(chat_id),
+                    "kind": kind,
+                    "key": coalesce_key,
+                    "item": json.dumps(item, default=str),
+                    "window": float(window_seconds),
+                },
+            )
+            conn.commit()
+
+
+def claim_notifications(limit: int, stale_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Παίρνει έως limit ειδοποιήσεις που πρέπει να φύγουν (SKIP LOCKED, ασφαλές με
+    πολλά processes). Όσες έμειναν 'sending' πάνω από stale_seconds (crash στη
+    μέση) ξαναδίνονται.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE notifications n
+                SET status = 'sending', attempts = n.attempts + 1, claimed_at = now()
+                WHERE n.id IN (
+                  SELECT id FROM notifications
+                  WHERE (status IN ('pending', 'retry') AND not_before <= now())
+                     OR (status = 'sending' AND claimed_at < now() - make_interval(secs => %s))
+                  ORDER BY not_before
+                  LIMIT %s
+                  FOR UPDATE SKIP LOCKED
+                )
+                RETURNING n.id, n.chat_id, n.kind, n.payload, n.attempts
+                """,
+                (float(stale_seconds), int(limit)),
+            )
+            rows = cur.fetchall()
+            conn.commit()
+    rows.sort(key=lambda r: r["id"])
+    return rows
+
+
+def finish_notifications(results: List[tuple]) -> None:
+    """results: [(id, status 'sent' | 'retry' | 'failed', retry_in_seconds, error | None), ...]"""
+    if not results:
+        return
+    ids, statuses, delays, errors = (list(x) for x in zip(*results))
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE notifications n
+                SET status = d.status,
+                    not_before = now() + make_interval(secs => d.delay),
+                    sent_at = CASE WHEN d.status = 'sent' THEN now() END,
+                    last_error = COALESCE(d.error, n.last_error)
+                FROM unnest(%s::bigint[], %s::text[], %s::float8[], %s::text[]) AS d(id, status, delay, error)
+                WHERE n.id = d.id
+                """,
+                (ids, statuses, delays, errors),
+            )
+            conn.commit()
+
+
+def delete_old_notifications(max_age_seconds: int) -> int:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM notifications
+                WHERE status IN ('sent', 'failed') AND created_at < now() - make_interval(secs => %s)
+                """,
+                (max_age_seconds,),
+            )
+            n = cur.rowcount
+            conn.commit()
+            return n
+
+
+# ======================
+# Telegram send slots (για core.telegram_sender)
+# ======================
+def reserve_telegram_send_slot(chat_id: Optional[int], interval: float, chat_interval: float) -> float:
+    """
+    Κλείνει το επόμενο slot αποστολής στο κοινό για όλα τα processes budget του
+    bot (ένα slot ανά interval) και, αν δοθεί chat_id, στο chat (ένα ανά
+    chat_interval). Η γραμμή του bot κλειδώνεται, οπότε τα slots δίνονται με τη
+    σειρά των κλήσεων. Επιστρέφει πόσα δευτερόλεπτα πρέπει να περιμένει ο caller.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                WITH locked AS (
+                  SELECT next_at FROM telegram_send_slots
+                  WHERE chat_id IN (0, %(chat_id)s)
+                  ORDER BY chat_id
+                  FOR UPDATE
+                ), slot AS (
+                  SELECT GREATEST(clock_timestamp(), max(next_at)) AS at FROM locked
+                ), reserved AS (
+                  INSERT INTO telegram_send_slots AS s (chat_id, next_at, sent)
+                  SELECT 0, at + make_interval(secs => %(interval)s), 1 FROM slot
+                  UNION ALL
+                  SELECT %(chat_id)s, at + make_interval(secs => %(chat_interval)s), 0 FROM slot
+                  WHERE %(chat_id)s <> 0
+                  ON CONFLICT (chat_id) DO UPDATE
+                  SET next_at = GREATEST(s.next_at, EXCLUDED.next_at),
+                      sent = s.sent + EXCLUDED.sent
+                )
+                SELECT EXTRACT(EPOCH FROM at - clock_timestamp())::float8 AS wait FROM slot
+                """,
+                {"chat_id": int(chat_id or 0), "interval": float(interval), "chat_interval": float(chat_interval)},
+            )
+            wait = cur.fetchone()["wait"]
+            conn.commit()
+    return max(0.0, wait)
+
+
+def telegram_sent_total() -> int:
+    """Σύνολο αποστολών εκτός broadcast από όλα τα processes (για το pacing του broadcast)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT sent FROM telegram_send_slots WHERE chat_id = 0")
+            row = cur.fetchone()
+    return int(row["sent"]) if row else 0
+
+
+def prune_telegram_send_slots(max_age_seconds: int) -> int:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM telegram_send_slots
+                WHERE chat_id <> 0 AND next_at < now() - make_interval(secs => %s)
+                """,
+                (max_age_seconds,),
+            )
+            n = cur.rowcount
+            conn.commit()
+            return n
+
+
+# ======================
+# Broadcasts (για core.broadcast)
+# ======================
+_BROADCAST_COLUMNS = """
+id, text, parse_mode, reply_markup, status, total, last_tg_user_id, sent, failed, blocked,
+send_rate, lease_owner, lease_until, error, created_at, started_at, finished_at, updated_at
+"""
+
+
+def set_users_blocked(tg_user_ids: List[int], blocked: bool) -> None:
+    """Σημειώνει (ή ξεμπλοκάρει) χρήστες που δεν δέχονται μηνύματα από το bot."""
+    if not tg_user_ids:
+        return
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE users
+                SET blocked_at = CASE WHEN %s THEN COALESCE(blocked_at, now()) END
+                WHERE tg_user_id = ANY(%s)
+                """,
+                (blocked, [int(x) for x in tg_user_ids]),
+            )
+            conn.commit()
+
+
+def create_broadcast(text: str, parse_mode: Optional[str] = None, reply_markup: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO broadcasts (text, parse_mode, reply_markup, total)
+                VALUES (%s, %s, %s, (SELECT count(*) FROM users WHERE blocked_at IS NULL))
+                RETURNING {_BROADCAST_COLUMNS}
+                """,
+                (text, parse_mode, json.dumps(reply_markup) if reply_markup else None),
+            )
+            row = cur.fetchone()
+            conn.commit()
+            return row
+
+
+def get_broadcast(broadcast_id: int) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE id = %s", (broadcast_id,))
+            return cur.fetchone()
+
+
+def list_broadcasts(limit: int = 20) -> List[Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT %s", (limit,))
+            return cur.fetchall()
+
+
+def set_broadcast_status(broadcast_id: int, status: str, from_statuses: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """Admin pause / resume / cancel. None αν το broadcast δεν είναι σε κάποιο από τα from_statuses."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                UPDATE broadcasts
+                SET status = %s,
+                    finished_at = CASE WHEN %s = 'cancelled' THEN now() ELSE finished_at END,
+                    updated_at = now()
+                WHERE id = %s AND status = ANY(%s)
+                RETURNING {_BROADCAST_COLUMNS}
+                """,
+                (status, status, broadcast_id, list(from_statuses)),
+            )
+            row = cur.fetchone()
+            conn.commit()
+            return row
+
+
+def claim_broadcast(owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+    """
+    Παίρνει το παλαιότερο running broadcast που δεν τρέχει αλλού (ή του οποίου το
+    lease έληξε, π.χ. μετά από crash). Ένας runner ανά broadcast σε όλα τα processes.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                UPDATE broadcasts
+                SET lease_owner = %(owner)s,
+                    lease_until = now() + make_interval(secs => %(lease)s),
+                    started_at = COALESCE(started_at, now()),
+                    updated_at = now()
+                WHERE id = (
+                  SELECT id FROM broadcasts
+                  WHERE status = 'running'
+                    AND (lease_until IS NULL OR lease_until < now() OR lease_owner = %(owner)s)
+                  ORDER BY id
+                  LIMIT 1
+                  FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {_BROADCAST_COLUMNS}
+                """,
+                {"owner": owner, "lease": float(lease_seconds)},
+            )
+            row = cur.fetchone()
+            conn.commit()
+            return row
+
+
+def checkpoint_broadcast(
+    broadcast_id: int,
+    owner: str,
+    last_tg_user_id: int,
+    sent: int,
+    failed: int,
+    blocked_ids: List[int],
+    send_rate: float,
+    lease_seconds: float,
+) -> Optional[str]:
+    """
+    Ένα transaction: σημειώνει τους blocked χρήστες, προσθέτει τους μετρητές
+    (deltas από το προηγούμενο checkpoint), προχωράει το checkpoint και ανανεώνει
+    το lease. Επιστρέφει το τρέχον status, ή None αν το lease χάθηκε.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if blocked_ids:
+                cur.execute(
+                    "UPDATE users SET blocked_at = now() WHERE tg_user_id = ANY(%s) AND blocked_at IS NULL",
+                    ([int(x) for x in blocked_ids],),
+                )
+            cur.execute(
+                """
+                UPDATE broadcasts
+                SET last_tg_user_id = GREATEST(last_tg_user_id, %(last)s),
+                    sent = sent + %(sent)s,
+                    failed = failed + %(failed)s,
+                    blocked = blocked + %(blocked)s,
+                    send_rate = %(rate)s,
+                    lease_until = now() + make_interval(secs => %(lease)s),
+                    updated_at = now()
+                WHERE id = %(id)s AND lease_owner = %(owner)s
+                RETURNING status
+                """,
+                {
+                    "id": broadcast_id,
+                    "owner": owner,
+                    "last": int(last_tg_user_id),
+                    "sent": int(sent),
+                    "failed": int(failed),
+                    "blocked": len(blocked_ids),
+                    "rate": float(send_rate),
+                    "lease": float(lease_seconds),
+                },
+            )
+            row = cur.fetchone()
+            conn.commit()
+            return row["status"] if row else None
+
+
+def renew_broadcast_lease(broadcast_id: int, owner: str, lease_seconds: float) -> bool:
+    """Heartbeat: ανανεώνει μόνο το lease. False αν το lease το έχει πια άλλος."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcasts
+                SET lease_until = now() + make_interval(secs => %s)
+                WHERE id = %s AND lease_owner = %s
+                """,
+                (float(lease_seconds), broadcast_id, owner),
+            )
+            ok = cur.rowcount == 1
+            conn.commit()
+            return ok
+
+
+def release_broadcast(broadcast_id: int, owner: str, final_status: Optional[str] = None, error: Optional[str] = None) -> None:
+    """Αφήνει το lease. final_status ('done' / 'failed') εφαρμόζεται μόνο αν είναι ακόμα running."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcasts
+                SET status = CASE WHEN status = 'running' THEN COALESCE(%(final)s, status) ELSE status END,
+                    finished_at = CASE WHEN status = 'running' AND %(final)s IS NOT NULL THEN now() ELSE finished_at END,
+                    send_rate = CASE WHEN %(final)s IS NOT NULL THEN 0 ELSE send_rate END,
+                    error = COALESCE(%(error)s, error),
+                    lease_owner = NULL,
+                    lease_until = NULL,
+                    updated_at = now()
+                WHERE id = %(id)s AND lease_owner = %(owner)s
+                """,
+                {"id": broadcast_id, "owner": owner, "final": final_status, "error": error},
+            )
+            conn.commit()
+
+
+def iter_broadcast_targets(after_tg_user_id: int, batch: int = 2000) -> Iterator[List[int]]:
+    """
+    Οι reachable χρήστες με tg_user_id > after_tg_user_id, σε αύξουσα σειρά, σε
+    batches, από server-side cursor. Ο cursor είναι WITH HOLD: το αποτέλεσμα
+    υλοποιείται στο commit, οπότε δεν μένει ανοιχτό transaction (ούτε snapshot
+    που κρατάει το vacuum) όσο διαρκεί η αποστολή. Ξεχωριστή σύνδεση, όχι από το pool.
+    """
+    with psycopg.connect(DATABASE_URL) as conn:
+        with conn.cursor(name="broadcast_targets", withhold=True) as cur:
+            cur.itersize = batch
+            cur.execute(
+                "SELECT tg_user_id FROM users WHERE tg_user_id > %s AND blocked_at IS NULL ORDER BY tg_user_id",
+                (int(after_tg_user_id),),
+            )
+            conn.commit()
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    return
+                yield [r[0] for r in rows]
+
+
+# ======================
+# Orders + payment events (για routes.billing / core.payments)
+# ======================
+def create_order(user_id: int, kind: str, sku: str, amount_eur, provider: str) -> int:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO orders (user_id, kind, sku, amount_eur, currency, status, provider)
+                VALUES (%s, %s, %s, %s, 'EUR', 'pending', %s)
+                RETURNING id
+                """,
+                (user_id, kind, sku, amount_eur, provider),
+            )
+            order_id = cur.fetchone()["id"]
+            conn.commit()
+            return order_id
+
+
+def set_order_provider_ref(order_id: int, provider_ref: str) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE orders SET provider_ref=%s WHERE id=%s", (provider_ref, order_id))
+            conn.commit()
+
+
+def record_payment_event(
+    provider: str,
+    event_id: str,
+    event_type: str,
+    order_id: Optional[int],
+    payload: Dict[str, Any],
+) -> bool:
+    """Αποθηκεύει το raw webhook event. False αν το ίδιο event έχει ήδη έρθει (retry του provider)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO payment_events (provider, event_id, event_type, order_id, payload)
+                VALUES (%s, %s, %s, %s, %s::jsonb)
+                ON CONFLICT (provider, event_id) DO NOTHING
+                """,
+                (provider, event_id, event_type, order_id, json.dumps(payload, default=str)),
+            )
+            new = cur.rowcount == 1
+            conn.commit()
+            return new
+
+
+class PaymentEventError(RuntimeError):
+    """Αποτυχία εφαρμογής ενός payment event (το transaction έγινε rollback)."""
+
+    def __init__(self, event_id: int, provider: str, attempts: int, message: str):
+        super().__init__(message)
+        self.event_id = event_id
+        self.provider = provider
+        self.attempts = attempts
+
+
+def _payment_pack(sku: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(pack, is_subscription) για ένα sku, (None, False) αν δεν υπάρχει."""
+    if sku in CREDITS_PACKS:
+        return CREDITS_PACKS[sku], False
+    if sku in SUBSCRIPTION_PLANS:
+        return SUBSCRIPTION_PLANS[sku], True
+    return None, False
+
+
+# results του _apply_payment που δεν εφαρμόστηκαν: το event γίνεται failed για
+# χειροκίνητο έλεγχο (πληρωμή χωρίς γνωστή παραγγελία/πακέτο), όχι ignored
+PAYMENT_UNAPPLIED = ("unknown_order", "unknown_sku")
+
+
+def _apply_payment(cur, ev: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    """Εφαρμόζει ένα paid event στο transaction του cur. Επιστρέφει (result, user_id)."""
+    if not ev["order_id"]:
+        return "unknown_order", None
+
+    cur.execute(
+        "SELECT id, user_id, sku, amount_eur, status, provider, provider_ref FROM orders WHERE id=%s FOR UPDATE",
+        (ev["order_id"],),
+    )
+    order = cur.fetchone()
+    if not order:
+        return "unknown_order", None
+    if order["status"] == "paid":
+        return "duplicate", order["user_id"]
+    pack, is_subscription = _payment_pack(order["sku"])
+    if not pack:
+        return "unknown_sku", order["user_id"]
+
+    cur.execute("UPDATE orders SET status='paid' WHERE id=%s", (order["id"],))
+    credits_amount = _to_decimal(pack.get("credits", 0))
+    if credits_amount > 0:
+        reason = f"Subscription {order['sku']}" if is_subscription else f"Extra credits {order['sku']}"
+        cur.execute(
+            db_queries.CREDIT["id", not is_subscription],
+            {
+                "amount": credits_amount,
+                "value": order["user_id"],
+                "reason": reason,
+                "provider": ev["provider"],
+                "provider_ref": order["provider_ref"],
+            },
+            prepare=True,
+        )
+        if not cur.fetchone():
+            raise RuntimeError(f"User {order['user_id']} of order {order['id']} not found")
+    if is_subscription:
+        cur.execute("UPDATE users SET plan_sku=%s WHERE id=%s", (order["sku"], order["user_id"]))
+    emit_referral_purchase(cur, order["id"], order["user_id"], order["amount_eur"])
+    return "paid", order["user_id"]
+
+
+def process_payment_event(paid_types: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """
+    Παίρνει το επόμενο pending payment event (SKIP LOCKED) και το εφαρμόζει σε
+    ένα transaction: order paid + credits/ledger + plan + referral event + event
+    done. Ένα crash στη μέση δεν αφήνει τίποτα μισό: το event μένει pending.
+    paid_types: τα event_type που σημαίνουν πληρωμή (τα υπόλοιπα γίνονται ignored).
+    Πληρωμή που δεν εφαρμόζεται (PAYMENT_UNAPPLIED) γίνεται failed με last_error.
+    None αν δεν υπάρχει event. Σε σφάλμα σηκώνει PaymentEventError με το id.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, provider, event_id, event_type, order_id, attempts, received_at
+                FROM payment_events
+                WHERE status = 'pending' AND not_before <= now()
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+                """
+            )
+            ev = cur.fetchone()
+            if not ev:
+                conn.commit()
+                return None
+            try:
+                if ev["event_type"] in paid_types:
+                    result, user_id = _apply_payment(cur, ev)
+                else:
+                    result, user_id = "ignored", None
+                if result in PAYMENT_UNAPPLIED:
+                    status, error = "failed", f"{result} (order {ev['order_id']})"
+                else:
+                    status, error = ("ignored" if result == "ignored" else "done"), None
+                cur.execute(
+                    """
+                    UPDATE payment_events
+                    SET status = %s, result = %s, last_error = COALESCE(%s, last_error),
+                        attempts = attempts + 1, processed_at = now()
+                    WHERE id = %s
+                    RETURNING processed_at - received_at AS lag
+                    """,
+                    (status, result, error, ev["id"]),
+                )
+                lag = cur.fetchone()["lag"]
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise PaymentEventError(ev["id"], ev["provider"], ev["attempts"] + 1, str(e)) from e
+            _mark_write(conn, user_id)
+
+    return {**ev, "result": result, "lag_seconds": lag.total_seconds()}
+
+
+def fail_payment_event(event_id: int, error: str, retry_in_seconds: Optional[float]) -> None:
+    """Καταγράφει αποτυχία: ξαναδοκιμάζεται μετά από retry_in_seconds, ή failed αν None."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE payment_events
+                SET attempts = attempts + 1,
+                    last_error = %s,
+                    status = CASE WHEN %s::float8 IS NULL THEN 'failed' ELSE status END,
+                    not_before = now() + make_interval(secs => COALESCE(%s::float8, 0))
+                WHERE id = %s
+                """,
+                (error[:1000], retry_in_seconds, retry_in_seconds, event_id),
+            )
+            conn.commit()
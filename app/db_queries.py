@@ -0,0 +1,367 @@
+# app/db_queries.py
+"""Κατάλογος των hot statements του db.py + ελαφριές γραμμές αποτελεσμάτων.
+
+Κάθε statement εδώ είναι σταθερό κείμενο (καμία f-string στο runtime), οπότε το
+db.py το εκτελεί με prepare=True: η Postgres το κάνει parse/plan μία φορά ανά
+σύνδεση του pool και μετά στέλνεται μόνο το όνομα + οι παράμετροι. Οι παραλλαγές
+(π.χ. credit by id / by tg_user_id) είναι ξεχωριστά statements, φτιαγμένα μία
+φορά στο import.
+
+Οι στήλες γράφονται ρητά (όχι SELECT *): ένα prepared statement με * σπάει με
+"cached plan must not change result type" μόλις ένα migration προσθέσει στήλη
+σε process που ήδη τρέχει.
+
+Row: tuple με πρόσβαση και με όνομα στήλης (row["credits"], row.get(...),
+dict(row), {**row}), ώστε ο κώδικας που περίμενε dict_row να δουλεύει ίδιος. Το
+mapping όνομα -> θέση φτιάχνεται μία φορά ανά σχήμα αποτελέσματος, όχι ανά γραμμή.
+"""
+from typing import Any, Dict, Tuple
+
+from psycopg.rows import no_result
+
+# ----------------------
+# Rows
+# ----------------------
+class Row(tuple):
+    __slots__ = ()
+    _index: Dict[str, int] = {}
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._index
+
+    def get(self, key: str, default: Any = None) -> Any:
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return [tuple.__getitem__(self, i) for i in self._index.values()]
+
+    def items(self):
+        return [(n, tuple.__getitem__(self, i)) for n, i in self._index.items()]
+
+    def _asdict(self) -> Dict[str, Any]:
+        return {n: tuple.__getitem__(self, i) for n, i in self._index.items()}
+
+    def __repr__(self) -> str:
+        return f"Row({self._asdict()!r})"
+
+
+_row_classes: Dict[Tuple[str, ...], type] = {}
+
+
+def row_factory(cursor):
+    """psycopg row factory: Row subclass ανά σχήμα (cache στα ονόματα των στηλών)."""
+    desc = cursor.description
+    if desc is None:
+        return no_result
+    names = tuple(c.name for c in desc)
+    cls = _row_classes.get(names)
+    if cls is None:
+        index = {}
+        for i, n in enumerate(names):
+            index.setdefault(n, i)
+        cls = _row_classes[names] = type("Row", (Row,), {"__slots__": (), "_index": index})
+    return cls
+
+
+# ----------------------
+# Users
+# ----------------------
+USER_COLUMNS = "id, tg_user_id, tg_username, tg_first_name, credits, credits_held, extra_credits, plan_sku, created_at"
+
+USER_BY_TG = f"SELECT {USER_COLUMNS} FROM users WHERE tg_user_id = %s"
+USER_BY_ID = f"SELECT {USER_COLUMNS} FROM users WHERE id = %s"
+
+USER_INSERT = f"""
+INSERT INTO users (tg_user_id, tg_username, tg_first_name, credits, credits_held)
+VALUES (%s, %s, %s, %s, 0)
+ON CONFLICT (tg_user_id) DO NOTHING
+RETURNING {USER_COLUMNS}
+"""
+
+USER_START_LEDGER = """
+INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
+VALUES (%s, %s, %s, 'Free start credits', 'system', NULL)
+"""
+
+USER_TOUCH = f"""
+UPDATE users
+SET tg_username = %s,
+    tg_first_name = %s
+WHERE tg_user_id = %s
+RETURNING {USER_COLUMNS}
+"""
+
+# ----------------------
+# Credits + ledger
+# ----------------------
+# (key, extra) -> statement. key: "id" | "tg_user_id", extra: και extra_credits.
+CREDIT = {
+    (key, extra): f"""
+    WITH u AS (
+      UPDATE users
+      SET credits = credits + %(amount)s{", extra_credits = extra_credits + %(amount)s" if extra else ""}
+      WHERE {key} = %(value)s
+      RETURNING id, credits
+    ),
+    led AS (
+      INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
+      SELECT id, %(amount)s, credits, %(reason)s, %(provider)s, %(provider_ref)s FROM u
+    )
+    SELECT id, credits FROM u
+    """
+    for key in ("id", "tg_user_id")
+    for extra in (False, True)
+}
+
+# Τα credits δεσμευμένα σε hold δεν ξοδεύονται. Το WHERE ξαναελέγχεται από την
+# Postgres πάνω στη νεότερη έκδοση της γραμμής αν κάποιο άλλο transaction την
+# άλλαξε, οπότε δεν γίνεται ποτέ overdraft. Το "have" είναι μόνο για το μήνυμα.
+SPEND = {
+    key: f"""
+    WITH u AS (
+      UPDATE users
+      SET credits = credits - %(amount)s
+      WHERE {key} = %(value)s AND credits - credits_held >= %(amount)s
+      RETURNING id, credits
+    ),
+    led AS (
+      INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
+      SELECT id, -%(amount)s, credits, %(reason)s, %(provider)s, %(provider_ref)s FROM u
+    )
+    SELECT (SELECT id FROM u) AS user_id,
+           (SELECT credits FROM u) AS new_balance,
+           (SELECT credits - credits_held FROM users WHERE {key} = %(value)s) AS have
+    """
+    for key in ("id", "tg_user_id")
+}
+
+# (by_tg, after_cursor) -> statement. Keyset πάνω στο (user_id, created_at DESC, id DESC).
+LEDGER_COLUMNS = "id, user_id, delta, balance_after, reason, provider, provider_ref, created_at"
+LEDGER_PAGE = {
+    (by_tg, after): f"""
+    SELECT {LEDGER_COLUMNS}
+    FROM credit_ledger
+    WHERE user_id = {"(SELECT id FROM users WHERE tg_user_id = %(v)s)" if by_tg else "%(v)s"}
+      {"AND (created_at, id) < (%(ts)s, %(id)s)" if after else ""}
+    ORDER BY created_at DESC, id DESC
+    LIMIT %(limit)s
+    """
+    for by_tg in (False, True)
+    for after in (False, True)
+}
+
+# ----------------------
+# Generation jobs
+# ----------------------
+# Ένα σταθερό statement για κάθε συνδυασμό πεδίων: NULL = "δεν αλλάζει".
+GENERATION_JOB_UPDATE = """
+UPDATE generation_jobs
+SET status = COALESCE(%(status)s, status),
+    progress = COALESCE(%(progress)s, progress),
+    provider_job_id = COALESCE(%(provider_job_id)s, provider_job_id),
+    result_url = COALESCE(%(result_url)s, result_url),
+    error = COALESCE(%(error)s, error),
+    updated_at = now()
+WHERE id = %(id)s
+"""
+
+GENERATION_JOBS_BY_USER = """
+SELECT id, model, mode, status, progress, result_url, error, created_at, updated_at
+FROM generation_jobs
+WHERE user_id = %s
+ORDER BY created_at DESC
+LIMIT %s
+"""
+
+# ----------------------
+# Last results
+# ----------------------
+LAST_RESULT_UPSERT = """
+INSERT INTO last_results (user_id, model, result_url)
+VALUES (%s, %s, %s)
+ON CONFLICT (user_id, model)
+DO UPDATE SET result_url = EXCLUDED.result_url, created_at = now()
+"""
+
+LAST_RESULT_BY_TG = """
+SELECT u.id AS user_id, lr.result_url
+FROM users u
+LEFT JOIN last_results lr ON lr.user_id = u.id AND lr.model = %s
+WHERE u.tg_user_id = %s
+"""
+
+# ----------------------
+# Marketplace
+# ----------------------
+MARKETPLACE_JOB_FIELDS = (
+    "id", "client_user_id", "title", "description", "budget_eur", "deadline_days",
+    "status", "offer_count", "created_at", "updated_at",
+)
+MARKETPLACE_JOB_COLUMNS = ", ".join(f"j.{c}" for c in MARKETPLACE_JOB_FIELDS)
+
+MARKETPLACE_JOB_INSERT = f"""
+INSERT INTO marketplace_jobs (id, client_user_id, title, description, budget_eur, deadline_days, status)
+VALUES (%s, %s, %s, %s, %s, %s, 'open')
+RETURNING {", ".join(MARKETPLACE_JOB_FIELDS)}
+"""
+
+MARKETPLACE_JOB_BY_ID = f"""
+SELECT {MARKETPLACE_JOB_COLUMNS}, u.tg_username, u.tg_first_name, u.tg_user_id
+FROM marketplace_jobs j
+JOIN users u ON u.id = j.client_user_id
+WHERE j.id = %s
+"""
+
+# (search, after_cursor) -> statement. Keyset πάνω στο (status, created_at DESC, id DESC).
+# Με search το GIN index του search_tsv βρίσκει τις γραμμές και η σειρά μένει η ίδια.
+# Τα φίλτρα budget/deadline είναι NULL = "χωρίς φίλτρο", ώστε να μη χρειάζονται
+# ακόμα περισσότερες παραλλαγές.
+MARKETPLACE_JOBS_PAGE = {
+    (search, after): f"""
+    SELECT {MARKETPLACE_JOB_COLUMNS}, u.tg_username, u.tg_first_name, u.tg_user_id
+    FROM marketplace_jobs j
+    JOIN users u ON u.id = j.client_user_id
+    WHERE j.status = %(status)s
+      {"AND j.search_tsv @@ websearch_to_tsquery('marketplace_search', %(q)s)" if search else ""}
+      {"AND (j.created_at, j.id) < (%(ts)s, %(id)s)" if after else ""}
+      AND (%(min_budget)s::numeric IS NULL OR j.budget_eur >= %(min_budget)s)
+      AND (%(max_budget)s::numeric IS NULL OR j.budget_eur <= %(max_budget)s)
+      AND (%(max_deadline)s::int IS NULL OR j.deadline_days <= %(max_deadline)s)
+    ORDER BY j.created_at DESC, j.id DESC
+    LIMIT %(limit)s
+    """
+    for search in (False, True)
+    for after in (False, True)
+}
+
+MARKETPLACE_JOBS_BY_CLIENT = f"""
+SELECT {MARKETPLACE_JOB_COLUMNS}
+FROM marketplace_jobs j
+WHERE j.client_user_id = %s
+ORDER BY j.created_at DESC
+LIMIT %s
+"""
+
+# ----------------------
+# Referrals
+# ----------------------
+REFERRALS_BY_OWNER = """
+SELECT r.id, r.code, r.created_at,
+       COALESCE(s.starts, 0) AS starts,
+       COALESCE(s.purchases, 0) AS purchases,
+       COALESCE(s.purchases_amount, 0) AS purchases_amount,
+       COALESCE(s.earnings_eur, 0) AS earnings_eur
+FROM referrals r
+LEFT JOIN referral_stats s ON s.referral_id = r.id
+WHERE r.owner_user_id = %s
+ORDER BY r.created_at DESC
+"""
+
+# Upserts: ένα link χωρίς γραμμή (π.χ. δημιουργήθηκε από παλιό process) αποκτά μία εδώ.
+REFERRAL_STATS_START = """
+INSERT INTO referral_stats AS s (referral_id, starts)
+VALUES (%s, 1)
+ON CONFLICT (referral_id) DO UPDATE
+SET starts = s.starts + 1, updated_at = now()
+"""
+
+# Pending purchase event + μετρητές σε ένα statement. Το referral_pct είναι του
+# πλάνου του owner τη στιγμή της αγοράς (plan_skus/plan_pcts: db._REFERRAL_PCT_PARAMS).
+# Η προμήθεια (earnings_eur) προστίθεται όταν πληρωθεί, από το REFERRAL_COMMISSIONS_APPLY.
+_REFERRAL_OWNER_PCT = (
+    "COALESCE((SELECT p.pct FROM unnest(%(plan_skus)s::text[], %(plan_pcts)s::int[]) AS p(sku, pct)"
+    " WHERE p.sku = COALESCE(o.plan_sku, 'FREE')), 0)"
+)
+
+_REFERRAL_PURCHASE_STATS = """
+INSERT INTO referral_stats AS s (referral_id, purchases, purchases_amount)
+SELECT referral_id, 1, amount_eur FROM ev
+ON CONFLICT (referral_id) DO UPDATE
+SET purchases = s.purchases + 1,
+    purchases_amount = s.purchases_amount + EXCLUDED.purchases_amount,
+    updated_at = now()
+"""
+
+REFERRAL_PURCHASE_BY_CODE = f"""
+WITH ev AS (
+  INSERT INTO referral_events (referral_id, event_type, amount_eur, referral_pct, commission_status)
+  SELECT r.id, 'purchase', %(amount)s, {_REFERRAL_OWNER_PCT}, 'pending'
+  FROM referrals r
+  LEFT JOIN users o ON o.id = r.owner_user_id
+  WHERE r.id = %(referral_id)s
+  RETURNING referral_id, amount_eur
+)
+{_REFERRAL_PURCHASE_STATS}
+"""
+
+# Το referral του αγοραστή είναι το πρώτο link από το οποίο μπήκε (referral_joins).
+REFERRAL_PURCHASE_BY_ORDER = f"""
+WITH ev AS (
+  INSERT INTO referral_events (referral_id, event_type, amount_eur, order_id, referral_pct, commission_status)
+  SELECT j.referral_id, 'purchase', %(amount)s, %(order_id)s, {_REFERRAL_OWNER_PCT}, 'pending'
+  FROM referral_joins j
+  LEFT JOIN referrals r ON r.id = j.referral_id
+  LEFT JOIN users o ON o.id = r.owner_user_id
+  WHERE j.invited_user_id = %(buyer)s
+  ORDER BY j.created_at, j.id
+  LIMIT 1
+  ON CONFLICT (order_id) WHERE order_id IS NOT NULL DO NOTHING
+  RETURNING referral_id, amount_eur
+)
+{_REFERRAL_PURCHASE_STATS}
+"""
+
+REFERRAL_COMMISSIONS_CLAIM = """
+SELECT id, referral_id, amount_eur, referral_pct
+FROM referral_events
+WHERE commission_status = 'pending'
+ORDER BY id
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+
+# events + earnings του referral_stats από τα ίδια arrays (ένα round-trip).
+# status: paid, ή failed (owner που δεν βρέθηκε: για χειροκίνητο έλεγχο).
+REFERRAL_COMMISSIONS_APPLY = """
+WITH d AS (
+  SELECT * FROM unnest(%(ids)s::bigint[], %(pcts)s::int[], %(commissions)s::numeric[], %(statuses)s::text[])
+    AS d(id, pct, commission, status)
+),
+ev AS (
+  UPDATE referral_events e
+  SET referral_pct = d.pct, commission_eur = d.commission, commission_status = d.status
+  FROM d
+  WHERE e.id = d.id
+  RETURNING e.referral_id, d.commission
+)
+UPDATE referral_stats s
+SET earnings_eur = s.earnings_eur + x.total, updated_at = now()
+FROM (SELECT referral_id, SUM(commission) AS total FROM ev GROUP BY referral_id) x
+WHERE s.referral_id = x.referral_id
+"""
+
+# Μία πίστωση + μία γραμμή ledger ανά owner για όλο το batch.
+REFERRAL_COMMISSIONS_CREDIT = """
+WITH d AS (
+  SELECT * FROM unnest(%(users)s::int[], %(amounts)s::numeric[], %(counts)s::int[])
+    AS d(user_id, amount, n)
+),
+u AS (
+  UPDATE users
+  SET credits = users.credits + d.amount
+  FROM d
+  WHERE users.id = d.user_id
+  RETURNING users.id, users.credits, d.amount, d.n
+)
+INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, provider_ref)
+SELECT id, amount, credits, 'Referral commission (' || n || ' αγορές)', 'referral', %(ref)s FROM u
+"""
@@ -1,4 +1,9 @@
 # app/keyboards.py
+# Τα InlineKeyboardMarkup είναι immutable, οπότε κάθε μενού χτίζεται μία φορά και ξαναχρησιμοποιείται.
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, Tuple
+
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 
 from .texts import (
@@ -11,12 +16,14 @@ from .texts import (
     BTN_JOBS,
     BTN_PROMPTS,
     BTN_SUPPORT,
+    START_CAPTION,
 )
 from .config import WEBAPP_URL
 
 FALLBACK_WEBAPP_BASE = "https://veolumibot-production.up.railway.app"
 
 
+@lru_cache(maxsize=None)
 def _base_url() -> str:
     base = (WEBAPP_URL or "").strip().rstrip("/")
     return base if base else FALLBACK_WEBAPP_BASE
@@ -132,6 +139,7 @@ def _webapp_jobs_browse_url() -> str:
 # ========================
 # Main menu
 # ========================
+@lru_cache(maxsize=None)
 def start_inline_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -150,10 +158,12 @@ def start_inline_menu() -> InlineKeyboardMarkup:
 # ========================
 # Video — category menu
 # ========================
+@lru_cache(maxsize=None)
 def video_models_menu() -> InlineKeyboardMarkup:
     return video_categories_menu()
 
 
+@lru_cache(maxsize=None)
 def video_categories_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -173,6 +183,7 @@ def video_categories_menu() -> InlineKeyboardMarkup:
 
 
 # --- Video submenus ---
+@lru_cache(maxsize=None)
 def kling_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -190,6 +201,7 @@ def kling_models_menu() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def runway_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -200,6 +212,7 @@ def runway_models_menu() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def sora_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -210,6 +223,7 @@ def sora_models_menu() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def veo_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -220,6 +234,7 @@ def veo_models_menu() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def wan_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -233,6 +248,7 @@ def wan_models_menu() -> InlineKeyboardMarkup:
 # ========================
 # Image — category menu
 # ========================
+@lru_cache(maxsize=None)
 def image_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -249,6 +265,7 @@ def image_models_menu() -> InlineKeyboardMarkup:
 
 
 # --- Image submenus ---
+@lru_cache(maxsize=None)
 def seedream_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -259,6 +276,7 @@ def seedream_models_menu() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def nanobanana_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -272,6 +290,7 @@ def nanobanana_models_menu() -> InlineKeyboardMarkup:
 # ========================
 # Audio models
 # ========================
+@lru_cache(maxsize=None)
 def audio_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -285,6 +304,7 @@ def audio_models_menu() -> InlineKeyboardMarkup:
 # ========================
 # Text AI models
 # ========================
+@lru_cache(maxsize=None)
 def text_models_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -297,6 +317,7 @@ def text_models_menu() -> InlineKeyboardMarkup:
 # ========================
 # Profile WebApp
 # ========================
+@lru_cache(maxsize=None)
 def open_profile_webapp_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -308,6 +329,7 @@ def open_profile_webapp_kb() -> InlineKeyboardMarkup:
 # ========================
 # Jobs (WebApp)
 # ========================
+@lru_cache(maxsize=None)
 def jobs_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -320,3 +342,30 @@ def jobs_menu() -> InlineKeyboardMarkup:
             [InlineKeyboardButton("← Πίσω", callback_data="menu:home")],
         ]
     )
+
+
+# ========================
+# Menu screens: callback_data -> (caption, keyboard)
+# ========================
+@lru_cache(maxsize=None)
+def menu_screens() -> Mapping[str, Tuple[str, InlineKeyboardMarkup]]:
+    return MappingProxyType(
+        {
+            "menu:home": (START_CAPTION, start_inline_menu()),
+            # Video
+            "menu:video": ("👇 Επίλεξε κατηγορία ΒΙΝΤΕΟ:", video_categories_menu()),
+            "menu:video:kling": ("🟢 Kling — Επίλεξε μοντέλο:", kling_models_menu()),
+            "menu:video:runway": ("🎬 Runway — Επίλεξε μοντέλο:", runway_models_menu()),
+            "menu:video:sora": ("🛰 Sora — Επίλεξε μοντέλο:", sora_models_menu()),
+            "menu:video:veo": ("🎬 Google Veo — Επίλεξε μοντέλο:", veo_models_menu()),
+            "menu:video:wan": ("🌀 Wan — Επίλεξε μοντέλο:", wan_models_menu()),
+            # Images
+            "menu:images": ("👇 Επίλεξε μοντέλο AI για ΕΙΚΟΝΕΣ:", image_models_menu()),
+            "menu:images:seedream": ("🌱 Seedream — Επίλεξε μοντέλο:", seedream_models_menu()),
+            "menu:images:nanobanana": ("🍌 Nano Banana — Επίλεξε μοντέλο:", nanobanana_models_menu()),
+            # Audio / Text / Jobs
+            "menu:audio": ("👇 Επίλεξε μοντέλο AI για ΗΧΟ:", audio_models_menu()),
+            "menu:text": ("👇 Επίλεξε μοντέλο AI για ΚΕΙΜΕΝΟ:", text_models_menu()),
+            "menu:jobs": ("💼 Εργασίες\n\nΕπίλεξε τι θέλεις να κάνεις:", jobs_menu()),
+        }
+    )
@@ -5,8 +5,8 @@ CREATE TABLE IF NOT EXISTS freelancer_profiles (
   display_name   TEXT,
   bio            TEXT,
   skills         TEXT,      -- comma separated for v1 (ή json later)
-  created_at     TIMESTAMP DEFAULT NOW(),
-  updated_at     TIMESTAMP DEFAULT NOW()
+  created_at     TIMESTAMPTZ DEFAULT NOW(),
+  updated_at     TIMESTAMPTZ DEFAULT NOW()
 );
 
 CREATE TABLE IF NOT EXISTS marketplace_jobs (
@@ -17,12 +17,11 @@ CREATE TABLE IF NOT EXISTS marketplace_jobs (
   budget_eur     NUMERIC(10,2),     -- optional
   deadline_days  INT,              -- optional
   status         TEXT NOT NULL DEFAULT 'open',  -- open|assigned|closed
-  created_at     TIMESTAMP DEFAULT NOW(),
-  updated_at     TIMESTAMP DEFAULT NOW()
+  created_at     TIMESTAMPTZ DEFAULT NOW(),
+  updated_at     TIMESTAMPTZ DEFAULT NOW()
 );
 
-CREATE INDEX IF NOT EXISTS idx_marketplace_jobs_status_created
-ON marketplace_jobs(status, created_at DESC);
+-- keyset index (status, created_at DESC, id DESC): στο db.run_migrations
 
 CREATE TABLE IF NOT EXISTS job_offers (
   id             UUID PRIMARY KEY,
@@ -31,7 +30,7 @@ CREATE TABLE IF NOT EXISTS job_offers (
   message        TEXT NOT NULL,
   price_eur      NUMERIC(10,2), -- optional
   status         TEXT NOT NULL DEFAULT 'sent',  -- sent|accepted|rejected
-  created_at     TIMESTAMP DEFAULT NOW()
+  created_at     TIMESTAMPTZ DEFAULT NOW()
 );
 
 CREATE INDEX IF NOT EXISTS idx_job_offers_job
@@ -11,6 +11,7 @@ import logging
 from typing import Any, Dict, Optional
 
 import httpx
+from ..core.metrics import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -57,7 +58,7 @@ def _join(base: str, path: str) -> str:
 
 async def create_kling_video_task(payload: dict, endpoint: str = "/v1/videos/text2video") -> str:
     url = _join(KLING_BASE_URL, endpoint)
-    async with httpx.AsyncClient(timeout=60) as client:
+    async with http_client(timeout=60) as client:
         r = await client.post(url, json=payload, headers=kling_headers())
         data = await _safe_json(r)
     if r.status_code != 200 or data.get("code") != 0:
@@ -70,7 +71,7 @@ async def create_kling_video_task(payload: dict, endpoint: str = "/v1/videos/tex
 
 async def poll_kling_video_task(task_id: str, endpoint: str = "/v1/videos/text2video") -> str:
     url = _join(KLING_BASE_URL, f"{endpoint}/{task_id}")
-    async with httpx.AsyncClient(timeout=60) as client:
+    async with http_client(timeout=60) as client:
         for _ in range(80):
             r = await client.get(url, headers=kling_headers())
             data = await _safe_json(r)
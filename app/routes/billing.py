@@ -1,9 +1,9 @@
 # app/routes/billing.py
 import hmac
 import json
+import asyncio
 import hashlib
 
-import httpx
 import stripe
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
@@ -16,9 +16,11 @@ from ..config import (
     CRYPTOCLOUD_WEBHOOK_SECRET,
     WEBAPP_URL,
 )
+from ..core import metrics, payments
 from ..core.telegram_auth import db_user_from_webapp
-from ..db import get_conn, add_credits_by_user_id, add_extra_credits_by_user_id, set_user_plan
+from ..db import create_order, set_order_provider_ref, record_payment_event
 from ..web_shared import packs_list, CREDITS_PACKS, SUBSCRIPTION_PLANS
+from ..core.metrics import http_client
 
 router = APIRouter()
 
@@ -48,6 +50,26 @@ def _all_valid_skus() -> set:
     return set(CREDITS_PACKS.keys()) | set(SUBSCRIPTION_PLANS.keys())
 
 
+async def _accept_event(provider: str, event_id: str, event_type: str, order_id, payload: dict) -> JSONResponse:
+    """
+    Γράφει το event στο payment_events και ξυπνάει το core.payments. Η εφαρμογή
+    (order paid + credits + πλάνο) γίνεται εκεί, σε ένα transaction. Τα retries
+    του provider με το ίδιο event_id απλώς επιστρέφουν 200.
+    """
+    new = await asyncio.to_thread(record_payment_event, provider, event_id, event_type, order_id, payload)
+    metrics.inc("payment_events_total", provider=provider, result="received" if new else "redelivered")
+    if new:
+        payments.wake()
+    return JSONResponse({"ok": True})
+
+
+def _order_id(value) -> int | None:
+    try:
+        return int(value) or None
+    except (TypeError, ValueError):
+        return None
+
+
 @router.post("/api/stripe/checkout")
 async def stripe_checkout(payload: dict):
     init_data = payload.get("initData", "")
@@ -63,28 +85,20 @@ async def stripe_checkout(payload: dict):
     if not WEBAPP_URL:
         raise HTTPException(500, "WEBAPP_URL missing")
 
-    dbu = db_user_from_webapp(init_data)
+    dbu = await asyncio.to_thread(db_user_from_webapp, init_data)
 
     kind = "subscription" if _is_subscription_sku(sku) else "credits"
 
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO orders (user_id, kind, sku, amount_eur, currency, status, provider)
-            VALUES (%s,%s,%s,%s,'EUR','pending','stripe')
-            RETURNING id
-            """,
-            (dbu["id"], kind, sku, pack["amount_eur"]),
-        )
-        order_id = cur.fetchone()["id"]
-        conn.commit()
+    order_id = await asyncio.to_thread(create_order, dbu["id"], kind, sku, pack["amount_eur"], "stripe")
 
     base = WEBAPP_URL.rstrip("/")
     title = pack.get("title") or pack.get("name", sku)
     desc = pack.get("desc", f"{pack.get('credits', 0)} credits")
 
-    session = stripe.checkout.Session.create(
+    # Το Stripe SDK είναι blocking (HTTP χωρίς await): σε thread για να μην
+    # σταματάει το event loop σε bursts αγορών.
+    session = await asyncio.to_thread(
+        stripe.checkout.Session.create,
         mode="payment",
         success_url=f"{base}/profile?success=1",
         cancel_url=f"{base}/profile?canceled=1",
@@ -101,10 +115,7 @@ async def stripe_checkout(payload: dict):
         metadata={"order_id": str(order_id), "sku": sku},
     )
 
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE orders SET provider_ref=%s WHERE id=%s", (session.id, order_id))
-        conn.commit()
+    await asyncio.to_thread(set_order_provider_ref, order_id, session.id)
 
     return {"url": session.url}
 
@@ -121,51 +132,14 @@ async def stripe_webhook(request: Request):
     except Exception:
         raise HTTPException(400, "Invalid webhook signature")
 
-    if event["type"] == "checkout.session.completed":
-        sess = event["data"]["object"]
-        meta = sess.get("metadata") or {}
-        order_id = int(meta.get("order_id", "0"))
-        sku = meta.get("sku", "")
-
-        pack = _get_pack(sku)
-        if not (order_id and pack):
-            return JSONResponse({"ok": True})
-
-        with get_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM orders WHERE id=%s FOR UPDATE", (order_id,))
-            order = cur.fetchone()
-
-            if not order or order["status"] == "paid":
-                conn.commit()
-                return JSONResponse({"ok": True})
-
-            cur.execute("UPDATE orders SET status='paid' WHERE id=%s", (order_id,))
-            conn.commit()
-
-        credits_amount = pack.get("credits", 0)
-
-        if _is_subscription_sku(sku):
-            # Subscription: add to plan credits + set plan
-            add_credits_by_user_id(
-                order["user_id"],
-                credits_amount,
-                f"Subscription {sku}",
-                "stripe",
-                order.get("provider_ref"),
-            )
-            set_user_plan(order["user_id"], sku)
-        else:
-            # Extra credits: add to extra_credits pool
-            add_extra_credits_by_user_id(
-                order["user_id"],
-                credits_amount,
-                f"Extra credits {sku}",
-                "stripe",
-                order.get("provider_ref"),
-            )
-
-    return JSONResponse({"ok": True})
+    meta = (event["data"]["object"].get("metadata") or {}) if event["type"] == "checkout.session.completed" else {}
+    return await _accept_event(
+        "stripe",
+        event["id"],
+        event["type"],
+        _order_id(meta.get("order_id")),
+        json.loads(payload),
+    )
 
 @router.post("/api/cryptocloud/invoice")
 async def cryptocloud_invoice(payload: dict):
@@ -180,26 +154,15 @@ async def cryptocloud_invoice(payload: dict):
     if not CRYPTOCLOUD_SHOP_ID:
         raise HTTPException(500, "CryptoCloud not configured: CRYPTOCLOUD_SHOP_ID missing")
 
-    dbu = db_user_from_webapp(init_data)
+    dbu = await asyncio.to_thread(db_user_from_webapp, init_data)
 
     kind = "subscription" if _is_subscription_sku(sku) else "credits"
     title = pack.get("title") or pack.get("name", sku)
     desc = pack.get("desc", f"{pack.get('credits', 0)} credits")
 
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO orders (user_id, kind, sku, amount_eur, currency, status, provider)
-            VALUES (%s,%s,%s,%s,'EUR','pending','cryptocloud')
-            RETURNING id
-            """,
-            (dbu["id"], kind, sku, pack["amount_eur"]),
-        )
-        order_id = cur.fetchone()["id"]
-        conn.commit()
+    order_id = await asyncio.to_thread(create_order, dbu["id"], kind, sku, pack["amount_eur"], "cryptocloud")
 
-    async with httpx.AsyncClient(timeout=20) as c:
+    async with http_client(timeout=20) as c:
         resp = await c.post(
             "https://api.cryptocloud.plus/v2/invoice/create",
             headers={"Authorization": f"Token {CRYPTOCLOUD_API_KEY}"},
@@ -218,10 +181,7 @@ async def cryptocloud_invoice(payload: dict):
     invoice_id = data["result"]["uuid"]
     pay_url = data["result"]["link"]
 
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE orders SET provider_ref=%s WHERE id=%s", (invoice_id, order_id))
-        conn.commit()
+    await asyncio.to_thread(set_order_provider_ref, order_id, invoice_id)
 
     return {"url": pay_url}
 
@@ -232,50 +192,18 @@ async def cryptocloud_webhook(request: Request):
 
     if CRYPTOCLOUD_WEBHOOK_SECRET:
         calc = hmac.new(CRYPTOCLOUD_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
-        if calc != signature:
+        if not hmac.compare_digest(calc, signature):
             raise HTTPException(400, "Bad signature")
 
-    payload = json.loads(body.decode())
-    order_id = int(payload.get("order_id", "0"))
-    status = payload.get("status")
-
-    if status == "paid" and order_id:
-        with get_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM orders WHERE id=%s FOR UPDATE", (order_id,))
-            order = cur.fetchone()
-
-            if not order or order["status"] == "paid":
-                conn.commit()
-                return JSONResponse({"ok": True})
-
-            sku = order["sku"]
-            pack = _get_pack(sku)
-            if not pack:
-                conn.commit()
-                return JSONResponse({"ok": True})
-
-            cur.execute("UPDATE orders SET status='paid' WHERE id=%s", (order_id,))
-            conn.commit()
-
-        credits_amount = pack.get("credits", 0)
-
-        if _is_subscription_sku(sku):
-            add_credits_by_user_id(
-                order["user_id"],
-                credits_amount,
-                f"Subscription {sku}",
-                "cryptocloud",
-                order.get("provider_ref"),
-            )
-            set_user_plan(order["user_id"], sku)
-        else:
-            add_extra_credits_by_user_id(
-                order["user_id"],
-                credits_amount,
-                f"Extra credits {sku}",
-                "cryptocloud",
-                order.get("provider_ref"),
-            )
-
-    return JSONResponse({"ok": True})
+    try:
+        payload = json.loads(body.decode())
+    except ValueError:
+        raise HTTPException(400, "Bad payload")
+    order_id = _order_id(payload.get("order_id"))
+    status = str(payload.get("status") or "")
+    # Το CryptoCloud δεν στέλνει id event: ένα postback ανά (invoice, status).
+    ref = payload.get("invoice_id") or order_id
+    if not ref:
+        raise HTTPException(400, "Bad payload")
+
+    return await _accept_event("cryptocloud", f"{ref}:{status}", status, order_id, payload)
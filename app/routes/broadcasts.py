@@ -0,0 +1,76 @@
+# app/routes/broadcasts.py
+"""Admin endpoints για μαζικά μηνύματα (core.broadcast).
+
+Opt-in: χωρίς ADMIN_TOKEN στο env απαντάνε 404. Header `X-Admin-Token`.
+"""
+import os
+import hmac
+import asyncio
+from typing import Any, Dict, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field
+
+from ..core import broadcast
+from ..db import get_broadcast, list_broadcasts, set_broadcast_status
+
+router = APIRouter(prefix="/admin/broadcasts", include_in_schema=False)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+
+# action -> (νέο status, από ποια status επιτρέπεται)
+_ACTIONS = {
+    "pause": ("paused", ("running",)),
+    "resume": ("running", ("paused",)),
+    "cancel": ("cancelled", ("running", "paused")),
+}
+
+
+def _require_token(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Not found")
+    got = request.headers.get("X-Admin-Token") or ""
+    if not hmac.compare_digest(got, ADMIN_TOKEN):
+        raise HTTPException(403, "Bad token")
+
+
+class BroadcastIn(BaseModel):
+    text: str = Field(..., min_length=1, max_length=4096)
+    parse_mode: Optional[Literal["HTML", "MarkdownV2"]] = None
+    reply_markup: Optional[Dict[str, Any]] = None
+
+
+@router.post("")
+async def create_broadcast(payload: BroadcastIn, request: Request):
+    _require_token(request)
+    row = await asyncio.to_thread(broadcast.create, payload.text, payload.parse_mode, payload.reply_markup)
+    return broadcast.status(row)
+
+
+@router.get("")
+async def get_broadcasts(request: Request, limit: int = 20):
+    _require_token(request)
+    rows = await asyncio.to_thread(list_broadcasts, max(1, min(limit, 100)))
+    return {"items": [broadcast.status(r) for r in rows]}
+
+
+@router.get("/{broadcast_id}")
+async def get_broadcast_status(broadcast_id: int, request: Request):
+    """Πρόοδος, ρυθμός αποστολής (msg/s, ζωντανά από το checkpoint) και ETA."""
+    _require_token(request)
+    row = await asyncio.to_thread(get_broadcast, broadcast_id)
+    if not row:
+        raise HTTPException(404, "Not found")
+    return broadcast.status(row)
+
+
+@router.post("/{broadcast_id}/{action}")
+async def change_broadcast(broadcast_id: int, action: str, request: Request):
+    _require_token(request)
+    if action not in _ACTIONS:
+        raise HTTPException(404, "Not found")
+    to, allowed = _ACTIONS[action]
+    row = await asyncio.to_thread(set_broadcast_status, broadcast_id, to, allowed)
+    if not row:
+        raise HTTPException(409, f"Cannot {action} this broadcast")
+    return broadcast.status(row)
@@ -0,0 +1,45 @@
+# app/routes/debug.py
+"""Διαγνωστικά endpoints: lag του event loop και on-demand sampling profiler.
+
+Το /debug/profile είναι opt-in: χωρίς DEBUG_TOKEN στο env απαντάει 404.
+"""
+import os
+import hmac
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from ..core.loop_monitor import loop_monitor
+
+router = APIRouter()
+
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "").strip()
+
+
+def _require_token(request: Request) -> None:
+    if not DEBUG_TOKEN:
+        raise HTTPException(404, "Not found")
+    got = request.headers.get("X-Debug-Token") or request.query_params.get("token") or ""
+    if not hmac.compare_digest(got, DEBUG_TOKEN):
+        raise HTTPException(403, "Bad token")
+
+
+@router.get("/metrics/loop")
+async def loop_metrics():
+    return loop_monitor.stats()
+
+
+@router.get("/debug/profile", include_in_schema=False)
+async def debug_profile(request: Request, seconds: float = 10, hz: int = 100, threads: str = "loop"):
+    """
+    Collapsed stacks για flamegraph:
+        curl -H "X-Debug-Token: ..." ".../debug/profile?seconds=15" > out.folded
+        flamegraph.pl out.folded > flame.svg   (ή άνοιγμα στο speedscope.app)
+    """
+    _require_token(request)
+    try:
+        folded = await asyncio.to_thread(loop_monitor.sample_stacks, seconds, hz, threads == "all")
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return PlainTextResponse(folded)
@@ -7,7 +7,6 @@ import logging
 import asyncio
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
@@ -15,9 +14,10 @@ from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
-from ..config import BOT_TOKEN
+from ..db import InsufficientCredits, set_last_result
+from ..config import BOT_TOKEN, TELEGRAM_API_BASE
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -68,13 +68,13 @@ async def _tg_send_audio(
     reply_markup: Optional[dict] = None,
 ) -> dict:
     """Send audio file to Telegram via sendAudio API."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendAudio"
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendAudio"
     data = {"chat_id": str(chat_id), "caption": caption}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
     files = {"audio": (filename, audio_bytes, mime)}
 
-    async with httpx.AsyncClient(timeout=120) as c:
+    async with http_client(timeout=120) as c:
         r = await c.post(url, data=data, files=files)
         j = r.json()
         if not j.get("ok"):
@@ -89,13 +89,13 @@ async def _tg_send_voice(
     reply_markup: Optional[dict] = None,
 ) -> dict:
     """Send voice message to Telegram via sendVoice API."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendVoice"
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendVoice"
     data = {"chat_id": str(chat_id), "caption": caption}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
     files = {"voice": ("voice.ogg", audio_bytes, "audio/ogg")}
 
-    async with httpx.AsyncClient(timeout=120) as c:
+    async with http_client(timeout=120) as c:
         r = await c.post(url, data=data, files=files)
         j = r.json()
         if not j.get("ok"):
@@ -103,6 +103,7 @@ async def _tg_send_voice(
         return j["result"]
 
 
+@track_job("elevenlabs")
 async def _run_elevenlabs_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -110,6 +111,7 @@ async def _run_elevenlabs_job(
     voice_id: str,
     output_format: str,
     cost: float,
+    hold_id: int,
 ) -> None:
     try:
         if not ELEVENLABS_API_KEY:
@@ -135,7 +137,7 @@ async def _run_elevenlabs_job(
             "Accept": f"audio/{ext}" if ext != "mp3" else "audio/mpeg",
         }
 
-        async with httpx.AsyncClient(timeout=120) as c:
+        async with http_client(timeout=120) as c:
             r = await c.post(tts_url, json=body, headers=headers)
 
         if r.status_code >= 400:
@@ -170,20 +172,11 @@ async def _run_elevenlabs_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during ElevenLabs job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund ElevenLabs fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/elevenlabs/generate")
@@ -220,14 +213,13 @@ async def elevenlabs_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(
+        hold_id = hold_credits(
             db_user_id, COST, f"ElevenLabs TTS ({len(text)} chars)", "elevenlabs", "eleven_multilingual_v2"
         )
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "\ud83c\udfa4 ElevenLabs: \u03a4\u03bf audio \u03b5\u03c4\u03bf\u03b9\u03bc\u03ac\u03b6\u03b5\u03c4\u03b1\u03b9\u2026")
@@ -242,6 +234,7 @@ async def elevenlabs_generate(
         voice_id,
         output_format,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
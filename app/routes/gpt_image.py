@@ -1,6 +1,5 @@
 # app/routes/gpt_image.py
 import os
-import base64
 import uuid
 
 from fastapi import APIRouter, BackgroundTasks
@@ -8,11 +7,13 @@ from openai import OpenAI
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
 
 from ..core.paths import IMAGES_DIR
+from ..core.codec import b64decode_async
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job
 
 router = APIRouter()
 
@@ -20,6 +21,7 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 
+@track_job("gpt_image")
 async def _run_gpt_image_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -27,6 +29,7 @@ async def _run_gpt_image_job(
     size: str,
     quality: str,
     cost: int,
+    hold_id: int,
 ):
     try:
         if client is None:
@@ -40,7 +43,7 @@ async def _run_gpt_image_job(
         )
 
         b64 = res.data[0].b64_json
-        img = base64.b64decode(b64)
+        img = await b64decode_async(b64)
 
         name = f"{uuid.uuid4().hex}.png"
         (IMAGES_DIR / name).write_bytes(img)
@@ -64,23 +67,10 @@ async def _run_gpt_image_job(
             mime_type="image/png",
             reply_markup=kb,
         )
+        capture_hold(hold_id)
 
     except Exception as e:
-        # 1) refund credits (best-effort)
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund GPT Image fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            pass
-
-        # 2) friendly greek message (no raw errors)
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            pass
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/gpt_image/generate")
@@ -114,14 +104,16 @@ async def gpt_image_generate(payload: dict, background_tasks: BackgroundTasks):
     db_user_id = int(dbu["id"])
 
     try:
-        spend_credits_by_user_id(db_user_id, COST, f"GPT Image ({quality})", "openai", "gpt-image-1.5")
-    except Exception:
+        hold_id = hold_credits(db_user_id, COST, f"GPT Image ({quality})", "openai", "gpt-image-1.5")
+    except InsufficientCredits:
         return {"ok": False, "error": "not_enough_credits"}
+    except Exception as e:
+        return {"ok": False, "error": str(e)[:200]}
 
     try:
         await tg_send_message(tg_chat_id, "🧪 Η εικόνα δημιουργείται… Το αποτέλεσμα θα έρθει εδώ.")
     except Exception:
         pass
 
-    background_tasks.add_task(_run_gpt_image_job, tg_chat_id, db_user_id, prompt, size, quality, COST)
+    background_tasks.add_task(_run_gpt_image_job, tg_chat_id, db_user_id, prompt, size, quality, COST, hold_id)
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
@@ -1,24 +1,23 @@
 import os
-import base64
 import uuid
 import asyncio
 import logging
 from pathlib import Path
 
-import httpx
 from fastapi import APIRouter, HTTPException, Request, BackgroundTasks
 from fastapi.responses import FileResponse, JSONResponse
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
 from ..core.paths import STATIC_DIR
+from ..core.codec import b64decode_async
 from ..web_shared import public_base_url
 from ..db import (
-    spend_credits_by_user_id,
-    add_credits_by_user_id,
+    InsufficientCredits,
     set_last_result,
 )
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -58,12 +57,14 @@ def _extract_image(data: dict):
 # ──────────────────────────────────
 # IMAGE generation job
 # ──────────────────────────────────
+@track_job("grok_image")
 async def _run_grok_image_job(
     tg_chat_id: int,
     db_user_id: int,
     prompt: str,
     aspect_ratio: str,
     cost: float,
+    hold_id: int,
 ):
     try:
         if not XAI_API_KEY:
@@ -83,7 +84,7 @@ async def _run_grok_image_job(
             "Content-Type": "application/json",
         }
 
-        async with httpx.AsyncClient(timeout=120) as c:
+        async with http_client(timeout=120) as c:
             r = await c.post(
                 "https://api.x.ai/v1/images/generations",
                 json=body,
@@ -108,9 +109,9 @@ async def _run_grok_image_job(
         kind, value = img
 
         if kind == "b64":
-            img_bytes = base64.b64decode(value)
+            img_bytes = await b64decode_async(value)
         elif kind == "url":
-            async with httpx.AsyncClient() as c:
+            async with http_client() as c:
                 img_bytes = (await c.get(value)).content
 
         IMAGES_DIR.mkdir(parents=True, exist_ok=True)
@@ -137,15 +138,17 @@ async def _run_grok_image_job(
             mime_type="image/png",
             reply_markup=kb,
         )
+        capture_hold(hold_id)
 
     except Exception as e:
         logger.exception("Error during Grok image job")
-        _handle_grok_error(tg_chat_id, db_user_id, cost, e)
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 # ──────────────────────────────────
 # VIDEO generation job
 # ──────────────────────────────────
+@track_job("grok_video")
 async def _run_grok_video_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -153,6 +156,7 @@ async def _run_grok_video_job(
     aspect_ratio: str,
     image_data_url: str | None,
     cost: float,
+    hold_id: int,
 ):
     try:
         if not XAI_API_KEY:
@@ -176,7 +180,7 @@ async def _run_grok_video_job(
             body["image"] = {"url": image_data_url}
 
         # Step 1: create generation request
-        async with httpx.AsyncClient(timeout=120) as c:
+        async with http_client(timeout=120) as c:
             r = await c.post(
                 "https://api.x.ai/v1/videos/generations",
                 json=body,
@@ -205,7 +209,7 @@ async def _run_grok_video_job(
         elapsed = 0
         interval = 5
 
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             while elapsed < max_wait:
                 await asyncio.sleep(interval)
                 elapsed += interval
@@ -231,7 +235,7 @@ async def _run_grok_video_job(
             raise RuntimeError("xAI video generation timed out")
 
         # Step 3: download video
-        async with httpx.AsyncClient(timeout=120) as c:
+        async with http_client(timeout=120) as c:
             vr = await c.get(video_url)
             video_bytes = vr.content
 
@@ -258,26 +262,11 @@ async def _run_grok_video_job(
             caption="✅ Grok Video: Έτοιμο",
             reply_markup=kb,
         )
+        capture_hold(hold_id)
 
     except Exception as e:
         logger.exception("Error during Grok video job")
-        await _handle_grok_error(tg_chat_id, db_user_id, cost, e)
-
-
-async def _handle_grok_error(tg_chat_id, db_user_id, cost, e):
-    refunded = None
-    try:
-        add_credits_by_user_id(db_user_id, cost, "Refund Grok fail", "system", None)
-        refunded = float(cost)
-    except Exception:
-        logger.exception("Error refunding credits")
-
-    try:
-        reason, tips = map_provider_error_to_gr(str(e))
-        msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-        await tg_send_message(tg_chat_id, msg)
-    except Exception:
-        logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/grok/generate")
@@ -312,13 +301,12 @@ async def grok_generate(request: Request, background_tasks: BackgroundTasks):
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(db_user_id, COST, f"Grok {mode}", "xai", "grok-imagine")
+        hold_id = hold_credits(db_user_id, COST, f"Grok {mode}", "xai", "grok-imagine")
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        logger.error(f"spend_credits failed: {msg}")
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        logger.error(f"hold_credits failed: {e}")
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     if mode == "text_to_image":
         try:
@@ -333,6 +321,7 @@ async def grok_generate(request: Request, background_tasks: BackgroundTasks):
             prompt,
             aspect_ratio,
             COST,
+            hold_id,
         )
 
     elif mode in ("text_to_video", "image_to_video"):
@@ -353,6 +342,7 @@ async def grok_generate(request: Request, background_tasks: BackgroundTasks):
             aspect_ratio,
             image_data_url,
             COST,
+            hold_id,
         )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
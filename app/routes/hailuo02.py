@@ -6,7 +6,6 @@ import logging
 import asyncio
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
@@ -14,8 +13,9 @@ from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -43,6 +43,7 @@ def _compute_cost(has_start_image: bool, has_end_image: bool) -> float:
     return base
 
 
+@track_job("hailuo02")
 async def _run_hailuo_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -51,6 +52,7 @@ async def _run_hailuo_job(
     end_image_b64: Optional[str],
     optimize_prompt: bool,
     cost: float,
+    hold_id: int,
 ) -> None:
     try:
         headers = _hailuo_headers()
@@ -66,7 +68,7 @@ async def _run_hailuo_job(
             body["last_frame_image"] = f"data:image/png;base64,{end_image_b64}"
 
         # 1) Create task
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await c.post(
                 f"{HAILUO_BASE_URL}/video_generation",
                 json=body,
@@ -88,7 +90,7 @@ async def _run_hailuo_job(
         # 2) Poll until done
         poll_url = f"{HAILUO_BASE_URL}/video_generation/{task_id}"
         for _ in range(240):  # ~8 min at 2s
-            async with httpx.AsyncClient(timeout=30) as c:
+            async with http_client(timeout=30) as c:
                 pr = await c.get(poll_url, headers=_hailuo_headers())
 
             try:
@@ -120,7 +122,7 @@ async def _run_hailuo_job(
         if not video_url.startswith("http"):
             video_url = f"{HAILUO_BASE_URL}/files/retrieve?file_id={video_url}"
 
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             dl_headers = _hailuo_headers()
             vr = await c.get(video_url, headers=dl_headers)
             if vr.status_code >= 400:
@@ -148,20 +150,11 @@ async def _run_hailuo_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Hailuo job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Hailuo fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/hailuo02/generate")
@@ -202,12 +195,11 @@ async def hailuo02_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(db_user_id, COST, "Hailuo AI Video", "hailuo", "T2V-01")
+        hold_id = hold_credits(db_user_id, COST, "Hailuo AI Video", "hailuo", "T2V-01")
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "\ud83c\udfac Hailuo AI: \u03a4\u03bf \u03b2\u03af\u03bd\u03c4\u03b5\u03bf \u03b5\u03c4\u03bf\u03b9\u03bc\u03ac\u03b6\u03b5\u03c4\u03b1\u03b9\u2026")
@@ -223,6 +215,7 @@ async def hailuo02_generate(
         end_b64,
         opt_prompt,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
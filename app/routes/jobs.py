@@ -1,16 +1,18 @@
 # app/routes/jobs.py
 from __future__ import annotations
 
+import asyncio
 from typing import Optional
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
 from ..core.telegram_auth import db_user_from_webapp
-from ..core.telegram_client import tg_send_message
+from ..core import notifications
 from ..db import (
     get_user,
     create_marketplace_job,
-    list_marketplace_jobs,
+    get_marketplace_jobs_page,
     get_marketplace_job,
     get_my_marketplace_jobs,
     create_job_offer,
@@ -67,12 +69,29 @@ async def api_create_job(payload: JobCreateIn):
 
 
 # =========================================================
-# API: List Open Jobs
+# API: List Open Jobs (cursor + αναζήτηση + φίλτρα)
 # =========================================================
 @router.get("/jobs")
-async def api_list_jobs(limit: int = 20):
-    jobs = list_marketplace_jobs(status="open", limit=limit)
-    return {"ok": True, "items": [_serialize_job(j) for j in jobs]}
+async def api_list_jobs(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    min_budget: Optional[float] = None,
+    max_budget: Optional[float] = None,
+    max_deadline_days: Optional[int] = None,
+):
+    try:
+        page = await asyncio.to_thread(
+            get_marketplace_jobs_page,
+            "open", limit, cursor, q, min_budget, max_budget, max_deadline_days,
+        )
+    except ValueError:
+        return JSONResponse({"ok": False, "error": "bad_cursor"}, status_code=400)
+    return {
+        "ok": True,
+        "items": [_serialize_job(j) for j in page["items"]],
+        "next_cursor": page["next_cursor"],
+    }
 
 
 # =========================================================
@@ -90,7 +109,7 @@ async def api_get_job(job_id: str):
 # API: Send Offer
 # =========================================================
 @router.post("/jobs/{job_id}/offer")
-async def api_send_offer(job_id: str, payload: OfferCreateIn, background_tasks: BackgroundTasks):
+async def api_send_offer(job_id: str, payload: OfferCreateIn):
     dbu = db_user_from_webapp(payload.initData)
     freelancer_id = int(dbu["id"])
 
@@ -112,12 +131,15 @@ async def api_send_offer(job_id: str, payload: OfferCreateIn, background_tasks:
         price_eur=payload.price_eur,
     )
 
-    # Notify job poster via Telegram
-    background_tasks.add_task(
-        _notify_new_offer,
-        job=job,
-        offer=offer,
+    # Ειδοποίηση του πελάτη μέσω της ουράς (σύνοψη αν έρθουν πολλές μαζί)
+    await asyncio.to_thread(
+        notifications.new_offer,
+        client_tg_id=int(job["tg_user_id"]),
+        job_title=job["title"],
+        offer_id=offer["id"],
         freelancer_name=dbu.get("tg_first_name") or dbu.get("tg_username") or "Freelancer",
+        message=offer["message"],
+        price_eur=offer.get("price_eur"),
     )
 
     return {"ok": True, "offer_id": str(offer["id"])}
@@ -146,7 +168,7 @@ async def api_list_offers(job_id: str, payload: InitDataIn):
 # API: Accept Offer (owner only)
 # =========================================================
 @router.post("/offers/{offer_id}/accept")
-async def api_accept_offer(offer_id: str, payload: InitDataIn, background_tasks: BackgroundTasks):
+async def api_accept_offer(offer_id: str, payload: InitDataIn):
     dbu = db_user_from_webapp(payload.initData)
     user_id = int(dbu["id"])
 
@@ -159,10 +181,10 @@ async def api_accept_offer(offer_id: str, payload: InitDataIn, background_tasks:
         return {"ok": False, "error": "not_owner"}
 
     # Notify freelancer
-    background_tasks.add_task(
-        _notify_offer_accepted,
-        result=result,
-    )
+    if result.get("status") == "accepted" and result.get("freelancer_tg_id"):
+        await asyncio.to_thread(
+            notifications.offer_accepted, int(result["freelancer_tg_id"]), result.get("job_title") or "—"
+        )
 
     return {"ok": True}
 
@@ -218,43 +240,3 @@ def _serialize_offer(o: dict) -> dict:
         "job_status": o.get("job_status", ""),
         "created_at": str(o.get("created_at", "")),
     }
-
-
-async def _notify_new_offer(job: dict, offer: dict, freelancer_name: str):
-    """Send Telegram notification to job poster about new offer."""
-    try:
-        client_tg_id = int(job["tg_user_id"])
-        price_text = f"\n💰 Τιμή: {float(offer['price_eur']):.0f}€" if offer.get("price_eur") else ""
-        text = (
-            f"📩 Νέα πρόταση στην αγγελία σου!\n\n"
-            f"📋 {job['title']}\n"
-            f"👤 Από: {freelancer_name}\n"
-            f"💬 {offer['message']}"
-            f"{price_text}\n\n"
-            f"Μπες στις Εργασίες για να δεις & αποδεχτείς."
-        )
-
-        kb = {
-            "inline_keyboard": [
-                [{"text": "✅ Αποδοχή", "callback_data": f"jobs:accept:{offer['id']}"}]
-            ]
-        }
-
-        await tg_send_message(client_tg_id, text, reply_markup=kb)
-    except Exception as e:
-        print(f"[jobs] notify_new_offer error: {e}", flush=True)
-
-
-async def _notify_offer_accepted(result: dict):
-    """Send Telegram notification to freelancer when offer is accepted."""
-    try:
-        freelancer_tg_id = int(result["freelancer_tg_id"])
-        job_title = result.get("job_title", "—")
-        text = (
-            f"✅ Η πρότασή σου έγινε δεκτή!\n\n"
-            f"📋 Εργασία: {job_title}\n\n"
-            f"Επικοινώνησε με τον πελάτη για τις λεπτομέρειες."
-        )
-        await tg_send_message(freelancer_tg_id, text)
-    except Exception as e:
-        print(f"[jobs] notify_offer_accepted error: {e}", flush=True)
@@ -2,7 +2,6 @@
 """Kling V2-6 Motion Brush v2 – image + motion brush to video (variant 2)"""
 import os, uuid, logging
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 
@@ -10,9 +9,10 @@ from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
 from ._kling_shared import create_kling_video_task, poll_kling_video_task, kling_headers
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -32,17 +32,19 @@ def _calc_cost(duration: int, mode: str) -> float:
 # -------------------------
 # BACKGROUND JOB
 # -------------------------
+@track_job("kling26motion2")
 async def _run_kling26motion2_job(
     tg_chat_id: int,
     db_user_id: int,
     payload: dict,
     cost: float,
+    hold_id: int,
 ):
     try:
         task_id = await create_kling_video_task(payload, ENDPOINT)
         video_url = await poll_kling_video_task(task_id, ENDPOINT)
 
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             vd = await c.get(video_url)
             if vd.status_code >= 400:
                 raise RuntimeError(f"Video download error {vd.status_code}")
@@ -71,20 +73,11 @@ async def _run_kling26motion2_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Kling 2.6 Motion2 fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 # -------------------------
@@ -121,12 +114,11 @@ async def kling26motion2_generate(request: Request, background_tasks: Background
         return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
-        spend_credits_by_user_id(db_user_id, COST, f"Kling 2.6 Motion v2 ({duration}s,{mode})", "kling", MODEL)
+        hold_id = hold_credits(db_user_id, COST, f"Kling 2.6 Motion v2 ({duration}s,{mode})", "kling", MODEL)
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     payload = {
         "model_name": MODEL,
@@ -148,6 +140,7 @@ async def kling26motion2_generate(request: Request, background_tasks: Background
         db_user_id,
         payload,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
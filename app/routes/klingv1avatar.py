@@ -1,19 +1,21 @@
 # app/routes/klingv1avatar.py
 """Kling V1 Avatar – face image to talking-head video"""
-import os, uuid, base64, logging
+import os, uuid, logging
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
+from ..core.codec import to_data_url_async
+from ..core.images import normalize_image, UnsupportedImage
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
 from ._kling_shared import create_kling_video_task, poll_kling_video_task, kling_headers
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -27,29 +29,22 @@ def _calc_cost(duration: int) -> float:
     return 32.0 if duration >= 10 else 16.0
 
 
-def _guess_mime(filename: str) -> str:
-    f = (filename or "").lower()
-    if f.endswith(".jpg") or f.endswith(".jpeg"):
-        return "image/jpeg"
-    if f.endswith(".webp"):
-        return "image/webp"
-    return "image/png"
-
-
 # -------------------------
 # BACKGROUND JOB
 # -------------------------
+@track_job("klingv1avatar")
 async def _run_klingv1avatar_job(
     tg_chat_id: int,
     db_user_id: int,
     payload: dict,
     cost: float,
+    hold_id: int,
 ):
     try:
         task_id = await create_kling_video_task(payload, ENDPOINT)
         video_url = await poll_kling_video_task(task_id, ENDPOINT)
 
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             vd = await c.get(video_url)
             if vd.status_code >= 400:
                 raise RuntimeError(f"Video download error {vd.status_code}")
@@ -78,20 +73,11 @@ async def _run_klingv1avatar_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Kling V1 Avatar fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 # -------------------------
@@ -129,25 +115,23 @@ async def klingv1avatar_generate(
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
-    try:
-        spend_credits_by_user_id(db_user_id, COST, f"Kling V1 Avatar ({duration}s)", "kling", MODEL)
-    except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
-
+    # έλεγχος input πριν δεσμευτούν credits
     face_bytes = await face_image.read()
     if not face_bytes:
-        try:
-            add_credits_by_user_id(db_user_id, COST, "Refund Kling Avatar empty image", "system", None)
-        except Exception:
-            logger.exception("Refund failed")
         return JSONResponse({"ok": False, "error": "empty_face_image"}, status_code=400)
+    try:
+        face_bytes, mime = await normalize_image(face_bytes, "kling_avatar")
+    except UnsupportedImage:
+        return JSONResponse({"ok": False, "error": "unsupported_image"}, status_code=400)
+
+    try:
+        hold_id = hold_credits(db_user_id, COST, f"Kling V1 Avatar ({duration}s)", "kling", MODEL)
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
-    mime = _guess_mime(face_image.filename or "face.png")
-    b64 = base64.b64encode(face_bytes).decode("utf-8")
-    face_data_url = f"data:{mime};base64,{b64}"
+    face_data_url = await to_data_url_async(face_bytes, mime)
 
     payload = {
         "model_name": MODEL,
@@ -169,6 +153,7 @@ async def klingv1avatar_generate(
         db_user_id,
         payload,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
@@ -1,13 +1,16 @@
 # app/routes/me.py
 import time
+import asyncio
 from typing import Dict, Optional, Tuple
 
-import httpx
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 
 from ..web_shared import packs_list, plans_list, SUBSCRIPTION_PLANS
 from ..core.telegram_auth import db_user_from_webapp, verify_telegram_init_data
-from ..config import BOT_TOKEN
+from ..config import BOT_TOKEN, TELEGRAM_API_BASE
+from ..db import get_ledger_page, get_monthly_statements
+from ..core.metrics import http_client
 
 router = APIRouter()
 
@@ -44,6 +47,76 @@ async def me(payload: dict):
         "plans": plans_list(),
     }
 
+
+# ----------------------
+# Ιστορικό credits (keyset pagination)
+# ----------------------
+def _money(x) -> float:
+    return float(x or 0)
+
+
+def _limit(payload: dict, default: int) -> Optional[int]:
+    try:
+        return int(payload.get("limit") or default)
+    except (TypeError, ValueError):
+        return None
+
+
+@router.post("/api/me/ledger")
+async def me_ledger(payload: dict):
+    dbu = db_user_from_webapp(payload.get("initData", ""))
+    limit = _limit(payload, 50)
+    if limit is None:
+        return JSONResponse({"ok": False, "error": "bad_limit"}, status_code=400)
+    try:
+        page = await asyncio.to_thread(get_ledger_page, int(dbu["id"]), limit, payload.get("cursor"))
+    except ValueError:
+        return JSONResponse({"ok": False, "error": "bad_cursor"}, status_code=400)
+
+    return {
+        "ok": True,
+        "items": [
+            {
+                "id": r["id"],
+                "delta": _money(r["delta"]),
+                "balance_after": _money(r["balance_after"]),
+                "reason": r["reason"],
+                "provider": r["provider"],
+                "created_at": r["created_at"].isoformat(),
+            }
+            for r in page["items"]
+        ],
+        "next_cursor": page["next_cursor"],
+    }
+
+
+@router.post("/api/me/statements")
+async def me_statements(payload: dict):
+    dbu = db_user_from_webapp(payload.get("initData", ""))
+    limit = _limit(payload, 12)
+    if limit is None:
+        return JSONResponse({"ok": False, "error": "bad_limit"}, status_code=400)
+    try:
+        rows = await asyncio.to_thread(get_monthly_statements, int(dbu["id"]), limit, payload.get("before"))
+    except ValueError:
+        return JSONResponse({"ok": False, "error": "bad_month"}, status_code=400)
+
+    return {
+        "ok": True,
+        "items": [
+            {
+                "month": r["month"].strftime("%Y-%m"),
+                "opening_balance": _money(r["opening_balance"]),
+                "credits_in": _money(r["credits_in"]),
+                "credits_out": _money(r["credits_out"]),
+                "closing_balance": _money(r["closing_balance"]),
+                "entries": r["entries"],
+            }
+            for r in rows
+        ],
+        "next_before": rows[-1]["month"].strftime("%Y-%m") if rows else None,
+    }
+
 # ----------------------
 # Telegram avatar
 # ----------------------
@@ -53,8 +126,8 @@ _AVATAR_TTL_SECONDS = 60 * 30
 async def _get_telegram_file_url(file_id: str) -> Optional[str]:
     if not file_id:
         return None
-    base = f"https://api.telegram.org/bot{BOT_TOKEN}"
-    async with httpx.AsyncClient(timeout=15) as c:
+    base = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}"
+    async with http_client(timeout=15) as c:
         r = await c.get(f"{base}/getFile", params={"file_id": file_id})
         data = r.json()
         if not data.get("ok"):
@@ -65,8 +138,8 @@ async def _get_telegram_file_url(file_id: str) -> Optional[str]:
         return f"{base}/file/{file_path}"
 
 async def _fetch_telegram_avatar_url(tg_user_id: int) -> Optional[str]:
-    base = f"https://api.telegram.org/bot{BOT_TOKEN}"
-    async with httpx.AsyncClient(timeout=15) as c:
+    base = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}"
+    async with http_client(timeout=15) as c:
         r = await c.get(f"{base}/getUserProfilePhotos", params={"user_id": tg_user_id, "limit": 1})
         data = r.json()
         if not data.get("ok"):
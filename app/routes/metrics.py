@@ -0,0 +1,21 @@
+# app/routes/metrics.py
+import os
+import hmac
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from ..core.metrics import render_prometheus
+
+router = APIRouter()
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(403, "Bad token")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,25 +1,26 @@
 # app/routes/nanobanana.py
 import os
-import base64
 import uuid
 import logging
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, Request
 from fastapi.responses import JSONResponse, HTMLResponse
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import IMAGES_DIR, BASE_DIR
+from ..core.codec import split_data_url, b64decode_async, b64encode_async
+from ..core.images import normalize_image, UnsupportedImage
+from ..config import GEMINI_API_BASE
 from ..web_shared import public_base_url
 
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
 from ..db import (
-    spend_credits_by_user_id,
-    add_credits_by_user_id,
+    InsufficientCredits,
     set_last_result,
 )
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -67,28 +68,38 @@ def _extract_gemini_image_b64(data: dict) -> Optional[str]:
     return None
 
 
+async def _prepare_image_parts(images_data_urls: list[str]) -> list[dict]:
+    """Data URLs -> Gemini inlineData parts (downscaled, μία φορά ανά job)."""
+    parts = []
+    for du in (images_data_urls or [])[:8]:
+        parsed = split_data_url(du)
+        if not parsed:
+            continue
+        mime, b64 = parsed
+
+        try:
+            img, mime = await normalize_image(await b64decode_async(b64), "nanobanana")
+            b64 = await b64encode_async(img)
+        except UnsupportedImage:
+            raise
+        except Exception:
+            logger.warning("NanoBanana: could not decode input image, sending as-is")
+
+        # your file used inlineData (camelCase) — keep it consistent
+        parts.append({"inlineData": {"mimeType": mime, "data": b64}})
+    return parts
+
+
 async def _gemini_generate_one_image(
     prompt: str,
-    images_data_urls: list[str],
+    image_parts: list[dict],
     aspect_ratio: str,
     image_size: str,
 ) -> bytes:
     if not GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY missing (set it in Railway env)")
 
-    parts = [{"text": prompt}]
-
-    for du in (images_data_urls or [])[:8]:
-        if not isinstance(du, str):
-            continue
-        if not du.startswith("data:") or "base64," not in du:
-            continue
-
-        head, b64 = du.split("base64,", 1)
-        mime = head.split(";")[0].replace("data:", "").strip() or "image/png"
-
-        # your file used inlineData (camelCase) — keep it consistent
-        parts.append({"inlineData": {"mimeType": mime, "data": b64.strip()}})
+    parts = [{"text": prompt}, *image_parts]
 
     body = {
         "contents": [{"parts": parts}],
@@ -102,9 +113,9 @@ async def _gemini_generate_one_image(
     }
 
     model = _gemini_model_name()
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+    url = f"{GEMINI_API_BASE}/models/{model}:generateContent"
 
-    async with httpx.AsyncClient(timeout=120) as c:
+    async with http_client(timeout=120) as c:
         r = await c.post(
             url,
             headers={
@@ -129,9 +140,10 @@ async def _gemini_generate_one_image(
     if not img_b64:
         raise RuntimeError("Gemini did not return image data")
 
-    return base64.b64decode(img_b64)
+    return await b64decode_async(img_b64)
 
 
+@track_job("nanobanana")
 async def _run_nanobanana_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -139,9 +151,10 @@ async def _run_nanobanana_job(
     aspect_ratio: str,
     image_size: str,
     output_format: str,
-    images_data_urls: list[str],
+    image_parts: list[dict],
     n_images: int,
     total_cost: float,
+    hold_id: int,
 ):
     try:
         ext = "png" if output_format.lower() == "png" else "jpg"
@@ -150,7 +163,7 @@ async def _run_nanobanana_job(
         for idx in range(1, n_images + 1):
             img_bytes = await _gemini_generate_one_image(
                 prompt=prompt,
-                images_data_urls=images_data_urls,
+                image_parts=image_parts,
                 aspect_ratio=aspect_ratio,
                 image_size=image_size,
             )
@@ -181,25 +194,11 @@ async def _run_nanobanana_job(
         if last_public_url:
             set_last_result(db_user_id, "nanobanana", last_public_url)
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during NanoBanana job")
-
-        refunded = None
-
-        # refund όλο το ποσό αν κάτι πάει λάθος
-        try:
-            add_credits_by_user_id(db_user_id, total_cost, "Refund NanoBanana fail", "system", None)
-            refunded = float(total_cost)
-        except Exception:
-            logger.exception("Error refunding credits")
-
-        # ίδιο message format με Grok / NB Pro
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(total_cost), raw_error=str(e))
 
 
 @router.post("/api/nanobanana/generate")
@@ -253,13 +252,18 @@ async def nanobanana_generate(request: Request, background_tasks: BackgroundTask
     except Exception:
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
+    # πριν το hold: μια εικόνα που δεν διαβάζεται απορρίπτεται χωρίς χρέωση
+    try:
+        image_parts = await _prepare_image_parts(images_data_urls)
+    except UnsupportedImage:
+        return JSONResponse({"ok": False, "error": "unsupported_image"}, status_code=400)
+
     try:
-        spend_credits_by_user_id(db_user_id, TOTAL_COST, "Banana AI", "gemini", _gemini_model_name())
+        hold_id = hold_credits(db_user_id, TOTAL_COST, "Banana AI", "gemini", _gemini_model_name())
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, f"🍌 Banana AI: Φτιάχνω {n_images} εικόνα/ες…")
@@ -274,9 +278,10 @@ async def nanobanana_generate(request: Request, background_tasks: BackgroundTask
         aspect_ratio,
         image_size,
         output_format,
-        images_data_urls,
+        image_parts,
         n_images,
         TOTAL_COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": TOTAL_COST, "n_images": n_images}
@@ -1,24 +1,26 @@
 # app/routes/nanobanana_pro.py
 import os
-import base64
 import uuid
 import logging
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, Request
 from fastapi.responses import JSONResponse
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import IMAGES_DIR
+from ..core.codec import b64decode_async
+from ..core.images import UnsupportedImage
+from ..config import GEMINI_API_BASE
 from ..web_shared import public_base_url
 
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
 from ..db import (
-    spend_credits_by_user_id,
-    add_credits_by_user_id,
+    InsufficientCredits,
     set_last_result,
 )
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from .nanobanana import _prepare_image_parts
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -43,6 +45,7 @@ def _extract_gemini_image_b64(data: dict) -> str | None:
     return None
 
 
+@track_job("nanobanana_pro")
 async def _run_nanobanana_pro_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -50,25 +53,15 @@ async def _run_nanobanana_pro_job(
     aspect_ratio: str,
     image_size: str,
     output_format: str,
-    images_data_urls: list[str],
+    image_parts: list[dict],
     cost: float,
+    hold_id: int,
 ):
     try:
         if not GEMINI_API_KEY:
             raise RuntimeError("GEMINI_API_KEY missing (set it in Railway env)")
 
-        parts = [{"text": prompt}]
-
-        # images_data_urls: ["data:image/png;base64,...", ...]
-        for du in images_data_urls[:8]:
-            if not isinstance(du, str):
-                continue
-            if not du.startswith("data:") or "base64," not in du:
-                continue
-
-            head, b64 = du.split("base64,", 1)
-            mime = head.split(";")[0].replace("data:", "").strip() or "image/png"
-            parts.append({"inline_data": {"mime_type": mime, "data": b64.strip()}})
+        parts = [{"text": prompt}, *image_parts]
 
         body = {
             "contents": [{"parts": parts}],
@@ -82,9 +75,9 @@ async def _run_nanobanana_pro_job(
         }
 
         model = _gemini_model_name()
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+        url = f"{GEMINI_API_BASE}/models/{model}:generateContent"
 
-        async with httpx.AsyncClient(timeout=120) as c:
+        async with http_client(timeout=120) as c:
             r = await c.post(url, params={"key": GEMINI_API_KEY}, json=body)
 
         try:
@@ -102,7 +95,7 @@ async def _run_nanobanana_pro_job(
         if not img_b64:
             raise RuntimeError("Gemini did not return image data")
 
-        img_bytes = base64.b64decode(img_b64)
+        img_bytes = await b64decode_async(img_b64)
 
         ext = "png" if output_format.lower() == "png" else "jpg"
         name = f"nbpro_{uuid.uuid4().hex}.{ext}"
@@ -128,25 +121,11 @@ async def _run_nanobanana_pro_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during NanoBananaPro job")
-
-        refunded = None
-
-        # refund credits
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund NanoBananaPro fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Error refunding credits")
-
-        # map error → greek reason/tips + send friendly message (same format as Grok)
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/nanobanana-pro/generate")
@@ -183,13 +162,18 @@ async def nanobanana_pro_generate(request: Request, background_tasks: Background
     except Exception:
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
+    # πριν το hold: μια εικόνα που δεν διαβάζεται απορρίπτεται χωρίς χρέωση
+    try:
+        image_parts = await _prepare_image_parts(images_data_urls)
+    except UnsupportedImage:
+        return JSONResponse({"ok": False, "error": "unsupported_image"}, status_code=400)
+
     try:
-        spend_credits_by_user_id(db_user_id, COST, "Nano Banana Pro", "gemini", _gemini_model_name())
+        hold_id = hold_credits(db_user_id, COST, "Nano Banana Pro", "gemini", _gemini_model_name())
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "🍌 Nano Banana Pro: Η εικόνα ετοιμάζεται…")
@@ -204,8 +188,9 @@ async def nanobanana_pro_generate(request: Request, background_tasks: Background
         aspect_ratio,
         image_size,
         output_format,
-        images_data_urls,
+        image_parts,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
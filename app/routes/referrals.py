@@ -24,6 +24,8 @@ async def ref_list(payload: dict):
             "code": x["code"],
             "url": f"https://t.me/veolumi_bot?start=ref_{x['code']}",
             "invited": int(x["starts"] or 0),
+            "purchases": int(x["purchases"] or 0),
             "purchased_eur": float(x["purchases_amount"] or 0),
+            "earned_eur": float(x["earnings_eur"] or 0),
         })
     return {"ok": True, "items": out, "limit": 10}
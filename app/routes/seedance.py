@@ -6,7 +6,6 @@ import logging
 import asyncio
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
@@ -14,8 +13,9 @@ from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -43,6 +43,7 @@ def _compute_cost(quality: str, duration: int) -> float:
     return round(base * multiplier, 2)
 
 
+@track_job("seedance")
 async def _run_seedance_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -52,6 +53,7 @@ async def _run_seedance_job(
     duration: int,
     camera_lock: bool,
     cost: float,
+    hold_id: int,
 ) -> None:
     try:
         headers = _seedance_headers()
@@ -65,7 +67,7 @@ async def _run_seedance_job(
         }
 
         # 1) Create generation
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await c.post(f"{SEEDANCE_API_URL}/generations", json=body, headers=headers)
 
         try:
@@ -83,7 +85,7 @@ async def _run_seedance_job(
         # 2) Poll until done
         poll_url = f"{SEEDANCE_API_URL}/generations/{task_id}"
         for _ in range(180):  # ~6 min at 2s
-            async with httpx.AsyncClient(timeout=30) as c:
+            async with http_client(timeout=30) as c:
                 pr = await c.get(poll_url, headers=_seedance_headers())
 
             try:
@@ -110,7 +112,7 @@ async def _run_seedance_job(
         if not video_url:
             raise RuntimeError(f"No video URL in response: {status_data}")
 
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             vr = await c.get(video_url)
             if vr.status_code >= 400:
                 raise RuntimeError(f"Video download error {vr.status_code}")
@@ -137,20 +139,11 @@ async def _run_seedance_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Seedance job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Seedance fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/seedance/generate")
@@ -189,14 +182,13 @@ async def seedance_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(
+        hold_id = hold_credits(
             db_user_id, COST, f"Seedance ({quality},{dur}s)", "seedance", "seedance-v1"
         )
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "\ud83c\udfac Seedance: \u03a4\u03bf \u03b2\u03af\u03bd\u03c4\u03b5\u03bf \u03b5\u03c4\u03bf\u03b9\u03bc\u03ac\u03b6\u03b5\u03c4\u03b1\u03b9\u2026")
@@ -213,6 +205,7 @@ async def seedance_generate(
         dur,
         cam_lock,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
@@ -6,7 +6,6 @@ import logging
 import asyncio
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
@@ -14,8 +13,9 @@ from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import IMAGES_DIR
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -38,12 +38,14 @@ def _seedream_headers() -> dict:
     }
 
 
+@track_job("seedream45")
 async def _run_seedream45_job(
     tg_chat_id: int,
     db_user_id: int,
     prompt: str,
     aspect_ratio: str,
     cost: float,
+    hold_id: int,
 ) -> None:
     try:
         headers = _seedream_headers()
@@ -55,7 +57,7 @@ async def _run_seedream45_job(
         }
 
         # 1) Create generation
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await c.post(
                 f"{SEEDREAM_API_URL}/images/generations",
                 json=body,
@@ -82,7 +84,7 @@ async def _run_seedream45_job(
             if b:
                 img_bytes = base64.b64decode(b)
             elif first.get("url"):
-                async with httpx.AsyncClient(timeout=120, follow_redirects=True) as c:
+                async with http_client(timeout=120, follow_redirects=True) as c:
                     ir = await c.get(first["url"])
                     if ir.status_code < 400:
                         img_bytes = ir.content
@@ -93,7 +95,7 @@ async def _run_seedream45_job(
         if not img_bytes and task_id:
             poll_url = f"{SEEDREAM_API_URL}/images/generations/{task_id}"
             for _ in range(120):  # ~4 min
-                async with httpx.AsyncClient(timeout=30) as c:
+                async with http_client(timeout=30) as c:
                     pr = await c.get(poll_url, headers=_seedream_headers())
 
                 try:
@@ -110,7 +112,7 @@ async def _run_seedream45_job(
                         if b:
                             img_bytes = base64.b64decode(b)
                         elif first.get("url"):
-                            async with httpx.AsyncClient(timeout=120, follow_redirects=True) as c2:
+                            async with http_client(timeout=120, follow_redirects=True) as c2:
                                 ir = await c2.get(first["url"])
                                 img_bytes = ir.content
                     break
@@ -143,20 +145,11 @@ async def _run_seedream45_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Seedream 4.5 job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Seedream 4.5 fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/seedream45/generate")
@@ -184,14 +177,13 @@ async def seedream45_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(
+        hold_id = hold_credits(
             db_user_id, COST, "Seedream 4.5", "seedream", "seedream-4.5"
         )
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "\ud83d\uddbc Seedream 4.5: \u0397 \u03b5\u03b9\u03ba\u03cc\u03bd\u03b1 \u03b5\u03c4\u03bf\u03b9\u03bc\u03ac\u03b6\u03b5\u03c4\u03b1\u03b9\u2026")
@@ -205,6 +197,7 @@ async def seedream45_generate(
         prompt,
         aspect_ratio,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
@@ -14,9 +14,11 @@ from fastapi.responses import JSONResponse
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
+from ..config import OPENAI_API_BASE
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -69,6 +71,7 @@ async def _request_with_retries(
     raise RuntimeError(f"Network/transient failure after retries: {last_exc or 'Unknown error'}")
 
 
+@track_job("sora2")
 async def _run_sora2_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -76,6 +79,7 @@ async def _run_sora2_job(
     size: str,
     seconds: str,
     cost: float,
+    hold_id: int,
 ) -> None:
     video_id: Optional[str] = None
 
@@ -85,7 +89,7 @@ async def _run_sora2_job(
 
         await tg_send_message(tg_chat_id, "\ud83c\udfac Sora 2: \u039e\u03b5\u03ba\u03af\u03bd\u03b7\u03c3\u03b5 \u03b7 \u03c0\u03b1\u03c1\u03b1\u03b3\u03c9\u03b3\u03ae\u2026")
 
-        url = "https://api.openai.com/v1/videos"
+        url = f"{OPENAI_API_BASE}/videos"
         headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
 
         body = {
@@ -95,7 +99,7 @@ async def _run_sora2_job(
             "seconds": seconds,
         }
 
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await _request_with_retries(c, "POST", url, headers=headers, json_body=body)
 
         try:
@@ -112,9 +116,9 @@ async def _run_sora2_job(
 
         # Poll status
         for _ in range(240):  # ~8 min at 2s
-            async with httpx.AsyncClient(timeout=30) as c:
+            async with http_client(timeout=30) as c:
                 vr = await _request_with_retries(
-                    c, "GET", f"https://api.openai.com/v1/videos/{video_id}", headers=headers
+                    c, "GET", f"{OPENAI_API_BASE}/videos/{video_id}", headers=headers
                 )
 
             try:
@@ -132,9 +136,9 @@ async def _run_sora2_job(
             await asyncio.sleep(2)
 
         # Download video
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             dr = await _request_with_retries(
-                c, "GET", f"https://api.openai.com/v1/videos/{video_id}/content", headers=headers
+                c, "GET", f"{OPENAI_API_BASE}/videos/{video_id}/content", headers=headers
             )
 
         if dr.status_code >= 400:
@@ -163,20 +167,11 @@ async def _run_sora2_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Sora2 job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Sora2 fail", "system", video_id)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/sora2/generate")
@@ -203,12 +198,11 @@ async def sora2_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(db_user_id, COST, f"Sora 2 ({secs}s)", "openai", "sora-2")
+        hold_id = hold_credits(db_user_id, COST, f"Sora 2 ({secs}s)", "openai", "sora-2")
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "\ud83c\udfac Sora 2: \u03a4\u03bf \u03b2\u03af\u03bd\u03c4\u03b5\u03bf \u03b5\u03c4\u03bf\u03b9\u03bc\u03ac\u03b6\u03b5\u03c4\u03b1\u03b9\u2026")
@@ -223,6 +217,7 @@ async def sora2_generate(
         size,
         secs,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
@@ -14,9 +14,12 @@ from fastapi.responses import JSONResponse
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
+from ..core.images import normalize_image, ext_for_mime
+from ..config import OPENAI_API_BASE
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -112,7 +115,7 @@ async def _openai_video_create(
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY missing (set it in Railway env)")
 
-    url = "https://api.openai.com/v1/videos"
+    url = f"{OPENAI_API_BASE}/videos"
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
 
     data = {"model": model, "prompt": prompt, "size": size, "seconds": seconds}
@@ -128,7 +131,7 @@ async def _openai_video_create(
             )
         }
 
-    async with httpx.AsyncClient(timeout=60) as c:
+    async with http_client(timeout=60) as c:
         # 1) attempt with quality
         if files:
             r = await _request_with_retries(c, "POST", url, headers=headers, data=data_with_quality, files=files)
@@ -166,10 +169,10 @@ async def _openai_video_retrieve(video_id: str) -> Dict[str, Any]:
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY missing (set it in Railway env)")
 
-    url = f"https://api.openai.com/v1/videos/{video_id}"
+    url = f"{OPENAI_API_BASE}/videos/{video_id}"
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
 
-    async with httpx.AsyncClient(timeout=30) as c:
+    async with http_client(timeout=30) as c:
         r = await _request_with_retries(c, "GET", url, headers=headers)
 
     if r.status_code >= 400:
@@ -185,10 +188,10 @@ async def _openai_video_download(video_id: str) -> bytes:
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY missing (set it in Railway env)")
 
-    url = f"https://api.openai.com/v1/videos/{video_id}/content"
+    url = f"{OPENAI_API_BASE}/videos/{video_id}/content"
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
 
-    async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+    async with http_client(timeout=300, follow_redirects=True) as c:
         r = await _request_with_retries(c, "GET", url, headers=headers)
 
     if r.status_code == 404:
@@ -213,6 +216,7 @@ def _build_storyboard_prompt(scenes: List[Dict[str, Any]], base_prompt: str) ->
     return "\n".join(lines).strip()
 
 
+@track_job("sora2pro")
 async def _run_sora2pro_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -225,6 +229,7 @@ async def _run_sora2pro_job(
     image_name: Optional[str],
     storyboard_scenes: List[Dict[str, Any]],
     cost: int,
+    hold_id: int,
 ) -> None:
     warned_transient = False
     video_id: Optional[str] = None
@@ -240,6 +245,10 @@ async def _run_sora2pro_job(
         elif mode == "storyboard":
             final_prompt = _build_storyboard_prompt(storyboard_scenes, prompt)
 
+        if input_reference_bytes:
+            input_reference_bytes, ref_mime = await normalize_image(input_reference_bytes, "sora")
+            input_reference_name = f"ref.{ext_for_mime(ref_mime)}"
+
         created = await _openai_video_create(
             model="sora-2-pro",
             prompt=final_prompt,
@@ -298,22 +307,12 @@ async def _run_sora2pro_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id, provider_ref=video_id)
+
     except Exception as e:
         logger.exception("Error during Sora2Pro job")
 
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Sora2Pro fail", "system", video_id)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Error refunding credits")
-
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/sora2pro/generate")
@@ -377,18 +376,17 @@ async def sora2pro_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(
+        hold_id = hold_credits(
             db_user_id,
             COST,
             f"Sora 2 Pro ({mode},{secs}s,{q})",
             "openai",
             "sora-2-pro",
         )
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "🎬 Sora 2 Pro: Το βίντεο ετοιμάζεται…")
@@ -408,6 +406,7 @@ async def sora2pro_generate(
         image_name,
         scenes,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST, "message": "Στάλθηκε στο Telegram."}
@@ -7,7 +7,6 @@ import logging
 import asyncio
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
@@ -15,9 +14,10 @@ from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
-from ..config import BOT_TOKEN
+from ..db import InsufficientCredits, set_last_result
+from ..config import BOT_TOKEN, TELEGRAM_API_BASE
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -58,13 +58,13 @@ async def _tg_send_audio(
     reply_markup: Optional[dict] = None,
 ) -> dict:
     """Send audio file to Telegram via sendAudio API."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendAudio"
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendAudio"
     data = {"chat_id": str(chat_id), "caption": caption}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
     files = {"audio": (filename, audio_bytes, "audio/mpeg")}
 
-    async with httpx.AsyncClient(timeout=120) as c:
+    async with http_client(timeout=120) as c:
         r = await c.post(url, data=data, files=files)
         j = r.json()
         if not j.get("ok"):
@@ -72,6 +72,7 @@ async def _tg_send_audio(
         return j["result"]
 
 
+@track_job("suno_v5")
 async def _run_suno_v5_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -82,6 +83,7 @@ async def _run_suno_v5_job(
     style: str,
     lyrics: str,
     cost: float,
+    hold_id: int,
 ) -> None:
     try:
         headers = _suno_headers()
@@ -114,7 +116,7 @@ async def _run_suno_v5_job(
         body["callBackUrl"] = f"{public_base_url()}/api/sunov5/callback"
 
         # 1) Create generation
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await c.post(
                 SUNO_API_URL,
                 json=body,
@@ -158,7 +160,7 @@ async def _run_suno_v5_job(
 
             # --- Otherwise poll the API ---
             try:
-                async with httpx.AsyncClient(timeout=30) as c:
+                async with http_client(timeout=30) as c:
                     pr = await c.get(
                         poll_base,
                         params={"taskId": task_id},
@@ -233,7 +235,7 @@ async def _run_suno_v5_job(
         sent_count = 0
         for idx, entry in enumerate(audio_entries, 1):
             try:
-                async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+                async with http_client(timeout=300, follow_redirects=True) as c:
                     ar = await c.get(entry["url"])
                     if ar.status_code >= 400:
                         logger.warning("Audio download error %d for track %d", ar.status_code, idx)
@@ -268,27 +270,18 @@ async def _run_suno_v5_job(
             ]
         }
         msg_text = f"✅ Suno V5: {sent_count} {'τραγούδια έτοιμα' if sent_count > 1 else 'τραγούδι έτοιμο'}!"
-        async with httpx.AsyncClient(timeout=30) as c:
+        async with http_client(timeout=30) as c:
             await c.post(
-                f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
+                f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendMessage",
                 json={"chat_id": tg_chat_id, "text": msg_text,
                       "reply_markup": kb},
             )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Suno v5 job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Suno v5 fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Refund failed")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 
 
 @router.post("/api/sunov5/generate")
@@ -347,14 +340,13 @@ async def suno_v5_generate(
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
     try:
-        spend_credits_by_user_id(
+        hold_id = hold_credits(
             db_user_id, COST, "Suno v5 Music", "suno", "suno-v5"
         )
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
     except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
 
     try:
         await tg_send_message(tg_chat_id, "🎵 Suno v5: Η μουσική ετοιμάζεται…")
@@ -372,6 +364,7 @@ async def suno_v5_generate(
         style,
         lyrics,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
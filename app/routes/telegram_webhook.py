@@ -0,0 +1,86 @@
+# app/routes/telegram_webhook.py
+"""Webhook ingestion για το Telegram bot.
+
+Το endpoint απαντάει αμέσως (200) και βάζει το update στην ουρά του PTB
+Application, το οποίο το επεξεργάζεται παράλληλα (PerUserUpdateProcessor).
+Μπορεί να γίνει mount στο web service (BOT_WEBHOOK_IN_WEB=1) ή να τρέξει
+ως ξεχωριστό service (BOT_MODE=webhook python -m app.bot).
+"""
+import hmac
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from telegram import Update
+from telegram.ext import Application
+
+from ..config import (
+    BOT_WEBHOOK_PATH,
+    BOT_WEBHOOK_URL,
+    BOT_WEBHOOK_SECRET,
+    BOT_WEBHOOK_MAX_CONNECTIONS,
+)
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+_application: Optional[Application] = None
+
+
+async def start_bot_webhook() -> None:
+    global _application
+    from ..bot import build_application
+
+    app = build_application(webhook=True)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    _application = app
+
+    if BOT_WEBHOOK_URL:
+        # idempotent: όλα τα replicas δηλώνουν το ίδιο URL
+        await app.bot.set_webhook(
+            url=BOT_WEBHOOK_URL,
+            secret_token=BOT_WEBHOOK_SECRET or None,
+            max_connections=BOT_WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Telegram webhook set to %s", BOT_WEBHOOK_URL)
+    else:
+        logger.warning("BOT_WEBHOOK_URL/WEBAPP_URL missing: webhook not registered with Telegram")
+
+
+async def stop_bot_webhook() -> None:
+    global _application
+    app = _application
+    _application = None
+    if app is None:
+        return
+    await app.stop()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    await app.shutdown()
+
+
+@router.post(BOT_WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    if BOT_WEBHOOK_SECRET:
+        got = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(got, BOT_WEBHOOK_SECRET):
+            raise HTTPException(403, "Bad secret token")
+
+    app = _application
+    if app is None:
+        # 503 => το Telegram θα ξαναστείλει το update αργότερα
+        raise HTTPException(503, "Bot not ready")
+
+    try:
+        data = await request.json()
+    except Exception:
+        raise HTTPException(400, "Bad JSON")
+
+    update = Update.de_json(data, app.bot)
+    if update is not None:
+        await app.update_queue.put(update)
+    return {"ok": True}
@@ -1,30 +1,69 @@
-"""Κοινό helper: όταν ένα εργαλείο αποτύχει, κάνε release hold + στείλε friendly μήνυμα.
+"""Κοινά helpers για τη χρέωση των jobs με hold -> capture / release.
 
-Βάλε αυτό το αρχείο στο: app/core/tool_fail_refund.py
+Το endpoint δεσμεύει τα credits (hold), το background job κάνει capture μόνο
+όταν το αποτέλεσμα παραδοθεί στο Telegram, και σε αποτυχία απλό release:
+καμία εγγραφή στο ledger, κανένα refund.
 
-Χρήση μέσα στα app/api/<tool>/generate:
+Χρήση μέσα στα app/routes/<tool>.py:
 
-    from app.db import create_credit_hold, capture_credit_hold
-    from app.core.tool_fail_refund import fail_and_refund
+    from ..db import InsufficientCredits
+    from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
 
-    hold = create_credit_hold(user_id, cost, reason="nanobanana_pro", provider="nanobanana_pro", idempotency_key=job_id)
-    hold_id = int(hold["id"])
+    # endpoint
+    try:
+        hold_id = hold_credits(db_user_id, COST, "Kling 2.6 Video", "kling", MODEL)
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
 
+    # background job
     try:
-        provider_resp = ...
-        capture_credit_hold(hold_id, reason="nanobanana_pro", provider="nanobanana_pro", provider_ref=provider_job_id)
+        ...
+        await tg_send_document(...)
+        capture_hold(hold_id)
     except Exception as e:
-        await fail_and_refund(chat_id=chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
-        raise
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
 """
 
 from __future__ import annotations
+import logging
 from typing import Optional
 
-from app.db import release_credit_hold
+from app.db import create_credit_hold, capture_credit_hold, release_credit_hold
 from app.core.telegram_client import tg_send_message_safe
+from app.core import metrics
 from app.texts import map_provider_error_to_gr, tool_error_message_gr
 
+logger = logging.getLogger(__name__)
+
+
+def hold_credits(
+    user_id: int,
+    amount,
+    reason: str,
+    provider: Optional[str] = None,
+    provider_ref: Optional[str] = None,
+) -> int:
+    """Δεσμεύει credits για ένα job, επιστρέφει το hold_id (raises InsufficientCredits)."""
+    return int(create_credit_hold(user_id, amount, reason, provider, provider_ref)["id"])
+
+
+def capture_hold(hold_id: int, provider_ref: Optional[str] = None) -> None:
+    """
+    Χρέωση μετά την παράδοση. Δεν σκάει ποτέ: το αποτέλεσμα έχει ήδη σταλεί,
+    οπότε ένα σφάλμα εδώ δεν πρέπει να οδηγήσει σε release / μήνυμα αποτυχίας.
+    Capture που δεν χρέωσε (hold όχι πια held, π.χ. release από το stale-hold
+    cleanup, ή σφάλμα) γράφεται στο log και στο credit_hold_capture_failures_total.
+    """
+    try:
+        captured = capture_credit_hold(hold_id, provider_ref=provider_ref)
+    except Exception:
+        logger.exception("capture_credit_hold failed (hold_id=%s)", hold_id)
+        metrics.inc("credit_hold_capture_failures_total", reason="error")
+        return
+    if not captured:
+        logger.error("capture_credit_hold: hold %s was not held, delivered job not charged", hold_id)
+        metrics.inc("credit_hold_capture_failures_total", reason="not_held")
+
 
 async def fail_and_refund(
     *,
@@ -34,12 +73,15 @@ async def fail_and_refund(
     raw_error: str,
 ) -> None:
     refunded = None
+    metrics.mark_job_failed(raw_error)
 
     # refund (release hold) — idempotent
     if hold_id is not None:
-        ok = release_credit_hold(hold_id, reason="tool_failed")
-        if ok:
-            refunded = float(cost)
+        try:
+            if release_credit_hold(hold_id, reason="tool_failed"):
+                refunded = float(cost)
+        except Exception:
+            logger.exception("release_credit_hold failed (hold_id=%s)", hold_id)
 
     reason, tips = map_provider_error_to_gr(raw_error)
     msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
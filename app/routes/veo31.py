@@ -1,27 +1,28 @@
 # app/routes/veo31.py
 import os
 import uuid
-import base64
 import asyncio
 import logging
 from typing import Dict, Any, Optional, List
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
+from ..core.codec import b64encode_async
+from ..core.images import normalize_image
+from ..config import GEMINI_API_BASE
 from ..web_shared import public_base_url
 
 from ..db import (
-    spend_credits_by_user_id,
-    add_credits_by_user_id,
+    InsufficientCredits,
     set_last_result,
 )
 
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -67,14 +68,6 @@ async def veo31_generate(
     except Exception:
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
-    try:
-        spend_credits_by_user_id(db_user_id, COST, f"Veo 3.1 ({mode})", "gemini", _veo31_model_name())
-    except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
-
     image_bytes = await image.read() if image else None
 
     ref_bytes: list[bytes] = []
@@ -85,19 +78,18 @@ async def veo31_generate(
             pass
 
     if mode == "image" and not image_bytes:
-        try:
-            add_credits_by_user_id(db_user_id, COST, "Refund Veo31 missing image", "system", None)
-        except Exception:
-            logger.exception("Refund Veo31 missing image failed")
         return JSONResponse({"ok": False, "error": "missing_image"}, status_code=400)
 
     if mode == "ref" and (len(ref_bytes) < 1 or len(ref_bytes) > 3):
-        try:
-            add_credits_by_user_id(db_user_id, COST, "Refund Veo31 bad ref_images", "system", None)
-        except Exception:
-            logger.exception("Refund Veo31 bad ref_images failed")
         return JSONResponse({"ok": False, "error": "bad_ref_images"}, status_code=400)
 
+    try:
+        hold_id = hold_credits(db_user_id, COST, f"Veo 3.1 ({mode})", "gemini", _veo31_model_name())
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
+
     try:
         await tg_send_message(tg_chat_id, "🎬 Veo 3.1: Το βίντεο ετοιμάζεται…")
     except Exception:
@@ -113,11 +105,13 @@ async def veo31_generate(
         image_bytes,
         ref_bytes,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
 
 
+@track_job("veo31")
 async def _run_veo31_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -127,13 +121,14 @@ async def _run_veo31_job(
     image_bytes: Optional[bytes],
     ref_images: list[bytes],
     cost: float,
+    hold_id: int,
 ):
     try:
         if not GEMINI_API_KEY:
             raise RuntimeError("GEMINI_API_KEY missing (set it in Railway env)")
 
         model = _veo31_model_name()
-        base_url = "https://generativelanguage.googleapis.com/v1beta"
+        base_url = GEMINI_API_BASE
         op_url = f"{base_url}/models/{model}:predictLongRunning"
 
         ratio_hint = ""
@@ -147,22 +142,21 @@ async def _run_veo31_job(
         instance: Dict[str, Any] = {"prompt": final_prompt}
 
         if mode == "image":
+            img, mime = await normalize_image(image_bytes, "veo")
             instance["image"] = {
-                "bytesBase64Encoded": base64.b64encode(image_bytes).decode("utf-8"),
-                "mimeType": "image/png",
+                "bytesBase64Encoded": await b64encode_async(img),
+                "mimeType": mime,
             }
         elif mode == "ref":
-            instance["reference_images"] = [
-                {
-                    "bytesBase64Encoded": base64.b64encode(b).decode("utf-8"),
-                    "mimeType": "image/png",
-                }
-                for b in ref_images[:3]
-            ]
+            refs = []
+            for b in ref_images[:3]:
+                img, mime = await normalize_image(b, "veo")
+                refs.append({"bytesBase64Encoded": await b64encode_async(img), "mimeType": mime})
+            instance["reference_images"] = refs
 
         body = {"instances": [instance]}
 
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await c.post(
                 op_url,
                 headers={"x-goog-api-key": GEMINI_API_KEY, "Content-Type": "application/json"},
@@ -182,7 +176,7 @@ async def _run_veo31_job(
             raise RuntimeError(f"No operation name returned: {data}")
 
         status = None
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             for _ in range(120):  # ~6 λεπτά
                 rs = await c.get(f"{base_url}/{op_name}", headers={"x-goog-api-key": GEMINI_API_KEY})
                 try:
@@ -206,7 +200,7 @@ async def _run_veo31_job(
         if not video_uri:
             raise RuntimeError(f"No video uri in response: {status}")
 
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             vd = await c.get(video_uri, headers={"x-goog-api-key": GEMINI_API_KEY})
             if vd.status_code >= 400:
                 raise RuntimeError(f"Video download error {vd.status_code}: {(vd.text or '')[:300]}")
@@ -235,19 +229,9 @@ async def _run_veo31_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Veo31 job")
 
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Veo31 fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Error refunding credits")
-
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
@@ -1,21 +1,23 @@
 # app/routes/veo3fast.py
 import os
 import uuid
-import base64
 import logging
 import asyncio
 from typing import Optional, Dict, Any
 
-import httpx
 from fastapi import APIRouter, Request, BackgroundTasks, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
 from ..core.telegram_auth import db_user_from_webapp
 from ..core.telegram_client import tg_send_message, tg_send_document
 from ..core.paths import VIDEOS_DIR
+from ..core.codec import b64encode_async
+from ..core.images import normalize_image
+from ..config import GEMINI_API_BASE
 from ..web_shared import public_base_url
-from ..db import spend_credits_by_user_id, add_credits_by_user_id, set_last_result
-from ..texts import map_provider_error_to_gr, tool_error_message_gr
+from ..db import InsufficientCredits, set_last_result
+from .tool_fail_refund import hold_credits, capture_hold, fail_and_refund
+from ..core.metrics import track_job, http_client
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -63,25 +65,20 @@ async def veo3fast_generate(
     except Exception:
         return JSONResponse({"ok": False, "error": "auth_failed"}, status_code=401)
 
-    try:
-        spend_credits_by_user_id(
-            db_user_id, COST, f"Veo 3 Fast ({mode})", "gemini", _veo3fast_model_name()
-        )
-    except Exception as e:
-        msg = str(e)
-        if "not enough" in msg.lower():
-            return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
-        return JSONResponse({"ok": False, "error": msg[:200]}, status_code=400)
-
     image_bytes = await image.read() if image else None
 
     if mode == "image" and not image_bytes:
-        try:
-            add_credits_by_user_id(db_user_id, COST, "Refund Veo3Fast missing image", "system", None)
-        except Exception:
-            logger.exception("Refund Veo3Fast missing image failed")
         return JSONResponse({"ok": False, "error": "missing_image"}, status_code=400)
 
+    try:
+        hold_id = hold_credits(
+            db_user_id, COST, f"Veo 3 Fast ({mode})", "gemini", _veo3fast_model_name()
+        )
+    except InsufficientCredits:
+        return JSONResponse({"ok": False, "error": "not_enough_credits"}, status_code=402)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": str(e)[:200]}, status_code=400)
+
     try:
         await tg_send_message(tg_chat_id, "\ud83c\udfac Veo 3 Fast: \u03a4\u03bf \u03b2\u03af\u03bd\u03c4\u03b5\u03bf \u03b5\u03c4\u03bf\u03b9\u03bc\u03ac\u03b6\u03b5\u03c4\u03b1\u03b9\u2026")
     except Exception:
@@ -96,11 +93,13 @@ async def veo3fast_generate(
         aspect_ratio,
         image_bytes,
         COST,
+        hold_id,
     )
 
     return {"ok": True, "sent_to_telegram": True, "cost": COST}
 
 
+@track_job("veo3fast")
 async def _run_veo3fast_job(
     tg_chat_id: int,
     db_user_id: int,
@@ -109,13 +108,14 @@ async def _run_veo3fast_job(
     aspect_ratio: str,
     image_bytes: Optional[bytes],
     cost: float,
+    hold_id: int,
 ):
     try:
         if not GEMINI_API_KEY:
             raise RuntimeError("GEMINI_API_KEY missing (set it in Railway env)")
 
         model = _veo3fast_model_name()
-        base_url = "https://generativelanguage.googleapis.com/v1beta"
+        base_url = GEMINI_API_BASE
         op_url = f"{base_url}/models/{model}:predictLongRunning"
 
         # Aspect ratio hint in prompt
@@ -130,14 +130,15 @@ async def _run_veo3fast_job(
         instance: Dict[str, Any] = {"prompt": final_prompt}
 
         if mode == "image" and image_bytes:
+            img, mime = await normalize_image(image_bytes, "veo")
             instance["image"] = {
-                "bytesBase64Encoded": base64.b64encode(image_bytes).decode("utf-8"),
-                "mimeType": "image/png",
+                "bytesBase64Encoded": await b64encode_async(img),
+                "mimeType": mime,
             }
 
         body = {"instances": [instance]}
 
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             r = await c.post(
                 op_url,
                 headers={"x-goog-api-key": GEMINI_API_KEY, "Content-Type": "application/json"},
@@ -158,7 +159,7 @@ async def _run_veo3fast_job(
 
         # Poll operation
         status = None
-        async with httpx.AsyncClient(timeout=60) as c:
+        async with http_client(timeout=60) as c:
             for _ in range(120):  # ~6 min
                 rs = await c.get(
                     f"{base_url}/{op_name}",
@@ -187,7 +188,7 @@ async def _run_veo3fast_job(
         if not video_uri:
             raise RuntimeError(f"No video uri in response: {status}")
 
-        async with httpx.AsyncClient(timeout=300, follow_redirects=True) as c:
+        async with http_client(timeout=300, follow_redirects=True) as c:
             vd = await c.get(video_uri, headers={"x-goog-api-key": GEMINI_API_KEY})
             if vd.status_code >= 400:
                 raise RuntimeError(f"Video download error {vd.status_code}: {(vd.text or '')[:300]}")
@@ -214,17 +215,8 @@ async def _run_veo3fast_job(
             reply_markup=kb,
         )
 
+        capture_hold(hold_id)
+
     except Exception as e:
         logger.exception("Error during Veo3Fast job")
-        refunded = None
-        try:
-            add_credits_by_user_id(db_user_id, cost, "Refund Veo3Fast fail", "system", None)
-            refunded = float(cost)
-        except Exception:
-            logger.exception("Error refunding credits")
-        try:
-            reason, tips = map_provider_error_to_gr(str(e))
-            msg = tool_error_message_gr(reason=reason, tips=tips, refunded=refunded)
-            await tg_send_message(tg_chat_id, msg)
-        except Exception:
-            logger.exception("Error sending failure message")
+        await fail_and_refund(chat_id=tg_chat_id, hold_id=hold_id, cost=float(cost), raw_error=str(e))
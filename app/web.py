@@ -4,8 +4,12 @@ from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
-from .config import STRIPE_SECRET_KEY
+from .config import STRIPE_SECRET_KEY, BOT_WEBHOOK_IN_WEB
 from .core.paths import STATIC_DIR
+from .core.loop_monitor import loop_monitor
+from .core import metrics, tracing, events, hold_sweeper, ledger_partitions, replica_monitor, notifications, broadcast, referral_reconciler, referral_commissions, payments
+from .db import close_pools, DATABASE_REPLICA_URL
+from . import db
 
 # --- Existing routers ---
 from .routes.health import router as health_router
@@ -15,6 +19,9 @@ from .routes.me import router as me_router
 from .routes.referrals import router as referrals_router
 from .routes.billing import router as billing_router
 from .routes.jobs import router as jobs_router
+from .routes.debug import router as debug_router
+from .routes.broadcasts import router as broadcasts_router
+from .routes.metrics import router as metrics_router
 
 # --- Image tools ---
 from .routes.gpt_image import router as gpt_image_router
@@ -69,6 +76,9 @@ app.include_router(me_router)
 app.include_router(referrals_router)
 app.include_router(billing_router)
 app.include_router(jobs_router)
+app.include_router(debug_router)
+app.include_router(broadcasts_router)
+app.include_router(metrics_router)
 
 # Routers — image tools
 app.include_router(gpt_image_router)
@@ -105,3 +115,50 @@ app.include_router(modjourney_video_router)
 # Routers — audio tools
 app.include_router(suno_v5_router)
 app.include_router(elevenlabs_router)
+
+if DATABASE_REPLICA_URL:
+    app.middleware("http")(db.http_middleware)
+app.middleware("http")(metrics.http_middleware)
+if tracing.is_enabled():
+    app.middleware("http")(tracing.http_middleware)
+app.add_event_handler("startup", loop_monitor.start)
+app.add_event_handler("startup", metrics.start)
+app.add_event_handler("startup", tracing.start)
+app.add_event_handler("startup", events.start)
+app.add_event_handler("startup", hold_sweeper.start)
+app.add_event_handler("startup", referral_reconciler.start)
+app.add_event_handler("startup", referral_commissions.start)
+app.add_event_handler("startup", payments.start)
+app.add_event_handler("startup", ledger_partitions.start)
+app.add_event_handler("startup", replica_monitor.start)
+app.add_event_handler("startup", notifications.start)
+app.add_event_handler("startup", broadcast.start)
+app.add_event_handler("shutdown", broadcast.stop)
+app.add_event_handler("shutdown", notifications.stop)
+app.add_event_handler("shutdown", replica_monitor.stop)
+app.add_event_handler("shutdown", ledger_partitions.stop)
+app.add_event_handler("shutdown", payments.stop)
+app.add_event_handler("shutdown", referral_commissions.stop)
+app.add_event_handler("shutdown", referral_reconciler.stop)
+app.add_event_handler("shutdown", hold_sweeper.stop)
+app.add_event_handler("shutdown", events.stop)
+app.add_event_handler("shutdown", tracing.stop)
+app.add_event_handler("shutdown", metrics.stop)
+app.add_event_handler("shutdown", loop_monitor.stop)
+
+# Telegram bot σε webhook mode μέσα στο web service (αντί για ξεχωριστό polling process)
+if BOT_WEBHOOK_IN_WEB:
+    from .db import run_migrations
+    from .routes.telegram_webhook import (
+        router as telegram_webhook_router,
+        start_bot_webhook,
+        stop_bot_webhook,
+    )
+
+    app.include_router(telegram_webhook_router)
+    app.add_event_handler("startup", run_migrations)
+    app.add_event_handler("startup", start_bot_webhook)
+    app.add_event_handler("shutdown", stop_bot_webhook)
+
+# τελευταίο: τα προηγούμενα shutdown handlers μπορεί να χρειάζονται ακόμα τη βάση
+app.add_event_handler("shutdown", close_pools)
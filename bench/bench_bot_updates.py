@@ -0,0 +1,120 @@
+# bench/bench_bot_updates.py
+"""
+Load test για το hot path του bot: πόσα menu clicks/sec χωράνε στο event loop.
+
+Συγκρίνει:
+  - legacy: sync ensure_user σε κάθε update (προσομοίωση με time.sleep(--db-ms))
+  - cached: user_sessions.touch() (write-behind, χωρίς DB στο update)
+
+Δεν χρειάζεται Telegram ή Postgres: τα update/query είναι stubs και το
+upsert_users_bulk αντικαθίσταται με sleep στο thread.
+
+Τρέξιμο (από το root του repo):
+    python -m bench.bench_bot_updates
+    python -m bench.bench_bot_updates --updates 5000 --users 500 --db-ms 3
+"""
+import os
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+from app import bot  # noqa: E402
+from app.core import user_sessions as user_sessions_mod  # noqa: E402
+
+MENU_DATA = ["menu:home", "menu:video", "menu:images", "menu:audio", "menu:text"]
+
+
+class _StubMessage:
+    photo = None
+
+    async def edit_caption(self, *args, **kwargs):
+        pass
+
+    async def edit_text(self, *args, **kwargs):
+        pass
+
+
+class _StubQuery:
+    def __init__(self, tg_id: int, data: str):
+        self.data = data
+        self.from_user = SimpleNamespace(id=tg_id, username=f"user{tg_id}", first_name="Bench")
+        self.message = _StubMessage()
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+def _make_updates(n: int, users: int):
+    return [
+        SimpleNamespace(callback_query=_StubQuery(1_000_000 + i % users, MENU_DATA[i % len(MENU_DATA)]))
+        for i in range(n)
+    ]
+
+
+async def _run(updates, concurrency: int) -> float:
+    ctx = SimpleNamespace(user_data={})
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(upd):
+        async with sem:
+            await bot.on_menu_click(upd, ctx)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(u) for u in updates))
+    return time.perf_counter() - t0
+
+
+def run(n: int, users: int, db_ms: float, concurrency: int) -> None:
+    updates = _make_updates(n, users)
+    orig_touch = user_sessions_mod.user_sessions.touch
+
+    # legacy: κάθε update κάνει sync round-trip στη βάση μέσα στο loop
+    def legacy_touch(tg_user_id, username, first_name):
+        time.sleep(db_ms / 1000)
+
+    user_sessions_mod.user_sessions.touch = legacy_touch
+    try:
+        t_legacy = asyncio.run(_run(updates, concurrency))
+    finally:
+        user_sessions_mod.user_sessions.touch = orig_touch
+
+    # cached: touch στη μνήμη + write-behind flush σε thread
+    flushed = 0
+
+    def fake_bulk(rows):
+        nonlocal flushed
+        time.sleep(db_ms / 1000)
+        flushed += len(rows)
+
+    user_sessions_mod.upsert_users_bulk = fake_bulk
+    cache = user_sessions_mod.UserSessionCache(flush_interval=0.05)
+    user_sessions_mod.user_sessions = cache
+    bot.user_sessions = cache
+
+    async def cached():
+        cache.start()
+        try:
+            return await _run(updates, concurrency)
+        finally:
+            await cache.stop()
+
+    t_cached = asyncio.run(cached())
+
+    print(f"updates={n} users={users} db_ms={db_ms} concurrency={concurrency}")
+    print(f"{'mode':<8} {'seconds':>8} {'updates/s':>10} {'db rows':>8}")
+    print(f"{'legacy':<8} {t_legacy:>8.2f} {n / t_legacy:>10.0f} {n:>8}")
+    print(f"{'cached':<8} {t_cached:>8.2f} {n / t_cached:>10.0f} {flushed:>8}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--db-ms", type=float, default=2.0)
+    ap.add_argument("--concurrency", type=int, default=64)
+    args = ap.parse_args()
+    run(args.updates, args.users, args.db_ms, args.concurrency)
@@ -0,0 +1,98 @@
+# bench/bench_codec.py
+"""
+Microbenchmark για το app.core.codec (base64 encode/decode εικόνων).
+
+Για κάθε μέγεθος (1K / 2K / 4K RGB, ασυμπίεστο => χειρότερη περίπτωση PNG)
+μετράει:
+  - χρόνο sync base64 (stdlib) vs chunked codec
+  - μέγιστο event-loop lag όσο τρέχει η μετατροπή (inline vs async/offload)
+
+Τρέξιμο (από το root του repo):
+    python -m bench.bench_codec
+    python -m bench.bench_codec --repeat 10
+"""
+import os
+import time
+import base64
+import asyncio
+import argparse
+
+from app.core.codec import (
+    b64encode_chunked,
+    b64decode_chunked,
+    b64encode_async,
+    b64decode_async,
+)
+
+SIZES = {
+    "1K": 1024 * 1024 * 3,
+    "2K": 2048 * 2048 * 3,
+    "4K": 4096 * 4096 * 3,
+}
+
+
+def _best_of(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+async def _max_loop_lag(coro_factory, tick: float = 0.001) -> float:
+    """Τρέχει το coroutine και μετράει το μεγαλύτερο καθυστερημένο tick του loop."""
+    max_lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal max_lag
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            t0 = loop.time()
+            await asyncio.sleep(tick)
+            max_lag = max(max_lag, loop.time() - t0 - tick)
+
+    t = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    try:
+        await coro_factory()
+    finally:
+        done.set()
+        await t
+    return max_lag
+
+
+async def _inline(fn, arg):
+    fn(arg)
+
+
+def run(repeat: int) -> None:
+    print(f"{'size':<5} {'op':<7} {'stdlib ms':>10} {'chunked ms':>11} {'lag inline ms':>14} {'lag async ms':>13}")
+    for label, n in SIZES.items():
+        raw = os.urandom(n)
+        enc = base64.b64encode(raw).decode("ascii")
+
+        assert b64encode_chunked(raw) == enc
+        assert b64decode_chunked(enc) == raw
+
+        rows = [
+            ("encode", lambda x: base64.b64encode(x).decode("ascii"), b64encode_chunked, b64encode_async, raw),
+            ("decode", base64.b64decode, b64decode_chunked, b64decode_async, enc),
+        ]
+        for op, stdlib_fn, chunked_fn, async_fn, arg in rows:
+            t_std = _best_of(stdlib_fn, arg, repeat)
+            t_chk = _best_of(chunked_fn, arg, repeat)
+            lag_inline = asyncio.run(_max_loop_lag(lambda: _inline(stdlib_fn, arg)))
+            lag_async = asyncio.run(_max_loop_lag(lambda: async_fn(arg)))
+            print(
+                f"{label:<5} {op:<7} {t_std * 1000:>10.1f} {t_chk * 1000:>11.1f} "
+                f"{lag_inline * 1000:>14.1f} {lag_async * 1000:>13.1f}"
+            )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    run(args.repeat)
@@ -0,0 +1,454 @@
+# bench/bench_db.py
+"""
+Benchmark των hot paths της βάσης: credits, ledger, holds, ensure_user, referrals,
+σελιδοποίηση ιστορικού.
+
+Όλες αυτές οι εγγραφές κλειδώνουν τη γραμμή του users (SELECT ... FOR UPDATE),
+οπότε το ενδιαφέρον είναι το contention: πολλά threads στον ίδιο χρήστη.
+Για κάθε σενάριο τρέχουν N workers (threads, όπως τα sync DB calls του app)
+για σταθερό χρόνο και μετράμε:
+  - ops/s και latency p50/p99 ανά op
+  - lock wait: δειγματοληψία του pg_stat_activity (wait_event_type = 'Lock')
+    κάθε --sample-ms, δηλαδή πόσα backend-δευτερόλεπτα πέρασαν σε αναμονή lock
+  - deadlocks (pg_stat_database)
+  - συνέπεια: μετά από κάθε σενάριο, για όλους τους χρήστες του σεναρίου,
+    credits == SUM(ledger.delta), credits >= 0 και κάθε balance_after ίσο με
+    το τρέχον άθροισμα των deltas (δηλαδή καμία χαμένη ή διπλή κίνηση)
+
+Baselines: με --baseline FILE (JSON) κάθε τρέξιμο συγκρίνεται με τα
+αποτελέσματα του αρχείου και το --save-baseline τα γράφει εκεί. Με --check το
+process βγαίνει με 1 αν κάποιο σενάριο χειροτέρεψε πέρα από το --tolerance ή
+αν βρέθηκε ασυνέπεια στο ledger. Τα νούμερα έχουν νόημα μόνο στο ίδιο
+μηχάνημα/ίδια Postgres, γι' αυτό δεν υπάρχει baseline στο repo: το αρχείο
+είναι τοπικό (ή artifact του CI runner).
+
+Χρειάζεται δοκιμαστική βάση (δημιουργεί χρήστες, ledger, holds):
+    DATABASE_URL=postgresql://localhost/bench python -m bench.bench_db
+    python -m bench.bench_db --scenario spend_same_user --workers 32 --seconds 20
+    python -m bench.bench_db --baseline /tmp/bench_db.json --save-baseline
+    python -m bench.bench_db --baseline /tmp/bench_db.json --check --tolerance 0.15
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from decimal import Decimal
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+if not os.getenv("DATABASE_URL"):
+    sys.exit("DATABASE_URL is required (χρησιμοποίησε μια δοκιμαστική βάση)")
+
+import psycopg
+
+from app import db
+
+
+# ----------------------
+# Σενάρια: setup(ctx) μία φορά, op(ctx, worker, i) σε loop από κάθε worker
+# ----------------------
+class _Ctx:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.first_tg = self.next_tg = 9_100_000_000 + random.randrange(10**8) * 10**4
+        self.lock = threading.Lock()
+        self.users: List[int] = []
+        self.tg_ids: List[int] = []
+        self.code = ""
+        self.codes: List[str] = []
+        self.cursors: List[str] = []
+
+    def new_tg_id(self) -> int:
+        with self.lock:
+            self.next_tg += 1
+            return self.next_tg
+
+    def new_user(self, credits: float = 0) -> Tuple[int, int]:
+        tg_id = self.new_tg_id()
+        u = db.ensure_user(tg_id, f"bench{tg_id}", "Bench")
+        if credits:
+            db.add_credits_by_user_id(u["id"], credits, "Bench seed", "system")
+        return int(u["id"]), tg_id
+
+
+def _setup_rich_users(n: int) -> Callable[[_Ctx], None]:
+    def setup(ctx: _Ctx) -> None:
+        for _ in range(n if n else ctx.workers):
+            uid, tg_id = ctx.new_user(credits=10_000_000)
+            ctx.users.append(uid)
+            ctx.tg_ids.append(tg_id)
+    return setup
+
+
+def _op_spend_same(ctx: _Ctx, w: int, i: int) -> None:
+    db.spend_credits_by_user_id(ctx.users[0], "0.01", "Bench spend", "bench")
+
+
+def _op_spend_spread(ctx: _Ctx, w: int, i: int) -> None:
+    db.spend_credits_by_user_id(ctx.users[w], "0.01", "Bench spend", "bench")
+
+
+def _op_hold_cycle(ctx: _Ctx, w: int, i: int) -> None:
+    hold = db.create_credit_hold(ctx.users[0], 1, "Bench hold", "bench")
+    if i % 4 == 3:
+        db.release_credit_hold(int(hold["id"]), "bench", None, "Bench release")
+    else:
+        db.capture_credit_hold(int(hold["id"]), "Bench capture", "bench")
+
+
+def _setup_ensure(ctx: _Ctx) -> None:
+    for _ in range(200):
+        _, tg_id = ctx.new_user()
+        ctx.tg_ids.append(tg_id)
+
+
+def _op_ensure_user(ctx: _Ctx, w: int, i: int) -> None:
+    # ~90% υπάρχοντες χρήστες (UPDATE), ~10% καινούργιοι (INSERT + ledger)
+    tg_id = ctx.new_tg_id() if i % 10 == 0 else random.choice(ctx.tg_ids)
+    db.ensure_user(tg_id, f"bench{tg_id}", "Bench")
+
+
+def _setup_referral(ctx: _Ctx) -> None:
+    uid, _ = ctx.new_user()
+    ctx.users.append(uid)
+    ctx.code = db.create_referral_link(uid)["code"]
+
+
+def _op_referral_storm(ctx: _Ctx, w: int, i: int) -> None:
+    # νέοι χρήστες από το ίδιο link: όλα τα bonus πέφτουν στη γραμμή του owner
+    invited, _ = ctx.new_user()
+    db.apply_referral_start(invited, ctx.code, bonus_credits=1)
+
+
+def _setup_referral_purchases(ctx: _Ctx) -> None:
+    for _ in range(20):
+        uid, _ = ctx.new_user()
+        db.set_user_plan(uid, "PRO")
+        ctx.users.append(uid)
+        ctx.codes.append(db.create_referral_link(uid)["code"])
+
+
+def _op_referral_purchases(ctx: _Ctx, w: int, i: int) -> None:
+    # αγορές μέσω referral σε 20 links, ενώ ο worker 0 πληρώνει προμήθειες σε
+    # batches (μία πίστωση ανά owner): οι owners δέχονται credits όσο γράφονται events
+    if w == 0 and i % 20 == 0:
+        db.pay_referral_commissions(5000, Decimal("14.2857"))
+    else:
+        db.record_referral_purchase(ctx.codes[(w + i) % len(ctx.codes)], "12.00")
+
+
+def _op_refund_storm(ctx: _Ctx, w: int, i: int) -> None:
+    # αποτυχία provider: refunds για πολλά jobs λίγων χρηστών ταυτόχρονα
+    db.add_credits_by_user_id(ctx.users[i % len(ctx.users)], 2, "Refund bench fail", "system")
+
+
+def _setup_overdraft(ctx: _Ctx) -> None:
+    for _ in range(20):
+        uid, _ = ctx.new_user(credits=20)
+        ctx.users.append(uid)
+
+
+def _op_overdraft_race(ctx: _Ctx, w: int, i: int) -> None:
+    # όλοι οι workers ξοδεύουν από λίγους χρήστες με μικρό υπόλοιπο, ενώ μερικοί
+    # κάνουν refund / extra credits: τα "Insufficient credits" είναι αναμενόμενα,
+    # αρνητικό υπόλοιπο ή ασυνέπεια στο ledger όχι
+    uid = ctx.users[(w + i) % len(ctx.users)]
+    if i % 5 == 4:
+        db.add_extra_credits_by_user_id(uid, 1, "Bench extra", "bench")
+    elif i % 7 == 6:
+        db.add_credits_by_user_id(uid, "0.5", "Refund bench", "system")
+    else:
+        db.spend_credits_by_user_id(uid, 3, "Bench spend", "bench")
+
+
+def _setup_history(ctx: _Ctx) -> None:
+    # ένας χρήστης με μεγάλο ιστορικό: γράφεται με ένα INSERT, με συνεπή
+    # balance_after, και συλλέγουμε τα cursors όλων των σελίδων
+    uid, _ = ctx.new_user()
+    ctx.users.append(uid)
+    n = 20_000
+    with psycopg.connect(db.DATABASE_URL) as conn:
+        conn.execute(
+            """
+            INSERT INTO credit_ledger (user_id, delta, balance_after, reason, provider, created_at)
+            SELECT %(uid)s, 1, u.credits + g, 'Bench history', 'bench', now() - make_interval(secs => %(n)s - g)
+            FROM users u, generate_series(1, %(n)s) g
+            WHERE u.id = %(uid)s
+            ORDER BY g
+            """,
+            {"uid": uid, "n": n},
+        )
+        conn.execute("UPDATE users SET credits = credits + %s WHERE id = %s", (n, uid))
+    cursor = None
+    while True:
+        page = db.get_ledger_page(uid, 50, cursor)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+        ctx.cursors.append(cursor)
+
+
+def _op_ledger_page(ctx: _Ctx, w: int, i: int) -> None:
+    # τυχαία σελίδα σε οποιοδήποτε βάθος: με keyset το κόστος δεν εξαρτάται από αυτό
+    db.get_ledger_page(ctx.users[0], 50, random.choice(ctx.cursors))
+
+
+SCENARIOS: Dict[str, Tuple[Callable[[_Ctx], None], Callable[[_Ctx, int, int], None]]] = {
+    "spend_same_user": (_setup_rich_users(1), _op_spend_same),
+    "spend_spread": (_setup_rich_users(0), _op_spend_spread),
+    "hold_cycle_same_user": (_setup_rich_users(1), _op_hold_cycle),
+    "ensure_user": (_setup_ensure, _op_ensure_user),
+    "referral_storm": (_setup_referral, _op_referral_storm),
+    "referral_purchases": (_setup_referral_purchases, _op_referral_purchases),
+    "refund_storm": (_setup_rich_users(10), _op_refund_storm),
+    "overdraft_race": (_setup_overdraft, _op_overdraft_race),
+    "ledger_page_deep": (_setup_history, _op_ledger_page),
+}
+
+
+# ----------------------
+# Μέτρηση
+# ----------------------
+class _LockSampler(threading.Thread):
+    """Μετράει backend-δευτερόλεπτα σε αναμονή heavyweight lock (row/tuple/transactionid)."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="lock-sampler", daemon=True)
+        self.interval = interval
+        self.lock_wait = 0.0
+        self.max_waiting = 0
+        self._stop = threading.Event()
+
+    def run(self) -> None:
+        with psycopg.connect(db.DATABASE_URL, autocommit=True) as conn:
+            last = time.perf_counter()
+            while not self._stop.wait(self.interval):
+                row = conn.execute(
+                    """
+                    SELECT count(*) FROM pg_stat_activity
+                    WHERE datname = current_database()
+                      AND pid <> pg_backend_pid()
+                      AND wait_event_type = 'Lock'
+                    """
+                ).fetchone()
+                now = time.perf_counter()
+                self.lock_wait += row[0] * (now - last)
+                self.max_waiting = max(self.max_waiting, row[0])
+                last = now
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.join()
+
+
+def _deadlocks() -> int:
+    with psycopg.connect(db.DATABASE_URL, autocommit=True) as conn:
+        return conn.execute(
+            "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+        ).fetchone()[0]
+
+
+def _verify(ctx: _Ctx) -> int:
+    """Αριθμός χρηστών του σεναρίου με ασυνεπές υπόλοιπο/ledger."""
+    with psycopg.connect(db.DATABASE_URL, autocommit=True) as conn:
+        return conn.execute(
+            """
+            WITH bench_users AS (
+              SELECT id, credits FROM users WHERE tg_user_id BETWEEN %(lo)s AND %(hi)s
+            ),
+            led AS (
+              SELECT l.user_id, l.balance_after,
+                     SUM(l.delta) OVER (PARTITION BY l.user_id ORDER BY l.id) AS running
+              FROM credit_ledger l JOIN bench_users b ON b.id = l.user_id
+            ),
+            totals AS (
+              SELECT user_id, SUM(delta) AS total
+              FROM credit_ledger WHERE user_id IN (SELECT id FROM bench_users)
+              GROUP BY user_id
+            ),
+            bad AS (
+              SELECT b.id FROM bench_users b
+              LEFT JOIN totals t ON t.user_id = b.id
+              WHERE b.credits < 0 OR b.credits <> COALESCE(t.total, 0)
+              UNION
+              SELECT user_id FROM led WHERE balance_after <> running
+            )
+            SELECT count(*) FROM bad
+            """,
+            {"lo": ctx.first_tg, "hi": ctx.next_tg},
+        ).fetchone()[0]
+
+
+def _pct(vals: List[float], q: float) -> float:
+    if not vals:
+        return 0.0
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+def run_scenario(name: str, workers: int, seconds: float, sample_ms: float) -> Dict[str, Any]:
+    setup, op = SCENARIOS[name]
+    ctx = _Ctx(workers)
+    setup(ctx)
+
+    deadline = 0.0
+    lat: List[List[float]] = [[] for _ in range(workers)]
+    errors: Dict[str, int] = {}
+    err_lock = threading.Lock()
+
+    def worker(w: int) -> None:
+        i = 0
+        out = lat[w]
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            try:
+                op(ctx, w, i)
+                out.append(time.perf_counter() - t0)
+            except Exception as e:
+                key = f"{type(e).__name__}: {str(e)[:60]}"
+                with err_lock:
+                    errors[key] = errors.get(key, 0) + 1
+            i += 1
+
+    deadlocks0 = _deadlocks()
+    sampler = _LockSampler(sample_ms / 1000)
+    sampler.start()
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        list(ex.map(worker, range(workers)))
+    elapsed = time.perf_counter() - t0
+    sampler.stop()
+
+    vals = sorted(x for per in lat for x in per)
+    busy = sum(vals)
+    return {
+        "ops": len(vals),
+        "ops_s": len(vals) / elapsed,
+        "p50_ms": _pct(vals, 0.50) * 1000,
+        "p99_ms": _pct(vals, 0.99) * 1000,
+        "lock_wait_s": sampler.lock_wait,
+        # τι ποσοστό του χρόνου των ops πέρασε σε αναμονή lock
+        "lock_wait_share": sampler.lock_wait / busy if busy else 0.0,
+        "max_waiting": sampler.max_waiting,
+        "deadlocks": _deadlocks() - deadlocks0,
+        "inconsistent_users": _verify(ctx),
+        "errors": errors,
+    }
+
+
+# ----------------------
+# Baselines
+# ----------------------
+def _meta(workers: int, seconds: float) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    with psycopg.connect(db.DATABASE_URL, autocommit=True) as conn:
+        pg = conn.execute("SHOW server_version").fetchone()[0]
+    return {"commit": commit, "postgres": pg, "workers": workers, "seconds": seconds, "ts": int(time.time())}
+
+
+def _load_baseline(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _save_baseline(path: Path, meta: Dict[str, Any], results: Dict[str, Dict[str, Any]]) -> None:
+    data = _load_baseline(path)
+    data.setdefault("results", {}).update(results)
+    data["meta"] = meta
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def _delta(cur: float, base: Optional[float]) -> str:
+    if not base:
+        return ""
+    return f"{(cur - base) / base * 100:+.0f}%"
+
+
+def _regressions(results: Dict[str, Dict[str, Any]], base: Dict[str, Any], tol: float) -> List[str]:
+    out = []
+    for name, r in results.items():
+        if r["inconsistent_users"]:
+            out.append(f"{name}: {r['inconsistent_users']} users with credits != ledger")
+        b = (base.get("results") or {}).get(name)
+        if not b:
+            continue
+        if r["ops_s"] < b["ops_s"] * (1 - tol):
+            out.append(f"{name}: ops/s {b['ops_s']:.0f} -> {r['ops_s']:.0f}")
+        if r["p99_ms"] > b["p99_ms"] * (1 + tol):
+            out.append(f"{name}: p99 {b['p99_ms']:.1f}ms -> {r['p99_ms']:.1f}ms")
+    return out
+
+
+def _print(results: Dict[str, Dict[str, Any]], base: Dict[str, Any]) -> None:
+    b_all = base.get("results") or {}
+    print(
+        f"{'scenario':<22} {'ops/s':>8} {'Δ':>6} {'p50 ms':>7} {'p99 ms':>8} {'Δ':>6} "
+        f"{'lock s':>7} {'lock %':>7} {'max w':>6} {'dl':>3} {'bad':>4} {'err':>5}"
+    )
+    for name, r in results.items():
+        b = b_all.get(name) or {}
+        print(
+            f"{name:<22} {r['ops_s']:>8.0f} {_delta(r['ops_s'], b.get('ops_s')):>6} "
+            f"{r['p50_ms']:>7.1f} {r['p99_ms']:>8.1f} {_delta(r['p99_ms'], b.get('p99_ms')):>6} "
+            f"{r['lock_wait_s']:>7.1f} {r['lock_wait_share'] * 100:>6.0f}% {r['max_waiting']:>6} "
+            f"{r['deadlocks']:>3} {r['inconsistent_users']:>4} {sum(r['errors'].values()):>5}"
+        )
+        for err, n in r["errors"].items():
+            print(f"{'':<22} {n} x {err}")
+    if base.get("meta"):
+        m = base["meta"]
+        print(f"\nbaseline: commit {m.get('commit')}, postgres {m.get('postgres')}, workers {m.get('workers')}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="DB hot-path benchmark (credits/ledger/holds)")
+    ap.add_argument("--scenario", default="all", choices=[*SCENARIOS, "all"])
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--sample-ms", type=float, default=5, help="περίοδος δειγματοληψίας του pg_stat_activity")
+    ap.add_argument("--baseline", type=Path, help="JSON με αποτελέσματα προηγούμενου τρεξίματος (τοπικό αρχείο)")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--check", action="store_true", help="exit 1 σε regression σε σχέση με το baseline")
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+    if (args.save_baseline or args.check) and args.baseline is None:
+        ap.error("--save-baseline/--check need --baseline FILE")
+    if args.check and not args.baseline.exists():
+        ap.error(f"--check: baseline {args.baseline} does not exist (run with --save-baseline first)")
+
+    db.run_migrations()
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = {n: run_scenario(n, args.workers, args.seconds, args.sample_ms) for n in names}
+
+    base = _load_baseline(args.baseline) if args.baseline else {}
+    if args.json:
+        print(json.dumps({"results": results, "baseline": base.get("results", {})}, indent=2))
+    else:
+        _print(results, base)
+
+    if args.save_baseline:
+        _save_baseline(args.baseline, _meta(args.workers, args.seconds), results)
+        print(f"baseline saved: {args.baseline}")
+
+    regressions = _regressions(results, base, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:\n  " + "\n  ".join(regressions))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
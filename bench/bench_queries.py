@@ -0,0 +1,218 @@
+# bench/bench_queries.py
+"""
+Benchmark των statements του app.db_queries ανά κλήση, σε τρεις τρόπους:
+  - connect: νέα σύνδεση ανά κλήση + dict_row, χωρίς prepare (η παλιά συμπεριφορά του get_conn)
+  - pooled:  μία σύνδεση που ξαναχρησιμοποιείται + dict_row, χωρίς prepare
+  - prepared: μία σύνδεση + server-side prepared statement + db_queries.Row
+
+Για κάθε statement / τρόπο μετράει:
+  - client: μs ανά κλήση (p50) και bytes που κρατάνε οι γραμμές του αποτελέσματος
+    (tracemalloc πάνω σε --calls αποτελέσματα που κρατιούνται ζωντανά)
+  - server: plan + exec ms ανά κλήση από το pg_stat_statements (αν υπάρχει το
+    extension και ο χρήστης μπορεί να κάνει pg_stat_statements_reset(); για plan
+    time χρειάζεται pg_stat_statements.track_planning = on). Στο "connect" δεν
+    μετράει το κόστος του backend startup, που είναι το μεγαλύτερο.
+
+Χρειάζεται δοκιμαστική βάση (γράφει credits/ledger/jobs σε ένα bench χρήστη):
+    DATABASE_URL=postgresql://localhost/bench python -m bench.bench_queries
+    python -m bench.bench_queries --calls 5000 --only user_by_tg,credit
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+if not os.getenv("DATABASE_URL"):
+    sys.exit("DATABASE_URL is required (χρησιμοποίησε μια δοκιμαστική βάση)")
+
+import psycopg
+from psycopg.rows import dict_row
+
+from app import db, db_queries
+
+MODES = ("connect", "pooled", "prepared")
+READ_ONLY = {"user_by_tg", "user_by_id", "ledger_page", "last_result_by_tg", "jobs_by_user", "marketplace_open", "marketplace_search", "referrals_by_owner"}
+
+
+def _cases(user_id: int, tg_id: int, job_id: str) -> Dict[str, Tuple[str, Callable[[], Any]]]:
+    board = {"status": "open", "q": None, "min_budget": None, "max_budget": None, "max_deadline": None, "limit": 21}
+    credit = {"amount": db._to_decimal("0.01"), "value": user_id, "reason": "Bench", "provider": "bench", "provider_ref": None}
+    return {
+        "user_by_tg": (db_queries.USER_BY_TG, lambda: (tg_id,)),
+        "user_by_id": (db_queries.USER_BY_ID, lambda: (user_id,)),
+        "credit": (db_queries.CREDIT["id", False], lambda: credit),
+        "spend": (db_queries.SPEND["id"], lambda: credit),
+        "ledger_page": (db_queries.LEDGER_PAGE[False, False], lambda: {"v": user_id, "limit": 51}),
+        "last_result_upsert": (db_queries.LAST_RESULT_UPSERT, lambda: (user_id, "bench", f"https://x/{random.random()}")),
+        "last_result_by_tg": (db_queries.LAST_RESULT_BY_TG, lambda: ("bench", tg_id)),
+        "job_update": (db_queries.GENERATION_JOB_UPDATE, lambda: {
+            "id": job_id, "status": "running", "progress": random.randrange(100),
+            "provider_job_id": None, "result_url": None, "error": None,
+        }),
+        "jobs_by_user": (db_queries.GENERATION_JOBS_BY_USER, lambda: (user_id, 50)),
+        "marketplace_open": (db_queries.MARKETPLACE_JOBS_PAGE[False, False], lambda: dict(board)),
+        "marketplace_search": (db_queries.MARKETPLACE_JOBS_PAGE[True, False], lambda: {**board, "q": "λογότυπο"}),
+        "referrals_by_owner": (db_queries.REFERRALS_BY_OWNER, lambda: (user_id,)),
+    }
+
+
+def _setup() -> Tuple[int, int, str]:
+    tg_id = 9_200_000_000 + random.randrange(10**8)
+    u = db.ensure_user(tg_id, f"bench{tg_id}", "Bench")
+    user_id = int(u["id"])
+    db.add_credits_by_user_id(user_id, 1_000_000, "Bench seed", "system")
+    for i in range(60):
+        db.add_credits_by_user_id(user_id, 1, f"Bench ledger {i}", "system")
+        db.create_generation_job(user_id, "bench", "t2i", None, "bench", {})
+    db.set_last_result(user_id, "bench", "https://x/0")
+    for _ in range(3):
+        code = db.create_referral_link(user_id)["code"]
+        for _ in range(200):
+            db.record_referral_purchase(code, "7.00")
+    job_id = db.create_generation_job(user_id, "bench", "t2i", None, "bench", {})
+    return user_id, tg_id, job_id
+
+
+# ----------------------
+# pg_stat_statements
+# ----------------------
+def _stats_reset(admin: psycopg.Connection) -> bool:
+    try:
+        admin.execute("SELECT pg_stat_statements_reset()")
+        return True
+    except psycopg.Error:
+        return False
+
+
+def _stats_read(admin: psycopg.Connection) -> Optional[Tuple[float, float, int]]:
+    try:
+        row = admin.execute(
+            """
+            SELECT COALESCE(SUM(total_plan_time), 0), COALESCE(SUM(total_exec_time), 0), COALESCE(SUM(calls), 0)
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+              AND query NOT ILIKE '%%pg_stat_statements%%'
+            """
+        ).fetchone()
+        return float(row[0]), float(row[1]), int(row[2])
+    except psycopg.Error:
+        return None
+
+
+# ----------------------
+# Run
+# ----------------------
+def _run_one(mode: str, query: str, params: Callable[[], Any], calls: int) -> Tuple[List[float], List[Any]]:
+    lat: List[float] = []
+    kept: List[Any] = []
+    conn = None
+    if mode != "connect":
+        conn = psycopg.connect(db.DATABASE_URL, autocommit=True, row_factory=dict_row)
+    try:
+        for _ in range(calls):
+            p = params()
+            t0 = time.perf_counter()
+            if mode == "connect":
+                with psycopg.connect(db.DATABASE_URL, autocommit=True, row_factory=dict_row) as c:
+                    cur = c.execute(query, p, prepare=False)
+                    rows = cur.fetchall() if cur.description else None
+            elif mode == "pooled":
+                cur = conn.execute(query, p, prepare=False)
+                rows = cur.fetchall() if cur.description else None
+            else:
+                cur = conn.cursor(row_factory=db_queries.row_factory)
+                cur.execute(query, p, prepare=True)
+                rows = cur.fetchall() if cur.description else None
+            lat.append(time.perf_counter() - t0)
+            kept.append(rows)
+    finally:
+        if conn is not None:
+            conn.close()
+    return lat, kept
+
+
+def _row_bytes(mode: str, query: str, params: Callable[[], Any], calls: int) -> float:
+    """Bytes ανά κλήση που μένουν δεσμευμένα όσο κρατάμε τα αποτελέσματα."""
+    tracemalloc.start()
+    try:
+        _, kept = _run_one(mode, query, params, calls)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return current / calls
+
+
+def run(calls: int, only: Optional[List[str]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    db.run_migrations()
+    user_id, tg_id, job_id = _setup()
+    cases = _cases(user_id, tg_id, job_id)
+    if only:
+        cases = {k: v for k, v in cases.items() if k in only}
+
+    admin = psycopg.connect(db.DATABASE_URL, autocommit=True)
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for name, (query, params) in cases.items():
+        if name in READ_ONLY:
+            # ίδιο αποτέλεσμα σε dict_row και Row
+            with psycopg.connect(db.DATABASE_URL, autocommit=True, row_factory=dict_row) as c:
+                p = params()
+                a = c.execute(query, p).fetchall()
+                b = c.cursor(row_factory=db_queries.row_factory).execute(query, p).fetchall()
+                assert [dict(r) for r in b] == a, name
+
+        results[name] = {}
+        for mode in MODES:
+            n = calls if mode != "connect" else max(1, calls // 10)
+            _run_one(mode, query, params, min(n, 50))  # warm-up
+            has_stats = _stats_reset(admin)
+            lat, _ = _run_one(mode, query, params, n)
+            stats = _stats_read(admin) if has_stats else None
+            lat.sort()
+            r: Dict[str, Any] = {
+                "calls": n,
+                "p50_us": lat[len(lat) // 2] * 1e6,
+                "p99_us": lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1e6,
+                "bytes_per_call": _row_bytes(mode, query, params, n),
+            }
+            if stats and stats[2]:
+                r["server_plan_ms"] = stats[0] / n
+                r["server_exec_ms"] = stats[1] / n
+            results[name][mode] = r
+    admin.close()
+    return results
+
+
+def _print(results: Dict[str, Dict[str, Dict[str, Any]]]) -> None:
+    print(f"{'statement':<20} {'mode':<9} {'p50 us':>8} {'p99 us':>8} {'B/call':>8} {'plan ms':>8} {'exec ms':>8}")
+    for name, per in results.items():
+        for mode, r in per.items():
+            plan = f"{r['server_plan_ms']:.3f}" if "server_plan_ms" in r else "n/a"
+            exe = f"{r['server_exec_ms']:.3f}" if "server_exec_ms" in r else "n/a"
+            print(
+                f"{name:<20} {mode:<9} {r['p50_us']:>8.0f} {r['p99_us']:>8.0f} "
+                f"{r['bytes_per_call']:>8.0f} {plan:>8} {exe:>8}"
+            )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Per-call cost of the db_queries catalog")
+    ap.add_argument("--calls", type=int, default=2000)
+    ap.add_argument("--only", default="", help="comma-separated statement names")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    only = [x.strip() for x in args.only.split(",") if x.strip()] or None
+    results = run(args.calls, only)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print(results)
+
+
+if __name__ == "__main__":
+    main()
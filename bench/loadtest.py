@@ -0,0 +1,388 @@
+# bench/loadtest.py
+"""
+Offline load test: το πραγματικό web app (uvicorn app.web:api) απέναντι σε
+mock providers και mock Telegram Bot API (bench/mock_providers.py).
+
+Για κάθε σενάριο σηκώνει καινούργιο web process (ώστε το memory peak να
+αφορά μόνο αυτό), στέλνει N generate requests με concurrency C από
+διαφορετικούς χρήστες και περιμένει την παράδοση στο mock Telegram.
+
+Μετράει:
+  - accept latency (HTTP απάντηση του /api/.../generate) p50/p99
+  - end-to-end latency μέχρι το αρχείο να φτάσει στο Telegram p50/p99
+  - throughput (accepted/s και completed/s)
+  - memory peak του web process (VmHWM)
+  - event-loop lag από το /metrics/loop
+
+Χρειάζεται Postgres (DATABASE_URL): οι χρήστες δημιουργούνται και παίρνουν
+credits πριν ξεκινήσει η μέτρηση. Κανένα request δεν βγαίνει εκτός localhost.
+
+Τρέξιμο (από το root του repo):
+    DATABASE_URL=postgresql://... python -m bench.loadtest
+    python -m bench.loadtest --scenario veo31 --requests 200 --concurrency 50
+    python -m bench.loadtest --scenario mixed --fail-rate 0.1 --error-rate 0.02 --json
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import signal
+import asyncio
+import hashlib
+import argparse
+import subprocess
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+BOT_TOKEN = os.getenv("BOT_TOKEN", "") or "123456:loadtest"
+MEDIA_METHODS = ("sendDocument", "sendVideo", "sendAudio", "sendPhoto", "sendVoice")
+SEED_CREDITS = 100
+
+
+# ----------------------
+# Σενάρια: (method, path, kwargs για httpx) ανά request
+# ----------------------
+def _init_data(tg_id: int) -> str:
+    """initData υπογεγραμμένο όπως από το Telegram WebApp (βλ. core/telegram_auth)."""
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"lt{tg_id}",
+        "user": json.dumps({"id": tg_id, "first_name": "Load", "username": f"lt{tg_id}"}, separators=(",", ":")),
+    }
+    check = "\n".join(f"{k}={fields[k]}" for k in sorted(fields))
+    secret = hmac.new(b"WebAppData", BOT_TOKEN.encode("utf-8"), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check.encode("utf-8"), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def _veo31(tg_id: int, upload: bytes) -> Tuple[str, Dict[str, Any]]:
+    return "/api/veo31/generate", {"data": {
+        "tg_init_data": _init_data(tg_id), "mode": "text", "prompt": "a red fox in snow", "aspect_ratio": "16:9",
+    }}
+
+
+def _kling26(tg_id: int, upload: bytes) -> Tuple[str, Dict[str, Any]]:
+    return "/api/kling26/generate", {"json": {
+        "initData": _init_data(tg_id), "prompt": "a red fox in snow", "aspect_ratio": "16:9",
+    }}
+
+
+def _sora2pro(tg_id: int, upload: bytes) -> Tuple[str, Dict[str, Any]]:
+    return "/api/sora2pro/generate", {"data": {
+        "tg_init_data": _init_data(tg_id), "mode": "text", "prompt": "a red fox in snow",
+        "aspect": "portrait", "seconds": "8", "quality": "standard",
+    }}
+
+
+def _suno(tg_id: int, upload: bytes) -> Tuple[str, Dict[str, Any]]:
+    return "/api/sunov5/generate", {"json": {
+        "initData": _init_data(tg_id), "mode": "auto", "voice": "male", "description": "summer song about the sea",
+    }}
+
+
+def _topaz(tg_id: int, upload: bytes) -> Tuple[str, Dict[str, Any]]:
+    return "/api/topaz-upscale/generate", {
+        "data": {"tg_init_data": _init_data(tg_id), "quality": "high"},
+        "files": {"video": ("input.mp4", upload, "video/mp4")},
+    }
+
+
+SCENARIOS: Dict[str, Callable[[int, bytes], Tuple[str, Dict[str, Any]]]] = {
+    "veo31": _veo31,
+    "kling26": _kling26,
+    "sora2pro": _sora2pro,
+    "suno": _suno,
+    "topaz": _topaz,
+}
+
+
+def _builder(scenario: str) -> Callable[[int, bytes], Tuple[str, Dict[str, Any]]]:
+    if scenario != "mixed":
+        return SCENARIOS[scenario]
+    builders = list(SCENARIOS.values())
+    return lambda tg_id, upload: random.choice(builders)(tg_id, upload)
+
+
+# ----------------------
+# Processes
+# ----------------------
+def _mock_env(mock: str) -> Dict[str, str]:
+    return {
+        "TELEGRAM_API_BASE": mock,
+        "GEMINI_API_BASE": f"{mock}/gemini/v1beta",
+        "GEMINI_API_KEY": "mock",
+        "OPENAI_API_BASE": f"{mock}/openai/v1",
+        "OPENAI_API_KEY": "mock",
+        "KLING_BASE_URL": f"{mock}/kling",
+        "KLING_ACCESS_KEY": "mock",
+        "KLING_SECRET_KEY": "mock",
+        "SUNO_API_URL": f"{mock}/suno/api/v1/generate",
+        "SUNO_POLL_URL": f"{mock}/suno/api/v1/generate/record-info",
+        "SUNO_API_KEY": "mock",
+        "TOPAZ_API_URL": f"{mock}/topaz/v1",
+        "TOPAZ_API_KEY": "mock",
+    }
+
+
+async def _wait_http(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as c:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"process exited with code {proc.returncode} before {url} came up")
+            try:
+                await c.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"timeout waiting for {url}")
+
+
+def _spawn(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], env={**os.environ, **env})
+
+
+def _terminate(proc: Optional[subprocess.Popen]) -> None:
+    if proc is None or proc.poll() is not None:
+        return
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def _mem_peak_mb(pid: int) -> Optional[float]:
+    """VmHWM (peak RSS) από /proc — μόνο σε Linux."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _seed_users(tg_ids: List[int]) -> None:
+    from app.db import run_migrations, ensure_user, add_credits_by_tg_id
+
+    run_migrations()
+    for tg_id in tg_ids:
+        ensure_user(tg_id, f"lt{tg_id}", "Load")
+        add_credits_by_tg_id(tg_id, SEED_CREDITS, "Load test seed", "system", None)
+
+
+# ----------------------
+# Μέτρηση
+# ----------------------
+def _pct(vals: List[float], q: float) -> Optional[float]:
+    if not vals:
+        return None
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+class _Run:
+    def __init__(self, tg_ids: List[int]):
+        self.accepted: Dict[int, float] = {}     # tg_id -> ts που απάντησε το web
+        self.submitted: Dict[int, float] = {}
+        self.accept_lat: List[float] = []
+        self.rejected: Dict[str, int] = {}
+        self.done: Dict[int, Tuple[float, bool]] = {}  # tg_id -> (ts, ok)
+        self.pending = set(tg_ids)
+
+    def on_event(self, ev: Dict[str, Any]) -> None:
+        tg_id = ev["chat_id"]
+        t_acc = self.accepted.get(tg_id)
+        if t_acc is None or tg_id in self.done or ev["ts"] < t_acc:
+            # το "ετοιμάζεται..." μήνυμα στέλνεται πριν απαντήσει το request
+            return
+        self.done[tg_id] = (ev["ts"], ev["method"] in MEDIA_METHODS)
+
+
+async def _fire(c: httpx.AsyncClient, run: _Run, build, tg_id: int, upload: bytes, sem: asyncio.Semaphore) -> None:
+    async with sem:
+        path, kwargs = build(tg_id, upload)
+        t0 = time.time()
+        run.submitted[tg_id] = t0
+        try:
+            r = await c.post(path, **kwargs)
+            status = str(r.status_code) if r.status_code != 200 else ""
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        t1 = time.time()
+        run.accept_lat.append(t1 - t0)
+        if status:
+            run.rejected[status] = run.rejected.get(status, 0) + 1
+            run.pending.discard(tg_id)
+        else:
+            run.accepted[tg_id] = t1
+
+
+async def _collect(mock: str, run: _Run, timeout: float, fired: asyncio.Event) -> None:
+    since = 0
+    deadline = None
+    async with httpx.AsyncClient(base_url=mock, timeout=10) as c:
+        while True:
+            data = (await c.get("/_events", params={"since": since})).json()
+            since = data["next"]
+            for ev in data["events"]:
+                run.on_event(ev)
+            if fired.is_set():
+                if deadline is None:
+                    deadline = time.monotonic() + timeout
+                if all(t in run.done for t in run.accepted) or time.monotonic() > deadline:
+                    return
+            await asyncio.sleep(0.25)
+
+
+async def run_scenario(scenario: str, args, base_tg_id: int) -> Dict[str, Any]:
+    mock = f"http://127.0.0.1:{args.mock_port}"
+    web = f"http://127.0.0.1:{args.web_port}"
+
+    tg_ids = [base_tg_id + i for i in range(args.requests)]
+    await asyncio.to_thread(_seed_users, tg_ids)
+
+    async with httpx.AsyncClient(base_url=mock, timeout=10) as c:
+        await c.post("/_reset")
+
+    env = {
+        **_mock_env(mock),
+        "BOT_TOKEN": BOT_TOKEN,
+        "WEBAPP_URL": web,
+        "METRICS_DIR": f"/tmp/loadtest_metrics_{args.web_port}",
+        "LOOP_MONITOR_LOG_SECONDS": "0",
+    }
+    proc = _spawn(["-m", "uvicorn", "app.web:api", "--host", "127.0.0.1", "--port", str(args.web_port),
+                   "--log-level", "warning"], env)
+    try:
+        await _wait_http(f"{web}/metrics/loop", proc)
+
+        run = _Run(tg_ids)
+        build = _builder(scenario)
+        upload = os.urandom(int(args.upload_kb * 1024))
+        sem = asyncio.Semaphore(args.concurrency)
+        fired = asyncio.Event()
+        collector = asyncio.create_task(_collect(mock, run, args.timeout, fired))
+
+        t_start = time.time()
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=web, timeout=120, limits=limits) as c:
+            await asyncio.gather(*(_fire(c, run, build, tg_id, upload, sem) for tg_id in tg_ids))
+        t_fired = time.time()
+        fired.set()
+        await collector
+        t_end = max([ts for ts, _ in run.done.values()] or [t_fired])
+
+        async with httpx.AsyncClient(base_url=web, timeout=10) as c:
+            loop = (await c.get("/metrics/loop")).json()
+        async with httpx.AsyncClient(base_url=mock, timeout=10) as c:
+            mock_stats = (await c.get("/_stats")).json()
+        mem_peak = _mem_peak_mb(proc.pid)
+    finally:
+        _terminate(proc)
+
+    e2e = [run.done[t][0] - run.submitted[t] for t in run.done if run.done[t][1]]
+    ok = len(e2e)
+    return {
+        "scenario": scenario,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "accepted": len(run.accepted),
+        "rejected": run.rejected,
+        "completed_ok": ok,
+        "completed_failed": len(run.done) - ok,
+        "timed_out": len(run.accepted) - len(run.done),
+        "accept_rps": len(run.accepted) / max(t_fired - t_start, 1e-9),
+        "complete_rps": ok / max(t_end - t_start, 1e-9),
+        "accept_p50_ms": (_pct(run.accept_lat, 0.50) or 0) * 1000,
+        "accept_p99_ms": (_pct(run.accept_lat, 0.99) or 0) * 1000,
+        "e2e_p50_s": _pct(e2e, 0.50),
+        "e2e_p99_s": _pct(e2e, 0.99),
+        "mem_peak_mb": mem_peak,
+        "loop_lag_p50_ms": loop.get("p50_ms"),
+        "loop_lag_p99_ms": loop.get("p99_ms"),
+        "loop_lag_max_ms": loop.get("max_ms"),
+        "loop_stalls": loop.get("stalls"),
+        "provider_calls": mock_stats.get("calls", {}),
+    }
+
+
+def _fmt(v: Any, spec: str) -> str:
+    return "-" if v is None else format(v, spec)
+
+
+def _print_report(results: List[Dict[str, Any]]) -> None:
+    header = (
+        f"{'scenario':<10} {'acc':>5} {'ok':>5} {'fail':>5} {'t/o':>5} {'acc/s':>7} {'done/s':>7} "
+        f"{'acc p50':>8} {'acc p99':>8} {'e2e p50':>8} {'e2e p99':>8} {'mem MB':>7} {'lag p99':>8} {'lag max':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<10} {r['accepted']:>5} {r['completed_ok']:>5} {r['completed_failed']:>5} "
+            f"{r['timed_out']:>5} {r['accept_rps']:>7.1f} {r['complete_rps']:>7.2f} "
+            f"{r['accept_p50_ms']:>6.0f}ms {r['accept_p99_ms']:>6.0f}ms "
+            f"{_fmt(r['e2e_p50_s'], '>7.1f')}s {_fmt(r['e2e_p99_s'], '>7.1f')}s "
+            f"{_fmt(r['mem_peak_mb'], '>7.0f')} {_fmt(r['loop_lag_p99_ms'], '>6.1f')}ms {_fmt(r['loop_lag_max_ms'], '>6.1f')}ms"
+        )
+        if r["rejected"]:
+            print(f"{'':<10} rejected: {r['rejected']}")
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    mock_args = ["-m", "bench.mock_providers", "--port", str(args.mock_port)]
+    for key in ("latency_ms", "job_seconds", "fail_rate", "error_rate", "payload_kb", "tg_latency_ms"):
+        mock_args += [f"--{key.replace('_', '-')}", str(getattr(args, key))]
+    mock = _spawn(mock_args, {})
+    try:
+        await _wait_http(f"http://127.0.0.1:{args.mock_port}/_stats", mock)
+        scenarios = list(SCENARIOS) + ["mixed"] if args.scenario == "all" else [args.scenario]
+        # tg ids εκτός του εύρους πραγματικών χρηστών, νέοι σε κάθε τρέξιμο
+        base = 9_000_000_000 + random.randrange(10**8) * 10**4
+        results = []
+        for i, scenario in enumerate(scenarios):
+            results.append(await run_scenario(scenario, args, base + i * args.requests))
+        return results
+    finally:
+        _terminate(mock)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Offline load test με mock providers")
+    ap.add_argument("--scenario", default="all", choices=[*SCENARIOS, "mixed", "all"])
+    ap.add_argument("--requests", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--timeout", type=float, default=300, help="αναμονή για παραδόσεις μετά το τελευταίο request (s)")
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--job-seconds", type=float, default=5)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--payload-kb", type=float, default=512)
+    ap.add_argument("--upload-kb", type=float, default=512, help="μέγεθος video upload για το topaz")
+    ap.add_argument("--tg-latency-ms", type=float, default=30)
+    ap.add_argument("--web-port", type=int, default=9901)
+    ap.add_argument("--mock-port", type=int, default=9900)
+    ap.add_argument("--json", action="store_true", help="αποτελέσματα σε JSON (για σύγκριση μεταξύ commits)")
+    args = ap.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        sys.exit("DATABASE_URL is required (χρησιμοποίησε μια δοκιμαστική βάση)")
+    os.environ["BOT_TOKEN"] = BOT_TOKEN
+
+    results = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+    else:
+        _print_report(results)
+
+
+if __name__ == "__main__":
+    main()
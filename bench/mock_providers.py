@@ -0,0 +1,366 @@
+# bench/mock_providers.py
+"""
+Mock AI providers + mock Telegram Bot API για offline load tests.
+
+Ένας server εξυπηρετεί όλους τους providers κάτω από διαφορετικά prefixes,
+με το ίδιο create -> poll -> download πρωτόκολλο που περιμένουν τα routes:
+
+    Veo (Gemini)   GEMINI_API_BASE = <mock>/gemini/v1beta
+    Sora (OpenAI)  OPENAI_API_BASE = <mock>/openai/v1
+    Kling          KLING_BASE_URL  = <mock>/kling
+    Suno           SUNO_API_URL    = <mock>/suno/api/v1/generate
+                   SUNO_POLL_URL   = <mock>/suno/api/v1/generate/record-info
+    Topaz          TOPAZ_API_URL   = <mock>/topaz/v1
+    Telegram       TELEGRAM_API_BASE = <mock>
+
+Ρυθμίσεις (CLI ή POST /_config με JSON):
+    latency_ms      καθυστέρηση κάθε provider response (+/- jitter)
+    jitter          σχετικό jitter της καθυστέρησης (0.2 = ±20%)
+    job_seconds     πόσο "τρέχει" ένα job μέχρι να γίνει done
+    fail_rate       ποσοστό jobs που τελειώνουν σε failed status
+    error_rate      ποσοστό HTTP calls που απαντούν 503 (παροδικό σφάλμα)
+    payload_kb      μέγεθος του αρχείου που κατεβαίνει
+    tg_latency_ms   καθυστέρηση του mock Telegram API
+
+Το harness διαβάζει τις παραδόσεις από GET /_events?since=<seq> και
+μηδενίζει την κατάσταση με POST /_reset.
+
+Τρέξιμο μόνο του:
+    python -m bench.mock_providers --port 9900 --job-seconds 5
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+SETTINGS: Dict[str, float] = {
+    "latency_ms": 50.0,
+    "jitter": 0.2,
+    "job_seconds": 5.0,
+    "fail_rate": 0.0,
+    "error_rate": 0.0,
+    "payload_kb": 512.0,
+    "tg_latency_ms": 30.0,
+}
+
+app = FastAPI()
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_events: List[Dict[str, Any]] = []
+_calls: Counter = Counter()
+_payloads: Dict[int, bytes] = {}
+_msg_id = 0
+
+
+# ----------------------
+# Helpers
+# ----------------------
+async def _delay(ms: float) -> None:
+    if ms > 0:
+        j = SETTINGS["jitter"]
+        await asyncio.sleep(ms / 1000 * random.uniform(1 - j, 1 + j))
+
+
+async def _provider(name: str) -> Response | None:
+    """Κοινό για κάθε provider call: μέτρηση, latency, παροδικά 503."""
+    _calls[name] += 1
+    await _delay(SETTINGS["latency_ms"])
+    if random.random() < SETTINGS["error_rate"]:
+        _calls[f"{name}:503"] += 1
+        return JSONResponse({"error": {"message": "mock overloaded"}}, status_code=503)
+    return None
+
+
+def _new_job(provider: str) -> str:
+    job_id = uuid.uuid4().hex
+    _jobs[job_id] = {
+        "provider": provider,
+        "ready_at": time.time() + SETTINGS["job_seconds"],
+        "failed": random.random() < SETTINGS["fail_rate"],
+    }
+    return job_id
+
+
+def _job_state(job_id: str) -> str:
+    """pending | done | failed | missing"""
+    job = _jobs.get(job_id)
+    if job is None:
+        return "missing"
+    if time.time() < job["ready_at"]:
+        return "pending"
+    return "failed" if job["failed"] else "done"
+
+
+def _payload() -> bytes:
+    size = max(1, int(SETTINGS["payload_kb"] * 1024))
+    data = _payloads.get(size)
+    if data is None:
+        _payloads.clear()
+        data = _payloads[size] = os.urandom(size)
+    return data
+
+
+def _file_url(request: Request, job_id: str) -> str:
+    return f"{str(request.base_url).rstrip('/')}/files/{job_id}"
+
+
+# ----------------------
+# Downloads (κοινά για όλους)
+# ----------------------
+@app.get("/files/{job_id}")
+async def download(job_id: str):
+    err = await _provider("download")
+    if err is not None:
+        return err
+    if _job_state(job_id) != "done":
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return Response(_payload(), media_type="application/octet-stream")
+
+
+# ----------------------
+# Veo (Gemini long-running operations)
+# ----------------------
+@app.post("/gemini/v1beta/models/{model_action}")
+async def veo_create(model_action: str):
+    err = await _provider("veo:create")
+    if err is not None:
+        return err
+    if not model_action.endswith(":predictLongRunning"):
+        return JSONResponse({"error": {"message": "unsupported"}}, status_code=404)
+    return {"name": f"operations/{_new_job('veo')}"}
+
+
+@app.get("/gemini/v1beta/operations/{job_id}")
+async def veo_poll(job_id: str, request: Request):
+    err = await _provider("veo:poll")
+    if err is not None:
+        return err
+    state = _job_state(job_id)
+    if state == "missing":
+        return JSONResponse({"error": {"message": "operation not found"}}, status_code=404)
+    if state == "pending":
+        return {"name": f"operations/{job_id}", "done": False}
+    if state == "failed":
+        return {"name": f"operations/{job_id}", "done": True, "error": {"code": 13, "message": "mock failure"}}
+    return {
+        "name": f"operations/{job_id}",
+        "done": True,
+        "response": {"generateVideoResponse": {"generatedSamples": [{"video": {"uri": _file_url(request, job_id)}}]}},
+    }
+
+
+# ----------------------
+# Sora (OpenAI videos)
+# ----------------------
+@app.post("/openai/v1/videos")
+async def sora_create():
+    err = await _provider("sora:create")
+    if err is not None:
+        return err
+    return {"id": f"video_{_new_job('sora')}", "status": "queued"}
+
+
+@app.get("/openai/v1/videos/{video_id}")
+async def sora_poll(video_id: str):
+    err = await _provider("sora:poll")
+    if err is not None:
+        return err
+    state = _job_state(video_id.removeprefix("video_"))
+    if state == "missing":
+        return JSONResponse({"error": {"message": "not found"}}, status_code=404)
+    status = {"pending": "in_progress", "done": "completed", "failed": "failed"}[state]
+    return {"id": video_id, "status": status}
+
+
+@app.get("/openai/v1/videos/{video_id}/content")
+async def sora_content(video_id: str):
+    err = await _provider("sora:download")
+    if err is not None:
+        return err
+    if _job_state(video_id.removeprefix("video_")) != "done":
+        return JSONResponse({"error": {"message": "not found"}}, status_code=404)
+    return Response(_payload(), media_type="video/mp4")
+
+
+# ----------------------
+# Kling
+# ----------------------
+@app.post("/kling/v1/videos/{kind}")
+async def kling_create(kind: str):
+    err = await _provider("kling:create")
+    if err is not None:
+        return err
+    return {"code": 0, "message": "SUCCEED", "data": {"task_id": _new_job("kling"), "task_status": "submitted"}}
+
+
+@app.get("/kling/v1/videos/{kind}/{task_id}")
+async def kling_poll(kind: str, task_id: str, request: Request):
+    err = await _provider("kling:poll")
+    if err is not None:
+        return err
+    state = _job_state(task_id)
+    if state == "missing":
+        return {"code": 1203, "message": "task not found", "data": {}}
+    if state == "pending":
+        return {"code": 0, "data": {"task_id": task_id, "task_status": "processing"}}
+    if state == "failed":
+        return {"code": 0, "data": {"task_id": task_id, "task_status": "failed", "task_status_msg": "mock failure"}}
+    return {
+        "code": 0,
+        "data": {
+            "task_id": task_id,
+            "task_status": "succeed",
+            "task_result": {"videos": [{"id": task_id, "url": _file_url(request, task_id)}]},
+        },
+    }
+
+
+# ----------------------
+# Suno (apibox)
+# ----------------------
+@app.post("/suno/api/v1/generate")
+async def suno_create():
+    err = await _provider("suno:create")
+    if err is not None:
+        return err
+    return {"code": 200, "msg": "success", "data": {"taskId": _new_job("suno")}}
+
+
+@app.get("/suno/api/v1/generate/record-info")
+async def suno_poll(taskId: str, request: Request):
+    err = await _provider("suno:poll")
+    if err is not None:
+        return err
+    state = _job_state(taskId)
+    if state == "missing":
+        return JSONResponse({"code": 404, "msg": "task not found"}, status_code=404)
+    if state == "pending":
+        return {"code": 200, "data": {"taskId": taskId, "status": "PENDING"}}
+    if state == "failed":
+        return {"code": 200, "data": {"taskId": taskId, "status": "FAILED"}}
+    url = _file_url(request, taskId)
+    return {
+        "code": 200,
+        "data": {
+            "taskId": taskId,
+            "status": "COMPLETE",
+            "data": [{"audio_url": url, "title": "track 1"}, {"audio_url": url, "title": "track 2"}],
+        },
+    }
+
+
+# ----------------------
+# Topaz
+# ----------------------
+@app.post("/topaz/v1/enhance")
+async def topaz_create(request: Request):
+    err = await _provider("topaz:create")
+    if err is not None:
+        return err
+    # το upload διαβάζεται ολόκληρο, όπως σε πραγματικό provider
+    await request.body()
+    return {"task_id": _new_job("topaz"), "status": "queued"}
+
+
+@app.get("/topaz/v1/enhance/{task_id}")
+async def topaz_poll(task_id: str, request: Request):
+    err = await _provider("topaz:poll")
+    if err is not None:
+        return err
+    state = _job_state(task_id)
+    if state == "missing":
+        return JSONResponse({"error": "not found"}, status_code=404)
+    if state == "pending":
+        return {"task_id": task_id, "status": "processing"}
+    if state == "failed":
+        return {"task_id": task_id, "status": "failed"}
+    return {"task_id": task_id, "status": "completed", "download_url": _file_url(request, task_id)}
+
+
+# ----------------------
+# Telegram Bot API
+# ----------------------
+@app.post("/bot{token}/{method}")
+async def telegram(token: str, method: str, request: Request):
+    global _msg_id
+    _calls[f"telegram:{method}"] += 1
+    await _delay(SETTINGS["tg_latency_ms"])
+
+    size = int(request.headers.get("content-length") or 0)
+    if request.headers.get("content-type", "").startswith("application/json"):
+        body = await request.json()
+    else:
+        form = await request.form()
+        body = {k: v for k, v in form.items() if isinstance(v, str)}
+
+    try:
+        chat_id = int(body.get("chat_id"))
+    except (TypeError, ValueError):
+        return JSONResponse({"ok": False, "error_code": 400, "description": "Bad Request: chat not found"}, status_code=400)
+
+    _msg_id += 1
+    _events.append({
+        "seq": len(_events),
+        "ts": time.time(),
+        "chat_id": chat_id,
+        "method": method,
+        "bytes": size,
+        "text": str(body.get("text") or body.get("caption") or "")[:200],
+    })
+    return {"ok": True, "result": {"message_id": _msg_id, "chat": {"id": chat_id}, "date": int(time.time())}}
+
+
+# ----------------------
+# Έλεγχος από το harness
+# ----------------------
+@app.get("/_events")
+async def events(since: int = 0):
+    return {"next": len(_events), "events": _events[since:]}
+
+
+@app.get("/_stats")
+async def stats():
+    return {"settings": SETTINGS, "jobs": len(_jobs), "events": len(_events), "calls": dict(_calls)}
+
+
+@app.post("/_config")
+async def config(request: Request):
+    data = await request.json()
+    for k, v in data.items():
+        if k in SETTINGS:
+            SETTINGS[k] = float(v)
+    return {"settings": SETTINGS}
+
+
+@app.post("/_reset")
+async def reset():
+    _jobs.clear()
+    _events.clear()
+    _calls.clear()
+    return {"ok": True}
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description="Mock AI providers + Telegram Bot API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9900)
+    for key, default in SETTINGS.items():
+        ap.add_argument(f"--{key.replace('_', '-')}", type=float, default=default)
+    args = ap.parse_args()
+    for key in SETTINGS:
+        SETTINGS[key] = getattr(args, key)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
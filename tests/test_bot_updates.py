@@ -0,0 +1,72 @@
+# tests/test_bot_updates.py
+"""PerUserUpdateProcessor: σειριακά ανά χρήστη, χωρίς να κρατάνε slots τα updates σε αναμονή."""
+import os
+import asyncio
+
+from telegram import CallbackQuery, Update, User
+
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from app.bot import PerUserUpdateProcessor  # noqa: E402
+
+_ids = iter(range(1, 1_000_000))
+
+
+def _update(user_id: int) -> Update:
+    n = next(_ids)
+    user = User(id=user_id, first_name="Test", is_bot=False)
+    return Update(update_id=n, callback_query=CallbackQuery(id=str(n), from_user=user, chat_instance="test"))
+
+
+async def _with_timeout(coro, seconds: float = 2.0):
+    return await asyncio.wait_for(coro, seconds)
+
+
+def test_blocked_user_does_not_starve_others():
+    async def main():
+        proc = PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+        done = []
+
+        async def blocking():
+            await release.wait()
+            done.append("a0")
+
+        async def quick(tag):
+            done.append(tag)
+
+        # ο χρήστης 1: ένα update που μπλοκάρει + πολλά σε αναμονή πίσω του
+        tasks = [asyncio.create_task(proc.process_update(_update(1), blocking()))]
+        tasks += [asyncio.create_task(proc.process_update(_update(1), quick(f"a{i}"))) for i in range(1, 6)]
+        await asyncio.sleep(0)
+
+        # ο χρήστης 2 περνάει παρόλο που ο 1 έχει 6 updates (> 2 slots)
+        await _with_timeout(proc.process_update(_update(2), quick("b")))
+        assert done == ["b"]
+
+        release.set()
+        await _with_timeout(asyncio.gather(*tasks))
+        assert done == ["b", "a0", "a1", "a2", "a3", "a4", "a5"]
+
+    asyncio.run(main())
+
+
+def test_concurrency_limit_applies_to_running_updates():
+    async def main():
+        proc = PerUserUpdateProcessor(2)
+        running = peak = 0
+
+        async def work():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await _with_timeout(asyncio.gather(*(proc.process_update(_update(100 + i), work()) for i in range(10))))
+        assert peak == 2
+        assert proc.max_concurrent_updates == 2
+        assert not proc._locks and not proc._refs
+
+    asyncio.run(main())
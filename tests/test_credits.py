@@ -0,0 +1,96 @@
+# tests/test_credits.py
+"""Credits / ledger πάνω σε πραγματικό Postgres.
+
+Χρειάζεται DATABASE_URL προς βάση δοκιμών (τρέχει τα migrations). Χωρίς
+προσβάσιμη βάση τα tests γίνονται skip. Τρέξιμο: python -m pytest -q
+"""
+import os
+import secrets
+from decimal import Decimal
+
+import psycopg
+import pytest
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+try:
+    psycopg.connect(DATABASE_URL, connect_timeout=3).close()
+except psycopg.OperationalError as e:
+    pytest.skip(f"database not reachable: {e}", allow_module_level=True)
+
+from app import db  # noqa: E402
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _schema():
+    db.run_migrations()
+    yield
+    db.close_pools()
+
+
+@pytest.fixture
+def user():
+    # τυχαίο tg id ώστε τα tests να μη συγκρούονται με υπάρχοντα δεδομένα
+    tg_user_id = 9_000_000_000 + secrets.randbelow(10 ** 9)
+    return db.ensure_user(tg_user_id, "test_credits", "Test")
+
+
+def _last_ledger(user_id: int):
+    return db.get_ledger_page(user_id, limit=1)["items"][0]
+
+
+def test_credit_adds_balance_and_ledger_row(user):
+    start = Decimal(user["credits"])
+    balance = db.add_credits_by_user_id(user["id"], Decimal("2.50"), "Test credit", "test", "ref-1")
+    assert balance == start + Decimal("2.50")
+
+    row = _last_ledger(user["id"])
+    assert row["delta"] == Decimal("2.50")
+    assert row["balance_after"] == balance
+    assert row["reason"] == "Test credit"
+    assert row["provider"] == "test"
+    assert row["provider_ref"] == "ref-1"
+
+
+def test_spend_by_tg_id_subtracts_and_writes_ledger(user):
+    start = Decimal(user["credits"])
+    balance = db.spend_credits_by_tg_id(user["tg_user_id"], Decimal("1"), "Test spend")
+    assert balance == start - 1
+
+    row = _last_ledger(user["id"])
+    assert row["delta"] == Decimal("-1")
+    assert row["balance_after"] == balance
+    assert row["reason"] == "Test spend"
+
+
+def test_spend_insufficient_credits_changes_nothing(user):
+    start = Decimal(user["credits"])
+    before = _last_ledger(user["id"])["id"]
+
+    with pytest.raises(db.InsufficientCredits):
+        db.spend_credits_by_user_id(user["id"], start + 1, "Too much")
+
+    assert Decimal(db.get_user_by_id(user["id"])["credits"]) == start
+    assert _last_ledger(user["id"])["id"] == before
+
+
+def test_non_positive_amount_rejected(user):
+    with pytest.raises(ValueError):
+        db.add_credits_by_user_id(user["id"], 0, "Zero")
+    with pytest.raises(ValueError):
+        db.spend_credits_by_user_id(user["id"], Decimal("-1"), "Negative")
+
+
+def test_bad_user_key_rejected():
+    with pytest.raises(ValueError):
+        db._credit("username", 1, 1, "Bad key", None, None)
+    with pytest.raises(ValueError):
+        db._spend("username", 1, 1, "Bad key", None, None)
+
+
+def test_unknown_user():
+    with pytest.raises(RuntimeError):
+        db.add_credits_by_tg_id(-1, 1, "Nobody")
+    with pytest.raises(RuntimeError):
+        db.spend_credits_by_tg_id(-1, 1, "Nobody")